@@ -118,6 +118,115 @@ def create_app():
     else:
         print("[Umwari] No Gemini API key in .env — set GEMINI_API_KEY in backend/.env or use Settings > Secrets")
     
+    # Performance metrics: slow-query fingerprint threshold and cross-worker snapshots
+    app.config['PERF_SLOW_QUERY_MS'] = float(os.environ.get('PERF_SLOW_QUERY_MS', 50))
+    app.config['PERF_SNAPSHOT_INTERVAL'] = float(os.environ.get('PERF_SNAPSHOT_INTERVAL', 15))
+    app.config['PERF_METRICS_DIR'] = os.environ.get('PERF_METRICS_DIR')
+    # /metrics answers 404 until a scrape token is set
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+
+    # Write-behind audit logging (SystemLog rows are batched off the request path)
+    app.config['AUDIT_LOG_ENABLED'] = os.environ.get('AUDIT_LOG_ENABLED', 'true').lower() == 'true'
+    app.config['AUDIT_LOG_QUEUE_SIZE'] = int(os.environ.get('AUDIT_LOG_QUEUE_SIZE', 10000))
+    app.config['AUDIT_LOG_BATCH_SIZE'] = int(os.environ.get('AUDIT_LOG_BATCH_SIZE', 200))
+    app.config['AUDIT_LOG_FLUSH_INTERVAL'] = float(os.environ.get('AUDIT_LOG_FLUSH_INTERVAL', 2.0))
+
+    # Write-behind USSD transaction logging (one row per hop, batched)
+    app.config['USSD_TXN_LOG_ENABLED'] = os.environ.get('USSD_TXN_LOG_ENABLED', 'true').lower() == 'true'
+    app.config['USSD_TXN_LOG_QUEUE_SIZE'] = int(os.environ.get('USSD_TXN_LOG_QUEUE_SIZE', 20000))
+    app.config['USSD_TXN_LOG_BATCH_SIZE'] = int(os.environ.get('USSD_TXN_LOG_BATCH_SIZE', 500))
+    app.config['USSD_TXN_LOG_FLUSH_INTERVAL'] = float(os.environ.get('USSD_TXN_LOG_FLUSH_INTERVAL', 1.0))
+
+    # Bulk admin user actions: chunk size per statement and the largest selection run inline
+    app.config['BULK_ACTION_CHUNK_SIZE'] = int(os.environ.get('BULK_ACTION_CHUNK_SIZE', 500))
+    app.config['BULK_ACTION_SYNC_LIMIT'] = int(os.environ.get('BULK_ACTION_SYNC_LIMIT', 200))
+
+    # Engagement rollups (DAU/WAU/MAU, retention) and request activity tracking
+    app.config['ENGAGEMENT_TRACKING_ENABLED'] = os.environ.get('ENGAGEMENT_TRACKING_ENABLED', 'true').lower() == 'true'
+    app.config['ENGAGEMENT_FLUSH_INTERVAL'] = float(os.environ.get('ENGAGEMENT_FLUSH_INTERVAL', 60))
+    app.config['ENGAGEMENT_REFRESH_SECONDS'] = int(os.environ.get('ENGAGEMENT_REFRESH_SECONDS', 300))
+    app.config['ENGAGEMENT_SYNC_BACKFILL_DAYS'] = int(os.environ.get('ENGAGEMENT_SYNC_BACKFILL_DAYS', 60))
+
+    # USSD hop latency budget (gateways drop sessions after a few seconds; 0 disables)
+    app.config['USSD_HOP_BUDGET_MS'] = int(os.environ.get('USSD_HOP_BUDGET_MS', 4000))
+    app.config['USSD_HANDLER_THREADS'] = int(os.environ.get('USSD_HANDLER_THREADS', 8))
+    # Re-render cached USSD cycle predictions in the background when cycle logs change
+    app.config['USSD_PREDICTION_REFRESH_ENABLED'] = os.environ.get('USSD_PREDICTION_REFRESH_ENABLED', 'true').lower() == 'true'
+
+    # PIN hashing: bcrypt cost for new/upgraded PIN hashes and the per-worker process pool size
+    app.config['PIN_HASH_ROUNDS'] = int(os.environ.get('PIN_HASH_ROUNDS', 12))
+    app.config['PIN_HASH_WORKERS'] = int(os.environ.get('PIN_HASH_WORKERS', 2))
+
+    # Shared key-value store for USSD sessions and rate limits ('sqlite' file in the
+    # instance folder is shared by all workers on the host; 'memory' is per process)
+    app.config['KV_STORE_BACKEND'] = os.environ.get('KV_STORE_BACKEND', 'sqlite')
+    app.config['KV_STORE_PATH'] = os.environ.get('KV_STORE_PATH')
+
+    # SMS digests of notifications for USSD-registered (feature-phone) users
+    app.config['SMS_OUTBOUND_ENABLED'] = os.environ.get('SMS_OUTBOUND_ENABLED', 'false').lower() == 'true'
+    # Required once outbound is on: 'africastalking', or 'fake' under TESTING/DEBUG only
+    app.config['SMS_GATEWAY'] = os.environ.get('SMS_GATEWAY')
+    app.config['AFRICASTALKING_USERNAME'] = os.environ.get('AFRICASTALKING_USERNAME')
+    # Sandbox only when asked for; never inferred from the username
+    app.config['AFRICASTALKING_SANDBOX'] = os.environ.get('AFRICASTALKING_SANDBOX', 'false').lower() == 'true'
+    app.config['AFRICASTALKING_API_KEY'] = os.environ.get('AFRICASTALKING_API_KEY')
+    app.config['AFRICASTALKING_SENDER_ID'] = os.environ.get('AFRICASTALKING_SENDER_ID')
+    app.config['SMS_DIGEST_INTERVAL'] = float(os.environ.get('SMS_DIGEST_INTERVAL', 60))
+    app.config['SMS_DIGEST_BATCH_SIZE'] = int(os.environ.get('SMS_DIGEST_BATCH_SIZE', 500))
+    app.config['SMS_DIGEST_MAX_CHARS'] = int(os.environ.get('SMS_DIGEST_MAX_CHARS', 306))
+    app.config['SMS_RATE_PER_SECOND'] = int(os.environ.get('SMS_RATE_PER_SECOND', 5))
+    app.config['SMS_MAX_ATTEMPTS'] = int(os.environ.get('SMS_MAX_ATTEMPTS', 5))
+    app.config['SMS_RETRY_BASE_SECONDS'] = int(os.environ.get('SMS_RETRY_BASE_SECONDS', 60))
+
+    # Shared Gemini client: per-endpoint concurrency, retries and circuit breaker
+    app.config['GEMINI_API_BASE'] = os.environ.get('GEMINI_API_BASE')
+    app.config['LLM_MAX_CONCURRENCY'] = int(os.environ.get('LLM_MAX_CONCURRENCY', 4))
+    app.config['LLM_QUEUE_TIMEOUT'] = float(os.environ.get('LLM_QUEUE_TIMEOUT', 5))
+    app.config['LLM_READ_TIMEOUT'] = float(os.environ.get('LLM_READ_TIMEOUT', 30))
+    app.config['LLM_STREAM_READ_TIMEOUT'] = float(os.environ.get('LLM_STREAM_READ_TIMEOUT', 120))
+    app.config['LLM_MAX_RETRIES'] = int(os.environ.get('LLM_MAX_RETRIES', 2))
+    app.config['LLM_BREAKER_FAILURES'] = int(os.environ.get('LLM_BREAKER_FAILURES', 5))
+    app.config['LLM_BREAKER_COOLDOWN'] = float(os.environ.get('LLM_BREAKER_COOLDOWN', 30))
+
+    # Seconds a request waits for Gemini before answering with the rule-based insight (0 waits indefinitely)
+    app.config['INSIGHT_LLM_BUDGET_SECONDS'] = float(os.environ.get('INSIGHT_LLM_BUDGET_SECONDS', 8))
+
+    # Off-peak insight pre-generation (window in UTC hours; 0-4 is 02:00-06:00 in Kigali)
+    app.config['INSIGHT_PREGEN_ENABLED'] = os.environ.get('INSIGHT_PREGEN_ENABLED', 'false').lower() == 'true'
+    app.config['INSIGHT_PREGEN_WINDOW_START'] = int(os.environ.get('INSIGHT_PREGEN_WINDOW_START', 0))
+    app.config['INSIGHT_PREGEN_WINDOW_END'] = int(os.environ.get('INSIGHT_PREGEN_WINDOW_END', 4))
+    app.config['INSIGHT_PREGEN_INTERVAL'] = float(os.environ.get('INSIGHT_PREGEN_INTERVAL', 300))
+    app.config['INSIGHT_PREGEN_BATCH_SIZE'] = int(os.environ.get('INSIGHT_PREGEN_BATCH_SIZE', 50))
+    app.config['INSIGHT_PREGEN_RATE_PER_MINUTE'] = int(os.environ.get('INSIGHT_PREGEN_RATE_PER_MINUTE', 20))
+    app.config['INSIGHT_PREGEN_ACTIVE_DAYS'] = int(os.environ.get('INSIGHT_PREGEN_ACTIVE_DAYS', 30))
+    app.config['INSIGHT_PREGEN_LANGUAGES'] = [
+        lang.strip() for lang in os.environ.get('INSIGHT_PREGEN_LANGUAGES', 'kinyarwanda').split(',') if lang.strip()
+    ]
+
+    # Purge of expired insight_cache rows (kept RETENTION_DAYS past expiry as the Gemini-down fallback)
+    app.config['INSIGHT_CACHE_CLEANUP_ENABLED'] = os.environ.get('INSIGHT_CACHE_CLEANUP_ENABLED', 'true').lower() == 'true'
+    app.config['INSIGHT_CACHE_CLEANUP_INTERVAL'] = float(os.environ.get('INSIGHT_CACHE_CLEANUP_INTERVAL', 3600))
+    app.config['INSIGHT_CACHE_CLEANUP_CHUNK_SIZE'] = int(os.environ.get('INSIGHT_CACHE_CLEANUP_CHUNK_SIZE', 1000))
+    app.config['INSIGHT_CACHE_RETENTION_DAYS'] = int(os.environ.get('INSIGHT_CACHE_RETENTION_DAYS', 30))
+
+    # Server-side Umwari conversations (token counts are estimates, ~4 chars per token)
+    app.config['UMWARI_HISTORY_TOKEN_BUDGET'] = int(os.environ.get('UMWARI_HISTORY_TOKEN_BUDGET', 4000))
+    app.config['UMWARI_KEEP_RECENT_MESSAGES'] = int(os.environ.get('UMWARI_KEEP_RECENT_MESSAGES', 6))
+    app.config['UMWARI_MAX_PROMPT_TOKENS'] = int(os.environ.get('UMWARI_MAX_PROMPT_TOKENS', 8000))
+    app.config['UMWARI_MAX_MESSAGE_CHARS'] = int(os.environ.get('UMWARI_MAX_MESSAGE_CHARS', 4000))
+    app.config['UMWARI_MAX_SYSTEM_CONTEXT_CHARS'] = int(os.environ.get('UMWARI_MAX_SYSTEM_CONTEXT_CHARS', 16000))
+    app.config['UMWARI_SUMMARY_MAX_TOKENS'] = int(os.environ.get('UMWARI_SUMMARY_MAX_TOKENS', 512))
+
+    # Gemini usage ledger (one row per call, batched) and per-user token quotas.
+    # LLM_QUOTAS overrides role sizes as JSON: {"adolescent": [capacity, refill_per_hour], "admin": null}
+    app.config['LLM_USAGE_LOG_ENABLED'] = os.environ.get('LLM_USAGE_LOG_ENABLED', 'true').lower() == 'true'
+    app.config['LLM_USAGE_LOG_QUEUE_SIZE'] = int(os.environ.get('LLM_USAGE_LOG_QUEUE_SIZE', 10000))
+    app.config['LLM_USAGE_LOG_BATCH_SIZE'] = int(os.environ.get('LLM_USAGE_LOG_BATCH_SIZE', 200))
+    app.config['LLM_USAGE_LOG_FLUSH_INTERVAL'] = float(os.environ.get('LLM_USAGE_LOG_FLUSH_INTERVAL', 5.0))
+    app.config['LLM_QUOTAS_ENABLED'] = os.environ.get('LLM_QUOTAS_ENABLED', 'true').lower() == 'true'
+    app.config['LLM_QUOTAS'] = os.environ.get('LLM_QUOTAS')
+    app.config['LLM_MAX_STREAMS_PER_USER'] = int(os.environ.get('LLM_MAX_STREAMS_PER_USER', 2))
+
     # Environment-specific configuration
     app.config['ENV'] = os.environ.get('FLASK_ENV', 'development')
     app.config['DEBUG'] = os.environ.get('FLASK_DEBUG', 'false').lower() == 'true'
@@ -131,7 +240,43 @@ def create_app():
     # Initialize performance monitoring
     from app.utils.performance import init_performance_monitoring
     init_performance_monitoring(app)
-    
+
+    # Start the buffered audit log writer
+    from app.services.audit_log import init_audit_log
+    init_audit_log(app)
+
+    # Move shared session/rate-limit stores onto the configured backend
+    from app.utils.kv_store import init_kv_store
+    init_kv_store(app)
+
+    # Start the buffered USSD transaction log writer
+    from app.ussd.session import init_ussd_transaction_log
+    init_ussd_transaction_log(app)
+
+    # Track authenticated request activity for engagement analytics
+    from app.services.engagement_analytics import init_engagement_tracking
+    init_engagement_tracking(app)
+
+    # Send pending notifications to feature-phone users as SMS digests
+    from app.ussd.outbound import init_sms_outbound
+    init_sms_outbound(app)
+
+    # Keep USSD cycle predictions pre-rendered
+    from app.ussd.prediction_cache import init_prediction_refresh
+    init_prediction_refresh(app)
+
+    # Generate insights for active users overnight
+    from app.services.insight_pregeneration import init_insight_pregeneration
+    init_insight_pregeneration(app)
+
+    # Purge long-expired cached insights
+    from app.services.insight_cache_maintenance import init_insight_cache_maintenance
+    init_insight_cache_maintenance(app)
+
+    # Start the buffered Gemini usage ledger writer
+    from app.services.llm_usage import init_llm_usage
+    init_llm_usage(app)
+
     # JWT error handlers
     @jwt.expired_token_loader
     def expired_token_callback(jwt_header, jwt_payload):
@@ -282,6 +427,10 @@ def create_app():
     app.register_blueprint(parent_appointments_bp, url_prefix='/api')
     app.register_blueprint(umwari_bp, url_prefix='/api/umwari')
     
+    # Prometheus scrape endpoint (performance_stats merged across workers)
+    from app.routes.metrics import metrics_bp
+    app.register_blueprint(metrics_bp)
+    
     # Register settings blueprint (account, privacy, bundle)
     from app.routes.settings import settings_bp
     app.register_blueprint(settings_bp, url_prefix='/api/settings')
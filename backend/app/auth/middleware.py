@@ -159,23 +159,19 @@ def health_provider_required(f):
     return decorated
 
 def log_user_activity(action, details=None):
-    """Helper function to log user activities"""
+    """Helper function to log user activities (queued, flushed in batches off the request path)"""
     try:
-        from app.models import SystemLog
-        from app import db
-        import json
-        
+        from app.services.audit_log import record_activity
+
         if hasattr(g, 'current_user') and g.current_user:
-            log_entry = SystemLog(
+            record_activity(
                 user_id=g.current_user.id,
                 action=action,
-                details=json.dumps(details) if details else None,
+                details=details,
                 ip_address=request.remote_addr,
                 user_agent=request.headers.get('User-Agent')
             )
-            db.session.add(log_entry)
-            db.session.commit()
-            
+
     except Exception as e:
         current_app.logger.error(f"Failed to log activity: {str(e)}")
 
@@ -1,12 +1,16 @@
 from app import db
 from datetime import datetime
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text, Float
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text, Float, event
 from sqlalchemy.orm import relationship
 
+from app.utils.phone import canonical_phone
+
 # Import enhanced notification models
 from .notification import Notification, NotificationTemplate, NotificationSubscription
-from .insight_cache import InsightCache
+from .insight_cache import InsightCache, InsightGenerationLock
+from .umwari_conversation import UmwariConversation, UmwariMessage
+from .llm_usage import LLMUsage
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -14,6 +18,7 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     phone_number = db.Column(db.String(20), unique=True, nullable=True)  # Made optional for children
+    phone_e164 = db.Column(db.String(20), unique=True, nullable=True, index=True)  # Canonical +250… form, kept in sync with phone_number
     email = db.Column(db.String(120), unique=True, nullable=True)  # Added email field
     password_hash = db.Column(db.String(255), nullable=False)
     user_type = db.Column(db.String(20), nullable=False)  # 'parent', 'adolescent', 'admin', 'content_writer', 'health_provider'
@@ -54,6 +59,23 @@ class User(db.Model):
         return f'<User {self.name}>'
 
 
+@event.listens_for(User, 'before_insert')
+def _set_phone_e164(mapper, connection, target):
+    """Fill the canonical phone column for new users"""
+    target.phone_e164 = canonical_phone(target.phone_number)
+
+
+@event.listens_for(User, 'before_update')
+def _sync_phone_e164(mapper, connection, target):
+    """Keep the canonical phone column in step when phone_number changes.
+
+    Untouched rows are left alone: duplicates left NULL by the backfill
+    migration must not start colliding on unrelated profile edits.
+    """
+    if db.inspect(target).attrs.phone_number.history.has_changes():
+        target.phone_e164 = canonical_phone(target.phone_number)
+
+
 class Admin(db.Model):
     __tablename__ = 'admins'
     
@@ -528,6 +550,31 @@ class Analytics(db.Model):
         return f'<Analytics {self.metric_name}>'
 
 
+class EngagementDaily(db.Model):
+    """Per-day engagement aggregate: one row per (day, metric).
+
+    ``user_bitmap`` has bit N set when user id N was counted for the metric on
+    that day, so distinct users over any range are an OR + popcount of a few
+    rows instead of a scan of the log tables.
+    """
+    __tablename__ = 'engagement_daily'
+    __table_args__ = (
+        db.UniqueConstraint('day', 'metric', name='uq_engagement_daily_day_metric'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    metric = db.Column(db.String(50), nullable=False)  # 'active', 'signups', 'feature:cycle_tracking', ...
+    user_bitmap = db.Column(db.LargeBinary, nullable=True)
+    distinct_users = db.Column(db.Integer, default=0)
+    events = db.Column(db.Integer, default=0)
+    is_final = db.Column(db.Boolean, default=False)  # day had fully elapsed when computed
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<EngagementDaily {self.day} {self.metric}>'
+
+
 class UserSession(db.Model):
     __tablename__ = 'user_sessions'
     
@@ -1,26 +1,39 @@
 from app import db
 from datetime import datetime, timedelta
 from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+# Dialects whose INSERT supports ON CONFLICT DO UPDATE
+_UPSERT_DIALECTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
 
 class InsightCache(db.Model):
     """
-    Model to cache AI-generated insights to reduce API costs and improve performance
+    Model to cache AI-generated insights to reduce API costs and improve performance.
+    One row per (user, language): a new insight overwrites the previous one.
     """
     __tablename__ = 'insight_cache'
+    __table_args__ = (
+        # Upsert target and the per-user lookups (get_valid_cache, stale fallback)
+        db.Index('ux_insight_cache_user_language', 'user_id', 'language', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # sha256 of the prompt inputs; equal fingerprints mean an equal insight
+    fingerprint = db.Column(db.String(64), nullable=True, index=True)
     language = db.Column(db.String(20), nullable=False, default='kinyarwanda')
     insight_data = db.Column(db.Text, nullable=False)  # JSON string of the insight
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    expires_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
     is_valid = db.Column(db.Boolean, default=True)
     
     # Relationship
     user = db.relationship('User', backref='cached_insights', lazy=True)
     
-    def __init__(self, user_id, language, insight_data, cache_hours=6):
+    def __init__(self, user_id, language, insight_data, cache_hours=6, fingerprint=None):
         self.user_id = user_id
+        self.fingerprint = fingerprint
         self.language = language
         self.insight_data = insight_data
         self.expires_at = datetime.utcnow() + timedelta(hours=cache_hours)
@@ -43,14 +56,111 @@ class InsightCache(db.Model):
         ).first()
     
     @classmethod
-    def cleanup_expired(cls):
-        """Remove expired cache entries"""
-        expired_entries = cls.query.filter(
-            cls.expires_at <= datetime.utcnow()
-        ).all()
-        
-        for entry in expired_entries:
-            db.session.delete(entry)
-        
+    def get_by_fingerprint(cls, fingerprint):
+        """Get a valid cached insight generated from identical inputs, for any user"""
+        return cls.query.filter(
+            cls.fingerprint == fingerprint,
+            cls.expires_at > datetime.utcnow(),
+            cls.is_valid == True
+        ).order_by(cls.created_at.desc()).first()
+    
+    @classmethod
+    def upsert(cls, user_id, language, insight_data, cache_hours=6, fingerprint=None):
+        """Store the user's insight for ``language`` in one statement, replacing any previous one"""
+        now = datetime.utcnow()
+        values = {
+            'fingerprint': fingerprint,
+            'insight_data': insight_data,
+            'created_at': now,
+            'expires_at': now + timedelta(hours=cache_hours),
+            'is_valid': True,
+        }
+        make_insert = _UPSERT_DIALECTS.get(db.session.get_bind().dialect.name)
+        if make_insert is None:
+            cls.query.filter_by(user_id=user_id, language=language).delete(synchronize_session=False)
+            db.session.execute(cls.__table__.insert().values(user_id=user_id, language=language, **values))
+        else:
+            statement = make_insert(cls.__table__).values(user_id=user_id, language=language, **values)
+            db.session.execute(statement.on_conflict_do_update(
+                index_elements=['user_id', 'language'], set_=values
+            ))
+        db.session.commit()
+    
+    @classmethod
+    def cleanup_expired(cls, before=None, chunk_size=1000):
+        """
+        Delete entries that expired before ``before`` (default: now) in chunks
+        of ``chunk_size`` rows, committing each chunk so no long transaction
+        holds locks on the table. Returns the number of rows deleted.
+        """
+        before = before or datetime.utcnow()
+        table = cls.__table__
+        deleted = 0
+        while True:
+            ids = [row.id for row in db.session.execute(
+                db.select(table.c.id).where(table.c.expires_at <= before).limit(chunk_size)
+            )]
+            if not ids:
+                return deleted
+            db.session.execute(table.delete().where(table.c.id.in_(ids)))
+            db.session.commit()
+            deleted += len(ids)
+            if len(ids) < chunk_size:
+                return deleted
+
+
+class InsightGenerationLock(db.Model):
+    """
+    Claim on generating the insight for one fingerprint, so gunicorn workers
+    don't each call Gemini for the same prompt. Rows are short-lived; an
+    expired row belongs to a worker that died and may be taken over.
+    """
+    __tablename__ = 'insight_generation_locks'
+    
+    fingerprint = db.Column(db.String(64), primary_key=True)
+    owner = db.Column(db.String(32), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f'<InsightGenerationLock {self.fingerprint[:12]} {self.owner}>'
+    
+    @classmethod
+    def acquire(cls, fingerprint, owner, ttl_seconds):
+        """Take the lock; False while another live owner holds it"""
+        now = datetime.utcnow()
+        table = cls.__table__
+        # Clear a lock abandoned by a dead worker before trying to insert
+        db.session.execute(table.delete().where(
+            table.c.fingerprint == fingerprint,
+            table.c.expires_at <= now
+        ))
+        try:
+            db.session.execute(table.insert().values(
+                fingerprint=fingerprint,
+                owner=owner,
+                expires_at=now + timedelta(seconds=ttl_seconds)
+            ))
+            db.session.commit()
+            return True
+        except IntegrityError:
+            db.session.rollback()
+            return False
+    
+    @classmethod
+    def is_held(cls, fingerprint):
+        table = cls.__table__
+        return db.session.execute(
+            db.select(table.c.owner).where(
+                table.c.fingerprint == fingerprint,
+                table.c.expires_at > datetime.utcnow()
+            )
+        ).first() is not None
+    
+    @classmethod
+    def release(cls, fingerprint, owner):
+        table = cls.__table__
+        db.session.execute(table.delete().where(
+            table.c.fingerprint == fingerprint,
+            table.c.owner == owner
+        ))
         db.session.commit()
-        return len(expired_entries)
\ No newline at end of file
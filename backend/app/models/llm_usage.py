@@ -0,0 +1,31 @@
+from app import db
+from datetime import datetime
+
+
+class LLMUsage(db.Model):
+    """
+    Ledger of Gemini usage: one row per upstream call, plus one per request
+    answered from a cached insight (``cache_hit``) so hit rates can be read
+    next to spend. Rows are written in batches by ``llm_usage_writer``.
+    """
+    __tablename__ = 'llm_usage'
+    __table_args__ = (
+        db.Index('ix_llm_usage_user_created', 'user_id', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    role = db.Column(db.String(20), nullable=True)
+    endpoint = db.Column(db.String(50), nullable=False)
+    language = db.Column(db.String(20), nullable=True)
+    model = db.Column(db.String(50), nullable=True)
+    outcome = db.Column(db.String(20), nullable=False)  # 'ok', 'error', 'cancelled', 'cache_hit'
+    cache_hit = db.Column(db.Boolean, nullable=False, default=False)
+    prompt_tokens = db.Column(db.Integer, nullable=False, default=0)
+    output_tokens = db.Column(db.Integer, nullable=False, default=0)
+    cached_tokens = db.Column(db.Integer, nullable=False, default=0)  # prompt tokens served by Gemini's context cache
+    duration_ms = db.Column(db.Float, nullable=False, default=0.0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<LLMUsage {self.endpoint} {self.outcome} user={self.user_id}>'
@@ -0,0 +1,60 @@
+from app import db
+from datetime import datetime
+
+
+class UmwariConversation(db.Model):
+    """
+    Server-side Umwari chat history. Messages up to ``summarized_through_id``
+    have been folded into ``summary``; only the summary and the messages after
+    it are sent to Gemini.
+    """
+    __tablename__ = 'umwari_conversations'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    # Sent as Gemini's system instruction on every turn; never summarized
+    system_context = db.Column(db.Text, nullable=True)
+    summary = db.Column(db.Text, nullable=True)
+    summary_tokens = db.Column(db.Integer, nullable=False, default=0)
+    summarized_through_id = db.Column(db.Integer, nullable=False, default=0)
+    # Estimated tokens of every message ever stored, i.e. what resending the whole history would cost
+    total_tokens = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    messages = db.relationship('UmwariMessage', backref='conversation', lazy='dynamic',
+                               cascade='all, delete-orphan', order_by='UmwariMessage.id')
+
+    def __repr__(self):
+        return f'<UmwariConversation {self.id} user={self.user_id}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'summarized': bool(self.summary),
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+
+class UmwariMessage(db.Model):
+    """One turn of an Umwari conversation ('user' or 'model')"""
+    __tablename__ = 'umwari_messages'
+
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('umwari_conversations.id'), nullable=False, index=True)
+    role = db.Column(db.String(10), nullable=False)
+    text = db.Column(db.Text, nullable=False)
+    tokens = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<UmwariMessage {self.id} {self.role}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'role': self.role,
+            'text': self.text,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
@@ -10,8 +10,10 @@ from app.auth.middleware import (
     admin_required, check_permissions, log_user_activity, RoleBasedAccess
 )
 from datetime import datetime, timedelta
-from sqlalchemy import func, desc, or_, and_
+from sqlalchemy import func, desc, or_, and_, case
 import json
+import os
+from app.utils.query_optimizer import BatchStatsLoader, scalar_counts
 from app.services.admin_notifications import (
     notify_provider_verified,
     notify_provider_verification_revoked,
@@ -213,36 +215,31 @@ def get_user_details(user_id):
         additional_data = {}
         
         if user.user_type == 'parent':
-            # Get children count, appointments, etc.
-            appointments_count = Appointment.query.filter_by(user_id=user.id).count()
-            additional_data.update({
-                'appointments_count': appointments_count,
-                'notifications_count': Notification.query.filter_by(user_id=user.id).count()
-            })
+            counts = scalar_counts(
+                appointments_count=Appointment.user_id == user.id,
+                notifications_count=Notification.user_id == user.id
+            )
+            additional_data.update(counts)
         elif user.user_type == 'adolescent':
-            # Get cycle logs, meal logs, etc.
-            cycle_logs_count = CycleLog.query.filter_by(user_id=user.id).count()
-            meal_logs_count = MealLog.query.filter_by(user_id=user.id).count()
+            counts = scalar_counts(
+                cycle_logs_count=CycleLog.user_id == user.id,
+                meal_logs_count=MealLog.user_id == user.id
+            )
             additional_data.update({
-                'cycle_logs_count': cycle_logs_count,
-                'meal_logs_count': meal_logs_count,
+                **counts,
                 'personal_cycle_length': getattr(user, 'personal_cycle_length', None),
                 'personal_period_length': getattr(user, 'personal_period_length', None)
             })
         elif user.user_type == 'content_writer':
-            # Get content created
-            content_count = ContentItem.query.filter_by(author_id=user.id).count()
-            courses_count = Course.query.filter_by(author_id=user.id).count() if hasattr(Course, 'author_id') else 0
-            additional_data.update({
-                'content_count': content_count,
-                'courses_count': courses_count
-            })
+            counts = scalar_counts(
+                content_count=ContentItem.author_id == user.id,
+                courses_count=Course.author_id == user.id
+            )
+            additional_data.update(counts)
         elif user.user_type == 'health_provider':
-            # Get appointments handled
-            appointments_handled = Appointment.query.filter_by(provider_id=user.id).count()
-            additional_data.update({
-                'appointments_handled': appointments_handled
-            })
+            additional_data.update(scalar_counts(
+                appointments_handled=Appointment.provider_id == user.id
+            ))
         
         log_user_activity('view_user_details', {'user_id': user_id})
         
@@ -284,7 +281,8 @@ def create_user():
             if User.query.filter_by(email=data['email']).first():
                 return jsonify({'error': 'User with this email already exists'}), 400
         
-        if User.query.filter_by(phone_number=data['phone_number']).first():
+        from app.ussd.session import find_user_by_phone
+        if find_user_by_phone(data['phone_number'], use_cache=False):
             return jsonify({'error': 'User with this phone number already exists'}), 400
         
         # Create new user
@@ -533,249 +531,150 @@ def bulk_user_action():
         except (ValueError, TypeError):
             return jsonify({'error': 'Invalid user_ids. Must be integers'}), 400
         
-        users = User.query.filter(User.id.in_(user_ids)).all()
+        try:
+            dry_run = _parse_dry_run(data.get('dry_run'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        from app.services.bulk_user_actions import plan_bulk_action
+        
+        plan = plan_bulk_action(action, user_ids)
         
-        if not users:
+        if not plan['found']:
             return jsonify({'error': 'No users found with provided IDs'}), 404
         
-        results = {'successful': 0, 'failed': 0, 'details': []}
-        
-        if action == 'activate':
-            for user in users:
-                try:
-                    user.is_active = True
-                    results['successful'] += 1
-                except Exception as e:
-                    results['failed'] += 1
-                    results['details'].append({'user_id': user.id, 'error': str(e)})
-            message = f'Activated {results["successful"]} users'
-            
-        elif action == 'deactivate':
-            for user in users:
-                try:
-                    user.is_active = False
-                    results['successful'] += 1
-                except Exception as e:
-                    results['failed'] += 1
-                    results['details'].append({'user_id': user.id, 'error': str(e)})
-            message = f'Deactivated {results["successful"]} users'
-            
-        elif action == 'delete':
+        if action == 'delete':
             # Prevent deleting admin users
-            admin_users = [u for u in users if u.user_type == 'admin']
-            if admin_users:
+            admin_user_ids = [uid for uid, user_type in plan['found'] if user_type == 'admin']
+            if admin_user_ids:
                 return jsonify({
-                    'error': f'Cannot delete {len(admin_users)} admin user(s)',
-                    'admin_user_ids': [u.id for u in admin_users]
+                    'error': f'Cannot delete {len(admin_user_ids)} admin user(s)',
+                    'admin_user_ids': admin_user_ids
                 }), 403
-            
-            for user in users:
-                try:
-                    # Import additional models that might not be in the initial imports
-                    from app.models import (
-                        PeriodLog, Feedback, SystemLog,
-                        InsightCache, NotificationSubscription, LoginAttempt
-                    )
-                    
-                    # Delete all related records before deleting the user
-                    # Use try-except for each deletion to handle missing tables or schema mismatches
-                    
-                    # Core user data - use raw SQL to avoid schema mismatches
-                    try:
-                        db.session.execute(
-                            db.text("DELETE FROM cycle_logs WHERE user_id = :user_id"),
-                            {"user_id": user.id}
-                        )
-                    except Exception:
-                        db.session.rollback()
-                    
-                    try:
-                        db.session.execute(
-                            db.text("DELETE FROM period_logs WHERE user_id = :user_id"),
-                            {"user_id": user.id}
-                        )
-                    except Exception:
-                        db.session.rollback()
-                    
-                    try:
-                        db.session.execute(
-                            db.text("DELETE FROM meal_logs WHERE user_id = :user_id"),
-                            {"user_id": user.id}
-                        )
-                    except Exception:
-                        db.session.rollback()
-                    
-                    # Notifications and subscriptions - use raw SQL
-                    try:
-                        db.session.execute(
-                            db.text("DELETE FROM notifications WHERE user_id = :user_id"),
-                            {"user_id": user.id}
-                        )
-                    except Exception:
-                        db.session.rollback()
-                    
-                    try:
-                        db.session.execute(
-                            db.text("DELETE FROM notification_subscriptions WHERE user_id = :user_id"),
-                            {"user_id": user.id}
-                        )
-                    except Exception:
-                        db.session.rollback()
-                    
-                    # User sessions and logs - use raw SQL
-                    try:
-                        db.session.execute(
-                            db.text("DELETE FROM user_sessions WHERE user_id = :user_id"),
-                            {"user_id": user.id}
-                        )
-                    except Exception:
-                        db.session.rollback()
-                    
-                    try:
-                        db.session.execute(
-                            db.text("DELETE FROM system_logs WHERE user_id = :user_id"),
-                            {"user_id": user.id}
-                        )
-                    except Exception:
-                        db.session.rollback()
-                    
-                    # Login attempts (by phone number)
-                    if user.phone_number:
-                        try:
-                            db.session.execute(
-                                db.text("DELETE FROM login_attempts WHERE phone_number = :phone_number"),
-                                {"phone_number": user.phone_number}
-                            )
-                        except Exception:
-                            db.session.rollback()
-                    
-                    # Insights cache
-                    try:
-                        db.session.execute(
-                            db.text("DELETE FROM insight_cache WHERE user_id = :user_id"),
-                            {"user_id": user.id}
-                        )
-                    except Exception:
-                        db.session.rollback()
-                    
-                    # Feedback
-                    try:
-                        db.session.execute(
-                            db.text("DELETE FROM feedbacks WHERE user_id = :user_id"),
-                            {"user_id": user.id}
-                        )
-                    except Exception:
-                        db.session.rollback()
-                    
-                    # Delete role-specific records
-                    if user.user_type == 'parent':
-                        parent = Parent.query.filter_by(user_id=user.id).first()
-                        if parent:
-                            try:
-                                ParentChild.query.filter_by(parent_id=parent.id).delete()
-                            except Exception:
-                                db.session.rollback()
-                            db.session.delete(parent)
-                    
-                    elif user.user_type == 'adolescent':
-                        adolescent = Adolescent.query.filter_by(user_id=user.id).first()
-                        if adolescent:
-                            try:
-                                ParentChild.query.filter_by(adolescent_id=adolescent.id).delete()
-                            except Exception:
-                                db.session.rollback()
-                            db.session.delete(adolescent)
-                    
-                    elif user.user_type == 'content_writer':
-                        content_writer = ContentWriter.query.filter_by(user_id=user.id).first()
-                        if content_writer:
-                            try:
-                                # Update or delete content items by this writer
-                                # Set author_id to NULL instead of deleting content
-                                ContentItem.query.filter_by(author_id=content_writer.id).update({'author_id': None})
-                                
-                                # Handle courses - either delete or reassign
-                                # For now, we'll prevent deletion if writer has published courses
-                                published_courses = Course.query.filter_by(
-                                    author_id=content_writer.id, 
-                                    status='published'
-                                ).count()
-                                if published_courses > 0:
-                                    raise Exception(f'Cannot delete: writer has {published_courses} published course(s)')
-                                
-                                # Delete draft courses
-                                Course.query.filter_by(author_id=content_writer.id).delete()
-                            except Exception:
-                                db.session.rollback()
-                            
-                            db.session.delete(content_writer)
-                    
-                    elif user.user_type == 'health_provider':
-                        health_provider = HealthProvider.query.filter_by(user_id=user.id).first()
-                        if health_provider:
-                            try:
-                                # Update appointments assigned to this provider to set provider_id to NULL
-                                Appointment.query.filter_by(provider_id=health_provider.id).update({'provider_id': None})
-                            except Exception:
-                                db.session.rollback()
-                            db.session.delete(health_provider)
-                    
-                    elif user.user_type == 'admin':
-                        admin_profile = Admin.query.filter_by(user_id=user.id).first()
-                        if admin_profile:
-                            db.session.delete(admin_profile)
-                    
-                    # Delete appointments created by this user (after handling provider and role-specific records)
-                    try:
-                        db.session.execute(
-                            db.text("DELETE FROM appointments WHERE user_id = :user_id"),
-                            {"user_id": user.id}
-                        )
-                    except Exception:
-                        db.session.rollback()
-                    
-                    # Finally, delete the user
-                    db.session.delete(user)
-                    
-                    # Commit this user's deletion immediately
-                    db.session.commit()
-                    results['successful'] += 1
-                    
-                except Exception as e:
-                    db.session.rollback()  # Rollback this specific user's deletion
-                    results['failed'] += 1
-                    results['details'].append({'user_id': user.id, 'error': str(e)})
-                    current_app.logger.error(f"Error deleting user {user.id}: {str(e)}")
-            
-            message = f'Deleted {results["successful"]} users'
-        
-        log_user_activity('bulk_user_action', {
-            'action': action,
-            'user_count': len(users),
-            'user_ids': user_ids,
-            'successful': results['successful'],
-            'failed': results['failed']
-        })
         
-        response = {
-            'message': message,
-            'action': action,
-            'results': {
-                'successful': results['successful'],
-                'failed': results['failed']
-            }
-        }
-        
-        if results['failed'] > 0:
-            response['details'] = results['details']
-        
-        return jsonify(response), 200
+        return _run_bulk_job(
+            kind='bulk_user_action',
+            targets=plan['targets'],
+            skipped=plan['skipped'],
+            dry_run=dry_run,
+            params={'action': action},
+            log_details={'action': action, 'user_ids': user_ids},
+            message=lambda n: f'{BULK_ACTION_VERBS[action]} {n} users'
+        )
         
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Error performing bulk action: {str(e)}")
         return jsonify({'error': 'Failed to perform bulk action', 'details': str(e)}), 500
 
+BULK_ACTION_VERBS = {'activate': 'Activated', 'deactivate': 'Deactivated', 'delete': 'Deleted'}
+
+
+def _parse_dry_run(value):
+    """``dry_run`` from a JSON body: a boolean, or 'true'/'false'/1/0; ValueError otherwise"""
+    if value is None or isinstance(value, bool):
+        return bool(value)
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in ('true', '1', 'yes', 'false', '0', 'no', ''):
+        return value.strip().lower() in ('true', '1', 'yes')
+    raise ValueError('dry_run must be true or false')
+
+
+def _run_bulk_job(kind, targets, skipped, dry_run, params, log_details, message, unchanged=0):
+    """Dry-run, run inline, or queue a bulk user job depending on its size"""
+    from app.services import bulk_user_actions
+    from app.utils.background import submit_job
+    
+    chunk_size = current_app.config.get('BULK_ACTION_CHUNK_SIZE', bulk_user_actions.DEFAULT_CHUNK_SIZE)
+    sync_limit = current_app.config.get('BULK_ACTION_SYNC_LIMIT', 200)
+    
+    if dry_run:
+        affected = (bulk_user_actions.dry_run_counts(params['action'], targets)
+                    if kind == 'bulk_user_action'
+                    else bulk_user_actions.role_change_counts(params['user_type'], targets))
+        return jsonify({
+            'dry_run': True,
+            **params,
+            'target_count': len(targets),
+            'unchanged_count': unchanged,
+            'skipped': skipped,
+            'affected': affected
+        }), 200
+    
+    def run(job=None):
+        if kind == 'bulk_user_action':
+            return bulk_user_actions.execute_bulk_action(
+                params['action'], targets, chunk_size=chunk_size, job=job
+            )
+        return bulk_user_actions.execute_role_change(
+            params['user_type'], targets, params['profile_data'], chunk_size=chunk_size, job=job
+        )
+    
+    log_user_activity(kind, {
+        **log_details,
+        'user_count': len(targets) + len(skipped) + unchanged,
+        'queued': len(targets) > sync_limit
+    })
+    
+    public_params = {k: v for k, v in params.items() if k != 'profile_data'}
+    
+    if len(targets) > sync_limit:
+        def job_target(job):
+            successful, failed, details = run(job)
+            successful += unchanged
+            return {
+                'message': message(successful),
+                'successful': successful,
+                'failed': failed + len(skipped),
+                'details': skipped + details
+            }
+        
+        job = submit_job(
+            current_app._get_current_object(), kind, job_target,
+            total=len(targets), created_by=g.current_user.id, params=public_params
+        )
+        return jsonify({
+            'message': f'{len(targets)} users queued for processing',
+            **public_params,
+            'job_id': job.id,
+            'status_url': f'/api/admin/users/bulk-jobs/{job.id}',
+            'job': job.to_dict()
+        }), 202
+    
+    successful, failed, details = run()
+    successful += unchanged
+    failed += len(skipped)
+    details = skipped + details
+    
+    response = {
+        'message': message(successful),
+        **public_params,
+        'results': {
+            'successful': successful,
+            'failed': failed,
+            'total': len(targets) + len(skipped) + unchanged
+        }
+    }
+    
+    if failed > 0:
+        response['details'] = details
+    
+    return jsonify(response), 200
+
+
+@admin_bp.route('/users/bulk-jobs/<job_id>', methods=['GET'])
+@admin_required
+@check_permissions(['manage_users'])
+def get_bulk_job_status(job_id):
+    """Progress of a queued bulk user job"""
+    from app.utils.background import get_job
+    
+    job = get_job(job_id, app=current_app)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job), 200
+
 @admin_bp.route('/users/<int:user_id>/change-role', methods=['PATCH'])
 @admin_required
 @check_permissions(['manage_users'])
@@ -952,18 +851,17 @@ def get_all_health_providers():
             page=page, per_page=per_page, error_out=False
         )
         
+        # Appointment counts for the whole page in one grouped query
+        stats = BatchStatsLoader(provider.id for provider in pagination.items).count_by(
+            'appointments', Appointment.provider_id, Appointment.status
+        ).load()
+        
         providers = []
         for provider in pagination.items:
-            # Count appointments for this provider
-            total_appointments = Appointment.query.filter_by(provider_id=provider.id).count()
-            pending_appointments = Appointment.query.filter_by(
-                provider_id=provider.id, 
-                status='pending'
-            ).count()
-            completed_appointments = Appointment.query.filter_by(
-                provider_id=provider.id, 
-                status='completed'
-            ).count()
+            by_status = stats[provider.id].get('appointments', {})
+            total_appointments = sum(by_status.values())
+            pending_appointments = by_status.get('pending', 0)
+            completed_appointments = by_status.get('completed', 0)
             
             providers.append({
                 'id': provider.id,
@@ -1432,128 +1330,35 @@ def bulk_change_user_role():
         except (ValueError, TypeError):
             return jsonify({'error': 'Invalid user_ids. Must be integers'}), 400
         
-        users = User.query.filter(User.id.in_(user_ids)).all()
-        
-        if not users:
-            return jsonify({'error': 'No users found with provided IDs'}), 404
-        
-        results = {'successful': 0, 'failed': 0, 'details': []}
+        try:
+            dry_run = _parse_dry_run(data.get('dry_run'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        for user in users:
-            try:
-                old_type = user.user_type
-                
-                # Prevent changing admin user role
-                if old_type == 'admin':
-                    results['failed'] += 1
-                    results['details'].append({
-                        'user_id': user.id,
-                        'error': 'Cannot change role of admin users'
-                    })
-                    continue
-                
-                # If role not changing, skip
-                if old_type == new_user_type:
-                    results['successful'] += 1
-                    continue
-                
-                # Clean up old role profile
-                if old_type == 'admin':
-                    old_profile = Admin.query.filter_by(user_id=user.id).first()
-                    if old_profile:
-                        db.session.delete(old_profile)
-                elif old_type == 'content_writer':
-                    old_profile = ContentWriter.query.filter_by(user_id=user.id).first()
-                    if old_profile:
-                        db.session.delete(old_profile)
-                elif old_type == 'health_provider':
-                    old_profile = HealthProvider.query.filter_by(user_id=user.id).first()
-                    if old_profile:
-                        db.session.delete(old_profile)
-                elif old_type == 'parent':
-                    old_profile = Parent.query.filter_by(user_id=user.id).first()
-                    if old_profile:
-                        ParentChild.query.filter_by(parent_id=old_profile.id).delete()
-                        db.session.delete(old_profile)
-                elif old_type == 'adolescent':
-                    old_profile = Adolescent.query.filter_by(user_id=user.id).first()
-                    if old_profile:
-                        ParentChild.query.filter_by(adolescent_id=old_profile.id).delete()
-                        db.session.delete(old_profile)
-                
-                # Update user type
-                user.user_type = new_user_type
-                
-                # Create new role profile
-                if new_user_type == 'admin':
-                    admin_profile = Admin(
-                        user_id=user.id,
-                        permissions=json.dumps(['all']),
-                        department=data.get('department', 'General')
-                    )
-                    db.session.add(admin_profile)
-                
-                elif new_user_type == 'content_writer':
-                    writer_profile = ContentWriter(
-                        user_id=user.id,
-                        specialization=data.get('specialization', ''),
-                        bio=data.get('bio', ''),
-                        is_approved=True
-                    )
-                    db.session.add(writer_profile)
-                
-                elif new_user_type == 'health_provider':
-                    provider_profile = HealthProvider(
-                        user_id=user.id,
-                        specialization=data.get('specialization', 'General Healthcare'),
-                        license_number=data.get('license_number', ''),
-                        clinic_name=data.get('clinic_name', ''),
-                        is_verified=True,
-                        created_at=datetime.utcnow()
-                    )
-                    db.session.add(provider_profile)
-                
-                elif new_user_type == 'parent':
-                    parent_profile = Parent(user_id=user.id)
-                    db.session.add(parent_profile)
-                
-                elif new_user_type == 'adolescent':
-                    adolescent_profile = Adolescent(
-                        user_id=user.id,
-                        date_of_birth=data.get('date_of_birth')
-                    )
-                    db.session.add(adolescent_profile)
-                
-                results['successful'] += 1
-                
-            except Exception as e:
-                results['failed'] += 1
-                results['details'].append({'user_id': user.id, 'error': str(e)})
-                current_app.logger.error(f"Error changing role for user {user.id}: {str(e)}")
+        from app.services.bulk_user_actions import plan_role_change
         
-        db.session.commit()
+        plan = plan_role_change(new_user_type, user_ids)
         
-        log_user_activity('bulk_change_user_role', {
-            'new_user_type': new_user_type,
-            'user_count': len(users),
-            'user_ids': user_ids,
-            'successful': results['successful'],
-            'failed': results['failed']
-        })
+        if not plan['found']:
+            return jsonify({'error': 'No users found with provided IDs'}), 404
         
-        response = {
-            'message': f'Changed role to {new_user_type} for {results["successful"]} users',
-            'results': {
-                'successful': results['successful'],
-                'failed': results['failed'],
-                'total': len(users)
-            }
+        profile_data = {
+            key: data.get(key) for key in (
+                'department', 'specialization', 'bio', 'license_number', 'clinic_name', 'date_of_birth'
+            ) if data.get(key) is not None
         }
         
-        if results['failed'] > 0:
-            response['details'] = results['details']
-        
-        return jsonify(response), 200
+        # Users already in the target role count as successful no-ops
+        return _run_bulk_job(
+            kind='bulk_change_user_role',
+            targets=plan['targets'],
+            skipped=plan['skipped'],
+            dry_run=dry_run,
+            params={'action': 'change_role', 'user_type': new_user_type, 'profile_data': profile_data},
+            log_details={'new_user_type': new_user_type, 'user_ids': user_ids},
+            message=lambda n: f'Changed role to {new_user_type} for {n} users',
+            unchanged=len(plan['unchanged'])
+        )
         
     except Exception as e:
         db.session.rollback()
@@ -1869,11 +1674,16 @@ def get_content_writers():
     try:
         content_writers = User.query.filter_by(user_type='content_writer').all()
         
+        # Content and course counts for every writer in two grouped queries
+        stats = (BatchStatsLoader(writer.id for writer in content_writers)
+                 .count('content', ContentItem.author_id)
+                 .count('courses', Course.author_id)
+                 .load())
+        
         writers_data = []
         for writer in content_writers:
-            # Get content and course counts
-            content_count = ContentItem.query.filter_by(author_id=writer.id).count()
-            courses_count = Course.query.filter_by(author_id=writer.id).count()
+            content_count = stats[writer.id].get('content', 0)
+            courses_count = stats[writer.id].get('courses', 0)
             
             writers_data.append({
                 'id': writer.id,
@@ -1978,10 +1788,214 @@ def get_system_logs():
         current_app.logger.error(f"Error getting system logs: {str(e)}")
         return jsonify({'error': 'Failed to fetch system logs'}), 500
 
+@admin_bp.route('/system/performance', methods=['GET'])
+@admin_required
+@check_permissions(['view_system_logs'])
+def get_performance_metrics():
+    """Per-route latency percentiles, DB usage, slow queries and cache hit rates"""
+    try:
+        from app.utils.performance import performance_stats
+        
+        return jsonify(performance_stats.get_summary()), 200
+        
+    except Exception as e:
+        current_app.logger.error(f"Error getting performance metrics: {str(e)}")
+        return jsonify({'error': 'Failed to fetch performance metrics'}), 500
+
+@admin_bp.route('/system/insights-performance', methods=['GET'])
+@admin_required
+@check_permissions(['view_system_logs'])
+def get_insights_performance():
+    """Gemini latency and tokens by endpoint, insight prompt-assembly stages and Umwari prompt tokens saved"""
+    try:
+        from app.utils.performance import performance_stats
+
+        return jsonify({
+            'llm': performance_stats.get_llm_summary(),
+            'pipelines': performance_stats.get_pipeline_summary(),
+            'contexts': performance_stats.get_context_summary(),
+        }), 200
+
+    except Exception as e:
+        current_app.logger.error(f"Error getting insights performance: {str(e)}")
+        return jsonify({'error': 'Failed to fetch insights performance'}), 500
+
+@admin_bp.route('/system/llm-usage', methods=['GET'])
+@admin_required
+@check_permissions(['view_system_logs'])
+def get_llm_usage():
+    """Gemini token spend, latency and cache hit rate from the usage ledger (``?days=7&limit=20``), plus quotas"""
+    try:
+        from app.services.llm_usage import llm_usage_writer, quotas, usage_report
+
+        days = min(max(request.args.get('days', 7, type=int), 1), 90)
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        return jsonify({
+            **usage_report(days, limit),
+            'quotas': {
+                role: {'capacity': quota[0], 'refill_per_hour': quota[1]} if quota else None
+                for role, quota in quotas().items()
+            },
+            'quotas_enabled': current_app.config.get('LLM_QUOTAS_ENABLED', True),
+            'writer': llm_usage_writer.metrics(),
+        }), 200
+
+    except Exception as e:
+        current_app.logger.error(f"Error getting LLM usage: {str(e)}")
+        return jsonify({'error': 'Failed to fetch LLM usage'}), 500
+
+@admin_bp.route('/system/ussd-performance', methods=['GET'])
+@admin_required
+@check_permissions(['view_system_logs'])
+def get_ussd_performance():
+    """Slowest USSD menu paths from USSDTransaction plus live per-phase hop timings"""
+    try:
+        from app.ussd.ussd_models import USSDTransaction
+        from app.utils.performance import performance_stats
+
+        days = min(request.args.get('days', 7, type=int), 90)
+        limit = min(request.args.get('limit', 20, type=int), 100)
+        budget_ms = current_app.config.get('USSD_HOP_BUDGET_MS', 4000)
+        since = datetime.utcnow() - timedelta(days=days)
+        timed = and_(USSDTransaction.created_at >= since, USSDTransaction.duration_ms.isnot(None))
+
+        paths = db.session.query(
+            USSDTransaction.menu_state,
+            func.count(USSDTransaction.id),
+            func.avg(USSDTransaction.duration_ms),
+            func.max(USSDTransaction.duration_ms),
+            func.sum(case((USSDTransaction.duration_ms > budget_ms, 1), else_=0)),
+            func.sum(case((USSDTransaction.success.is_(False), 1), else_=0)),
+        ).filter(timed).group_by(USSDTransaction.menu_state).order_by(
+            desc(func.avg(USSDTransaction.duration_ms))
+        ).all()
+
+        # request_text is left out on purpose: the first segment is the caller's PIN
+        slowest = USSDTransaction.query.filter(timed).order_by(
+            desc(USSDTransaction.duration_ms)
+        ).limit(limit).all()
+
+        return jsonify({
+            'days': days,
+            'budget_ms': budget_ms,
+            'paths': [{
+                'menu_state': menu_state,
+                'hops': hops,
+                'avg_ms': round(float(avg_ms or 0), 1),
+                'max_ms': max_ms,
+                'over_budget': int(over_budget or 0),
+                'failures': int(failures or 0),
+            } for menu_state, hops, avg_ms, max_ms, over_budget, failures in paths],
+            'slowest_hops': [{
+                'session_id': txn.session_id,
+                'menu_state': txn.menu_state,
+                'duration_ms': txn.duration_ms,
+                'success': txn.success,
+                'created_at': txn.created_at.isoformat() if txn.created_at else None,
+            } for txn in slowest],
+            'live': performance_stats.get_ussd_summary(),
+        }), 200
+
+    except Exception as e:
+        current_app.logger.error(f"Error getting USSD performance: {str(e)}")
+        return jsonify({'error': 'Failed to fetch USSD performance'}), 500
+
+@admin_bp.route('/system/sms-outbound', methods=['GET'])
+@admin_required
+@check_permissions(['view_system_logs'])
+def get_sms_outbound_status():
+    """Delivery state of SMS notification digests for feature-phone users"""
+    try:
+        from app.ussd.ussd_models import USSDNotification
+
+        counts = dict(db.session.query(
+            USSDNotification.delivery_status, func.count(USSDNotification.id)
+        ).group_by(USSDNotification.delivery_status).all())
+
+        recent_errors = db.session.query(
+            USSDNotification.last_error, func.count(USSDNotification.id)
+        ).filter(
+            USSDNotification.last_error.isnot(None),
+            USSDNotification.created_at >= datetime.utcnow() - timedelta(days=1),
+        ).group_by(USSDNotification.last_error).order_by(desc(func.count(USSDNotification.id))).limit(10).all()
+
+        return jsonify({
+            'enabled': current_app.config.get('SMS_OUTBOUND_ENABLED', False),
+            'gateway': current_app.config.get('SMS_GATEWAY'),
+            'by_status': counts,
+            'recent_errors': [{'error': error, 'count': count} for error, count in recent_errors],
+        }), 200
+
+    except Exception as e:
+        current_app.logger.error(f"Error getting SMS outbound status: {str(e)}")
+        return jsonify({'error': 'Failed to fetch SMS outbound status'}), 500
+
+@admin_bp.route('/system/sms-outbound/dispatch', methods=['POST'])
+@admin_required
+@check_permissions(['manage_users'])
+def dispatch_sms_outbound():
+    """Send one batch of pending SMS digests now"""
+    try:
+        from app.ussd.outbound import dispatch_pending
+
+        log_user_activity('dispatch_sms_digests')
+        return jsonify(dispatch_pending()), 200
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error dispatching SMS digests: {str(e)}")
+        return jsonify({'error': 'Failed to dispatch SMS digests'}), 500
+
+@admin_bp.route('/system/log-pipeline', methods=['GET'])
+@admin_required
+@check_permissions(['view_system_logs'])
+def get_log_pipeline_metrics():
+    """Queue depth, throughput and drop counters for the buffered log writers"""
+    try:
+        from app.utils.buffered_writer import registered_writers
+
+        return jsonify({
+            'pid': os.getpid(),
+            'writers': [writer.metrics() for writer in registered_writers().values()]
+        }), 200
+
+    except Exception as e:
+        current_app.logger.error(f"Error getting log pipeline metrics: {str(e)}")
+        return jsonify({'error': 'Failed to fetch log pipeline metrics'}), 500
+
 # ===================================
 # ANALYTICS ENDPOINTS
 # ===================================
 
+@admin_bp.route('/analytics/engagement', methods=['GET'])
+@admin_required
+@check_permissions(['view_analytics'])
+def get_engagement_analytics():
+    """DAU/WAU/MAU series, feature reach and weekly retention cohorts"""
+    try:
+        from app.services.engagement_analytics import (
+            daily_series, range_summary, retention_cohorts
+        )
+        
+        days = min(max(request.args.get('days', 30, type=int), 1), 365)
+        weeks = min(max(request.args.get('weeks', 8, type=int), 1), 26)
+        end_day = datetime.utcnow().date()
+        start_day = end_day - timedelta(days=days - 1)
+        
+        return jsonify({
+            'period': {
+                'start': start_day.isoformat(),
+                'end': end_day.isoformat()
+            },
+            'series': daily_series(start_day, end_day),
+            'summary': range_summary(start_day, end_day),
+            'retention': retention_cohorts(start_day, end_day, weeks=weeks)
+        }), 200
+        
+    except Exception as e:
+        current_app.logger.error(f"Error getting engagement analytics: {str(e)}")
+        return jsonify({'error': 'Failed to fetch engagement analytics'}), 500
+
 @admin_bp.route('/analytics/generate', methods=['POST'])
 @admin_required
 @check_permissions(['view_analytics'])
@@ -2071,13 +2085,9 @@ def generate_analytics():
         
         # ========== USER ACTIVITY REPORT ==========
         elif report_type == 'user_activity':
-            # Daily active users
-            daily_active = db.session.query(
-                func.date(User.last_activity).label('date'),
-                func.count(User.id).label('count')
-            ).filter(
-                User.last_activity.between(start_date, end_date)
-            ).group_by(func.date(User.last_activity)).order_by('date').all()
+            # Daily/weekly/monthly active users from the engagement rollups
+            from app.services.engagement_analytics import daily_series
+            series = daily_series(start_date.date(), end_date.date())
             
             # Most active users
             most_active = db.session.query(
@@ -2091,7 +2101,12 @@ def generate_analytics():
             
             return jsonify({
                 'report_type': 'user_activity',
-                'data': [{'date': str(item.date), 'count': item.count} for item in daily_active],
+                'data': [{
+                    'date': day['date'],
+                    'count': day['dau'],
+                    'wau': day['wau'],
+                    'mau': day['mau']
+                } for day in series],
                 'most_active_users': [{
                     'id': u[0],
                     'name': u[1],
@@ -2288,20 +2303,13 @@ def generate_analytics():
             # Calculate engagement scores
             total_users = User.query.filter(User.created_at <= end_date).count()
             
-            # Users with cycle logs
-            users_with_cycles = db.session.query(
-                func.count(func.distinct(CycleLog.user_id))
-            ).filter(CycleLog.created_at.between(start_date, end_date)).scalar()
-            
-            # Users with meal logs
-            users_with_meals = db.session.query(
-                func.count(func.distinct(MealLog.user_id))
-            ).filter(MealLog.created_at.between(start_date, end_date)).scalar()
-            
-            # Users with appointments
-            users_with_appointments = db.session.query(
-                func.count(func.distinct(Appointment.user_id))
-            ).filter(Appointment.created_at.between(start_date, end_date)).scalar()
+            # Distinct users per feature and returning users from the engagement rollups
+            from app.services.engagement_analytics import range_summary
+            summary = range_summary(start_date.date(), end_date.date())
+            features = summary['features']
+            users_with_cycles = features['cycle_tracking']['users']
+            users_with_meals = features['meal_tracking']['users']
+            users_with_appointments = features['appointments']['users']
             
             # Content engagement (users viewing content)
             content_views_total = db.session.query(
@@ -2309,13 +2317,7 @@ def generate_analytics():
             ).filter(ContentItem.created_at <= end_date).scalar() or 0
             
             # Retention rate (users active in period who were created before period)
-            returning_users = db.session.query(
-                func.count(func.distinct(User.id))
-            ).filter(
-                User.created_at < start_date,
-                User.last_activity.between(start_date, end_date)
-            ).scalar()
-            
+            returning_users = summary['returning_users']
             users_before_period = User.query.filter(User.created_at < start_date).count()
             retention_rate = (returning_users / users_before_period * 100) if users_before_period > 0 else 0
             
@@ -2328,7 +2330,9 @@ def generate_analytics():
                     'appointment_users': users_with_appointments,
                     'content_views': content_views_total,
                     'returning_users': returning_users,
-                    'retention_rate': round(retention_rate, 2)
+                    'retention_rate': round(retention_rate, 2),
+                    'active_users': summary['active_users'],
+                    'ussd_users': features['ussd']['users']
                 },
                 'engagement_rates': {
                     'cycle_tracking': round((users_with_cycles / total_users * 100) if total_users > 0 else 0, 2),
@@ -4,6 +4,8 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt_identity
 from datetime import datetime, timedelta
 import re
+from app.ussd.session import find_user_by_phone
+from app.services.pin_auth import verify_user_pin
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -135,7 +137,7 @@ def register():
         return jsonify({'message': error_msg}), 400
     
     # Check if phone number already exists
-    if User.query.filter_by(phone_number=data['phone_number'].strip()).first():
+    if find_user_by_phone(data['phone_number'].strip(), use_cache=False):
         return jsonify({'message': 'Phone number already registered'}), 409
 
     # Check email uniqueness if provided
@@ -242,8 +244,8 @@ def login():
             log_login_attempt(phone, False)
             return jsonify({'message': rate_limit_error}), 429
         
-        # Find user by phone number
-        user = User.query.filter_by(phone_number=phone).first()
+        # Find user by phone number (any local/international format, one indexed read)
+        user = find_user_by_phone(phone, use_cache=False)
         
         if not user:
             log_login_attempt(phone, False)
@@ -259,7 +261,7 @@ def login():
                 return jsonify({'message': 'This account does not have PIN authentication enabled'}), 401
             
             # Verify PIN
-            if user.pin_hash and bcrypt.check_password_hash(user.pin_hash, pin):
+            if verify_user_pin(user, pin, allow_password=False):
                 # PIN authentication successful
                 log_login_attempt(phone, True)
                 user_identity = str(user.id)
@@ -1,7 +1,9 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.models import User, Parent, Adolescent, ParentChild
+from app.services import llm_usage
 from app.services.kinyarwanda_insight_service import KinyarwandaInsightService
+from app.utils.sse import SSE_HEADERS, sse_event
 import logging
 
 logger = logging.getLogger(__name__)
@@ -9,6 +11,70 @@ logger = logging.getLogger(__name__)
 insights_bp = Blueprint('insights', __name__)
 insight_service = KinyarwandaInsightService()
 
+
+def _resolve_target_user(current_user_id, target_user_id):
+    """
+    User whose insights the caller may generate: themselves, or (for parents,
+    health providers and admins) ``target_user_id``. Returns ``(user, None)`` or
+    ``(None, error_response)``.
+    """
+    # Get current user
+    current_user = User.query.get(current_user_id)
+    if not current_user:
+        return None, (jsonify({'message': 'User not found'}), 404)
+    
+    # Determine target user for insight generation
+    if target_user_id:
+        # Validate authorization for accessing child data
+        if current_user.user_type == 'parent':
+            # Verify parent-child relationship
+            parent = Parent.query.filter_by(user_id=current_user.id).first()
+            if not parent:
+                return None, (jsonify({'message': 'Parent profile not found'}), 404)
+            
+            # Check if the target user is the parent's child
+            if target_user_id != current_user.id:
+                # Look for adolescent with user_id = target_user_id
+                adolescent = Adolescent.query.filter_by(user_id=target_user_id).first()
+                if not adolescent:
+                    return None, (jsonify({'message': 'Child not found'}), 404)
+                
+                # Verify parent-child relationship
+                relation = ParentChild.query.filter_by(
+                    parent_id=parent.id,
+                    adolescent_id=adolescent.id
+                ).first()
+                if not relation:
+                    return None, (jsonify({'message': 'Unauthorized: Not your child'}), 403)
+            
+            final_user_id = target_user_id
+        
+        elif current_user.user_type == 'health_provider':
+            # Health providers can generate insights for their patients
+            # Additional authorization logic can be added here
+            final_user_id = target_user_id
+        
+        elif current_user.user_type == 'admin':
+            # Admins can generate insights for any user
+            final_user_id = target_user_id
+        
+        else:
+            # Adolescents can only generate insights for themselves
+            if target_user_id != current_user.id:
+                return None, (jsonify({'message': 'Unauthorized: Can only generate insights for yourself'}), 403)
+            final_user_id = current_user.id
+    else:
+        # No target user specified, use current user
+        final_user_id = current_user.id
+    
+    # Validate target user exists
+    target_user = User.query.get(final_user_id)
+    if not target_user:
+        return None, (jsonify({'message': 'Target user not found'}), 404)
+    
+    return target_user, None
+
+
 @insights_bp.route('/generate', methods=['POST'])
 @jwt_required()
 def generate_insight():
@@ -35,70 +101,25 @@ def generate_insight():
         if language not in ['kinyarwanda', 'english']:
             return jsonify({'message': 'Language must be either "kinyarwanda" or "english"'}), 400
         
-        # Get current user
-        current_user = User.query.get(current_user_id)
-        if not current_user:
-            return jsonify({'message': 'User not found'}), 404
-        
-        # Determine target user for insight generation
-        if target_user_id:
-            # Validate authorization for accessing child data
-            if current_user.user_type == 'parent':
-                # Verify parent-child relationship
-                parent = Parent.query.filter_by(user_id=current_user.id).first()
-                if not parent:
-                    return jsonify({'message': 'Parent profile not found'}), 404
-                
-                # Check if the target user is the parent's child
-                if target_user_id != current_user.id:
-                    # Look for adolescent with user_id = target_user_id
-                    adolescent = Adolescent.query.filter_by(user_id=target_user_id).first()
-                    if not adolescent:
-                        return jsonify({'message': 'Child not found'}), 404
-                    
-                    # Verify parent-child relationship
-                    relation = ParentChild.query.filter_by(
-                        parent_id=parent.id,
-                        adolescent_id=adolescent.id
-                    ).first()
-                    if not relation:
-                        return jsonify({'message': 'Unauthorized: Not your child'}), 403
-                
-                final_user_id = target_user_id
-            
-            elif current_user.user_type == 'health_provider':
-                # Health providers can generate insights for their patients
-                # Additional authorization logic can be added here
-                final_user_id = target_user_id
-            
-            elif current_user.user_type == 'admin':
-                # Admins can generate insights for any user
-                final_user_id = target_user_id
-            
-            else:
-                # Adolescents can only generate insights for themselves
-                if target_user_id != current_user.id:
-                    return jsonify({'message': 'Unauthorized: Can only generate insights for yourself'}), 403
-                final_user_id = current_user.id
-        else:
-            # No target user specified, use current user
-            final_user_id = current_user.id
-        
-        # Validate target user exists
-        target_user = User.query.get(final_user_id)
-        if not target_user:
-            return jsonify({'message': 'Target user not found'}), 404
+        target_user, error = _resolve_target_user(current_user_id, target_user_id)
+        if error:
+            return error
+        final_user_id = target_user.id
         
         # Generate insights
         logger.info(f"Generating {language} insights for user {final_user_id} requested by {current_user_id}")
         
-        result = insight_service.generate_insight(final_user_id, language)
+        # Gemini usage is charged to the caller, not the user the insight is about
+        with llm_usage.attribute(llm_usage.caller(current_user_id, language)):
+            result = insight_service.generate_insight(final_user_id, language)
         
         if result['success']:
             response_data = {
                 'message': 'Insights generated successfully',
                 'insights': result['data'],
                 'cached': result.get('cached', False),
+                'stale': result.get('stale', False),
+                'fallback': result.get('fallback', False),
                 'target_user': {
                     'id': target_user.id,
                     'name': target_user.name,
@@ -126,6 +147,56 @@ def generate_insight():
         }), 500
 
 
+@insights_bp.route('/generate/stream', methods=['POST'])
+@jwt_required()
+def stream_insight():
+    """
+    Same as /generate, streamed as server-sent events so the first section shows
+    up while Gemini is still writing the rest.
+    
+    Events: ``preview`` (the rule-based insight, before Gemini is called),
+    ``section`` ({"section": "inyunganizi" | "icyo_wakora" | "ihumure",
+    "content": ...}) as each part completes, then ``done`` (the full insight,
+    "cached", "stale", "fallback", "target_user", "language") or ``error``.
+    """
+    try:
+        current_user_id = get_jwt_identity()
+        if not current_user_id:
+            return jsonify({'message': 'Invalid token'}), 401
+        
+        data = request.get_json() or {}
+        language = data.get('language', 'kinyarwanda').lower()
+        if language not in ['kinyarwanda', 'english']:
+            return jsonify({'message': 'Language must be either "kinyarwanda" or "english"'}), 400
+        
+        target_user, error = _resolve_target_user(current_user_id, data.get('user_id'))
+        if error:
+            return error
+        target = {
+            'id': target_user.id,
+            'name': target_user.name,
+            'user_type': target_user.user_type
+        }
+        
+        who = llm_usage.caller(current_user_id, language)
+        
+        def generate():
+            with llm_usage.attribute(who):
+                for event, payload in insight_service.stream_insight(target['id'], language):
+                    if event == 'done':
+                        payload = {**payload, 'target_user': target, 'language': language}
+                    yield sse_event(event, payload)
+        
+        return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=SSE_HEADERS)
+    
+    except Exception as e:
+        logger.error(f"Unexpected error in stream_insight: {str(e)}")
+        return jsonify({
+            'message': 'Internal server error',
+            'error': 'An unexpected error occurred while generating insights'
+        }), 500
+
+
 @insights_bp.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint for the insights service"""
@@ -0,0 +1,48 @@
+from flask import Blueprint, Response, current_app, jsonify, request
+import hmac
+import logging
+
+from app.utils.performance import performance_stats, render_prometheus
+
+logger = logging.getLogger(__name__)
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+def _writer_gauges():
+    """Queue depth and drop counters for the buffered log writers"""
+    from app.utils.buffered_writer import registered_writers
+
+    writers = [writer.metrics() for writer in registered_writers().values()]
+    return [
+        ('buffered_writer_queue_depth', 'Rows waiting to be flushed (this worker)',
+         [({'writer': w['name']}, w['queue_depth']) for w in writers]),
+        ('buffered_writer_dropped_rows', 'Rows dropped because the queue was full (this worker)',
+         [({'writer': w['name']}, w['dropped']) for w in writers]),
+        ('buffered_writer_failed_rows', 'Rows that failed to flush (this worker)',
+         [({'writer': w['name']}, w['failed']) for w in writers]),
+    ]
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Prometheus scrape endpoint aggregated across all workers
+
+    The scraper must send ``Authorization: Bearer <METRICS_TOKEN>``. Without a
+    configured token the endpoint does not exist (404): route names and SQL
+    fingerprints are not for the public.
+    """
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token:
+        return jsonify({'error': 'Not found'}), 404
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not hmac.compare_digest(supplied, token):
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    try:
+        body = render_prometheus(performance_stats.collect(), extra_gauges=_writer_gauges())
+        return Response(body, mimetype='text/plain; version=0.0.4')
+    except Exception as e:
+        logger.error(f"Error rendering metrics: {str(e)}")
+        return jsonify({'error': 'Failed to render metrics'}), 500
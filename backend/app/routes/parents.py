@@ -1,6 +1,7 @@
 from app.models import Parent, Adolescent, ParentChild, User
 from app import db
 from app.utils.parent_auth import get_or_create_parent_profile, authorize_parent_for_child
+from app.ussd.session import find_user_by_phone
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime, timedelta
@@ -268,7 +269,7 @@ def add_child():
     
     # Check if phone number already exists (if provided)
     if data.get('phone_number'):
-        if User.query.filter_by(phone_number=data['phone_number']).first():
+        if find_user_by_phone(data['phone_number'], use_cache=False):
             return jsonify({'message': 'Phone number already registered'}), 409
     
     # Validate relationship type
@@ -846,7 +847,7 @@ def update_child_phone(adolescent_id):
     adolescent = Adolescent.query.get(adolescent_id)
     child_user = User.query.get(adolescent.user_id)
 
-    existing = User.query.filter_by(phone_number=phone_number).first()
+    existing = find_user_by_phone(phone_number, use_cache=False)
     if existing and existing.id != child_user.id:
         return jsonify({'message': 'Phone number already registered'}), 409
 
@@ -888,7 +889,7 @@ def grant_child_independence(adolescent_id):
     adolescent = Adolescent.query.get(adolescent_id)
     child_user = User.query.get(adolescent.user_id)
 
-    existing = User.query.filter_by(phone_number=phone_number).first()
+    existing = find_user_by_phone(phone_number, use_cache=False)
     if existing and existing.id != child_user.id:
         return jsonify({'message': 'Phone number already registered'}), 409
 
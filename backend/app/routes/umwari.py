@@ -1,21 +1,21 @@
-"""Umwari AI chat — Gemini streaming proxy (replaces Express mock server)."""
+"""Umwari AI chat — Gemini streaming proxy (replaces Express mock server) and server-side conversations."""
 
 import json
 from typing import Any, Optional
 
-import requests
 from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
+from app import db
+from app.models.umwari_conversation import UmwariConversation, UmwariMessage
+from app.services import llm_usage, umwari_conversations as conversations
+from app.services.llm_client import DEFAULT_MODEL, CircuitOpenError, LLMError, gemini_client
 from app.utils.gemini_config import ENV_KEY_NAMES, get_gemini_api_key_from_env, resolve_gemini_api_key
+from app.utils.performance import performance_stats
+from app.utils.sse import SSE_HEADERS, sse_event
 
 umwari_bp = Blueprint('umwari', __name__)
 
-DEFAULT_MODEL = 'gemini-2.5-flash'
-STREAM_URL = (
-    'https://generativelanguage.googleapis.com/v1beta/models/{model}:streamGenerateContent?alt=sse'
-)
-
 # Legacy / frontend aliases → supported model
 MODEL_ALIASES = {
     'gemini-3.5-flash': DEFAULT_MODEL,
@@ -89,87 +89,241 @@ def umwari_config_status():
     }), 200
 
 
+def _missing_key_response():
+    return jsonify({
+        'error': (
+            'Gemini API is not configured. Add GEMINI_API_KEY=your-key to backend/.env '
+            '(or GOOGLE_API_KEY / API_KEY), restart the server, or set a key under Settings > Secrets.'
+        ),
+        'env_configured': False,
+    }), 500
+
+
+def _admit_stream(who):
+    """
+    Quota and concurrent-stream checks for a chat stream; returns a 429
+    response, or None once the caller holds a stream slot (released when the
+    response closes).
+    """
+    retry_after = llm_usage.check_quota(who)
+    if retry_after is not None:
+        response = jsonify({'error': 'AI usage limit reached. Please try again later.', 'retry_after': retry_after})
+        response.headers['Retry-After'] = str(retry_after)
+        return response, 429
+    if not llm_usage.acquire_stream(who['user_id']):
+        return jsonify({'error': 'Umwari is already answering you. Wait for the reply to finish.'}), 429
+    return None
+
+
+def _stream_reply(contents, api_key, model, generation_config, endpoint, who, system_instruction=None,
+                  on_complete=None):
+    """Plain-text stream of Gemini's reply; errors are sent inline as ``[ServerError: ...]``.
+
+    Usage is charged to ``who`` and its stream slot (see ``_admit_stream``)
+    is released when the response closes. ``on_complete`` gets the full reply
+    text once the stream finished cleanly.
+    """
+    def generate():
+        with llm_usage.attribute(who):
+            yield from stream()
+
+    def stream():
+        reply = []
+        try:
+            for text in gemini_client.stream(
+                contents, api_key, model=model, generation_config=generation_config or None,
+                endpoint=endpoint, system_instruction=system_instruction,
+            ):
+                reply.append(text)
+                yield text
+        except CircuitOpenError:
+            yield '\n[ServerError: Umwari is busy right now. Please try again in a minute.]'
+        except LLMError as exc:
+            if exc.status:
+                detail = _parse_gemini_error(exc.status, exc.body or '')
+                current_app.logger.warning(
+                    'Umwari Gemini HTTP %s model=%s: %s',
+                    exc.status,
+                    model,
+                    detail,
+                )
+                yield f'\n[ServerError: {detail}]'
+            else:
+                current_app.logger.warning('Umwari stream request failed: %s', exc)
+                yield f'\n[ServerError: {exc}]'
+        except Exception as exc:
+            current_app.logger.exception('Umwari stream error')
+            yield f'\n[ServerError: {exc}]'
+        else:
+            if on_complete and reply:
+                try:
+                    on_complete(''.join(reply))
+                except Exception:
+                    current_app.logger.exception('Umwari reply could not be saved')
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/plain; charset=utf-8',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+    response.call_on_close(lambda: llm_usage.release_stream(who['user_id']))
+    return response
+
+
 @umwari_bp.route('/chat', methods=['POST'])
 @jwt_required()
 def umwari_chat():
+    """
+    Stateless chat: the client sends the whole history each turn. History past
+    UMWARI_MAX_PROMPT_TOKENS is trimmed to the first turn plus the newest ones;
+    /conversations keeps history server-side and summarizes it instead.
+    """
     body = request.get_json(silent=True) or {}
     api_key = resolve_gemini_api_key(
         body.get('apiKey') or body.get('api_key'),
         current_app.config,
     )
     if not api_key:
-        return jsonify({
-            'error': (
-                'Gemini API is not configured. Add GEMINI_API_KEY=your-key to backend/.env '
-                '(or GOOGLE_API_KEY / API_KEY), restart the server, or set a key under Settings > Secrets.'
-            ),
-            'env_configured': False,
-        }), 500
+        return _missing_key_response()
 
     contents = _normalize_contents(body.get('parts') or body.get('contents'))
     if not contents:
         return jsonify({'error': 'No valid chat messages to send to Gemini.'}), 400
 
+    contents, full_tokens, sent_tokens = conversations.bound_contents(
+        contents, conversations.setting('UMWARI_MAX_PROMPT_TOKENS'),
+    )
+    performance_stats.record_prompt_context('umwari_chat_stateless', full_tokens, sent_tokens)
+
+    who = llm_usage.caller(get_jwt_identity())
+    rejected = _admit_stream(who)
+    if rejected:
+        return rejected
+
     model = _resolve_model(body.get('modelName') or body.get('model'))
-    generation_config = body.get('config') or {}
+    return _stream_reply(contents, api_key, model, body.get('config') or {}, 'umwari_chat', who)
 
-    url = STREAM_URL.format(model=model)
-    headers = {'Content-Type': 'application/json', 'X-goog-api-key': api_key}
-    payload: dict = {'contents': contents}
-    if generation_config:
-        payload['generationConfig'] = generation_config
 
-    def generate():
-        try:
-            with requests.post(
-                url, headers=headers, json=payload, stream=True, timeout=120
-            ) as resp:
-                if resp.status_code != 200:
-                    detail = _parse_gemini_error(resp.status_code, resp.text or '')
-                    current_app.logger.warning(
-                        'Umwari Gemini HTTP %s model=%s: %s',
-                        resp.status_code,
-                        model,
-                        detail,
-                    )
-                    yield f'\n[ServerError: {detail}]'
-                    return
-
-                for line in resp.iter_lines(decode_unicode=True):
-                    if not line:
-                        continue
-                    if not line.startswith('data: '):
-                        continue
-                    data = line[6:].strip()
-                    if data == '[DONE]':
-                        break
-                    try:
-                        chunk = json.loads(data)
-                    except json.JSONDecodeError:
-                        continue
-                    if chunk.get('error'):
-                        err_msg = chunk['error'].get('message', 'Gemini stream error')
-                        yield f'\n[ServerError: {err_msg}]'
-                        return
-                    for cand in chunk.get('candidates') or []:
-                        for part in (cand.get('content') or {}).get('parts') or []:
-                            text = part.get('text')
-                            if text:
-                                yield text
-        except requests.RequestException as exc:
-            current_app.logger.exception('Umwari stream request failed')
-            yield f'\n[ServerError: Network error contacting Gemini: {exc}]'
-        except Exception as exc:
-            current_app.logger.exception('Umwari stream error')
-            yield f'\n[ServerError: {exc}]'
+@umwari_bp.route('/conversations', methods=['POST'])
+@jwt_required()
+def create_conversation():
+    """
+    Start a server-side conversation.
 
-    return Response(
-        stream_with_context(generate()),
-        mimetype='text/plain; charset=utf-8',
-        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    Request body (optional): {"system_context": "..."} — instructions and user
+    context sent as Gemini's system instruction on every turn.
+    """
+    current_user_id = get_jwt_identity()
+    body = request.get_json(silent=True) or {}
+    system_context = str(body.get('system_context') or '').strip()
+    if len(system_context) > conversations.setting('UMWARI_MAX_SYSTEM_CONTEXT_CHARS'):
+        return jsonify({'error': 'system_context is too long'}), 413
+
+    conversation = conversations.create_conversation(int(current_user_id), system_context)
+    return jsonify(conversation.to_dict()), 201
+
+
+@umwari_bp.route('/conversations/<int:conversation_id>', methods=['GET'])
+@jwt_required()
+def get_conversation(conversation_id):
+    """The conversation with its most recent messages (``?limit=``, default 50, max 200)"""
+    conversation = conversations.get_conversation(int(get_jwt_identity()), conversation_id)
+    if not conversation:
+        return jsonify({'error': 'Conversation not found'}), 404
+
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    messages = conversation.messages.order_by(None).order_by(UmwariMessage.id.desc()).limit(limit).all()
+    return jsonify({
+        **conversation.to_dict(),
+        'messages': [message.to_dict() for message in reversed(messages)],
+    }), 200
+
+
+@umwari_bp.route('/conversations/<int:conversation_id>', methods=['DELETE'])
+@jwt_required()
+def delete_conversation(conversation_id):
+    conversation = conversations.get_conversation(int(get_jwt_identity()), conversation_id)
+    if not conversation:
+        return jsonify({'error': 'Conversation not found'}), 404
+
+    db.session.delete(conversation)
+    db.session.commit()
+    return jsonify({'message': 'Conversation deleted'}), 200
+
+
+@umwari_bp.route('/conversations/<int:conversation_id>/messages', methods=['POST'])
+@jwt_required()
+def send_conversation_message(conversation_id):
+    """
+    Send one user message and stream Umwari's reply (same text stream as /chat).
+
+    Request body: {"message": "...", "modelName"?, "config"?, "apiKey"?}. Both
+    the message and the reply are stored; long histories are summarized in the
+    background once they pass UMWARI_HISTORY_TOKEN_BUDGET.
+    """
+    body = request.get_json(silent=True) or {}
+    conversation = conversations.get_conversation(int(get_jwt_identity()), conversation_id)
+    if not conversation:
+        return jsonify({'error': 'Conversation not found'}), 404
+
+    api_key = resolve_gemini_api_key(
+        body.get('apiKey') or body.get('api_key'),
+        current_app.config,
+    )
+    if not api_key:
+        return _missing_key_response()
+
+    text = str(body.get('message') or '').strip()
+    if not text:
+        return jsonify({'error': 'message is required'}), 400
+    if len(text) > conversations.setting('UMWARI_MAX_MESSAGE_CHARS'):
+        return jsonify({'error': 'message is too long'}), 413
+
+    who = llm_usage.caller(conversation.user_id)
+    rejected = _admit_stream(who)
+    if rejected:
+        return rejected
+
+    model = _resolve_model(body.get('modelName') or body.get('model'))
+    conversations.add_message(conversation, 'user', text)
+    contents, pending_tokens = conversations.build_prompt(conversation)
+    app = current_app._get_current_object()
+
+    def on_complete(reply):
+        conversations.add_message(db.session.get(UmwariConversation, conversation_id), 'model', reply)
+        if conversations.needs_compaction(pending_tokens + conversations.estimate_tokens(reply)):
+            conversations.schedule_compaction(app, conversation_id, api_key, model)
+
+    return _stream_reply(
+        contents, api_key, model, body.get('config') or {}, 'umwari_chat', who,
+        system_instruction=conversation.system_context, on_complete=on_complete,
     )
 
 
+def _insight_language(body: dict) -> str:
+    language = str(body.get('language') or 'english').lower()
+    return language if language in ('kinyarwanda', 'english') else 'english'
+
+
+def _resolve_insight_user(current_user_id, target_user_id):
+    """The caller, or a child of the calling parent; ``(user_id, None)`` or ``(None, error_response)``."""
+    # Support parent requesting insights about a child
+    if not target_user_id:
+        return int(current_user_id), None
+
+    # Verify parent-child relationship
+    from app.models import ParentChild, Parent
+    parent = Parent.query.filter_by(user_id=current_user_id).first()
+    if not parent:
+        return None, (jsonify({'error': 'Only parents can request insights for another user'}), 403)
+    child_relation = ParentChild.query.filter_by(
+        parent_id=parent.id, adolescent_id=target_user_id
+    ).first()
+    if not child_relation:
+        return None, (jsonify({'error': 'No parent-child relationship found'}), 403)
+    return int(target_user_id), None
+
+
 @umwari_bp.route('/insights', methods=['POST'])
 @jwt_required()
 def umwari_insights():
@@ -188,6 +342,7 @@ def umwari_insights():
         "success": true,
         "insights": { "inyunganizi": "...", "icyo_wakora": [...], "ihumure": "..." },
         "cached": false,
+        "fallback": false,   (true: rule-based insight, Gemini unavailable or too slow)
         "generated_at": "...",
         "language": "..."
     }
@@ -205,34 +360,16 @@ def umwari_insights():
             return jsonify({'error': 'User not found'}), 404
 
         body = request.get_json(silent=True) or {}
-        language = body.get('language', 'english').lower()
-        if language not in ('kinyarwanda', 'english'):
-            language = 'english'
-
-        # Support parent requesting insights about a child
-        target_user_id = body.get('target_user_id')
-        if target_user_id:
-            # Verify parent-child relationship
-            from app.models import ParentChild, Adolescent, Parent
-            parent = Parent.query.filter_by(user_id=current_user_id).first()
-            if not parent:
-                return jsonify({'error': 'Only parents can request insights for another user'}), 403
-            child_relation = ParentChild.query.filter_by(
-                parent_id=parent.id, adolescent_id=target_user_id
-            ).first()
-            if not child_relation:
-                return jsonify({'error': 'No parent-child relationship found'}), 403
-            insight_user_id = int(target_user_id)
-        else:
-            insight_user_id = int(current_user_id)
+        language = _insight_language(body)
 
-        service = KinyarwandaInsightService()
-        if not service.google_api_key:
-            return jsonify({
-                'error': 'Gemini API key not configured on the server. Set GEMINI_API_KEY in backend/.env.'
-            }), 500
+        insight_user_id, error = _resolve_insight_user(current_user_id, body.get('target_user_id'))
+        if error:
+            return error
 
-        result = service.generate_insight(insight_user_id, language)
+        # Without a Gemini key the service answers with the rule-based insight
+        service = KinyarwandaInsightService()
+        with llm_usage.attribute(llm_usage.caller(current_user_id, language)):
+            result = service.generate_insight(insight_user_id, language)
 
         if not result.get('success'):
             return jsonify({
@@ -243,6 +380,8 @@ def umwari_insights():
             'success': True,
             'insights': result['data'],
             'cached': result.get('cached', False),
+            'stale': result.get('stale', False),
+            'fallback': result.get('fallback', False),
             'generated_at': result['data'].get('generated_at', ''),
             'language': language,
             'target_user': {
@@ -255,3 +394,37 @@ def umwari_insights():
     except Exception as exc:
         current_app.logger.exception('Umwari insights endpoint error')
         return jsonify({'error': f'Insights generation failed: {exc}'}), 500
+
+
+@umwari_bp.route('/insights/stream', methods=['POST'])
+@jwt_required()
+def umwari_insights_stream():
+    """
+    Streaming variant of /insights: a ``preview`` event with the rule-based
+    insight, server-sent ``section`` events as each part of the insight is ready,
+    then ``done`` (full insight, cached/stale/fallback flags) or ``error``. Takes
+    the same body as /insights.
+    """
+    from app.services.kinyarwanda_insight_service import KinyarwandaInsightService
+
+    current_user_id = get_jwt_identity()
+    if not current_user_id:
+        return jsonify({'error': 'Invalid token'}), 401
+
+    body = request.get_json(silent=True) or {}
+    language = _insight_language(body)
+    insight_user_id, error = _resolve_insight_user(current_user_id, body.get('target_user_id'))
+    if error:
+        return error
+
+    service = KinyarwandaInsightService()
+    who = llm_usage.caller(current_user_id, language)
+
+    def generate():
+        with llm_usage.attribute(who):
+            for event, payload in service.stream_insight(insight_user_id, language):
+                if event == 'done':
+                    payload = {**payload, 'language': language}
+                yield sse_event(event, payload)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=SSE_HEADERS)
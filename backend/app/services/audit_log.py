@@ -0,0 +1,32 @@
+"""
+Audit log pipeline for SystemLog.
+
+Admin/provider/writer actions are recorded through ``record_activity`` which
+queues the row on a BufferedWriter instead of committing inside the request.
+"""
+
+import json
+import logging
+
+from app.models import SystemLog
+from app.utils.buffered_writer import BufferedWriter
+
+logger = logging.getLogger(__name__)
+
+audit_log_writer = BufferedWriter('audit_log', SystemLog.__table__, config_prefix='AUDIT_LOG')
+
+
+def init_audit_log(app):
+    """Start the background flusher for this process."""
+    audit_log_writer.start(app)
+
+
+def record_activity(user_id, action, details=None, ip_address=None, user_agent=None):
+    """Queue a SystemLog row. Returns False if the row was dropped under overload."""
+    return audit_log_writer.submit({
+        'user_id': user_id,
+        'action': action[:100],
+        'details': json.dumps(details) if details else None,
+        'ip_address': ip_address,
+        'user_agent': user_agent,
+    })
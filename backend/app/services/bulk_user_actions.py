@@ -0,0 +1,373 @@
+"""
+Set-based bulk user operations for the admin dashboard.
+
+Activate/deactivate, delete and role changes run as chunked UPDATE/DELETE
+statements. Profile-table cascades (parent links, provider appointments,
+writer content) are applied per chunk, and each chunk commits in its own
+transaction. A failed chunk is reported without undoing the chunks before
+it.
+"""
+
+import json
+import logging
+from datetime import datetime
+
+from sqlalchemy import delete, insert, inspect, select, update, func
+
+from app import db
+from app.models import (
+    User, Admin, ContentWriter, HealthProvider, Parent, Adolescent, ParentChild,
+    Appointment, ContentItem, Course, LoginAttempt
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 500
+
+VALID_ACTIONS = ['activate', 'deactivate', 'delete']
+VALID_USER_TYPES = ['parent', 'adolescent', 'content_writer', 'health_provider', 'admin']
+
+PROFILE_MODELS = {
+    'admin': Admin,
+    'content_writer': ContentWriter,
+    'health_provider': HealthProvider,
+    'parent': Parent,
+    'adolescent': Adolescent,
+}
+
+# Nullable user references that are still removed with the user rather than
+# kept anonymised
+DELETE_NULLABLE_TABLES = {'system_logs', 'ussd_sessions'}
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _existing_tables():
+    return set(inspect(db.engine).get_table_names())
+
+
+def _user_references(existing_tables):
+    """
+    (table, column, delete_rows) for every FK to users.id outside the profile
+    tables, children before the tables they reference (period_logs before
+    cycle_logs) so deleting them in order never trips a foreign key.
+    """
+    profile_tables = {model.__tablename__ for model in PROFILE_MODELS.values()}
+    references = []
+    for table in reversed(db.metadata.sorted_tables):
+        if table.name in profile_tables or table.name == User.__tablename__:
+            continue
+        if table.name not in existing_tables:
+            continue
+        for fk in table.foreign_keys:
+            if fk.column.table.name != User.__tablename__:
+                continue
+            column = fk.parent
+            references.append((table, column, not column.nullable or table.name in DELETE_NULLABLE_TABLES))
+    return references
+
+
+def _dependent_references(references, existing_tables):
+    """
+    (table, column, parent_ids, delete_rows) for rows pointing at user-owned
+    rows about to be deleted, e.g. umwari_messages of the user's conversations
+    (no users FK of their own) or period_logs linked to the user's cycle_logs.
+    ``parent_ids(chunk)`` selects the ids of the parent rows being deleted.
+    Nullable links are cleared, required ones deleted with the parent.
+    """
+    dependents = []
+    for parent, user_column, delete_rows in references:
+        if not delete_rows:
+            continue
+        for table in reversed(db.metadata.sorted_tables):
+            if table.name not in existing_tables or table is parent:
+                continue
+            for fk in table.foreign_keys:
+                if fk.column.table is not parent:
+                    continue
+
+                def parent_ids(chunk, user_column=user_column, key=fk.column):
+                    return select(key).where(user_column.in_(chunk))
+
+                dependents.append((table, fk.parent, parent_ids, not fk.parent.nullable))
+    return dependents
+
+
+# ── Planning / dry run ────────────────────────────────────────────────────
+
+def resolve_users(user_ids):
+    """[(id, user_type)] for the ids that exist, in one query"""
+    rows = []
+    for chunk in _chunks(sorted(set(user_ids)), DEFAULT_CHUNK_SIZE):
+        rows.extend(db.session.query(User.id, User.user_type).filter(User.id.in_(chunk)).all())
+    return [(row.id, row.user_type) for row in rows]
+
+
+def _writers_with_published_courses(user_ids):
+    blocked = set()
+    for chunk in _chunks(user_ids, DEFAULT_CHUNK_SIZE):
+        blocked.update(row[0] for row in db.session.query(ContentWriter.user_id).join(
+            Course, Course.author_id == ContentWriter.id
+        ).filter(
+            ContentWriter.user_id.in_(chunk),
+            Course.status == 'published'
+        ).distinct().all())
+    return blocked
+
+
+def plan_bulk_action(action, user_ids):
+    """Split the requested ids into targets and skipped ids with reasons"""
+    found = resolve_users(user_ids)
+    found_ids = {user_id for user_id, _ in found}
+    skipped = [{'user_id': user_id, 'error': 'User not found'}
+               for user_id in sorted(set(user_ids) - found_ids)]
+
+    targets = [user_id for user_id, _ in found]
+    if action == 'delete':
+        admins = {user_id for user_id, user_type in found if user_type == 'admin'}
+        blocked = _writers_with_published_courses(
+            [user_id for user_id, user_type in found if user_type == 'content_writer']
+        )
+        skipped.extend({'user_id': user_id, 'error': 'Cannot delete admin users'} for user_id in sorted(admins))
+        skipped.extend({'user_id': user_id, 'error': 'Writer has published course(s)'} for user_id in sorted(blocked))
+        targets = [user_id for user_id in targets if user_id not in admins and user_id not in blocked]
+
+    return {'targets': sorted(targets), 'skipped': skipped, 'found': found}
+
+
+def plan_role_change(new_user_type, user_ids):
+    found = resolve_users(user_ids)
+    found_ids = {user_id for user_id, _ in found}
+    skipped = [{'user_id': user_id, 'error': 'User not found'}
+               for user_id in sorted(set(user_ids) - found_ids)]
+
+    targets, unchanged = [], []
+    for user_id, user_type in found:
+        if user_type == 'admin':
+            skipped.append({'user_id': user_id, 'error': 'Cannot change role of admin users'})
+        elif user_type == new_user_type:
+            unchanged.append(user_id)
+        else:
+            targets.append(user_id)
+
+    # Courses require an author, so writers who own any cannot lose their profile
+    writer_ids = [user_id for user_id, user_type in found
+                  if user_type == 'content_writer' and user_id in targets]
+    with_courses = set()
+    for chunk in _chunks(writer_ids, DEFAULT_CHUNK_SIZE):
+        with_courses.update(row[0] for row in db.session.query(ContentWriter.user_id).join(
+            Course, Course.author_id == ContentWriter.id
+        ).filter(ContentWriter.user_id.in_(chunk)).distinct().all())
+    skipped.extend({'user_id': user_id, 'error': 'Writer has course(s)'} for user_id in sorted(with_courses))
+    targets = [user_id for user_id in targets if user_id not in with_courses]
+
+    return {'targets': sorted(targets), 'unchanged': unchanged, 'skipped': skipped, 'found': found}
+
+
+def dry_run_counts(action, user_ids):
+    """Rows each statement would touch for ``user_ids``, without changing anything"""
+    counts = {'users': len(user_ids)}
+    if action in ('activate', 'deactivate'):
+        target_state = action == 'activate'
+        counts['users_changing_state'] = _count(User.id, user_ids, User.is_active != target_state)
+        return counts
+
+    existing = _existing_tables()
+    references = _user_references(existing)
+    for table, column, parent_ids, delete_rows in _dependent_references(references, existing):
+        key = f"{table.name}.{column.name}" + ('' if delete_rows else ' (set null)')
+        counts[key] = counts.get(key, 0) + sum(
+            db.session.query(func.count()).filter(column.in_(parent_ids(chunk))).scalar() or 0
+            for chunk in _chunks(list(user_ids), DEFAULT_CHUNK_SIZE)
+        )
+    for table, column, delete_rows in references:
+        key = f"{table.name}.{column.name}" + ('' if delete_rows else ' (set null)')
+        counts[key] = _count(column, user_ids)
+
+    counts.update(_profile_cascade_counts(user_ids))
+    if LoginAttempt.__tablename__ in existing:
+        counts['login_attempts'] = _count_where(lambda chunk: LoginAttempt.phone_number.in_(
+            select(User.phone_number).where(User.id.in_(chunk))
+        ), user_ids)
+    return counts
+
+
+def role_change_counts(new_user_type, user_ids):
+    """Rows a role change to ``new_user_type`` would touch for ``user_ids``, without changing anything"""
+    counts = {'users': len(user_ids)}
+    counts.update(_profile_cascade_counts(user_ids))
+    counts[f"{PROFILE_MODELS[new_user_type].__tablename__} (insert)"] = len(user_ids)
+    return counts
+
+
+def _profile_cascade_counts(user_ids):
+    """Profile rows of ``user_ids`` and the rows that point at them (see ``_cascade_profiles``)"""
+    counts = {}
+    for model in PROFILE_MODELS.values():
+        counts[model.__tablename__] = _count(model.user_id, user_ids)
+
+    cascades = {
+        'parent_children': lambda chunk: ParentChild.parent_id.in_(
+            select(Parent.id).where(Parent.user_id.in_(chunk))
+        ) | ParentChild.adolescent_id.in_(
+            select(Adolescent.id).where(Adolescent.user_id.in_(chunk))
+        ),
+        'appointments.provider_id (set null)': lambda chunk: Appointment.provider_id.in_(
+            select(HealthProvider.id).where(HealthProvider.user_id.in_(chunk))
+        ),
+        'content_items.author_id (set null)': lambda chunk: ContentItem.author_id.in_(
+            select(ContentWriter.id).where(ContentWriter.user_id.in_(chunk))
+        ),
+        'courses': lambda chunk: Course.author_id.in_(
+            select(ContentWriter.id).where(ContentWriter.user_id.in_(chunk))
+        ),
+    }
+    for key, criterion in cascades.items():
+        counts[key] = _count_where(criterion, user_ids)
+    return counts
+
+
+def _count_where(criterion, ids):
+    """Sum of ``count(*) WHERE criterion(chunk)`` over ``ids`` in chunks"""
+    return sum(
+        db.session.query(func.count()).filter(criterion(chunk)).scalar() or 0
+        for chunk in _chunks(list(ids), DEFAULT_CHUNK_SIZE)
+    )
+
+
+def _count(key_column, ids, *criteria):
+    total = 0
+    for chunk in _chunks(list(ids), DEFAULT_CHUNK_SIZE):
+        total += db.session.query(func.count()).filter(key_column.in_(chunk), *criteria).scalar() or 0
+    return total
+
+
+# ── Execution ─────────────────────────────────────────────────────────────
+
+def _cascade_profiles(conn, chunk):
+    """Remove profile rows for ``chunk`` and detach whatever points at them"""
+    parent_ids = select(Parent.id).where(Parent.user_id.in_(chunk))
+    adolescent_ids = select(Adolescent.id).where(Adolescent.user_id.in_(chunk))
+    provider_ids = select(HealthProvider.id).where(HealthProvider.user_id.in_(chunk))
+    writer_ids = select(ContentWriter.id).where(ContentWriter.user_id.in_(chunk))
+
+    conn.execute(delete(ParentChild).where(
+        ParentChild.parent_id.in_(parent_ids) | ParentChild.adolescent_id.in_(adolescent_ids)
+    ))
+    conn.execute(update(Appointment).where(Appointment.provider_id.in_(provider_ids)).values(provider_id=None))
+    conn.execute(update(ContentItem).where(ContentItem.author_id.in_(writer_ids)).values(author_id=None))
+    # Only draft/archived courses remain here; writers with published ones were skipped
+    conn.execute(delete(Course).where(Course.author_id.in_(writer_ids)))
+
+    for model in PROFILE_MODELS.values():
+        conn.execute(delete(model).where(model.user_id.in_(chunk)))
+
+
+def _delete_chunk(conn, chunk, references, dependents, existing_tables):
+    _cascade_profiles(conn, chunk)
+
+    for table, column, parent_ids, delete_rows in dependents:
+        if delete_rows:
+            conn.execute(delete(table).where(column.in_(parent_ids(chunk))))
+        else:
+            conn.execute(update(table).where(column.in_(parent_ids(chunk))).values({column.name: None}))
+
+    if LoginAttempt.__tablename__ in existing_tables:
+        conn.execute(delete(LoginAttempt).where(
+            LoginAttempt.phone_number.in_(select(User.phone_number).where(User.id.in_(chunk)))
+        ))
+
+    for table, column, delete_rows in references:
+        if delete_rows:
+            conn.execute(delete(table).where(column.in_(chunk)))
+        else:
+            conn.execute(update(table).where(column.in_(chunk)).values({column.name: None}))
+
+    return conn.execute(delete(User).where(User.id.in_(chunk))).rowcount
+
+
+def _run_chunks(job, targets, chunk_size, apply_chunk):
+    """Apply ``apply_chunk(conn, chunk)`` per chunk, one transaction each"""
+    successful, failed, details = 0, 0, []
+    for chunk in _chunks(targets, chunk_size):
+        try:
+            with db.engine.begin() as conn:
+                affected = apply_chunk(conn, chunk)
+            ok = len(chunk) if affected is None else affected
+            successful += ok
+            if job is not None:
+                job.advance(len(chunk), successful=ok)
+        except Exception as e:
+            failed += len(chunk)
+            details.append({'user_ids': chunk, 'error': str(e)[:300]})
+            logger.error(f"Bulk user chunk of {len(chunk)} failed: {e}")
+            if job is not None:
+                job.advance(len(chunk), failed=len(chunk))
+    return successful, failed, details
+
+
+def execute_bulk_action(action, targets, chunk_size=DEFAULT_CHUNK_SIZE, job=None):
+    """Run activate/deactivate/delete for ``targets``; returns (successful, failed, details)"""
+    if action in ('activate', 'deactivate'):
+        is_active = action == 'activate'
+
+        def apply_chunk(conn, chunk):
+            conn.execute(update(User).where(User.id.in_(chunk)).values(is_active=is_active))
+            return len(chunk)
+    else:
+        existing = _existing_tables()
+        references = _user_references(existing)
+        dependents = _dependent_references(references, existing)
+
+        def apply_chunk(conn, chunk):
+            return _delete_chunk(conn, chunk, references, dependents, existing)
+
+    result = _run_chunks(job, targets, chunk_size, apply_chunk)
+    db.session.expire_all()
+    return result
+
+
+def _parse_date(value):
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+
+def _profile_row(new_user_type, user_id, data, now):
+    if new_user_type == 'admin':
+        return {'user_id': user_id, 'permissions': json.dumps(['all']),
+                'department': data.get('department', 'General'), 'created_at': now}
+    if new_user_type == 'content_writer':
+        return {'user_id': user_id, 'specialization': data.get('specialization', ''),
+                'bio': data.get('bio', ''), 'is_approved': True, 'created_at': now}
+    if new_user_type == 'health_provider':
+        return {'user_id': user_id, 'specialization': data.get('specialization', 'General Healthcare'),
+                'license_number': data.get('license_number', ''), 'clinic_name': data.get('clinic_name', ''),
+                'is_verified': True, 'created_at': now}
+    if new_user_type == 'parent':
+        return {'user_id': user_id}
+    return {'user_id': user_id, 'date_of_birth': _parse_date(data.get('date_of_birth'))}
+
+
+def execute_role_change(new_user_type, targets, data, chunk_size=DEFAULT_CHUNK_SIZE, job=None):
+    """Swap profiles and user_type for ``targets``; returns (successful, failed, details)"""
+    profile_model = PROFILE_MODELS[new_user_type]
+
+    def apply_chunk(conn, chunk):
+        now = datetime.utcnow()
+        _cascade_profiles(conn, chunk)
+        conn.execute(update(User).where(User.id.in_(chunk)).values(user_type=new_user_type))
+        conn.execute(insert(profile_model.__table__), [
+            _profile_row(new_user_type, user_id, data, now) for user_id in chunk
+        ])
+        return len(chunk)
+
+    result = _run_chunks(job, targets, chunk_size, apply_chunk)
+    db.session.expire_all()
+    return result
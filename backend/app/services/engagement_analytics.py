@@ -0,0 +1,493 @@
+"""
+Materialized engagement analytics.
+
+Activity from SystemLog, USSDTransaction, the health-tracking tables and
+authenticated API requests is rolled up into one ``EngagementDaily`` row per
+(day, metric). Each row keeps a user-id bitmap, so DAU/WAU/MAU, feature
+reach and retention cohorts for any range come from ORing and popcounting a
+handful of small blobs.
+
+Finished days are computed once and never touched again; today's rows are
+recomputed lazily when a report asks for them and the stored copy is older
+than ``ENGAGEMENT_REFRESH_SECONDS``. A report only rolls up the most recent
+``ENGAGEMENT_SYNC_BACKFILL_DAYS`` missing days itself; older history (a cold
+start, a year-long report) is handed to the tracker thread and filled in
+behind it.
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime, time, timedelta
+
+from flask import g
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import (
+    User, SystemLog, CycleLog, MealLog, Appointment, EngagementDaily
+)
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = 'active'
+SIGNUPS = 'signups'
+FEATURE_PREFIX = 'feature:'
+
+DEFAULT_REFRESH_SECONDS = 300
+DEFAULT_MAX_BACKFILL_DAYS = 400
+# The default 30-day report plus the 29 days behind its first MAU point
+DEFAULT_SYNC_BACKFILL_DAYS = 60
+UPDATE_CHUNK_SIZE = 500
+
+
+def _feature_sources():
+    """feature name -> (user id column, timestamp column)"""
+    from app.ussd.ussd_models import USSDTransaction
+
+    return {
+        'cycle_tracking': (CycleLog.user_id, CycleLog.created_at),
+        'meal_tracking': (MealLog.user_id, MealLog.created_at),
+        'appointments': (Appointment.user_id, Appointment.created_at),
+        'ussd': (USSDTransaction.user_id, USSDTransaction.created_at),
+        # Audited admin, content writer and provider actions
+        'staff_actions': (SystemLog.user_id, SystemLog.created_at),
+    }
+
+
+def feature_names():
+    return list(_feature_sources())
+
+
+# ── Bitmaps ───────────────────────────────────────────────────────────────
+
+def ids_to_bitmap(user_ids):
+    bitmap = 0
+    for user_id in user_ids:
+        if user_id is not None and user_id >= 0:
+            bitmap |= 1 << int(user_id)
+    return bitmap
+
+
+def bitmap_to_ids(bitmap):
+    user_ids = []
+    while bitmap:
+        lowest = bitmap & -bitmap
+        user_ids.append(lowest.bit_length() - 1)
+        bitmap ^= lowest
+    return user_ids
+
+
+def bitmap_to_bytes(bitmap):
+    if not bitmap:
+        return b''
+    return bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+
+
+def bytes_to_bitmap(data):
+    return int.from_bytes(data, 'little') if data else 0
+
+
+def popcount(bitmap):
+    return bitmap.bit_count()
+
+
+def union(bitmaps):
+    result = 0
+    for bitmap in bitmaps:
+        result |= bitmap
+    return result
+
+
+# ── Rollup ────────────────────────────────────────────────────────────────
+
+def _day_bounds(day):
+    start = datetime.combine(day, time.min)
+    return start, start + timedelta(days=1)
+
+
+def _refresh_seconds():
+    from flask import current_app
+    return current_app.config.get('ENGAGEMENT_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS)
+
+
+def rollup_day(day, now=None):
+    """Recompute every metric for ``day`` from the source tables and store it.
+
+    The stored ``active`` bitmap is ORed in rather than replaced, because it
+    also carries request activity recorded by the tracker that has no source
+    table of its own.
+    """
+    now = now or datetime.utcnow()
+    start, end = _day_bounds(day)
+
+    computed = {}
+    for name, (user_col, ts_col) in _feature_sources().items():
+        rows = db.session.query(user_col, func.count()).filter(
+            ts_col >= start, ts_col < end, user_col.isnot(None)
+        ).group_by(user_col).all()
+        computed[FEATURE_PREFIX + name] = (
+            ids_to_bitmap(user_id for user_id, _ in rows),
+            sum(count for _, count in rows),
+        )
+
+    signup_ids = [row[0] for row in db.session.query(User.id).filter(
+        User.created_at >= start, User.created_at < end
+    ).all()]
+    computed[SIGNUPS] = (ids_to_bitmap(signup_ids), len(signup_ids))
+
+    # last_activity only remembers each user's latest day, so it is a floor
+    # for the day being rolled up, not the full picture
+    seen_ids = [row[0] for row in db.session.query(User.id).filter(
+        User.last_activity >= start, User.last_activity < end
+    ).all()]
+
+    existing = {
+        row.metric: row
+        for row in EngagementDaily.query.filter_by(day=day).all()
+    }
+
+    # Registering counts as activity on the signup day
+    active = ids_to_bitmap(seen_ids) | union(bitmap for bitmap, _ in computed.values())
+    if ACTIVE in existing:
+        active |= bytes_to_bitmap(existing[ACTIVE].user_bitmap)
+    feature_events = sum(events for metric, (_, events) in computed.items() if metric != SIGNUPS)
+    computed[ACTIVE] = (active, feature_events)
+
+    is_final = end <= now
+    for metric, (bitmap, events) in computed.items():
+        row = existing.get(metric)
+        if row is None:
+            row = EngagementDaily(day=day, metric=metric)
+            db.session.add(row)
+        row.user_bitmap = bitmap_to_bytes(bitmap)
+        row.distinct_users = popcount(bitmap)
+        row.events = events
+        row.is_final = is_final
+        row.computed_at = now
+
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another worker rolled the same day up concurrently; theirs is as good
+        db.session.rollback()
+
+
+def _sync_backfill_days():
+    from flask import current_app
+    return current_app.config.get('ENGAGEMENT_SYNC_BACKFILL_DAYS', DEFAULT_SYNC_BACKFILL_DAYS)
+
+
+def _clamp_range(start_day, end_day, today):
+    end_day = min(end_day, today)
+    if (end_day - start_day).days > DEFAULT_MAX_BACKFILL_DAYS:
+        start_day = end_day - timedelta(days=DEFAULT_MAX_BACKFILL_DAYS)
+    return start_day, end_day
+
+
+def days_needing_rollup(start_day, end_day, now):
+    """Days in the range that are missing, unfinished or stale, newest first."""
+    today = now.date()
+    stored = dict(db.session.query(
+        EngagementDaily.day, EngagementDaily
+    ).filter(
+        EngagementDaily.metric == ACTIVE,
+        EngagementDaily.day.between(start_day, end_day)
+    ).all())
+
+    stale_before = now - timedelta(seconds=_refresh_seconds())
+    days = []
+    day = end_day
+    while day >= start_day:
+        row = stored.get(day)
+        if row is None or not row.is_final and (
+            day < today or row.computed_at is None or row.computed_at < stale_before
+        ):
+            days.append(day)
+        day -= timedelta(days=1)
+    return days
+
+
+def ensure_rollups(start_day, end_day):
+    """Roll up any day in the range that is missing, unfinished or stale.
+
+    Only the most recent ``ENGAGEMENT_SYNC_BACKFILL_DAYS`` are done inline;
+    anything older is queued for the tracker thread, and reports read
+    whatever is stored for those days until it catches up.
+    """
+    now = datetime.utcnow()
+    start_day, end_day = _clamp_range(start_day, end_day, now.date())
+    if start_day > end_day:
+        return
+
+    sync_from = end_day - timedelta(days=max(_sync_backfill_days(), 1) - 1)
+    deferred = []
+    for day in days_needing_rollup(start_day, end_day, now):
+        if day >= sync_from:
+            rollup_day(day, now=now)
+        else:
+            deferred.append(day)
+
+    if deferred:
+        activity_tracker.request_backfill(min(deferred), max(deferred))
+
+
+def load_bitmaps(start_day, end_day, metrics):
+    """{(day, metric): (bitmap, events)} for the stored rows in range."""
+    rows = db.session.query(
+        EngagementDaily.day, EngagementDaily.metric,
+        EngagementDaily.user_bitmap, EngagementDaily.events
+    ).filter(
+        EngagementDaily.day.between(start_day, end_day),
+        EngagementDaily.metric.in_(list(metrics))
+    ).all()
+    return {(row.day, row.metric): (bytes_to_bitmap(row.user_bitmap), row.events or 0) for row in rows}
+
+
+# ── Reports ───────────────────────────────────────────────────────────────
+
+def _days(start_day, end_day):
+    day = start_day
+    while day <= end_day:
+        yield day
+        day += timedelta(days=1)
+
+
+def daily_series(start_day, end_day):
+    """DAU with trailing-7 and trailing-30 day distinct users for each day."""
+    ensure_rollups(start_day - timedelta(days=29), end_day)
+    data = load_bitmaps(start_day - timedelta(days=29), end_day, [ACTIVE, SIGNUPS])
+
+    def active(day):
+        return data.get((day, ACTIVE), (0, 0))[0]
+
+    series = []
+    for day in _days(start_day, end_day):
+        series.append({
+            'date': day.isoformat(),
+            'dau': popcount(active(day)),
+            'wau': popcount(union(active(day - timedelta(days=i)) for i in range(7))),
+            'mau': popcount(union(active(day - timedelta(days=i)) for i in range(30))),
+            'new_users': popcount(data.get((day, SIGNUPS), (0, 0))[0]),
+        })
+    return series
+
+
+def range_summary(start_day, end_day):
+    """Distinct active, returning and per-feature users across the whole range."""
+    ensure_rollups(start_day, end_day)
+    features = [FEATURE_PREFIX + name for name in feature_names()]
+    data = load_bitmaps(start_day, end_day, [ACTIVE, SIGNUPS] + features)
+
+    def combined(metric):
+        bitmaps = [value for (_, m), value in data.items() if m == metric]
+        return union(b for b, _ in bitmaps), sum(e for _, e in bitmaps)
+
+    active, _ = combined(ACTIVE)
+    signups, _ = combined(SIGNUPS)
+
+    feature_usage = {}
+    for name in feature_names():
+        bitmap, events = combined(FEATURE_PREFIX + name)
+        feature_usage[name] = {'users': popcount(bitmap), 'events': events}
+
+    return {
+        'active_users': popcount(active),
+        'new_users': popcount(signups),
+        'returning_users': popcount(active & ~signups),
+        'features': feature_usage,
+    }
+
+
+def retention_cohorts(start_day, end_day, weeks=8):
+    """Weekly signup cohorts and the share of each still active N weeks later."""
+    today = datetime.utcnow().date()
+    cohort_start = start_day - timedelta(days=start_day.weekday())
+    horizon = min(today, end_day + timedelta(weeks=weeks))
+    ensure_rollups(cohort_start, horizon)
+    data = load_bitmaps(cohort_start, horizon, [ACTIVE, SIGNUPS])
+
+    def week_union(metric, week_start):
+        return union(data.get((week_start + timedelta(days=i), metric), (0, 0))[0] for i in range(7))
+
+    cohorts = []
+    week_start = cohort_start
+    while week_start <= end_day:
+        cohort = week_union(SIGNUPS, week_start)
+        size = popcount(cohort)
+        retention = []
+        if size:
+            for offset in range(weeks + 1):
+                period_start = week_start + timedelta(weeks=offset)
+                if period_start > today:
+                    break
+                retained = popcount(cohort & week_union(ACTIVE, period_start))
+                retention.append({
+                    'week': offset,
+                    'users': retained,
+                    'rate': round(retained / size * 100, 2),
+                })
+        cohorts.append({
+            'cohort_week': week_start.isoformat(),
+            'size': size,
+            'retention': retention,
+        })
+        week_start += timedelta(weeks=1)
+    return cohorts
+
+
+# ── Request activity ──────────────────────────────────────────────────────
+
+class ActivityTracker:
+    """Collects ids of users seen on authenticated requests and periodically
+    stamps ``User.last_activity`` and today's ``active`` bitmap in bulk.
+
+    The same thread rolls up history that reports asked for but were too far
+    back to compute inline (``request_backfill``).
+    """
+
+    def __init__(self):
+        self._pending = set()
+        self._backfill = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._app = None
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self.flush_interval = 60.0
+
+    def start(self, app):
+        self.flush_interval = float(app.config.get('ENGAGEMENT_FLUSH_INTERVAL', 60))
+        self._app = app
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='engagement-tracker', daemon=True)
+        self._thread.start()
+
+    def touch(self, user_id):
+        if self._app is None or user_id is None:
+            return
+        with self._lock:
+            self._pending.add(int(user_id))
+        self._ensure_thread()
+
+    def request_backfill(self, start_day, end_day):
+        """Queue [start_day, end_day] to be rolled up off the request path."""
+        if self._app is None:
+            from flask import current_app
+            self._app = current_app._get_current_object()
+        with self._lock:
+            if self._backfill is not None:
+                start_day = min(start_day, self._backfill[0])
+                end_day = max(end_day, self._backfill[1])
+            self._backfill = (start_day, end_day)
+        self._ensure_thread()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+            self.run_backfill()
+
+    def run_backfill(self):
+        with self._lock:
+            pending, self._backfill = self._backfill, None
+        if pending is None or self._app is None:
+            return
+
+        try:
+            with self._app.app_context():
+                now = datetime.utcnow()
+                days = days_needing_rollup(*_clamp_range(*pending, now.date()), now)
+                for day in days:
+                    rollup_day(day, now=now)
+                if days:
+                    logger.info(f"Backfilled engagement rollups for {len(days)} days")
+        except Exception as e:
+            logger.error(f"Failed to backfill engagement rollups {pending[0]}..{pending[1]}: {e}")
+        finally:
+            with self._app.app_context():
+                db.session.remove()
+
+    def flush(self):
+        with self._lock:
+            user_ids, self._pending = self._pending, set()
+        if not user_ids or self._app is None:
+            return
+
+        now = datetime.utcnow()
+        try:
+            with self._app.app_context():
+                ids = sorted(user_ids)
+                for i in range(0, len(ids), UPDATE_CHUNK_SIZE):
+                    User.query.filter(User.id.in_(ids[i:i + UPDATE_CHUNK_SIZE])).update(
+                        {User.last_activity: now}, synchronize_session=False
+                    )
+                db.session.commit()
+                _merge_active(now.date(), user_ids, now)
+        except Exception as e:
+            logger.error(f"Failed to flush engagement activity for {len(user_ids)} users: {e}")
+        finally:
+            if self._app is not None:
+                with self._app.app_context():
+                    db.session.remove()
+
+
+def _merge_active(day, user_ids, now):
+    """OR user ids into the stored ``active`` bitmap for ``day``."""
+    for _ in range(2):
+        row = EngagementDaily.query.filter_by(day=day, metric=ACTIVE).with_for_update().first()
+        if row is None:
+            row = EngagementDaily(day=day, metric=ACTIVE, events=0, is_final=False, computed_at=now)
+            db.session.add(row)
+            bitmap = 0
+        else:
+            bitmap = bytes_to_bitmap(row.user_bitmap)
+        bitmap |= ids_to_bitmap(user_ids)
+        row.user_bitmap = bitmap_to_bytes(bitmap)
+        row.distinct_users = popcount(bitmap)
+        try:
+            db.session.commit()
+            return
+        except IntegrityError:
+            db.session.rollback()
+
+
+activity_tracker = ActivityTracker()
+
+
+def _current_user_id():
+    user = getattr(g, 'current_user', None)
+    if user is not None:
+        return user.id
+    try:
+        from flask_jwt_extended import get_jwt_identity
+        identity = get_jwt_identity()
+    except Exception:
+        return None
+    try:
+        return int(identity) if identity is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def init_engagement_tracking(app):
+    """Record authenticated request activity for the engagement rollups."""
+    if not app.config.get('ENGAGEMENT_TRACKING_ENABLED', True):
+        return
+
+    activity_tracker.start(app)
+
+    @app.after_request
+    def _track_engagement(response):
+        if response.status_code < 400:
+            activity_tracker.touch(_current_user_id())
+        return response
@@ -0,0 +1,87 @@
+"""
+Periodic purge of expired insight_cache rows.
+
+Expired insights stay useful for a while: when Gemini is down the insight
+service serves the user's newest one, expired or not. Rows that expired more
+than ``INSIGHT_CACHE_RETENTION_DAYS`` ago are deleted every
+``INSIGHT_CACHE_CLEANUP_INTERVAL`` seconds in chunked DELETEs
+(``INSIGHT_CACHE_CLEANUP_CHUNK_SIZE`` rows per transaction), so the table
+stays small without one long delete locking it. One worker purges at a time,
+holding an ``insight_generation_locks`` row.
+"""
+
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from app import db
+from app.models.insight_cache import InsightCache, InsightGenerationLock
+
+logger = logging.getLogger(__name__)
+
+CLEANUP_LOCK_KEY = 'insight-cache-cleanup'
+CLEANUP_LOCK_SECONDS = 600
+
+
+def purge_expired_insights(retention_days, chunk_size):
+    """Delete insights that expired over ``retention_days`` ago; None when another worker is purging."""
+    owner = uuid.uuid4().hex
+    if not InsightGenerationLock.acquire(CLEANUP_LOCK_KEY, owner, CLEANUP_LOCK_SECONDS):
+        return None
+    try:
+        before = datetime.utcnow() - timedelta(days=retention_days)
+        deleted = InsightCache.cleanup_expired(before, chunk_size)
+    finally:
+        InsightGenerationLock.release(CLEANUP_LOCK_KEY, owner)
+    if deleted:
+        logger.info(f"Purged {deleted} insight_cache rows expired before {before:%Y-%m-%d %H:%M}")
+    return deleted
+
+
+class InsightCacheMaintenance:
+    """Runs ``purge_expired_insights`` every ``INSIGHT_CACHE_CLEANUP_INTERVAL`` seconds."""
+
+    def __init__(self):
+        self._app = None
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self.interval = 3600.0
+
+    def start(self, app):
+        self.interval = float(app.config.get('INSIGHT_CACHE_CLEANUP_INTERVAL', 3600))
+        self._app = app
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='insight-cache-cleanup', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def run_once(self):
+        app = self._app
+        with app.app_context():
+            try:
+                return purge_expired_insights(
+                    int(app.config.get('INSIGHT_CACHE_RETENTION_DAYS', 30)),
+                    int(app.config.get('INSIGHT_CACHE_CLEANUP_CHUNK_SIZE', 1000)),
+                )
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Insight cache cleanup failed: {e}")
+                return None
+            finally:
+                db.session.remove()
+
+
+insight_cache_maintenance = InsightCacheMaintenance()
+
+
+def init_insight_cache_maintenance(app):
+    if app.config.get('INSIGHT_CACHE_CLEANUP_ENABLED'):
+        insight_cache_maintenance.start(app)
@@ -0,0 +1,208 @@
+"""
+Off-peak pre-generation of AI insights.
+
+Generating an insight in the request path makes the first load of the
+insights screen wait on Gemini for several seconds. During the off-peak window
+(``INSIGHT_PREGEN_WINDOW_START``..``INSIGHT_PREGEN_WINDOW_END``, UTC hours) a
+daemon thread walks users active in the last ``INSIGHT_PREGEN_ACTIVE_DAYS``
+days, picks those whose cycle, meal or appointment data changed after their
+newest insight, and has ``KinyarwandaInsightService.pregenerate_insights``
+fill insight_cache a batch at a time. Gemini calls share one per-minute budget
+across workers.
+
+Only one worker runs a pass at a time: the pass holds an
+``insight_generation_locks`` row and gives it up after about one interval, so
+the next tick (on any worker) carries on from the stored cursor.
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from app import db
+from app.models import User, CycleLog, MealLog, Appointment
+from app.models.insight_cache import InsightCache, InsightGenerationLock
+from app.services.engagement_analytics import ACTIVE, bitmap_to_ids, ensure_rollups, load_bitmaps, union
+from app.utils.kv_store import SharedKVStore, SlidingWindowCounter
+
+logger = logging.getLogger(__name__)
+
+PREGEN_LOCK_KEY = 'insight-pregeneration'
+PREGEN_USER_TYPES = ('parent', 'adolescent')
+DATA_TABLES = (CycleLog, MealLog, Appointment)
+
+# Last user id handled per language, so a pass resumes where the previous one stopped
+_cursor = SharedKVStore('insight_pregen_cursor', default_ttl=24 * 3600, max_entries=10)
+_llm_rate = SlidingWindowCounter(SharedKVStore('insight_pregen_rate', default_ttl=120, max_entries=100), 60)
+
+
+def in_window(now, start_hour, end_hour):
+    """True when ``now`` falls in [start_hour, end_hour), wrapping past midnight."""
+    if start_hour == end_hour:
+        return False
+    if start_hour < end_hour:
+        return start_hour <= now.hour < end_hour
+    return now.hour >= start_hour or now.hour < end_hour
+
+
+def active_user_ids(days):
+    """Ids of users counted active on any of the last ``days`` days, ascending."""
+    end_day = datetime.utcnow().date()
+    start_day = end_day - timedelta(days=days - 1)
+    ensure_rollups(start_day, end_day)
+    bitmaps = load_bitmaps(start_day, end_day, [ACTIVE])
+    return bitmap_to_ids(union(bitmap for bitmap, _ in bitmaps.values()))
+
+
+def users_needing_insight(user_ids, language):
+    """Of ``user_ids``, the app users with no insight yet or data newer than it."""
+    if not user_ids:
+        return []
+    eligible = [user_id for (user_id,) in db.session.query(User.id).filter(
+        User.id.in_(user_ids),
+        User.is_active == True,
+        User.user_type.in_(PREGEN_USER_TYPES)
+    )]
+    if not eligible:
+        return []
+
+    latest_insight = dict(db.session.query(
+        InsightCache.user_id, func.max(InsightCache.created_at)
+    ).filter(
+        InsightCache.user_id.in_(eligible),
+        InsightCache.language == language,
+        InsightCache.is_valid == True
+    ).group_by(InsightCache.user_id).all())
+
+    latest_change = {}
+    for model in DATA_TABLES:
+        rows = db.session.query(model.user_id, func.max(model.updated_at)).filter(
+            model.user_id.in_(eligible)
+        ).group_by(model.user_id).all()
+        for user_id, changed_at in rows:
+            if changed_at and (user_id not in latest_change or changed_at > latest_change[user_id]):
+                latest_change[user_id] = changed_at
+
+    return [
+        user_id for user_id in eligible
+        if user_id not in latest_insight
+        or (user_id in latest_change and latest_change[user_id] > latest_insight[user_id])
+    ]
+
+
+def _acquire_llm_slot(rate_per_minute, wait_seconds=60.0):
+    """Wait for a slot in the shared per-minute Gemini budget; False if none came up."""
+    if not rate_per_minute:
+        return True
+    deadline = time.monotonic() + wait_seconds
+    while not _llm_rate.hit('generate', rate_per_minute):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(1.0)
+    return True
+
+
+def run_pregeneration(app, time_budget_seconds):
+    """
+    One pass: walk active users from the stored cursor, generating stale
+    insights until the time budget, the Gemini budget or the users run out.
+    Returns run stats, or None when another worker holds the pass.
+    """
+    from app.services.kinyarwanda_insight_service import GENERATION_LOCK_SECONDS, KinyarwandaInsightService
+
+    service = KinyarwandaInsightService()
+    if not service.google_api_key:
+        return None
+
+    owner = uuid.uuid4().hex
+    if not InsightGenerationLock.acquire(PREGEN_LOCK_KEY, owner, time_budget_seconds + GENERATION_LOCK_SECONDS):
+        return None
+
+    batch_size = int(app.config.get('INSIGHT_PREGEN_BATCH_SIZE', 50))
+    rate = int(app.config.get('INSIGHT_PREGEN_RATE_PER_MINUTE', 20))
+    languages = app.config.get('INSIGHT_PREGEN_LANGUAGES', ['kinyarwanda'])
+    deadline = time.monotonic() + time_budget_seconds
+    stats = {'scanned': 0, 'stale': 0, 'generated': 0, 'shared': 0, 'failed': 0, 'deferred': 0}
+
+    try:
+        user_ids = active_user_ids(int(app.config.get('INSIGHT_PREGEN_ACTIVE_DAYS', 30)))
+        for language in languages:
+            after_id = _cursor.get(language, 0)
+            remaining = [user_id for user_id in user_ids if user_id > after_id]
+            while remaining and time.monotonic() < deadline:
+                batch, remaining = remaining[:batch_size], remaining[batch_size:]
+                stats['scanned'] += len(batch)
+                stale = users_needing_insight(batch, language)
+                stats['stale'] += len(stale)
+                batch_stats = service.pregenerate_insights(
+                    stale, language,
+                    acquire_budget=lambda: time.monotonic() < deadline and _acquire_llm_slot(rate)
+                )
+                for key, value in batch_stats.items():
+                    stats[key] += value
+                if batch_stats['deferred']:
+                    # Out of time or budget, or Gemini is down: redo this batch next pass
+                    return stats
+                _cursor.set(language, batch[-1])
+            if remaining:
+                return stats
+            # Finished the language; the next window starts from the beginning
+            _cursor.delete(language)
+        return stats
+    finally:
+        InsightGenerationLock.release(PREGEN_LOCK_KEY, owner)
+        if stats['scanned']:
+            logger.info(f"Insight pre-generation pass: {stats}")
+
+
+class InsightPregenerator:
+    """Runs ``run_pregeneration`` every ``INSIGHT_PREGEN_INTERVAL`` seconds inside the off-peak window."""
+
+    def __init__(self):
+        self._app = None
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self.interval = 300.0
+
+    def start(self, app):
+        self.interval = float(app.config.get('INSIGHT_PREGEN_INTERVAL', 300))
+        self._app = app
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='insight-pregeneration', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def run_once(self, now=None, force=False):
+        app = self._app
+        start_hour = int(app.config.get('INSIGHT_PREGEN_WINDOW_START', 0))
+        end_hour = int(app.config.get('INSIGHT_PREGEN_WINDOW_END', 4))
+        if not force and not in_window(now or datetime.utcnow(), start_hour, end_hour):
+            return None
+        with app.app_context():
+            try:
+                return run_pregeneration(app, self.interval)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Insight pre-generation failed: {e}")
+                return None
+            finally:
+                db.session.remove()
+
+
+insight_pregenerator = InsightPregenerator()
+
+
+def init_insight_pregeneration(app):
+    if app.config.get('INSIGHT_PREGEN_ENABLED'):
+        insight_pregenerator.start(app)
@@ -1,16 +1,132 @@
 import os
 import json
-import requests
+import contextvars
+import functools
+import hashlib
+import string
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
+from flask import current_app
 from app import db
 from app.models import User, CycleLog, MealLog, Appointment, Parent, Adolescent, ParentChild
-from app.models.insight_cache import InsightCache
+from app.models.insight_cache import InsightCache, InsightGenerationLock
+from app.services import llm_usage
+from app.services.llm_client import DEFAULT_MODEL, CircuitOpenError, LLMError, gemini_client
+from app.services.rule_based_insights import build_rule_based_insight
+from app.utils.kv_store import MemoryKVStore
+from app.utils.performance import StageTimer, record_cache_access
+from app.utils.single_flight import SingleFlight
 import logging
 import statistics
 
 logger = logging.getLogger(__name__)
 
+# Bump whenever _build_prompt or _parse_ai_response changes what an insight contains
+PROMPT_VERSION = 2
+
+# Identical inputs give an identical insight, so entries only age out as a backstop
+INSIGHT_CACHE_HOURS = 7 * 24
+
+# In-process LRU in front of insight_cache, keyed by prompt fingerprint
+_recent_insights = MemoryKVStore('insight_fingerprint', default_ttl=INSIGHT_CACHE_HOURS * 3600, max_entries=2000)
+
+# (user_id, language) -> fingerprint their own insight_cache row is known to hold,
+# so a fingerprint hit only writes the caller's row when it holds something else
+_user_fingerprints = MemoryKVStore('insight_user_fingerprint', default_ttl=3600, max_entries=20000)
+
+# Concurrent requests for the same fingerprint share one Gemini call: threads
+# through the single flight, workers through an insight_generation_locks row
+_generations = SingleFlight('insight_generation')
+GENERATION_LOCK_SECONDS = 90
+GENERATION_POLL_SECONDS = 0.5
+
+# A request waits at most INSIGHT_LLM_BUDGET_SECONDS for Gemini before answering
+# with the rule-based insight; the generation carries on here and is cached
+_llm_calls = ThreadPoolExecutor(max_workers=8, thread_name_prefix='insight-llm')
+DEFAULT_LLM_BUDGET_SECONDS = 8.0
+
+INSIGHT_GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "topK": 40,
+    "topP": 0.95,
+    "maxOutputTokens": 1024
+}
+
+# Order the sections of a parsed insight appear in (and are streamed in)
+INSIGHT_SECTIONS = ('inyunganizi', 'icyo_wakora', 'ihumure')
+
+# Prompt-context reuse: the verified provider list is the same for everyone, and
+# a cycle analysis only changes with the user's logs (or the date)
+_verified_providers = MemoryKVStore('insight_providers', default_ttl=300, max_entries=1)
+_cycle_analyses = MemoryKVStore('insight_cycle_analysis', default_ttl=24 * 3600, max_entries=5000)
+
+# Prompt text sent to Gemini; the {fields} are filled in by _build_prompt
+
+PROMPT_TEMPLATES = {
+    'kinyarwanda': """Wowe uri umuganga w'abagore mu Rwanda ukoresha tekinoroji igezweho (AI/ML) kugira ngo ufashe abagore n'abakobwa gukurikirana ubuzima bwabo. Ugomba gutanga inyunganizi ku buzima mu Kinyarwanda ku buryo bworoshye, bushimishije kandi bwizewe.
+
+Amakuru y'umukiriya:
+- Ubwoko bw'ukoresha: {user_type}
+- Imiterere y'imyaka: {age_context}
+- Aho aherereye: {relationship_context}
+
+Amakuru y'ubuzima yashyizwe mu sisitemu y'ubwenge bwa machine learning:
+{summary_text}
+
+{rec_text}
+{provider_section}
+
+Ugomba gutanga inyunganizi zishingiye ku makuru y'ubwenge bwa machine learning (ML):
+1. **Inyunganizi ku buzima** - Sobanura uko ubuzima bwe bwifashe nk'uko isesengura rya ML rigaragaza, mvuge ku regularity, trends, na patterns zabonwemo. Koresha amakuru ya wellness (imiterere y'ibitekerezo, ibipimo by'inkomere, ibiryo) kugirango ugire inama nziza.
+2. **Icyo wakora** - Tanga inama eshatu (3) zifatika zishingiye ku makuru ya ML (cycle predictions, anomaly detection, wellness patterns). Ongeramo ibyo kurya byo mu Rwanda nka dodo, ibijumba, ibishyimbo, avoka.
+3. **Amagambo y'ihumure** - Andika ubutumwa bushimishije no gushimangira, wishingire ku myumvire nziza ya ML ku buzima bwe
+
+Nyandiko ibikurikira mu Kinyarwanda rwiza, gukoresha amagambo yoroshye kandi ukaba ufite impuhwe. Ntukavuge izina ry'umukiriya mu gisubizo. Koresha imvugo nziza kandi ishimishije. Shyira imbere amakuru ya ML kugira ngo inama zawe zibeho precision.""",
+    'english': """You are a compassionate women's health advisor in Rwanda who uses advanced AI/ML technology to help women and girls track their health. Provide personalized health insights in clear, encouraging, and trustworthy English.
+
+User Information:
+- User Type: {user_type}
+- Age Context: {age_context}
+- Relationship Context: {relationship_context}
+
+Health Data Summary with ML Analysis:
+{summary_text}
+
+{rec_text}
+{provider_section}
+
+Please provide ML-enhanced insights:
+1. **Health Insight** - Explain what the ML analysis shows about their wellbeing, including cycle regularity, trends, patterns, predictions, and wellness observations (mood, stress, sleep, energy, exercise)
+2. **What to do next** - Give three (3) practical, culturally-appropriate recommendations based on ML insights (cycle predictions, anomaly detection, wellness patterns). Include local Rwandan foods (dodo, sweet potatoes, black beans, avocados) in nutrition recommendations.
+3. **Words of encouragement** - Write an encouraging and affirming message that acknowledges the ML insights about their health patterns
+
+If you detect any health concerns (anomalies, irregular patterns, high stress, poor sleep), gently recommend consulting one of the available verified health providers listed above.
+Write in clear, simple English using compassionate language. Do not mention the user's name directly in the response. Use supportive and positive tone. Emphasize the ML-powered insights for precision and accuracy.""",
+}
+
+# Templates split once into (static text, field) pairs, so a prompt is a single join
+_COMPILED_TEMPLATES = {
+    language: [(literal, field) for literal, field, _, _ in string.Formatter().parse(template)]
+    for language, template in PROMPT_TEMPLATES.items()
+}
+
+
+def _render_prompt(language: str, values: Dict[str, str]) -> str:
+    parts = _COMPILED_TEMPLATES['kinyarwanda' if language == 'kinyarwanda' else 'english']
+    return ''.join(literal + (values[field] if field else '') for literal, field in parts)
+
+
+@functools.lru_cache(maxsize=32)
+def _render_provider_section(providers: tuple) -> str:
+    if not providers:
+        return ""
+    provider_list = [f"- {name} ({spec}, {clinic})" for name, spec, clinic in providers]
+    return "\n\nAvailable Verified Health Providers (recommend these if consultation needed):\n" + "\n".join(provider_list)
+
+
 class KinyarwandaInsightService:
     """
     Service to generate health insights in Kinyarwanda using Gemini 2.0 Flash API
@@ -20,10 +136,8 @@ class KinyarwandaInsightService:
     def __init__(self):
         from app.utils.gemini_config import get_gemini_api_key_from_env
         self.google_api_key = get_gemini_api_key_from_env()
-        self.gemini_endpoint = (
-            "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent"
-        )
-        self.cache_duration_hours = 6
+        self.gemini_model = DEFAULT_MODEL
+        self.cache_duration_hours = INSIGHT_CACHE_HOURS
 
         if not self.google_api_key:
             logger.warning(
@@ -42,22 +156,317 @@ class KinyarwandaInsightService:
             Dict containing the generated insights or error information
         """
         try:
-            # Check if we have cached insights (within 6 hours)
-            cached_insight = self._get_cached_insight(user_id, language)
+            timer = StageTimer('insight_context')
+            
+            # Fetch user data
+            user_data = self._fetch_user_data(user_id, timer)
+            if not user_data['success']:
+                return user_data
+            
+            # Generate prompt based on user type and data
+            with timer.stage('prompt'):
+                prompt = self._build_prompt(user_data['data'], language)
+                fingerprint = self._fingerprint(prompt, language)
+            
+            # Same prompt inputs (for this or any other user) -> reuse the insight
+            with timer.stage('cache_lookup'):
+                cached_insight = self._get_cached_insight(fingerprint)
+            timer.finish()
             if cached_insight:
+                llm_usage.record_cache_hit('insights', language)
+                self._keep_for_user(user_id, cached_insight, language, fingerprint)
                 return {
                     'success': True,
                     'data': cached_insight,
                     'cached': True
                 }
             
-            # Fetch user data
+            if not self.google_api_key:
+                return self._rule_based_result(user_data['data'], language)
+            if llm_usage.check_quota() is not None:
+                logger.info(f"LLM quota exhausted for user {user_id}; serving rule-based insight")
+                return self._rule_based_result(user_data['data'], language)
+            
+            result = self._generate_within_budget(user_id, prompt, language, fingerprint)
+            if result is None:
+                logger.info(f"Gemini over its latency budget for user {user_id}; serving rule-based insight")
+                return self._rule_based_result(user_data['data'], language)
+            if not result['success']:
+                if result.get('degraded'):
+                    # Upstream trouble: an expired insight beats a generic one
+                    stale_insight = self._get_stale_insight(user_id, language)
+                    if stale_insight:
+                        return {
+                            'success': True,
+                            'data': stale_insight,
+                            'cached': True,
+                            'stale': True
+                        }
+                return self._rule_based_result(user_data['data'], language)
+            # A flight led by (or a worker generating for) another user cached it under their row
+            self._keep_for_user(user_id, result['data'], language, fingerprint)
+            return result
+            
+        except Exception as e:
+            logger.error(f"Error generating insight for user {user_id}: {str(e)}")
+            return {
+                'success': False,
+                'error': 'Failed to generate insights. Please try again later.'
+            }
+    
+    def stream_insight(self, user_id: int, language: str = 'kinyarwanda'):
+        """
+        Generate insights like ``generate_insight`` but yield ``(event, data)`` pairs
+        as soon as each part is ready, for server-sent events:
+        
+        - ``preview``: ``{'insights': ...}``, the rule-based insight, sent before
+          Gemini is called so there is something to show straight away
+        - ``section``: ``{'section': name, 'content': ...}`` once a section of the
+          Gemini answer is complete (sections in ``INSIGHT_SECTIONS`` order)
+        - ``done``: the full insight plus ``cached``/``stale``/``fallback`` flags;
+          clients should treat this as authoritative
+        - ``error``: ``{'error': message}``; nothing follows
+        """
+        try:
             user_data = self._fetch_user_data(user_id)
             if not user_data['success']:
-                return user_data
+                yield 'error', {'error': user_data['error']}
+                return
             
-            # Generate prompt based on user type and data
             prompt = self._build_prompt(user_data['data'], language)
+            fingerprint = self._fingerprint(prompt, language)
+            cached_insight = self._get_cached_insight(fingerprint)
+            if cached_insight:
+                llm_usage.record_cache_hit('insights_stream', language)
+                self._keep_for_user(user_id, cached_insight, language, fingerprint)
+                yield from self._insight_events(cached_insight, cached=True)
+                return
+            
+            rule_based = build_rule_based_insight(user_data['data'], language)
+            if not self.google_api_key or llm_usage.check_quota() is not None:
+                yield from self._insight_events(rule_based, cached=False, fallback=True)
+                return
+            yield 'preview', {'insights': rule_based}
+            
+            # Same single flight and cross-worker lock as generate_insight, so a
+            # fingerprint is never generated twice at once
+            with _generations.lead(fingerprint) as flight:
+                if flight is None:
+                    result = _generations.do(
+                        fingerprint,
+                        lambda: self._generate_coalesced(user_id, prompt, language, fingerprint)
+                    )
+                    if result and result['success']:
+                        self._keep_for_user(user_id, result['data'], language, fingerprint)
+                    yield from self._result_events(result, rule_based, user_id, language)
+                    return
+                flight.result = {'success': False, 'error': 'Insight stream ended early'}
+                
+                owner = uuid.uuid4().hex
+                locked = self._acquire_generation_lock(fingerprint, owner)
+                if locked is False:
+                    # Another worker is generating it: wait for theirs, don't stream a second one
+                    flight.result = self._generate_coalesced(user_id, prompt, language, fingerprint)
+                    if flight.result['success']:
+                        self._keep_for_user(user_id, flight.result['data'], language, fingerprint)
+                    yield from self._result_events(flight.result, rule_based, user_id, language)
+                    return
+                try:
+                    insight = self._get_cached_insight(fingerprint)
+                    if insight:
+                        flight.result = {'success': True, 'data': insight, 'cached': True}
+                        self._keep_for_user(user_id, insight, language, fingerprint)
+                        yield from self._insight_events(insight, cached=True)
+                        return
+                    
+                    emitted = set()
+                    try:
+                        text = yield from self._stream_sections(prompt, language, emitted)
+                    except LLMError as e:
+                        degraded = isinstance(e, CircuitOpenError) or e.status is None or e.status >= 429
+                        logger.error(f"Gemini stream failed for user {user_id}: {e}")
+                        flight.result = {'success': False, 'degraded': degraded, 'error': str(e)}
+                        yield from self._result_events(flight.result, rule_based, user_id, language)
+                        return
+                    
+                    structured_insight = self._parse_ai_response(text, language)
+                    self._cache_insight(user_id, structured_insight, language, fingerprint)
+                    flight.result = {'success': True, 'data': structured_insight, 'cached': False}
+                    yield from self._insight_events(structured_insight, cached=False, skip=emitted)
+                finally:
+                    if locked:
+                        self._release_generation_lock(fingerprint, owner)
+            
+        except Exception as e:
+            logger.error(f"Error streaming insight for user {user_id}: {str(e)}")
+            yield 'error', {'error': 'Failed to generate insights. Please try again later.'}
+    
+    def _stream_sections(self, prompt: str, language: str, emitted: set):
+        """Stream the Gemini answer, yielding each section as soon as the next header closes it.
+
+        Adds the names of the sections sent to ``emitted`` and returns the full text.
+        """
+        text = ''
+        current_section = None
+        for chunk in gemini_client.stream(
+            prompt, self.google_api_key, model=self.gemini_model,
+            generation_config=INSIGHT_GENERATION_CONFIG, endpoint='insights_stream',
+        ):
+            complete_before = text.rfind('\n') + 1
+            text += chunk
+            complete_upto = text.rfind('\n') + 1
+            for line in text[complete_before:complete_upto].split('\n'):
+                section = self._section_for_header(line.strip())
+                if section is None or section == current_section:
+                    continue
+                # A new header closes the section before it
+                if current_section and current_section not in emitted:
+                    partial = self._parse_ai_response(text[:complete_before], language)
+                    if partial.get(current_section):
+                        emitted.add(current_section)
+                        yield 'section', {'section': current_section, 'content': partial[current_section]}
+                current_section = section
+        return text
+    
+    def _result_events(self, result: Dict[str, Any], rule_based: Dict[str, Any], user_id: int, language: str):
+        """Events for a finished (or failed) generation, after the preview has been sent"""
+        if result and result['success']:
+            yield from self._insight_events(result['data'], cached=result.get('cached', False))
+            return
+        stale_insight = self._get_stale_insight(user_id, language) if result and result.get('degraded') else None
+        if stale_insight:
+            yield from self._insight_events(stale_insight, cached=True, stale=True)
+        else:
+            yield from self._insight_events(rule_based, cached=False, fallback=True)
+    
+    @staticmethod
+    def _insight_events(insight: Dict[str, Any], cached: bool, stale: bool = False, skip=(), fallback: bool = False):
+        for section in INSIGHT_SECTIONS:
+            if section not in skip:
+                yield 'section', {'section': section, 'content': insight.get(section)}
+        yield 'done', {'insights': insight, 'cached': cached, 'stale': stale, 'fallback': fallback}
+    
+    @staticmethod
+    def _rule_based_result(user_data: Dict[str, Any], language: str) -> Dict[str, Any]:
+        """Template insight from the cycle engine's results, for when Gemini can't answer in time"""
+        return {
+            'success': True,
+            'data': build_rule_based_insight(user_data, language),
+            'cached': False,
+            'fallback': True
+        }
+    
+    def _generate_within_budget(self, user_id: int, prompt: str, language: str,
+                                fingerprint: str) -> Optional[Dict[str, Any]]:
+        """
+        Coalesced Gemini generation, waited on for at most ``INSIGHT_LLM_BUDGET_SECONDS``.
+        Returns None once the budget runs out; the call keeps going on the
+        worker pool and caches its insight for the next request.
+        """
+        # One Gemini call per fingerprint, however many callers want it
+        def generate():
+            return _generations.do(
+                fingerprint,
+                lambda: self._generate_coalesced(user_id, prompt, language, fingerprint)
+            )
+        
+        budget = current_app.config.get('INSIGHT_LLM_BUDGET_SECONDS', DEFAULT_LLM_BUDGET_SECONDS)
+        if not budget:
+            return generate()
+        
+        app = current_app._get_current_object()
+        
+        def run():
+            with app.app_context():
+                try:
+                    return generate()
+                finally:
+                    db.session.remove()
+        
+        try:
+            # Carry the request's usage attribution onto the pool thread
+            return _llm_calls.submit(contextvars.copy_context().run, run).result(timeout=budget)
+        except FutureTimeout:
+            return None
+    
+    @staticmethod
+    def _section_for_header(line: str) -> Optional[str]:
+        """Section a response line opens, by the same header keywords as _parse_ai_response"""
+        lowered = line.lower()
+        if any(keyword in lowered for keyword in ['inyunganizi ku buzima', 'health insight', '1.', '**inyunganizi']):
+            return 'inyunganizi'
+        if any(keyword in lowered for keyword in ['icyo wakora', 'what to do', '2.', '**icyo']):
+            return 'icyo_wakora'
+        if any(keyword in lowered for keyword in ['amagambo y\'ihumure', 'encouragement', '3.', '**amagambo']):
+            return 'ihumure'
+        return None
+    
+    def pregenerate_insights(self, user_ids: List[int], language: str, acquire_budget=None) -> Dict[str, int]:
+        """
+        Fill the cache for a batch of users ahead of their next visit.
+        
+        Prompt inputs for the whole batch are loaded together. A user whose
+        fingerprint is already cached gets a copy of that insight; the rest
+        call Gemini, each after ``acquire_budget()`` grants a slot. Stops early,
+        with the remaining users counted as deferred, when the budget runs out
+        or Gemini is unavailable.
+        """
+        stats = {'generated': 0, 'shared': 0, 'failed': 0, 'deferred': 0}
+        timer = StageTimer('insight_pregeneration_batch')
+        users_data = self._fetch_users_data(user_ids, timer)
+        timer.finish()
+        pending = list(users_data.items())
+        while pending:
+            user_id, user_data = pending.pop(0)
+            prompt = self._build_prompt(user_data, language)
+            fingerprint = self._fingerprint(prompt, language)
+            
+            cached_insight = self._get_cached_insight(fingerprint)
+            if cached_insight:
+                self._keep_for_user(user_id, cached_insight, language, fingerprint)
+                stats['shared'] += 1
+                continue
+            
+            if acquire_budget is not None and not acquire_budget():
+                stats['deferred'] += 1 + len(pending)
+                break
+            
+            result = _generations.do(
+                fingerprint,
+                lambda: self._generate_coalesced(user_id, prompt, language, fingerprint)
+            )
+            if result['success']:
+                stats['generated'] += 1
+            elif result.get('degraded'):
+                stats['deferred'] += 1 + len(pending)
+                break
+            else:
+                stats['failed'] += 1
+        return stats
+    
+    def _generate_coalesced(self, user_id: int, prompt: str, language: str, fingerprint: str) -> Dict[str, Any]:
+        """Call Gemini under the cross-worker lock, or wait for the worker holding it"""
+        owner = uuid.uuid4().hex
+        locked = self._acquire_generation_lock(fingerprint, owner)
+        if locked is False:
+            insight = self._wait_for_insight(fingerprint)
+            if insight:
+                return {
+                    'success': True,
+                    'data': insight,
+                    'cached': True
+                }
+            # The other worker failed or timed out; generate here instead
+        
+        try:
+            # A flight that finished just before this one began has already cached it
+            insight = self._get_cached_insight(fingerprint)
+            if insight:
+                return {
+                    'success': True,
+                    'data': insight,
+                    'cached': True
+                }
             
             # Call Gemini API
             ai_response = self._call_gemini_api(prompt)
@@ -68,20 +477,51 @@ class KinyarwandaInsightService:
             structured_insight = self._parse_ai_response(ai_response['data'], language)
             
             # Cache the insight
-            self._cache_insight(user_id, structured_insight, language)
+            self._cache_insight(user_id, structured_insight, language, fingerprint)
             
             return {
                 'success': True,
                 'data': structured_insight,
                 'cached': False
             }
-            
+        finally:
+            if locked:
+                self._release_generation_lock(fingerprint, owner)
+    
+    def _acquire_generation_lock(self, fingerprint: str, owner: str) -> Optional[bool]:
+        """True when held, False when another worker holds it, None when locking is unavailable"""
+        try:
+            return InsightGenerationLock.acquire(fingerprint, owner, GENERATION_LOCK_SECONDS)
         except Exception as e:
-            logger.error(f"Error generating insight for user {user_id}: {str(e)}")
-            return {
-                'success': False,
-                'error': 'Failed to generate insights. Please try again later.'
-            }
+            db.session.rollback()
+            logger.warning(f"Insight generation lock unavailable, generating unlocked: {str(e)}")
+            return None
+    
+    def _release_generation_lock(self, fingerprint: str, owner: str) -> None:
+        try:
+            InsightGenerationLock.release(fingerprint, owner)
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"Could not release insight generation lock {fingerprint[:12]}: {str(e)}")
+    
+    def _wait_for_insight(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """Poll for the insight another worker is generating, until it lands or the lock goes"""
+        deadline = time.monotonic() + GENERATION_LOCK_SECONDS
+        while time.monotonic() < deadline:
+            time.sleep(GENERATION_POLL_SECONDS)
+            try:
+                cached_insight = InsightCache.get_by_fingerprint(fingerprint)
+                if cached_insight:
+                    insight = json.loads(cached_insight.insight_data)
+                    _recent_insights.set(fingerprint, insight)
+                    return insight
+                if not InsightGenerationLock.is_held(fingerprint):
+                    return None
+            except Exception as e:
+                db.session.rollback()
+                logger.warning(f"Error waiting for insight {fingerprint[:12]}: {str(e)}")
+                return None
+        return None
     
     def _analyze_wellness_data(self, cycle_logs: List[CycleLog]) -> Dict[str, Any]:
         """Analyze wellness patterns (mood, sleep, stress, energy, exercise) from cycle logs"""
@@ -136,142 +576,244 @@ class KinyarwandaInsightService:
             logger.warning(f"Error analyzing wellness data: {str(e)}")
             return {'has_wellness_data': False}
     
-    def _fetch_user_data(self, user_id: int) -> Dict[str, Any]:
+    def _fetch_user_data(self, user_id: int, timer: Optional[StageTimer] = None) -> Dict[str, Any]:
         """Fetch comprehensive user data for insight generation"""
         try:
-            user = User.query.get(user_id)
-            if not user:
+            user_data = self._fetch_users_data([user_id], timer).get(user_id)
+            if not user_data:
                 return {'success': False, 'error': 'User not found'}
-            
-            # Get recent cycle logs (last 3 months)
-            three_months_ago = datetime.utcnow() - timedelta(days=90)
-            cycle_logs = CycleLog.query.filter(
-                CycleLog.user_id == user_id,
-                CycleLog.created_at >= three_months_ago
-            ).order_by(CycleLog.start_date.desc()).limit(10).all()
-            
-            # Get advanced cycle analysis from cycle_logs engine
-            cycle_analysis = self._get_advanced_cycle_analysis(user_id, cycle_logs)
-            
-            # Get recent meal logs (last 30 days)
-            thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-            meal_logs = MealLog.query.filter(
-                MealLog.user_id == user_id,
-                MealLog.created_at >= thirty_days_ago
-            ).order_by(MealLog.meal_time.desc()).limit(20).all()
-            
-            # Get recent appointments (last 60 days)
-            sixty_days_ago = datetime.utcnow() - timedelta(days=60)
-            appointments = Appointment.query.filter(
-                Appointment.user_id == user_id,
-                Appointment.created_at >= sixty_days_ago
-            ).order_by(Appointment.created_at.desc()).limit(5).all()
-            
-            # Determine user type context
-            user_context = self._get_user_context(user)
-            
-            # Extract wellness data from cycle logs (mood, sleep, stress, exercise, energy)
-            wellness_patterns = self._analyze_wellness_data(cycle_logs)
-            
-            # Fetch available health providers for recommendations (eagerly load user relationship)
-            from app.models import HealthProvider
-            from sqlalchemy.orm import joinedload
-            available_providers = (
-                HealthProvider.query
-                .options(joinedload(HealthProvider.user))
-                .filter_by(is_verified=True)
-                .limit(5)
-                .all()
-            )
-            
-            return {
-                'success': True,
-                'data': {
-                    'user': {
-                        'id': user.id,
-                        'name': user.name,
-                        'user_type': user.user_type,
-                        'age_context': user_context['age_context'],
-                        'relationship_context': user_context['relationship_context']
-                    },
-                    'cycle_analysis': cycle_analysis,
-                    'wellness_patterns': wellness_patterns,
-                    'cycle_logs': [{
-                        'start_date': log.start_date.isoformat() if log.start_date else None,
-                        'end_date': log.end_date.isoformat() if log.end_date else None,
-                        'cycle_length': log.cycle_length,
-                        'period_length': log.period_length,
-                        'flow_intensity': log.flow_intensity,
-                        'symptoms': log.symptoms,
-                        'mood': log.mood,
-                        'energy_level': log.energy_level,
-                        'sleep_quality': log.sleep_quality,
-                        'stress_level': log.stress_level,
-                        'exercise_activities': log.exercise_activities,
-                        'notes': log.notes
-                    } for log in cycle_logs],
-                    'meal_logs': [{
-                        'meal_type': log.meal_type,
-                        'meal_time': log.meal_time.isoformat() if log.meal_time else None,
-                        'description': log.description,
-                        'calories': log.calories,
-                        'protein': log.protein,
-                        'carbs': log.carbs,
-                        'fat': log.fat
-                    } for log in meal_logs],
-                    'appointments': [{
-                        'appointment_date': apt.appointment_date.isoformat() if apt.appointment_date else None,
-                        'issue': apt.issue,
-                        'status': apt.status,
-                        'priority': apt.priority,
-                        'notes': apt.notes
-                    } for apt in appointments],
-                    'available_providers': [{
-                        'id': p.id,
-                        'name': p.user.name if p.user else 'Unknown',
-                        'specialization': p.specialization,
-                        'clinic': p.clinic_name,
-                        'is_verified': p.is_verified
-                    } for p in available_providers]
-                }
-            }
+            return {'success': True, 'data': user_data}
             
         except Exception as e:
             logger.error(f"Error fetching user data for {user_id}: {str(e)}")
             return {'success': False, 'error': 'Failed to fetch user data'}
     
+    def _fetch_users_data(self, user_ids: List[int], timer: Optional[StageTimer] = None) -> Dict[int, Dict[str, Any]]:
+        """
+        Prompt inputs for a batch of users, keyed by user id. Users that don't exist are left out.
+        
+        Whatever the batch size this is at most six queries (users, cycle logs, meals,
+        appointments, adolescent and parent context) plus the provider list every few
+        minutes. Stage times go to ``timer``: load, cycle_analysis, assemble.
+        """
+        timer = timer or StageTimer('insight_context')
+        with timer.stage('load'):
+            users = User.query.filter(User.id.in_(user_ids)).all()
+            if not users:
+                return {}
+            loaded = self._load_prompt_rows(users)
+        
+        with timer.stage('cycle_analysis'):
+            cycle_analyses = {
+                user.id: self._get_cached_cycle_analysis(user.id, loaded['cycle_logs'].get(user.id, []))
+                for user in users
+            }
+        
+        with timer.stage('assemble'):
+            return {
+                user.id: self._assemble_user_data(
+                    user,
+                    loaded['contexts'][user.id],
+                    cycle_analyses[user.id],
+                    loaded['cycle_logs'].get(user.id, []),
+                    loaded['meal_logs'].get(user.id, []),
+                    loaded['appointments'].get(user.id, []),
+                    loaded['providers']
+                ) for user in users
+            }
+    
+    def _load_prompt_rows(self, users: List[User]) -> Dict[str, Any]:
+        """Rows behind the prompts of ``users``, one query per table"""
+        ids = [user.id for user in users]
+        now = datetime.utcnow()
+        
+        # Get recent cycle logs (last 3 months, newest 10 per user)
+        cycle_logs_by_user = self._group_recent(
+            CycleLog.query.filter(
+                CycleLog.user_id.in_(ids),
+                CycleLog.created_at >= now - timedelta(days=90)
+            ).order_by(CycleLog.start_date.desc()),
+            10
+        )
+        
+        # Get recent meal logs (last 30 days, newest 20 per user)
+        meal_logs_by_user = self._group_recent(
+            MealLog.query.filter(
+                MealLog.user_id.in_(ids),
+                MealLog.created_at >= now - timedelta(days=30)
+            ).order_by(MealLog.meal_time.desc()),
+            20
+        )
+        
+        # Get recent appointments (last 60 days, newest 5 per user)
+        appointments_by_user = self._group_recent(
+            Appointment.query.filter(
+                Appointment.user_id.in_(ids),
+                Appointment.created_at >= now - timedelta(days=60)
+            ).order_by(Appointment.created_at.desc()),
+            5
+        )
+        
+        return {
+            'cycle_logs': cycle_logs_by_user,
+            'meal_logs': meal_logs_by_user,
+            'appointments': appointments_by_user,
+            # Determine user type context
+            'contexts': self._get_user_contexts(users),
+            'providers': self._get_verified_providers(),
+        }
+    
+    def _get_verified_providers(self) -> List[Dict[str, Any]]:
+        """Verified health providers for recommendations, shared by every prompt for a few minutes"""
+        providers = _verified_providers.get('verified')
+        if providers is not None:
+            return providers
+        
+        # Eagerly load user relationship
+        from app.models import HealthProvider
+        from sqlalchemy.orm import joinedload
+        providers = [{
+            'id': p.id,
+            'name': p.user.name if p.user else 'Unknown',
+            'specialization': p.specialization,
+            'clinic': p.clinic_name,
+            'is_verified': p.is_verified
+        } for p in (
+            HealthProvider.query
+            .options(joinedload(HealthProvider.user))
+            .filter_by(is_verified=True)
+            .limit(5)
+            .all()
+        )]
+        _verified_providers.set('verified', providers)
+        return providers
+    
+    def _get_cached_cycle_analysis(self, user_id: int, cycle_logs: List[CycleLog]) -> Dict[str, Any]:
+        """Advanced cycle analysis, recomputed only when the user's logs change or the day turns"""
+        signature = hashlib.sha1(repr([
+            (log.id, log.updated_at) for log in cycle_logs
+        ]).encode('utf-8')).hexdigest()
+        key = f"{user_id}:{datetime.utcnow().date().isoformat()}:{signature}"
+        analysis = _cycle_analyses.get(key)
+        if analysis is None:
+            analysis = self._get_advanced_cycle_analysis(user_id, cycle_logs)
+            _cycle_analyses.set(key, analysis)
+        return analysis
+    
+    def _assemble_user_data(self, user: User, user_context: Dict[str, str], cycle_analysis: Dict[str, Any],
+                            cycle_logs: List[CycleLog], meal_logs: list, appointments: list,
+                            available_providers: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Prompt inputs for one user from already loaded rows"""
+        return {
+            'user': {
+                'id': user.id,
+                'name': user.name,
+                'user_type': user.user_type,
+                'age_context': user_context['age_context'],
+                'relationship_context': user_context['relationship_context']
+            },
+            # Advanced cycle analysis from cycle_logs engine
+            'cycle_analysis': cycle_analysis,
+            # Extract wellness data from cycle logs (mood, sleep, stress, exercise, energy)
+            'wellness_patterns': self._analyze_wellness_data(cycle_logs),
+            'cycle_logs': [{
+                'start_date': log.start_date.isoformat() if log.start_date else None,
+                'end_date': log.end_date.isoformat() if log.end_date else None,
+                'cycle_length': log.cycle_length,
+                'period_length': log.period_length,
+                'flow_intensity': log.flow_intensity,
+                'symptoms': log.symptoms,
+                'mood': log.mood,
+                'energy_level': log.energy_level,
+                'sleep_quality': log.sleep_quality,
+                'stress_level': log.stress_level,
+                'exercise_activities': log.exercise_activities,
+                'notes': log.notes
+            } for log in cycle_logs],
+            'meal_logs': [{
+                'meal_type': log.meal_type,
+                'meal_time': log.meal_time.isoformat() if log.meal_time else None,
+                'description': log.description,
+                'calories': log.calories,
+                'protein': log.protein,
+                'carbs': log.carbs,
+                'fat': log.fat
+            } for log in meal_logs],
+            'appointments': [{
+                'appointment_date': apt.appointment_date.isoformat() if apt.appointment_date else None,
+                'issue': apt.issue,
+                'status': apt.status,
+                'priority': apt.priority,
+                'notes': apt.notes
+            } for apt in appointments],
+            'available_providers': available_providers
+        }
+    
+    @staticmethod
+    def _group_recent(query, per_user: int) -> Dict[int, list]:
+        """Split an ordered multi-user query into per-user lists of at most ``per_user`` rows"""
+        grouped: Dict[int, list] = {}
+        for row in query.all():
+            rows = grouped.setdefault(row.user_id, [])
+            if len(rows) < per_user:
+                rows.append(row)
+        return grouped
+    
     def _get_user_context(self, user: User) -> Dict[str, str]:
         """Get additional context about the user for better insights"""
-        context = {
-            'age_context': 'adult',  # Default
-            'relationship_context': 'individual'  # Default
+        return self._get_user_contexts([user])[user.id]
+    
+    def _get_user_contexts(self, users: List[User]) -> Dict[int, Dict[str, str]]:
+        """User context for a batch of users, keyed by user id"""
+        from sqlalchemy import func
+        
+        contexts = {
+            user.id: {
+                'age_context': 'adult',  # Default
+                'relationship_context': 'individual'  # Default
+            } for user in users
         }
         
         try:
-            if user.user_type == 'adolescent':
-                adolescent = Adolescent.query.filter_by(user_id=user.id).first()
-                if adolescent and adolescent.date_of_birth:
-                    age = datetime.utcnow().year - adolescent.date_of_birth.year
-                    if age < 16:
-                        context['age_context'] = 'young_adolescent'
-                    elif age < 20:
-                        context['age_context'] = 'adolescent'
-                
-                # Check if adolescent has parent relationship
-                parent_relation = ParentChild.query.filter_by(adolescent_id=adolescent.id).first()
-                if parent_relation:
-                    context['relationship_context'] = 'has_parent_support'
-            
-            elif user.user_type == 'parent':
-                parent = Parent.query.filter_by(user_id=user.id).first()
-                if parent:
-                    children_count = len(parent.children)
-                    context['relationship_context'] = f'parent_of_{children_count}_children'
+            adolescent_ids = [user.id for user in users if user.user_type == 'adolescent']
+            if adolescent_ids:
+                # Date of birth and parent links in one query
+                rows = (
+                    db.session.query(Adolescent.user_id, Adolescent.date_of_birth, func.count(ParentChild.id))
+                    .outerjoin(ParentChild, ParentChild.adolescent_id == Adolescent.id)
+                    .filter(Adolescent.user_id.in_(adolescent_ids))
+                    .group_by(Adolescent.id, Adolescent.user_id, Adolescent.date_of_birth)
+                    .all()
+                )
+                for adolescent_user_id, date_of_birth, parent_links in rows:
+                    context = contexts[adolescent_user_id]
+                    if date_of_birth:
+                        age = datetime.utcnow().year - date_of_birth.year
+                        if age < 16:
+                            context['age_context'] = 'young_adolescent'
+                        elif age < 20:
+                            context['age_context'] = 'adolescent'
+                    
+                    # Check if adolescent has parent relationship
+                    if parent_links:
+                        context['relationship_context'] = 'has_parent_support'
+            
+            parent_ids = [user.id for user in users if user.user_type == 'parent']
+            if parent_ids:
+                rows = (
+                    db.session.query(Parent.user_id, func.count(ParentChild.id))
+                    .outerjoin(ParentChild, ParentChild.parent_id == Parent.id)
+                    .filter(Parent.user_id.in_(parent_ids))
+                    .group_by(Parent.user_id)
+                    .all()
+                )
+                for parent_user_id, children_count in rows:
+                    contexts[parent_user_id]['relationship_context'] = f'parent_of_{children_count}_children'
                     
         except Exception as e:
-            logger.warning(f"Could not determine user context for {user.id}: {str(e)}")
+            logger.warning(f"Could not determine user context for {[user.id for user in users]}: {str(e)}")
             
-        return context
+        return contexts
     
     def _get_advanced_cycle_analysis(self, user_id: int, cycle_logs: List[CycleLog]) -> Dict[str, Any]:
         """Get advanced cycle analysis using CyclePredictionEngine from cycle_logs route"""
@@ -493,17 +1035,6 @@ class KinyarwandaInsightService:
                     apt_summary += f"Recent health concerns: {', '.join(issues[:3])}. "
             data_summary.append(apt_summary)
         
-        # Provider recommendations section
-        provider_section = ""
-        if available_providers:
-            provider_list = []
-            for p in available_providers[:5]:
-                clinic = p.get('clinic', '') or ''
-                spec = p.get('specialization', 'General') or 'General'
-                provider_list.append(f"- {p['name']} ({spec}, {clinic})")
-            provider_section = "\n\nAvailable Verified Health Providers (recommend these if consultation needed):\n"
-            provider_section += "\n".join(provider_list)
-        
         # Build text variables (avoid backslash in f-string for Python 3.10 compat)
         if data_summary:
             summary_text = ' '.join(data_summary)
@@ -513,55 +1044,23 @@ class KinyarwandaInsightService:
             summary_text = 'Limited health data available for comprehensive insights.'
         rec_text = '\n'.join(recommendations) if recommendations else ''
         
-        if language == 'kinyarwanda':
-            base_prompt = f"""Wowe uri umuganga w'abagore mu Rwanda ukoresha tekinoroji igezweho (AI/ML) kugira ngo ufashe abagore n'abakobwa gukurikirana ubuzima bwabo. Ugomba gutanga inyunganizi ku buzima mu Kinyarwanda ku buryo bworoshye, bushimishije kandi bwizewe.
-
-Amakuru y'umukiriya:
-- Izina: {user_info['name']}
-- Ubwoko bw'ukoresha: {user_info['user_type']}
-- Imiterere y'imyaka: {user_info['age_context']}
-- Aho aherereye: {user_info['relationship_context']}
-
-Amakuru y'ubuzima yashyizwe mu sisitemu y'ubwenge bwa machine learning:
-{summary_text}
-
-{rec_text}
-{provider_section}
-
-Ugomba gutanga inyunganizi zishingiye ku makuru y'ubwenge bwa machine learning (ML):
-1. **Inyunganizi ku buzima** - Sobanura uko ubuzima bwe bwifashe nk'uko isesengura rya ML rigaragaza, mvuge ku regularity, trends, na patterns zabonwemo. Koresha amakuru ya wellness (imiterere y'ibitekerezo, ibipimo by'inkomere, ibiryo) kugirango ugire inama nziza.
-2. **Icyo wakora** - Tanga inama eshatu (3) zifatika zishingiye ku makuru ya ML (cycle predictions, anomaly detection, wellness patterns). Ongeramo ibyo kurya byo mu Rwanda nka dodo, ibijumba, ibishyimbo, avoka.
-3. **Amagambo y'ihumure** - Andika ubutumwa bushimishije no gushimangira, wishingire ku myumvire nziza ya ML ku buzima bwe
-
-Nyandiko ibikurikira mu Kinyarwanda rwiza, gukoresha amagambo yoroshye kandi ukaba ufite impuhwe. Ntukavuge izina ry'umukiriya mu gisubizo. Koresha imvugo nziza kandi ishimishije. Shyira imbere amakuru ya ML kugira ngo inama zawe zibeho precision."""
-
-        else:  # English
-            base_prompt = f"""You are a compassionate women's health advisor in Rwanda who uses advanced AI/ML technology to help women and girls track their health. Provide personalized health insights in clear, encouraging, and trustworthy English.
-
-User Information:
-- Name: {user_info['name']}
-- User Type: {user_info['user_type']}
-- Age Context: {user_info['age_context']}
-- Relationship Context: {user_info['relationship_context']}
-
-Health Data Summary with ML Analysis:
-{summary_text}
-
-{rec_text}
-{provider_section}
-
-Please provide ML-enhanced insights:
-1. **Health Insight** - Explain what the ML analysis shows about their wellbeing, including cycle regularity, trends, patterns, predictions, and wellness observations (mood, stress, sleep, energy, exercise)
-2. **What to do next** - Give three (3) practical, culturally-appropriate recommendations based on ML insights (cycle predictions, anomaly detection, wellness patterns). Include local Rwandan foods (dodo, sweet potatoes, black beans, avocados) in nutrition recommendations.
-3. **Words of encouragement** - Write an encouraging and affirming message that acknowledges the ML insights about their health patterns
-
-If you detect any health concerns (anomalies, irregular patterns, high stress, poor sleep), gently recommend consulting one of the available verified health providers listed above.
-Write in clear, simple English using compassionate language. Do not mention the user's name directly in the response. Use supportive and positive tone. Emphasize the ML-powered insights for precision and accuracy."""
-
-        return base_prompt
+        # Provider recommendations section (same for every user, rendered once)
+        provider_section = _render_provider_section(tuple(
+            (p['name'], p.get('specialization', 'General') or 'General', p.get('clinic', '') or '')
+            for p in available_providers[:5]
+        ))
+        
+        return _render_prompt(language, {
+            'user_type': user_info['user_type'],
+            'age_context': user_info['age_context'],
+            'relationship_context': user_info['relationship_context'],
+            'summary_text': summary_text,
+            'rec_text': rec_text,
+            'provider_section': provider_section,
+        })
     
     def _call_gemini_api(self, prompt: str) -> Dict[str, Any]:
-        """Make API call to Gemini 2.0 Flash"""
+        """Make API call to Gemini through the shared pooled client"""
         if not self.google_api_key:
             return {
                 'success': False,
@@ -569,62 +1068,30 @@ Write in clear, simple English using compassionate language. Do not mention the
             }
         
         try:
-            headers = {
-                'Content-Type': 'application/json',
-                'X-goog-api-key': self.google_api_key
-            }
-            
-            payload = {
-                "contents": [{
-                    "parts": [{
-                        "text": prompt
-                    }]
-                }],
-                "generationConfig": {
-                    "temperature": 0.7,
-                    "topK": 40,
-                    "topP": 0.95,
-                    "maxOutputTokens": 1024
-                }
-            }
-            
-            response = requests.post(
-                self.gemini_endpoint,
-                headers=headers,
-                json=payload,
-                timeout=30
+            result = gemini_client.generate(
+                prompt,
+                self.google_api_key,
+                model=self.gemini_model,
+                generation_config=INSIGHT_GENERATION_CONFIG,
+                endpoint='insights',
             )
-            
-            if response.status_code == 200:
-                data = response.json()
-                if 'candidates' in data and data['candidates']:
-                    content = data['candidates'][0]['content']['parts'][0]['text']
-                    return {
-                        'success': True,
-                        'data': content
-                    }
-                else:
-                    return {
-                        'success': False,
-                        'error': 'No content generated by AI'
-                    }
-            else:
-                logger.error(f"Gemini API error: {response.status_code} - {response.text}")
-                return {
-                    'success': False,
-                    'error': f'AI service error: {response.status_code}'
-                }
-                
-        except requests.exceptions.Timeout:
+            return {
+                'success': True,
+                'data': result['text']
+            }
+        
+        except CircuitOpenError:
             return {
                 'success': False,
-                'error': 'AI service timeout. Please try again.'
+                'degraded': True,
+                'error': 'AI service is temporarily unavailable. Please try again shortly.'
             }
-        except Exception as e:
-            logger.error(f"Gemini API call failed: {str(e)}")
+        except LLMError as e:
+            logger.error(f"Gemini API call failed: {e} {(e.body or '')[:500]}")
             return {
                 'success': False,
-                'error': 'Failed to connect to AI service'
+                'degraded': e.status is None or e.status >= 429,
+                'error': str(e) if e.status else 'Failed to connect to AI service'
             }
     
     def _parse_ai_response(self, ai_content: str, language: str) -> Dict[str, Any]:
@@ -755,42 +1222,76 @@ Write in clear, simple English using compassionate language. Do not mention the
                     'generated_at': datetime.utcnow().isoformat()
                 }
     
-    def _get_cached_insight(self, user_id: int, language: str) -> Optional[Dict[str, Any]]:
-        """Check if we have a cached insight for the user"""
+    def _fingerprint(self, prompt: str, language: str) -> str:
+        """Content address of an insight: everything that decides what Gemini is asked"""
+        key = f"{PROMPT_VERSION}\n{self.gemini_model}\n{language}\n{prompt}"
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+    
+    def _get_cached_insight(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """Check the in-process LRU, then insight_cache, for an insight with this fingerprint"""
+        insight = _recent_insights.get(fingerprint)
+        if insight is not None:
+            return insight
         try:
-            cached_insight = InsightCache.get_valid_cache(user_id, language)
+            cached_insight = InsightCache.get_by_fingerprint(fingerprint)
+            record_cache_access('insight_cache', cached_insight is not None)
             if cached_insight:
-                logger.info(f"Returning cached insight for user {user_id} in {language}")
-                return json.loads(cached_insight.insight_data)
+                logger.info(f"Returning cached insight {fingerprint[:12]} (generated for user {cached_insight.user_id})")
+                insight = json.loads(cached_insight.insight_data)
+                _recent_insights.set(fingerprint, insight)
+                return insight
             return None
         except Exception as e:
-            logger.error(f"Error checking cache for user {user_id}: {str(e)}")
+            logger.error(f"Error checking cache for fingerprint {fingerprint[:12]}: {str(e)}")
             return None
     
-    def _cache_insight(self, user_id: int, insight: Dict[str, Any], language: str) -> None:
-        """Cache the generated insight"""
+    def _get_stale_insight(self, user_id: int, language: str) -> Optional[Dict[str, Any]]:
+        """Newest cached insight for the user regardless of expiry"""
         try:
-            # Remove any existing cache for this user and language
-            existing_cache = InsightCache.query.filter_by(
+            newest = InsightCache.query.filter_by(
                 user_id=user_id,
                 language=language
-            ).all()
-            
-            for cache in existing_cache:
-                db.session.delete(cache)
-            
-            # Create new cache entry
-            new_cache = InsightCache(
-                user_id=user_id,
-                language=language,
-                insight_data=json.dumps(insight),
-                cache_hours=self.cache_duration_hours
+            ).order_by(InsightCache.created_at.desc()).first()
+            return json.loads(newest.insight_data) if newest else None
+        except Exception as e:
+            logger.error(f"Error reading stale cache for user {user_id}: {str(e)}")
+            return None
+    
+    def _cache_insight(self, user_id: int, insight: Dict[str, Any], language: str, fingerprint: Optional[str] = None) -> None:
+        """Cache the generated insight, replacing the user's previous one for this language"""
+        try:
+            InsightCache.upsert(
+                user_id,
+                language,
+                json.dumps(insight),
+                cache_hours=self.cache_duration_hours,
+                fingerprint=fingerprint
             )
-            
-            db.session.add(new_cache)
-            db.session.commit()
+            if fingerprint:
+                _recent_insights.set(fingerprint, insight)
+                _user_fingerprints.set((user_id, language), fingerprint)
             
             logger.info(f"Cached insight for user {user_id} in {language} (valid for {self.cache_duration_hours}h)")
         except Exception as e:
             logger.error(f"Error caching insight for user {user_id}: {str(e)}")
-            db.session.rollback()
\ No newline at end of file
+            db.session.rollback()
+    
+    def _keep_for_user(self, user_id: int, insight: Dict[str, Any], language: str, fingerprint: str) -> None:
+        """Make the caller's own (user, language) row hold ``fingerprint``.
+        
+        Rows are one per (user, language), so an insight shared from another
+        user's row vanishes as soon as that user's data changes unless the
+        caller keeps a copy.
+        """
+        if _user_fingerprints.get((user_id, language)) == fingerprint:
+            return
+        try:
+            own = InsightCache.get_valid_cache(user_id, language)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error reading cached insight for user {user_id}: {str(e)}")
+            return
+        if own is not None and own.fingerprint == fingerprint:
+            _user_fingerprints.set((user_id, language), fingerprint)
+            return
+        self._cache_insight(user_id, insight, language, fingerprint)
\ No newline at end of file
@@ -0,0 +1,389 @@
+"""
+Shared HTTP client for Gemini calls.
+
+Every caller used to ``requests.post`` on its own, paying a fresh TCP+TLS
+handshake per call with no retry and no protection when Gemini is slow or
+down. ``gemini_client`` gives them:
+
+- one keep-alive connection pool per worker process,
+- a concurrency limit per endpoint (``LLM_MAX_CONCURRENCY``), so a burst of
+  insight requests cannot tie up every request thread waiting on Gemini,
+- bounded retries with full-jitter backoff on connection errors, 429 and 5xx
+  (``Retry-After`` is honoured, within limits),
+- a circuit breaker per endpoint: after ``LLM_BREAKER_FAILURES`` consecutive
+  failures calls fail fast with ``CircuitOpenError`` for
+  ``LLM_BREAKER_COOLDOWN`` seconds, then one trial call is let through.
+  Callers catch ``LLMError`` and fall back to cached or rule-based content,
+- latency, outcome and token counts in the performance collector, and a
+  row per call in the ``llm_usage`` ledger charged to the attributed user
+  (see ``app.services.llm_usage``).
+
+``GEMINI_API_BASE`` points the client at another server (a local fake in tests).
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+from flask import current_app, has_app_context
+from requests.adapters import HTTPAdapter
+
+from app.services import llm_usage
+from app.utils.performance import performance_stats
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_BASE = 'https://generativelanguage.googleapis.com/v1beta'
+DEFAULT_MODEL = 'gemini-2.5-flash'
+
+DEFAULTS = {
+    'LLM_MAX_CONCURRENCY': 4,
+    'LLM_QUEUE_TIMEOUT': 5.0,
+    'LLM_CONNECT_TIMEOUT': 5.0,
+    'LLM_READ_TIMEOUT': 30.0,
+    'LLM_STREAM_READ_TIMEOUT': 120.0,
+    'LLM_MAX_RETRIES': 2,
+    'LLM_RETRY_BASE_SECONDS': 0.5,
+    'LLM_BREAKER_FAILURES': 5,
+    'LLM_BREAKER_COOLDOWN': 30.0,
+}
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+MAX_RETRY_AFTER_SECONDS = 5.0
+
+
+class LLMError(Exception):
+    def __init__(self, message, status=None, retryable=False, body=None):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+        self.body = body
+        self.retries = 0
+
+
+class CircuitOpenError(LLMError):
+    """The endpoint failed repeatedly; calls are short-circuited until the cooldown ends."""
+
+
+def _setting(name):
+    if has_app_context():
+        return current_app.config.get(name, DEFAULTS[name])
+    return DEFAULTS[name]
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with a single half-open trial call."""
+
+    def __init__(self, name):
+        self.name = name
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < _setting('LLM_BREAKER_COOLDOWN'):
+            return 'open'
+        return 'half_open'
+
+    def before_call(self):
+        """Admit a call; returns True when it is the half-open trial."""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return False
+            if state == 'half_open' and not self._trial_running:
+                self._trial_running = True
+                return True
+        raise CircuitOpenError(f"{self.name}: upstream degraded, try again shortly")
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def end_trial(self):
+        """Trial ended without a verdict (a cancelled stream): let the next call try again."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= _setting('LLM_BREAKER_FAILURES'):
+                if self.opened_at is None or self._trial_running:
+                    logger.warning(f"LLM circuit for {self.name} opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+
+def _usage(payload):
+    usage = (payload or {}).get('usageMetadata') or {}
+    return usage.get('promptTokenCount', 0), usage.get('candidatesTokenCount', 0), usage.get('cachedContentTokenCount', 0)
+
+
+def _candidate_text(payload):
+    parts = []
+    for candidate in (payload or {}).get('candidates') or []:
+        for part in (candidate.get('content') or {}).get('parts') or []:
+            if part.get('text'):
+                parts.append(part['text'])
+    return ''.join(parts)
+
+
+class GeminiClient:
+    """Pooled, rate-limited, retrying Gemini client (one per process, see ``gemini_client``)."""
+
+    def __init__(self):
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._breakers = {}
+
+    # ── Plumbing ──────────────────────────────────────────────────────────
+
+    def _get_session(self):
+        pid = os.getpid()
+        if self._session is None or self._pid != pid:
+            with self._lock:
+                if self._session is None or self._pid != pid:
+                    pool_size = max(_setting('LLM_MAX_CONCURRENCY') * 2, 10)
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+                    self._pid = pid
+        return self._session
+
+    def _semaphore(self, endpoint):
+        with self._lock:
+            semaphore = self._semaphores.get(endpoint)
+            if semaphore is None:
+                semaphore = self._semaphores[endpoint] = threading.BoundedSemaphore(_setting('LLM_MAX_CONCURRENCY'))
+            return semaphore
+
+    def breaker(self, endpoint):
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = self._breakers[endpoint] = CircuitBreaker(endpoint)
+            return breaker
+
+    def is_available(self, endpoint):
+        """False while the endpoint's circuit is open (callers can skip straight to a fallback)."""
+        return self.breaker(endpoint).state != 'open'
+
+    def _url(self, model, method):
+        base = (current_app.config.get('GEMINI_API_BASE') if has_app_context() else None) or DEFAULT_API_BASE
+        return f"{base.rstrip('/')}/models/{model}:{method}"
+
+    def _post(self, url, api_key, payload, stream, read_timeout):
+        """POST with retries; returns the successful response (caller closes streams)."""
+        session = self._get_session()
+        headers = {'Content-Type': 'application/json', 'X-goog-api-key': api_key}
+        timeout = (_setting('LLM_CONNECT_TIMEOUT'), read_timeout)
+        max_retries = _setting('LLM_MAX_RETRIES')
+        base_delay = _setting('LLM_RETRY_BASE_SECONDS')
+
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                resp = session.post(url, headers=headers, json=payload, stream=stream, timeout=timeout)
+            except requests.ConnectTimeout as exc:
+                error = LLMError(f'Failed to connect to AI service: {exc}', retryable=True)
+            except requests.Timeout as exc:
+                # A read timeout already cost the full budget; do not spend it again
+                raise LLMError(f'AI service timeout: {exc}', retryable=False)
+            except requests.RequestException as exc:
+                error = LLMError(f'Failed to connect to AI service: {exc}', retryable=True)
+            else:
+                if resp.status_code == 200:
+                    return resp, attempt
+                body = resp.text
+                resp.close()
+                error = LLMError(
+                    f'AI service error: {resp.status_code}', status=resp.status_code,
+                    retryable=resp.status_code in RETRYABLE_STATUS, body=body,
+                )
+                retry_after = resp.headers.get('Retry-After')
+
+            if not error.retryable or attempt >= max_retries:
+                error.retries = attempt
+                raise error
+            delay = random.uniform(0, base_delay * 2 ** attempt)
+            if retry_after:
+                try:
+                    delay = max(delay, min(float(retry_after), MAX_RETRY_AFTER_SECONDS))
+                except ValueError:
+                    pass
+            time.sleep(delay)
+            attempt += 1
+
+    def _acquire(self, endpoint):
+        semaphore = self._semaphore(endpoint)
+        if not semaphore.acquire(timeout=_setting('LLM_QUEUE_TIMEOUT')):
+            performance_stats.record_llm_call(endpoint, 0.0, 'busy')
+            raise LLMError(f'{endpoint}: too many concurrent AI requests', status=503)
+        return semaphore
+
+    def _open_call(self, endpoint):
+        """Pass the breaker and take a concurrency slot; returns the slot to release
+        and whether this call is the breaker's half-open trial."""
+        breaker = self.breaker(endpoint)
+        if breaker.state == 'open':
+            performance_stats.record_llm_call(endpoint, 0.0, 'short_circuit')
+            raise CircuitOpenError(f"{endpoint}: upstream degraded, try again shortly")
+        semaphore = self._acquire(endpoint)
+        try:
+            trial = breaker.before_call()
+        except CircuitOpenError:
+            semaphore.release()
+            performance_stats.record_llm_call(endpoint, 0.0, 'short_circuit')
+            raise
+        return semaphore, trial
+
+    @staticmethod
+    def _record_error(breaker, error):
+        # 4xx other than 429 is our request's fault, not the upstream's health
+        if error.status is None or error.status in RETRYABLE_STATUS:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+    # ── Public API ────────────────────────────────────────────────────────
+
+    def generate(self, contents, api_key, model=DEFAULT_MODEL, generation_config=None, endpoint='gemini'):
+        """Non-streaming generateContent; returns ``{'text', 'prompt_tokens', 'output_tokens'}``.
+
+        ``contents`` is a prompt string or a list of Gemini chat turns. Raises
+        ``LLMError`` (``CircuitOpenError`` when short-circuited).
+        """
+        if isinstance(contents, str):
+            contents = [{'parts': [{'text': contents}]}]
+        payload = {'contents': contents}
+        if generation_config:
+            payload['generationConfig'] = generation_config
+
+        breaker = self.breaker(endpoint)
+        semaphore, trial = self._open_call(endpoint)
+        started = time.perf_counter()
+        retries = 0
+        try:
+            resp, retries = self._post(self._url(model, 'generateContent'), api_key, payload, False,
+                                       _setting('LLM_READ_TIMEOUT'))
+            try:
+                data = resp.json()
+            except ValueError:
+                raise LLMError('AI service returned invalid JSON')
+        except LLMError as exc:
+            self._record_error(breaker, exc)
+            duration_ms = (time.perf_counter() - started) * 1000
+            performance_stats.record_llm_call(endpoint, duration_ms, 'error', retries=exc.retries)
+            llm_usage.record_call(endpoint, model, 'error', duration_ms)
+            raise
+        except BaseException:
+            if trial:
+                breaker.end_trial()
+            raise
+        finally:
+            semaphore.release()
+
+        breaker.record_success()
+        prompt_tokens, output_tokens, cached_tokens = _usage(data)
+        duration_ms = (time.perf_counter() - started) * 1000
+        performance_stats.record_llm_call(
+            endpoint, duration_ms, 'ok', prompt_tokens, output_tokens, retries, cached_tokens,
+        )
+        llm_usage.record_call(endpoint, model, 'ok', duration_ms, prompt_tokens, output_tokens, cached_tokens)
+        text = _candidate_text(data)
+        if not text:
+            raise LLMError('No content generated by AI')
+        return {'text': text, 'prompt_tokens': prompt_tokens, 'output_tokens': output_tokens}
+
+    def stream(self, contents, api_key, model=DEFAULT_MODEL, generation_config=None, endpoint='gemini_stream',
+               usage=None, system_instruction=None):
+        """Server-sent streamGenerateContent; yields text chunks.
+
+        Retries only happen before the first byte. Errors raise ``LLMError``.
+        When given, the ``usage`` dict receives ``prompt_tokens``,
+        ``output_tokens`` and ``cached_tokens`` once the stream ends.
+        """
+        if isinstance(contents, str):
+            contents = [{'parts': [{'text': contents}]}]
+        payload = {'contents': contents}
+        if generation_config:
+            payload['generationConfig'] = generation_config
+        if system_instruction:
+            payload['systemInstruction'] = {'parts': [{'text': system_instruction}]}
+
+        breaker = self.breaker(endpoint)
+        semaphore, trial = self._open_call(endpoint)
+        started = time.perf_counter()
+        retries = 0
+        prompt_tokens = output_tokens = cached_tokens = 0
+        outcome = 'error'
+        try:
+            try:
+                resp, retries = self._post(self._url(model, 'streamGenerateContent') + '?alt=sse', api_key,
+                                           payload, True, _setting('LLM_STREAM_READ_TIMEOUT'))
+            except LLMError as exc:
+                retries = exc.retries
+                self._record_error(breaker, exc)
+                raise
+
+            with resp:
+                try:
+                    for line in resp.iter_lines(decode_unicode=True):
+                        if not line or not line.startswith('data: '):
+                            continue
+                        data = line[6:].strip()
+                        if data == '[DONE]':
+                            break
+                        try:
+                            chunk = json.loads(data)
+                        except json.JSONDecodeError:
+                            continue
+                        if chunk.get('error'):
+                            breaker.record_failure()
+                            raise LLMError(chunk['error'].get('message', 'Gemini stream error'))
+                        if chunk.get('usageMetadata'):
+                            prompt_tokens, output_tokens, cached_tokens = _usage(chunk)
+                        text = _candidate_text(chunk)
+                        if text:
+                            yield text
+                except requests.RequestException as exc:
+                    breaker.record_failure()
+                    raise LLMError(f'Network error contacting Gemini: {exc}')
+
+            breaker.record_success()
+            outcome = 'ok'
+        except GeneratorExit:
+            # Client went away mid-stream; the upstream was fine
+            outcome = 'cancelled'
+            raise
+        finally:
+            semaphore.release()
+            if trial:
+                # Whatever the exit, never leave the breaker waiting on a trial that is over
+                breaker.end_trial()
+            if usage is not None:
+                usage.update(prompt_tokens=prompt_tokens, output_tokens=output_tokens, cached_tokens=cached_tokens)
+            duration_ms = (time.perf_counter() - started) * 1000
+            performance_stats.record_llm_call(
+                endpoint, duration_ms, outcome, prompt_tokens, output_tokens, retries, cached_tokens,
+            )
+            llm_usage.record_call(endpoint, model, outcome, duration_ms, prompt_tokens, output_tokens, cached_tokens)
+
+
+gemini_client = GeminiClient()
@@ -0,0 +1,237 @@
+"""
+Gemini usage accounting and per-user quotas.
+
+Every upstream call made by ``gemini_client`` is attributed to the user the
+request is for (``attribute(...)`` around the work; the attribution follows
+the call onto worker threads when the context is copied there) and lands in
+the ``llm_usage`` ledger through a BufferedWriter: tokens in/out, cached
+prompt tokens, latency and outcome. Insight requests answered from the cache
+are recorded too (``cache_hit``), so the admin report shows hit rates next to
+spend.
+
+Quotas are token buckets per user, sized by role (``LLM_QUOTAS``): a call's
+tokens are charged when it ends, and a user whose bucket is empty gets a 429
+(chat) or the rule-based insight until it refills. Chat streams hold a
+request thread for as long as Gemini keeps talking, so each user may also
+hold at most ``LLM_MAX_STREAMS_PER_USER`` of them at once.
+"""
+
+import contextvars
+import json
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import func
+
+from app import db
+from app.models import LLMUsage, User
+from app.utils.buffered_writer import BufferedWriter
+from app.utils.kv_store import SharedKVStore, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+llm_usage_writer = BufferedWriter('llm_usage', LLMUsage.__table__, config_prefix='LLM_USAGE_LOG')
+
+# Role -> (bucket capacity in tokens, tokens refilled per hour); None is unlimited
+DEFAULT_QUOTAS = {
+    'adolescent': (40000, 20000),
+    'parent': (60000, 30000),
+    'health_provider': (100000, 50000),
+    'content_writer': (100000, 50000),
+    'admin': None,
+}
+DEFAULT_ROLE_QUOTA = (40000, 20000)
+DEFAULT_MAX_STREAMS_PER_USER = 2
+# A slot whose release was lost (worker killed mid-stream) frees itself after this
+STREAM_SLOT_TTL = 300
+
+_quota_store = SharedKVStore('llm_quota', default_ttl=24 * 3600, max_entries=50000)
+_buckets = TokenBucket(_quota_store)
+_stream_slots = SharedKVStore('llm_streams', default_ttl=STREAM_SLOT_TTL, max_entries=50000)
+
+# {'user_id', 'role', 'language'} for the work being done, or None
+_attribution = contextvars.ContextVar('llm_usage_attribution', default=None)
+
+
+def init_llm_usage(app):
+    """Start the background flusher for this process."""
+    llm_usage_writer.start(app)
+
+
+# ── Attribution ───────────────────────────────────────────────────────────
+
+def caller(user_id, language=None):
+    """Attribution for ``user_id``, with the role their quota is sized by."""
+    if user_id is None:
+        return None
+    user = db.session.get(User, int(user_id))
+    return {'user_id': int(user_id), 'role': user.user_type if user else None, 'language': language}
+
+
+@contextmanager
+def attribute(who):
+    """Charge Gemini calls made inside the block to ``who`` (see ``caller``)."""
+    token = _attribution.set(who)
+    try:
+        yield who
+    finally:
+        _attribution.reset(token)
+
+
+def current_attribution():
+    return _attribution.get()
+
+
+# ── Ledger ────────────────────────────────────────────────────────────────
+
+def _submit(endpoint, outcome, language=None, model=None, cache_hit=False, duration_ms=0.0,
+            prompt_tokens=0, output_tokens=0, cached_tokens=0):
+    # Unstarted (tests, scripts) would write through on the caller's session
+    # mid-request; the performance collector still has the call
+    if not llm_usage_writer.started:
+        return
+    who = current_attribution() or {}
+    # Every row carries every column: a batch is one multi-row INSERT
+    llm_usage_writer.submit({
+        'user_id': who.get('user_id'),
+        'role': who.get('role'),
+        'endpoint': endpoint,
+        'language': language or who.get('language'),
+        'model': model,
+        'outcome': outcome,
+        'cache_hit': cache_hit,
+        'prompt_tokens': prompt_tokens or 0,
+        'output_tokens': output_tokens or 0,
+        'cached_tokens': cached_tokens or 0,
+        'duration_ms': round(duration_ms, 1),
+    })
+
+
+def record_call(endpoint, model, outcome, duration_ms, prompt_tokens=0, output_tokens=0, cached_tokens=0):
+    """Ledger row for one upstream call; its tokens are charged to the attributed user."""
+    who = current_attribution() or {}
+    tokens = (prompt_tokens or 0) + (output_tokens or 0)
+    if who.get('user_id') is not None and tokens:
+        quota = quota_for(who.get('role'))
+        if quota:
+            _buckets.charge(_bucket_key(who['user_id']), tokens, quota[0], quota[1] / 3600.0)
+    _submit(endpoint, outcome, model=model, duration_ms=duration_ms, prompt_tokens=prompt_tokens,
+            output_tokens=output_tokens, cached_tokens=cached_tokens)
+
+
+def record_cache_hit(endpoint, language=None):
+    """Ledger row for a request answered without calling Gemini."""
+    _submit(endpoint, 'cache_hit', language=language, cache_hit=True)
+
+
+# ── Quotas ────────────────────────────────────────────────────────────────
+
+def _bucket_key(user_id):
+    return f'user:{user_id}'
+
+
+def quotas():
+    """Role -> (capacity, refill per hour) after ``LLM_QUOTAS`` overrides."""
+    merged = dict(DEFAULT_QUOTAS)
+    raw = current_app.config.get('LLM_QUOTAS') if has_app_context() else None
+    if raw:
+        try:
+            overrides = json.loads(raw) if isinstance(raw, str) else raw
+            merged.update({role: tuple(quota) if quota else None for role, quota in overrides.items()})
+        except (ValueError, TypeError, AttributeError) as exc:
+            logger.warning(f"Ignoring malformed LLM_QUOTAS: {exc}")
+    return merged
+
+
+def quota_for(role):
+    if has_app_context() and not current_app.config.get('LLM_QUOTAS_ENABLED', True):
+        return None
+    return quotas().get(role, DEFAULT_ROLE_QUOTA)
+
+
+def check_quota(who=None):
+    """Seconds until ``who`` (default: the current attribution) may call Gemini again, or None."""
+    who = who if who is not None else current_attribution()
+    if not who or who.get('user_id') is None:
+        return None
+    quota = quota_for(who.get('role'))
+    if not quota:
+        return None
+    capacity, per_hour = quota
+    level = _buckets.level(_bucket_key(who['user_id']), capacity, per_hour / 3600.0)
+    if level > 0:
+        return None
+    if not per_hour:
+        return 3600
+    return int(-level * 3600 / per_hour) + 1
+
+
+def acquire_stream(user_id):
+    """Take one of the user's concurrent stream slots; False when all are in use."""
+    limit = current_app.config.get('LLM_MAX_STREAMS_PER_USER', DEFAULT_MAX_STREAMS_PER_USER)
+    if not limit:
+        return True
+    key = str(user_id)
+    if _stream_slots.incr(key, ttl=STREAM_SLOT_TTL) > limit:
+        release_stream(user_id)
+        return False
+    return True
+
+
+def release_stream(user_id):
+    key = str(user_id)
+    if _stream_slots.incr(key, -1, ttl=STREAM_SLOT_TTL) <= 0:
+        _stream_slots.delete(key)
+
+
+# ── Reporting ─────────────────────────────────────────────────────────────
+
+def usage_report(days=7, limit=20):
+    """Token spend, latency and cache hit rate over the last ``days``, by endpoint, language, role, user and day."""
+    since = datetime.utcnow() - timedelta(days=days)
+    calls = func.sum(db.case((LLMUsage.cache_hit.is_(False), 1), else_=0))
+    hits = func.sum(db.case((LLMUsage.cache_hit.is_(True), 1), else_=0))
+    columns = [
+        calls.label('calls'),
+        hits.label('cache_hits'),
+        func.coalesce(func.sum(LLMUsage.prompt_tokens), 0).label('prompt_tokens'),
+        func.coalesce(func.sum(LLMUsage.output_tokens), 0).label('output_tokens'),
+        func.coalesce(func.sum(LLMUsage.cached_tokens), 0).label('cached_tokens'),
+        func.avg(db.case((LLMUsage.cache_hit.is_(False), LLMUsage.duration_ms))).label('avg_duration_ms'),
+        func.sum(db.case((LLMUsage.outcome == 'error', 1), else_=0)).label('errors'),
+    ]
+
+    def row_dict(row):
+        calls_, hits_ = row.calls or 0, row.cache_hits or 0
+        return {
+            'calls': calls_,
+            'cache_hits': hits_,
+            'cache_hit_ratio': round(hits_ / (calls_ + hits_), 3) if calls_ + hits_ else None,
+            'errors': row.errors or 0,
+            'prompt_tokens': int(row.prompt_tokens),
+            'output_tokens': int(row.output_tokens),
+            'cached_tokens': int(row.cached_tokens),
+            'avg_duration_ms': round(row.avg_duration_ms, 1) if row.avg_duration_ms is not None else None,
+        }
+
+    def grouped(column, order_by_tokens=False):
+        query = db.session.query(column.label('key'), *columns).filter(LLMUsage.created_at >= since).group_by(column)
+        if order_by_tokens:
+            query = query.order_by(func.sum(LLMUsage.prompt_tokens + LLMUsage.output_tokens).desc()).limit(limit)
+        else:
+            query = query.order_by(column)
+        return [{'key': row.key, **row_dict(row)} for row in query.all()]
+
+    totals = db.session.query(*columns).filter(LLMUsage.created_at >= since).one()
+    return {
+        'days': days,
+        'since': since.isoformat(),
+        'totals': row_dict(totals),
+        'by_endpoint': grouped(LLMUsage.endpoint),
+        'by_language': grouped(LLMUsage.language),
+        'by_role': grouped(LLMUsage.role),
+        'top_users': grouped(LLMUsage.user_id, order_by_tokens=True),
+        'by_day': grouped(func.date(LLMUsage.created_at)),
+    }
@@ -266,6 +266,9 @@ class NotificationManager:
             is_read=False
         ).update({'is_read': True, 'read_at': now})
         db.session.commit()
+        # A bulk UPDATE fires no per-row events; drop the USSD menu's copy here
+        from app.ussd.notification_cache import invalidate_inbox
+        invalidate_inbox(user_id)
         return updated
 
     def delete(self, notification_id: int, user_id: int) -> bool:
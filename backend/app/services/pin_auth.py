@@ -0,0 +1,167 @@
+"""
+PIN hashing off the request thread.
+
+bcrypt at the default cost is ~250ms of CPU per check. Checks and new hashes
+run in a small process pool (``PIN_HASH_WORKERS``) so they neither hold the
+GIL nor serialise a worker's request threads; with no pool configured (tests,
+scripts) they run inline. Hashes whose cost differs from ``PIN_HASH_ROUNDS``
+are re-hashed after the next successful check.
+
+USSD sessions also get a signed credential after the first successful PIN
+entry. It proves the session is authenticated without a DB read, and a
+repeated PIN hop in the same session (gateway retry, re-entry) is checked
+against its HMAC instead of bcrypt.
+"""
+
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt as bcrypt_lib
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROUNDS = 12
+
+
+# ── Hashing primitives (run inside the pool) ─────────────────────────────
+
+def _check(pin, pin_hash):
+    try:
+        return bcrypt_lib.checkpw(pin.encode('utf-8'), pin_hash.encode('utf-8'))
+    except ValueError:
+        # Not a bcrypt hash
+        return False
+
+
+def _hash(pin, rounds):
+    return bcrypt_lib.hashpw(pin.encode('utf-8'), bcrypt_lib.gensalt(rounds)).decode('utf-8')
+
+
+class _HashPool:
+    """Process pool created lazily in each worker process."""
+
+    def __init__(self):
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get(self, workers):
+        pid = os.getpid()
+        if self._executor is None or self._pid != pid:
+            with self._lock:
+                if self._executor is None or self._pid != pid:
+                    self._executor = ProcessPoolExecutor(max_workers=workers)
+                    self._pid = pid
+        return self._executor
+
+    def run(self, fn, *args):
+        workers = current_app.config.get('PIN_HASH_WORKERS', 0)
+        if not workers:
+            return fn(*args)
+        try:
+            return self._get(workers).submit(fn, *args).result()
+        except BrokenProcessPool:
+            logger.warning("PIN hash pool broke; recreating it and hashing inline this time")
+            with self._lock:
+                self._executor = None
+            return fn(*args)
+
+
+_pool = _HashPool()
+
+
+def hash_rounds():
+    return current_app.config.get('PIN_HASH_ROUNDS', DEFAULT_ROUNDS)
+
+
+def check_pin(pin, pin_hash):
+    """bcrypt check in the hash pool."""
+    if not pin or not pin_hash:
+        return False
+    return _pool.run(_check, pin, pin_hash)
+
+
+def hash_pin(pin):
+    """New bcrypt hash at the configured cost, computed in the hash pool."""
+    return _pool.run(_hash, pin, hash_rounds())
+
+
+def needs_rehash(pin_hash):
+    """True when the hash was made with a different cost than PIN_HASH_ROUNDS."""
+    try:
+        return int(pin_hash.split('$')[2]) != hash_rounds()
+    except (AttributeError, IndexError, ValueError):
+        return False
+
+
+def verify_user_pin(user, pin, allow_password=True):
+    """Check a PIN against the user's pin_hash (and password_hash as a fallback).
+
+    A matching pin_hash made at an outdated cost is upgraded in place.
+    """
+    if user.enable_pin_auth and user.pin_hash and check_pin(pin, user.pin_hash):
+        if needs_rehash(user.pin_hash):
+            _upgrade_pin_hash(user, pin)
+        return True
+
+    return bool(allow_password and user.password_hash and check_pin(pin, user.password_hash))
+
+
+def _upgrade_pin_hash(user, pin):
+    try:
+        user.pin_hash = hash_pin(pin)
+        db.session.commit()
+    except Exception as exc:
+        db.session.rollback()
+        logger.warning(f"PIN hash upgrade failed for user {user.id}: {exc}")
+
+
+# ── Signed USSD session credential ───────────────────────────────────────
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='ussd-session')
+
+
+def _pin_digest(session_id, user_id, pin):
+    key = current_app.config['SECRET_KEY'].encode('utf-8')
+    message = f'{session_id}:{user_id}:{pin}'.encode('utf-8')
+    return hmac.new(key, message, hashlib.sha256).hexdigest()
+
+
+def issue_session_credential(session_id, user_id, expires_at, pin=None):
+    """Signed token binding the session to the user until ``expires_at`` (epoch seconds)."""
+    payload = {'s': session_id, 'u': user_id, 'exp': expires_at}
+    if pin:
+        payload['pin'] = _pin_digest(session_id, user_id, pin)
+    return _serializer().dumps(payload)
+
+
+def read_session_credential(token, session_id, user_id):
+    """Payload of a valid, unexpired credential for this session and user, else None."""
+    if not token:
+        return None
+    try:
+        payload = _serializer().loads(token)
+    except BadSignature:
+        logger.warning(f"Rejected USSD session credential with a bad signature for session {session_id}")
+        return None
+    if payload.get('s') != session_id or payload.get('u') != user_id:
+        return None
+    if payload.get('exp', 0) < time.time():
+        return None
+    return payload
+
+
+def credential_matches_pin(payload, session_id, user_id, pin):
+    digest = payload.get('pin') if payload else None
+    return bool(digest) and hmac.compare_digest(digest, _pin_digest(session_id, user_id, pin))
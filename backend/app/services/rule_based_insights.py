@@ -0,0 +1,311 @@
+"""
+Template-driven insights built from the cycle engine's own results.
+
+``build_rule_based_insight`` turns the prompt inputs that
+``KinyarwandaInsightService`` already assembles (cycle analysis with
+``calculate_health_insights`` and anomaly results, wellness patterns, meals,
+appointments, verified providers) into an insight with the same sections as a
+Gemini one: ``inyunganizi``, ``icyo_wakora`` and ``ihumure``. It takes no
+I/O and runs in well under a millisecond, so it is used:
+
+- as the first paint of a streamed insight, before Gemini answers,
+- in place of Gemini when no API key is configured, Gemini fails with no
+  stale insight to fall back on, or the call runs past its latency budget.
+
+Rule-based insights carry ``source: 'rules'`` and are never written to
+insight_cache, so the next request still tries Gemini.
+"""
+
+from datetime import datetime, date
+from typing import Any, Dict, List, Optional
+
+MAX_FINDINGS = 2
+MAX_ACTIONS = 3
+
+# Engine findings by "<category>:<type>" from CyclePredictionEngine.calculate_health_insights:
+# (what it means, what to do about it or None)
+FINDINGS = {
+    'english': {
+        'amenorrhea_risk:warning': (
+            'No period has been logged for more than three months. A gap this long needs a health check.',
+            'Visit a health provider soon to find out why your period has stopped',
+        ),
+        'late_period:info': (
+            'Your period seems to be late compared with your usual cycle.',
+            'If you could be pregnant, take a pregnancy test and note any unusual symptoms',
+        ),
+        'cycle_regularity:warning': (
+            'Your cycle length changes a lot from month to month.',
+            'Keep logging every period so a health provider can review the pattern with you',
+        ),
+        'cycle_regularity:positive': (
+            'Your cycles are very regular, a good sign of hormonal balance.',
+            None,
+        ),
+        'cycle_length:warning': (
+            'Your cycles are shorter than 21 days on average.',
+            'Note your symptoms and mention your short cycles at your next health visit',
+        ),
+        'cycle_length:info': (
+            'Your cycles are longer than 35 days, which can be normal for you.',
+            'Keep tracking, and see a provider if long cycles come with other symptoms',
+        ),
+        'menorrhagia_risk:warning': (
+            'Your periods often last more than 7 days.',
+            'Talk to a health provider about long periods and eat iron-rich foods like beans and dodo',
+        ),
+        'period_length:info': (
+            'Your periods usually last less than 2 days.',
+            None,
+        ),
+        'pcos_pattern:info': (
+            'Many of your cycles are long and irregular, a pattern a provider may want to check.',
+            'Consider a consultation to rule out hormonal conditions such as PCOS',
+        ),
+        'mental_wellness:warning': (
+            'You have often logged a low mood.',
+            'Take time each day for something that calms you, and talk to someone you trust',
+        ),
+        'mental_wellness:positive': (
+            'Your mood has mostly been good.',
+            None,
+        ),
+        'stress_management:warning': (
+            'You have often reported high stress.',
+            'Try slow breathing or a short walk when stress builds up, and rest well',
+        ),
+        'sleep_wellness:info': (
+            'Poor sleep shows up often in your logs.',
+            'Go to bed at the same time every night and put your phone away before sleep',
+        ),
+        'physical_wellness:info': (
+            'You have logged little exercise.',
+            'Walk or dance for 30 minutes on most days of the week',
+        ),
+        'physical_wellness:positive': (
+            'You have stayed active, which supports hormonal balance.',
+            None,
+        ),
+        'data_quality:info': (
+            'A few more logged cycles will make your predictions more accurate.',
+            'Log the start and end date of each period',
+        ),
+    },
+    'kinyarwanda': {
+        'amenorrhea_risk:warning': (
+            'Nta mihango yanditswe mu mezi arenga atatu. Iyo imihango imaze igihe kingana gutyo itaza, ni ngombwa kwisuzumisha.',
+            'Jya kwa muganga vuba kugira ngo umenye impamvu imihango yahagaze',
+        ),
+        'late_period:info': (
+            "Imihango yawe isa n'iyatinze ugereranyije n'uko isanzwe iza.",
+            'Niba ushobora kuba utwite, kora ikizamini cyo gutwita kandi wandike ibimenyetso bidasanzwe',
+        ),
+        'cycle_regularity:warning': (
+            "Uburebure bw'ukwezi kwawe k'imihango buhinduka cyane buri kwezi.",
+            'Komeza wandike imihango yawe yose kugira ngo umuganga azabashe kureba uko bimeze',
+        ),
+        'cycle_regularity:positive': (
+            "Imihango yawe iza ku gihe neza, ni ikimenyetso cyiza cy'uko imisemburo iringaniye.",
+            None,
+        ),
+        'cycle_length:warning': (
+            "Ukwezi kwawe k'imihango kuba kugufi, munsi y'iminsi 21.",
+            'Andika ibimenyetso byawe kandi uzabibwire umuganga ubutaha',
+        ),
+        'cycle_length:info': (
+            "Ukwezi kwawe k'imihango kurarenza iminsi 35; bishobora kuba bisanzwe kuri wowe.",
+            "Komeza ukurikirane, kandi ujye kwa muganga niba bijyana n'ibindi bimenyetso",
+        ),
+        'menorrhagia_risk:warning': (
+            'Imihango yawe ikunze kumara iminsi irenze 7.',
+            "Vugana n'umuganga ku mihango imara igihe kirekire, kandi urye ibiryo bikungahaye ku butare nk'ibishyimbo na dodo",
+        ),
+        'period_length:info': (
+            'Imihango yawe ikunze kumara iminsi iri munsi ya 2.',
+            None,
+        ),
+        'pcos_pattern:info': (
+            "Amezi menshi imihango yawe iratinda kandi ntiza ku gihe kimwe; ni ibintu umuganga yakwitaho.",
+            "Tekereza kwisuzumisha kugira ngo umenye niba nta kibazo cy'imisemburo nka PCOS gihari",
+        ),
+        'mental_wellness:warning': (
+            'Kenshi wanditse ko wumva utameze neza mu mutima.',
+            "Fata akanya buri munsi ukore ikintu kigutuza, kandi uganire n'umuntu wizeye",
+        ),
+        'mental_wellness:positive': (
+            'Akenshi wumvise umeze neza mu mutima.',
+            None,
+        ),
+        'stress_management:warning': (
+            'Kenshi wavuze ko ufite stress nyinshi.',
+            "Gerageza guhumeka buhoro cyangwa kugenda n'amaguru gato iyo stress yiyongereye, kandi uruhuke bihagije",
+        ),
+        'sleep_wellness:info': (
+            'Kenshi wanditse ko utasinziriye neza.',
+            'Jya uryama ku isaha imwe buri joro kandi ushyire telefoni kure mbere yo kuryama',
+        ),
+        'physical_wellness:info': (
+            'Wanditse imyitozo ngororamubiri mike.',
+            "Genda n'amaguru cyangwa ubyine iminota 30 iminsi myinshi mu cyumweru",
+        ),
+        'physical_wellness:positive': (
+            'Wakomeje gukora imyitozo ngororamubiri, bifasha imisemburo kuringanira.',
+            None,
+        ),
+        'data_quality:info': (
+            "Andika imihango y'andi mezi make kugira ngo ibiteganijwe birusheho kuba ukuri.",
+            "Andika itariki imihango itangiriyeho n'iyo irangiriyeho",
+        ),
+    },
+}
+
+PHRASES = {
+    'english': {
+        'average': 'Your cycles average {days} days.',
+        'next_period': 'Your next period is expected around {date}.',
+        'no_cycle_data': 'There is not enough cycle data yet to show your pattern. Keep logging your periods.',
+        'anomaly': 'Some recent cycles look different from your usual pattern.',
+        'see_provider': 'See a health provider{provider} about these changes',
+        'provider': ' such as {name} ({specialization})',
+        'log_meals': 'Log your meals and include iron-rich local foods like beans, dodo and avocado',
+        'appointment': 'Remember your health appointment on {date}',
+        'defaults': [
+            'Drink plenty of clean water every day',
+            'Eat beans, sweet potatoes and green vegetables such as dodo',
+            'Rest well and keep logging your health each day',
+        ],
+        'encourage_concern': 'Noticing these signs early is a strong step. You are not alone, and help is close by.',
+        'encourage_positive': 'You are taking great care of yourself. Keep going!',
+        'encourage_neutral': 'Every day you log brings a clearer picture of your health. Keep it up!',
+        'date_format': '%B %d, %Y',
+    },
+    'kinyarwanda': {
+        'average': "Ukwezi kwawe k'imihango kumara iminsi {days} ugereranyije.",
+        'next_period': 'Imihango itaha iteganijwe ahagana ku itariki {date}.',
+        'no_cycle_data': "Nta makuru ahagije y'imihango arahari ngo tubone uko ukwezi kwawe kumeze. Komeza wandike imihango yawe.",
+        'anomaly': "Amezi amwe aheruka ntameze nk'uko bisanzwe kuri wowe.",
+        'see_provider': 'Jya kwa muganga{provider} umubwire izi mpinduka',
+        'provider': ' nka {name} ({specialization})',
+        'log_meals': "Andika ibyo urya kandi ushyiremo ibiryo bikungahaye ku butare nk'ibishyimbo, dodo na avoka",
+        'appointment': 'Wibuke gahunda yawe kwa muganga ku itariki {date}',
+        'defaults': [
+            'Nywa amazi meza ahagije buri munsi',
+            "Rya ibishyimbo, ibijumba n'imboga rwatsi nka dodo",
+            "Ruhuka bihagije kandi ukomeze wandike amakuru y'ubuzima bwawe buri munsi",
+        ],
+        'encourage_concern': 'Kubona ibi bimenyetso hakiri kare ni intambwe ikomeye. Ntabwo uri wenyine, ubufasha buri hafi.',
+        'encourage_positive': 'Urimo kwita ku buzima bwawe neza cyane. Komereza aho!',
+        'encourage_neutral': 'Buri munsi wandika amakuru, urushaho kumenya ubuzima bwawe. Komereza aho!',
+        'date_format': '%d/%m/%Y',
+    },
+}
+
+# Most urgent engine findings first
+_PRIORITY = {'high': 0, 'medium': 1, 'low': 2}
+_TYPE_ORDER = {'warning': 0, 'info': 1, 'positive': 2}
+
+
+def _format_date(value: Optional[str], phrases: Dict[str, Any]) -> Optional[str]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).strftime(phrases['date_format'])
+    except (TypeError, ValueError):
+        return None
+
+
+def _ranked_findings(health_insights: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return sorted(
+        (finding for finding in health_insights if isinstance(finding, dict)),
+        key=lambda finding: (
+            _PRIORITY.get(finding.get('priority'), 3),
+            _TYPE_ORDER.get(finding.get('type'), 3),
+        )
+    )
+
+
+def _next_appointment(appointments: List[Dict[str, Any]]) -> Optional[str]:
+    today = date.today().isoformat()
+    upcoming = sorted(
+        apt['appointment_date'] for apt in appointments
+        if apt.get('appointment_date') and apt['appointment_date'][:10] >= today
+        and apt.get('status') not in ('cancelled', 'completed')
+    )
+    return upcoming[0] if upcoming else None
+
+
+def build_rule_based_insight(user_data: Dict[str, Any], language: str) -> Dict[str, Any]:
+    """Insight in the Gemini insight schema from assembled prompt inputs, in English or Kinyarwanda"""
+    language = 'kinyarwanda' if language == 'kinyarwanda' else 'english'
+    phrases = PHRASES[language]
+    findings = FINDINGS[language]
+    cycle_analysis = user_data.get('cycle_analysis') or {}
+
+    summary: List[str] = []
+    actions: List[str] = []
+    concern = False
+    positive = False
+
+    if cycle_analysis.get('has_data'):
+        average = cycle_analysis.get('weighted_cycle_length') or cycle_analysis.get('average_cycle_length')
+        if average:
+            summary.append(phrases['average'].format(days=int(round(average))))
+        predictions = cycle_analysis.get('predictions') or []
+        next_date = _format_date(predictions[0].get('predicted_start'), phrases) if predictions else None
+        if next_date:
+            summary.append(phrases['next_period'].format(date=next_date))
+    else:
+        summary.append(phrases['no_cycle_data'])
+
+    shown = 0
+    for finding in _ranked_findings(cycle_analysis.get('health_insights') or []):
+        phrase = findings.get(f"{finding.get('category')}:{finding.get('type')}")
+        if not phrase:
+            continue
+        text, action = phrase
+        if shown < MAX_FINDINGS:
+            summary.append(text)
+            shown += 1
+        if action and action not in actions:
+            actions.append(action)
+        if finding.get('type') == 'warning' or finding.get('priority') == 'high':
+            concern = True
+        elif finding.get('type') == 'positive':
+            positive = True
+
+    anomalies = cycle_analysis.get('anomaly_analysis') or {}
+    if anomalies.get('anomalies_detected') and (anomalies.get('risk_score') or {}).get('level') in ('medium', 'high'):
+        concern = True
+        summary.append(phrases['anomaly'])
+        providers = user_data.get('available_providers') or []
+        provider = phrases['provider'].format(
+            name=providers[0]['name'],
+            specialization=providers[0].get('specialization') or 'General',
+        ) if providers else ''
+        actions.insert(0, phrases['see_provider'].format(provider=provider))
+
+    appointment_date = _format_date(_next_appointment(user_data.get('appointments') or []), phrases)
+    if appointment_date:
+        actions.append(phrases['appointment'].format(date=appointment_date))
+    if not user_data.get('meal_logs'):
+        actions.append(phrases['log_meals'])
+    for default in phrases['defaults']:
+        if len(actions) >= MAX_ACTIONS:
+            break
+        actions.append(default)
+
+    if concern:
+        encouragement = phrases['encourage_concern']
+    elif positive:
+        encouragement = phrases['encourage_positive']
+    else:
+        encouragement = phrases['encourage_neutral']
+
+    return {
+        'inyunganizi': ' '.join(summary),
+        'icyo_wakora': actions[:MAX_ACTIONS],
+        'ihumure': encouragement,
+        'language': language,
+        'generated_at': datetime.utcnow().isoformat(),
+        'source': 'rules',
+    }
@@ -0,0 +1,141 @@
+"""
+Outbound SMS gateways.
+
+``get_sms_gateway()`` returns the adapter named by ``SMS_GATEWAY``:
+``africastalking`` posts to the Africa's Talking messaging API, ``fake`` keeps
+messages in memory and is refused outside TESTING/DEBUG, so a deployment that
+turns outbound SMS on cannot mark real notifications sent into a list nobody
+reads. There is no default: the gateway must be named. Adapters expose one method,
+``send(phone, message)``, which returns the provider's message id or raises
+``SMSGatewayError``; ``retryable`` tells the caller whether trying again later
+can help.
+"""
+
+import logging
+import threading
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+AFRICASTALKING_URL = 'https://api.africastalking.com/version1/messaging'
+AFRICASTALKING_SANDBOX_URL = 'https://api.sandbox.africastalking.com/version1/messaging'
+
+# Per-recipient status codes Africa's Talking reports as accepted
+AT_ACCEPTED_CODES = {100, 101, 102}
+# Per-recipient failures that may succeed later (risk hold, gateway/system errors)
+AT_RETRYABLE_CODES = {401, 500, 501, 502}
+
+
+class SMSGatewayError(Exception):
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class FakeSMSGateway:
+    """Records messages instead of sending them.
+
+    ``fail_numbers`` always fail (not retryable); ``fail_next`` makes the next
+    N sends fail with a retryable error.
+    """
+
+    def __init__(self):
+        self.outbox = []
+        self.fail_numbers = set()
+        self.fail_next = 0
+        self._lock = threading.Lock()
+
+    def send(self, phone, message):
+        with self._lock:
+            if phone in self.fail_numbers:
+                raise SMSGatewayError(f'Rejected recipient {phone}', retryable=False)
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                raise SMSGatewayError('Gateway unavailable')
+            self.outbox.append({'to': phone, 'message': message})
+            return f'fake-{len(self.outbox)}'
+
+
+class AfricasTalkingGateway:
+    """Africa's Talking bulk SMS API, one keep-alive HTTP session per thread."""
+
+    def __init__(self, username, api_key, sender_id=None, sandbox=False, timeout=10):
+        import requests
+
+        self._requests = requests
+        self.username = username
+        self.api_key = api_key
+        self.sender_id = sender_id
+        self.url = AFRICASTALKING_SANDBOX_URL if sandbox else AFRICASTALKING_URL
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+            session.headers.update({'apiKey': self.api_key, 'Accept': 'application/json'})
+        return session
+
+    def send(self, phone, message):
+        data = {'username': self.username, 'to': phone, 'message': message}
+        if self.sender_id:
+            data['from'] = self.sender_id
+
+        try:
+            resp = self._session().post(self.url, data=data, timeout=self.timeout)
+        except self._requests.RequestException as exc:
+            raise SMSGatewayError(f"Africa's Talking request failed: {exc}")
+
+        if resp.status_code >= 500 or resp.status_code == 429:
+            raise SMSGatewayError(f"Africa's Talking returned HTTP {resp.status_code}")
+        if resp.status_code >= 400:
+            raise SMSGatewayError(f"Africa's Talking rejected the request: HTTP {resp.status_code} {resp.text[:200]}",
+                                  retryable=False)
+
+        try:
+            recipients = resp.json()['SMSMessageData']['Recipients']
+            recipient = recipients[0]
+        except (ValueError, KeyError, IndexError, TypeError):
+            raise SMSGatewayError(f"Unexpected Africa's Talking response: {resp.text[:200]}")
+
+        code = recipient.get('statusCode')
+        if code in AT_ACCEPTED_CODES:
+            return recipient.get('messageId')
+        raise SMSGatewayError(f"{recipient.get('status', 'Failed')} ({code})", retryable=code in AT_RETRYABLE_CODES)
+
+
+def gateway_kind(app):
+    """``SMS_GATEWAY`` for ``app``; raises ValueError when it can't send real messages."""
+    kind = app.config.get('SMS_GATEWAY')
+    if not kind:
+        raise ValueError("SMS_GATEWAY must be set ('africastalking', or 'fake' under TESTING/DEBUG)")
+    if kind == 'africastalking':
+        missing = [name for name in ('AFRICASTALKING_USERNAME', 'AFRICASTALKING_API_KEY') if not app.config.get(name)]
+        if missing:
+            raise ValueError(f"SMS_GATEWAY 'africastalking' needs {' and '.join(missing)}")
+    elif kind == 'fake':
+        if not (app.testing or app.debug):
+            raise ValueError("SMS_GATEWAY 'fake' only records messages in memory; it is refused outside TESTING/DEBUG")
+    else:
+        raise ValueError(f"Unknown SMS_GATEWAY '{kind}'")
+    return kind
+
+
+def get_sms_gateway():
+    """The configured gateway, created once per app."""
+    app = current_app._get_current_object()
+    gateway = app.extensions.get('sms_gateway')
+    if gateway is None:
+        if gateway_kind(app) == 'africastalking':
+            gateway = AfricasTalkingGateway(
+                app.config['AFRICASTALKING_USERNAME'],
+                app.config['AFRICASTALKING_API_KEY'],
+                sender_id=app.config.get('AFRICASTALKING_SENDER_ID'),
+                sandbox=app.config.get('AFRICASTALKING_SANDBOX', False),
+            )
+        else:
+            gateway = FakeSMSGateway()
+        app.extensions['sms_gateway'] = gateway
+    return gateway
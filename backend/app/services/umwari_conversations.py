@@ -0,0 +1,250 @@
+"""
+Server-side Umwari conversation history with compaction.
+
+``/api/umwari/chat`` receives the whole history from the client on every
+turn, so a long chat grows the prompt (and Gemini latency) with each message
+and resends the same prefix every time. Conversations stored here send Gemini:
+
+- the conversation's ``system_context`` as the system instruction,
+- a running summary of older turns, as one fixed user/model exchange,
+- the turns after the summary, newest first, up to ``UMWARI_MAX_PROMPT_TOKENS``.
+
+Once the unsummarized turns pass ``UMWARI_HISTORY_TOKEN_BUDGET`` a background
+thread folds all but the last ``UMWARI_KEEP_RECENT_MESSAGES`` into the summary.
+Between compactions the prompt prefix stays byte-identical, so Gemini's
+implicit context cache can serve it; cached prompt tokens are recorded per
+endpoint. Tokens of the whole history vs. tokens sent are recorded under the
+``umwari_chat`` context in the performance collector.
+
+Token counts are estimates (about four characters per token); they only
+decide when to compact and how much history to send.
+"""
+
+import contextvars
+import logging
+import threading
+
+from flask import current_app
+
+from app import db
+from app.models.umwari_conversation import UmwariConversation, UmwariMessage
+from app.services.llm_client import LLMError, gemini_client
+from app.utils.performance import performance_stats
+from app.utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4
+SETTINGS = {
+    'UMWARI_HISTORY_TOKEN_BUDGET': 4000,
+    'UMWARI_KEEP_RECENT_MESSAGES': 6,
+    'UMWARI_MAX_PROMPT_TOKENS': 8000,
+    'UMWARI_MAX_MESSAGE_CHARS': 4000,
+    'UMWARI_MAX_SYSTEM_CONTEXT_CHARS': 16000,
+    'UMWARI_SUMMARY_MAX_TOKENS': 512,
+}
+# Newest unsummarized messages read per turn; older ones would not fit the prompt anyway
+MAX_MESSAGES_LOADED = 200
+
+SUMMARY_PREAMBLE = 'Summary of our conversation so far:\n'
+SUMMARY_ACK = 'Thank you, I remember our conversation and will continue from there.'
+SUMMARY_PROMPT = (
+    "You keep the memory of a health chat between a user and Umwari, a caring assistant for "
+    "women and girls in Rwanda. Update the summary below with the new messages. Keep every fact "
+    "the user shared about herself (cycle, symptoms, mood, diet, appointments, worries), advice "
+    "already given and open questions. Write it in the language the conversation uses, in at most "
+    "{max_words} words, as plain sentences without headings.\n\n"
+    "Current summary:\n{summary}\n\nNew messages:\n{transcript}\n\nUpdated summary:"
+)
+
+_compactions = SingleFlight('umwari_compaction')
+
+
+def setting(name):
+    return current_app.config.get(name, SETTINGS[name])
+
+
+def estimate_tokens(text):
+    if not text:
+        return 0
+    return max(1, (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN)
+
+
+def _content_tokens(content):
+    return sum(estimate_tokens(part.get('text')) for part in content['parts'])
+
+
+def _merge_turns(turns):
+    """Gemini turns from ``(role, text)`` pairs; consecutive same-role turns are joined"""
+    contents = []
+    for role, text in turns:
+        if contents and contents[-1]['role'] == role:
+            contents[-1]['parts'].append({'text': text})
+        else:
+            contents.append({'role': role, 'parts': [{'text': text}]})
+    return contents
+
+
+def bound_contents(contents, max_tokens):
+    """
+    Trim client-supplied history to about ``max_tokens``: the first turn (the
+    frontend puts its system context there) and as many of the newest turns
+    as fit. Returns ``(contents, full_tokens, sent_tokens)``.
+    """
+    sizes = [_content_tokens(content) for content in contents]
+    full_tokens = sum(sizes)
+    if full_tokens <= max_tokens or len(contents) <= 2:
+        return contents, full_tokens, full_tokens
+
+    used = sizes[0] + sizes[-1]
+    start = len(contents) - 1
+    while start > 1 and used + sizes[start - 1] <= max_tokens:
+        start -= 1
+        used += sizes[start]
+    kept = contents[start:]
+    # History must resume on a user turn after the pinned first turn
+    while len(kept) > 1 and kept[0]['role'] != 'user':
+        used -= sizes[len(contents) - len(kept)]
+        kept = kept[1:]
+    return [contents[0]] + kept, full_tokens, used
+
+
+def create_conversation(user_id, system_context=None):
+    conversation = UmwariConversation(user_id=user_id, system_context=system_context or None)
+    db.session.add(conversation)
+    db.session.commit()
+    return conversation
+
+
+def get_conversation(user_id, conversation_id):
+    """The user's conversation, or None (also when it belongs to someone else)"""
+    return UmwariConversation.query.filter_by(id=conversation_id, user_id=user_id).first()
+
+
+def add_message(conversation, role, text):
+    tokens = estimate_tokens(text)
+    message = UmwariMessage(conversation_id=conversation.id, role=role, text=text, tokens=tokens)
+    db.session.add(message)
+    conversation.total_tokens = (conversation.total_tokens or 0) + tokens
+    db.session.commit()
+    return message
+
+
+def _pending_messages(conversation):
+    """Unsummarized messages, newest first"""
+    return UmwariMessage.query.filter(
+        UmwariMessage.conversation_id == conversation.id,
+        UmwariMessage.id > conversation.summarized_through_id
+    ).order_by(UmwariMessage.id.desc()).limit(MAX_MESSAGES_LOADED).all()
+
+
+def build_prompt(conversation):
+    """
+    Contents for the next Gemini call. Returns ``(contents, pending_tokens)``,
+    where ``pending_tokens`` counts every unsummarized message, sent or not.
+    Records full-history vs. sent tokens for the savings metric.
+    """
+    max_tokens = setting('UMWARI_MAX_PROMPT_TOKENS')
+    system_tokens = estimate_tokens(conversation.system_context)
+    used = system_tokens
+
+    prefix = []
+    if conversation.summary:
+        prefix = [('user', SUMMARY_PREAMBLE + conversation.summary), ('model', SUMMARY_ACK)]
+        used += conversation.summary_tokens + estimate_tokens(SUMMARY_PREAMBLE + SUMMARY_ACK)
+
+    pending = _pending_messages(conversation)
+    pending_tokens = sum(message.tokens for message in pending)
+    turns = []
+    for message in pending:
+        if turns and used + message.tokens > max_tokens:
+            break
+        turns.append((message.role, message.text))
+        used += message.tokens
+    turns.reverse()
+    # Drop a leading reply whose question fell outside the window
+    while len(turns) > 1 and turns[0][0] != 'user':
+        used -= estimate_tokens(turns[0][1])
+        turns = turns[1:]
+
+    performance_stats.record_prompt_context(
+        'umwari_chat', system_tokens + (conversation.total_tokens or 0), used,
+    )
+    return _merge_turns(prefix + turns), pending_tokens
+
+
+def needs_compaction(pending_tokens):
+    return pending_tokens > setting('UMWARI_HISTORY_TOKEN_BUDGET')
+
+
+def compact_conversation(conversation_id, api_key, model):
+    """
+    Fold all but the most recent messages into the conversation summary.
+    Returns True when the summary moved forward. A Gemini failure leaves the
+    conversation as it was; ``build_prompt`` still caps what is sent.
+    """
+    conversation = db.session.get(UmwariConversation, conversation_id)
+    if conversation is None:
+        return False
+    pending = list(reversed(_pending_messages(conversation)))
+    if not needs_compaction(sum(message.tokens for message in pending)):
+        return False
+
+    older = pending[:-setting('UMWARI_KEEP_RECENT_MESSAGES')]
+    # Never fold a question without its answer
+    while older and older[-1].role == 'user':
+        older.pop()
+    if not older:
+        return False
+
+    max_tokens = setting('UMWARI_SUMMARY_MAX_TOKENS')
+    transcript = '\n'.join(
+        f"{'User' if message.role == 'user' else 'Umwari'}: {message.text}" for message in older
+    )
+    prompt = SUMMARY_PROMPT.format(
+        max_words=int(max_tokens * 0.7),
+        summary=conversation.summary or '(none yet)',
+        transcript=transcript,
+    )
+    try:
+        result = gemini_client.generate(
+            prompt, api_key, model=model,
+            generation_config={'temperature': 0.2, 'maxOutputTokens': max_tokens},
+            endpoint='umwari_summary',
+        )
+    except LLMError as e:
+        logger.warning(f"Umwari conversation {conversation_id} compaction failed: {e}")
+        return False
+
+    summary = result['text'].strip()
+    table = UmwariConversation.__table__
+    # Another worker may have compacted meanwhile; only move forward from what was read
+    updated = db.session.execute(table.update().where(
+        table.c.id == conversation_id,
+        table.c.summarized_through_id == conversation.summarized_through_id
+    ).values(
+        summary=summary,
+        summary_tokens=estimate_tokens(summary),
+        summarized_through_id=older[-1].id,
+    ))
+    db.session.commit()
+    return updated.rowcount == 1
+
+
+def schedule_compaction(app, conversation_id, api_key, model):
+    """Compact on a daemon thread so the reply stream is not held open for it"""
+    def run():
+        with app.app_context():
+            try:
+                _compactions.do(conversation_id, lambda: compact_conversation(conversation_id, api_key, model))
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Umwari conversation {conversation_id} compaction failed: {e}")
+            finally:
+                db.session.remove()
+
+    # The summary call is charged to the conversation's owner like the reply was
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(run,), name=f'umwari-compaction-{conversation_id}',
+                     daemon=True).start()
+
@@ -1,3 +1,6 @@
 from app.ussd.handlers import ussd_bp
+from app.ussd import outbound  # noqa: F401  (mirrors notifications for SMS digests)
+from app.ussd import prediction_cache  # noqa: F401  (drops cached predictions on cycle log commits)
+from app.ussd import notification_cache  # noqa: F401  (drops cached USSD inboxes on notification commits)
 
 __all__ = ['ussd_bp']
@@ -1,15 +1,17 @@
 import logging
 import re
 
-from app import bcrypt, db
+from app import db
 from app.models import User, Parent, Adolescent
 from app.services.notification_manager import notification_manager
+from app.services.pin_auth import hash_pin, verify_user_pin
 from app.ussd.constants import REGISTRATION_TYPE_MAP, USSD_ALLOWED_ROLES, WEAK_PINS
 from app.ussd.session import (
     clear_login_attempts,
     find_user_by_phone,
     increment_login_attempts,
     mark_session_authenticated,
+    pin_verified_in_session,
     rate_limit_ussd_login,
     to_stored_phone,
     user_first_name,
@@ -66,16 +68,14 @@ def verify_ussd_pin(user, pin_input, session_id):
             "Please wait 15 minutes and try again."
         )
 
-    pin_valid = False
-    if user.enable_pin_auth and user.pin_hash:
-        pin_valid = bcrypt.check_password_hash(user.pin_hash, pin_input)
-
-    if not pin_valid and user.password_hash:
-        pin_valid = bcrypt.check_password_hash(user.password_hash, pin_input)
+    pin_valid = (
+        pin_verified_in_session(session_id, user.id, pin_input)
+        or verify_user_pin(user, pin_input)
+    )
 
     if pin_valid:
         clear_login_attempts(session_id)
-        mark_session_authenticated(session_id, user.id)
+        mark_session_authenticated(session_id, user.id, pin_input)
         return build_main_menu(user)
 
     attempts = increment_login_attempts(session_id)
@@ -137,12 +137,13 @@ def handle_registration_flow(phone_number, input_list):
             return "END Invalid account type. Please start again."
 
         stored_phone = to_stored_phone(phone_number)
-        if find_user_by_phone(stored_phone):
+        if find_user_by_phone(stored_phone, use_cache=False):
             return "END This number was just registered. Please dial again to log in."
 
         try:
-            password_hash = bcrypt.generate_password_hash(pin).decode('utf-8')
-            pin_hash = bcrypt.generate_password_hash(pin).decode('utf-8')
+            # Both columns hold a hash of the PIN; one bcrypt run serves both
+            pin_hash = hash_pin(pin)
+            password_hash = pin_hash
 
             name_parts = name.strip().split()
             first_name = name_parts[0]
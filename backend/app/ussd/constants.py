@@ -16,5 +16,3 @@ MEAL_TYPE_MAP = {
     '3': 'dinner',
     '4': 'snack',
 }
-
-LOGIN_ATTEMPTS = {}
@@ -0,0 +1,154 @@
+"""
+Pre-rendered health tips for the USSD menus.
+
+Tip screens used to query ContentItem (and walk every ContentCategory) on each
+hop. Instead each worker keeps a snapshot of ready-to-send tip frames, already
+cut to the USSD frame size, and serves tips from memory. Committing a change to
+ContentItem or ContentCategory bumps a shared version number; workers notice it
+within a few seconds and rebuild their snapshot on the next tip request.
+"""
+
+import logging
+import random
+import threading
+import time
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import ContentCategory, ContentItem
+from app.utils.kv_store import SharedKVStore
+
+logger = logging.getLogger(__name__)
+
+FRAME_CHARS = 160
+TIP_CHARS = 140
+TITLE_CHARS = 60
+
+RANDOM_POOL_SIZE = 20
+CATEGORY_POOL_SIZE = 5
+# Drafts are only shown when nothing is published yet
+UNPUBLISHED_POOL_SIZE = 10
+
+# How often a worker looks for a version bump from another worker, and the
+# longest a snapshot is kept regardless (covers bulk SQL edits)
+VERSION_CHECK_SECONDS = 5
+MAX_AGE_SECONDS = 600
+
+NO_TIPS = "END No health tips available yet."
+
+_versions = SharedKVStore('ussd_content_version', default_ttl=0, max_entries=100)
+
+
+def render_tip(title, body):
+    """One END frame: the title plus as much of the body as fits."""
+    head = f"END 💡 {(title or '').strip()[:TITLE_CHARS]}\n\n"
+    body = (body or '').strip()
+    room = min(TIP_CHARS, FRAME_CHARS - len(head))
+    if len(body) > room:
+        body = body[:room - 3].rstrip() + '...'
+    return head + body
+
+
+class TipCache:
+    """Per-process snapshot of rendered tips, rebuilt when the shared version moves."""
+
+    def __init__(self):
+        self._tips = None
+        self._built_at = 0.0
+        self._version = None
+        self._seen_version = 0
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def random_tip(self):
+        tips = self._snapshot()['random']
+        return random.choice(tips) if tips else NO_TIPS
+
+    def category_tip(self, keyword):
+        """A tip from the first category whose name contains ``keyword``."""
+        snapshot = self._snapshot()
+        keyword = keyword.lower()
+        for name, tips in snapshot['categories']:
+            if keyword in name and tips:
+                return random.choice(tips)
+        return random.choice(snapshot['random']) if snapshot['random'] else NO_TIPS
+
+    def invalidate(self):
+        """Mark every worker's snapshot stale."""
+        _versions.incr('tips')
+        self._checked_at = 0.0
+
+    def _snapshot(self):
+        now = time.monotonic()
+        if now - self._checked_at >= VERSION_CHECK_SECONDS:
+            self._checked_at = now
+            self._seen_version = _versions.get('tips', 0) or 0
+
+        if self._tips is None or self._version != self._seen_version or now - self._built_at > MAX_AGE_SECONDS:
+            with self._lock:
+                if self._tips is None or self._version != self._seen_version or now - self._built_at > MAX_AGE_SECONDS:
+                    version = self._seen_version
+                    self._tips = self._build()
+                    self._version = version
+                    self._built_at = time.monotonic()
+        return self._tips
+
+    def _build(self):
+        columns = (
+            ContentItem.category_id,
+            ContentItem.title,
+            func.substr(func.coalesce(ContentItem.summary, ContentItem.content), 1, TIP_CHARS + 1),
+        )
+        published = (
+            db.session.query(*columns)
+            .filter(ContentItem.status == 'published')
+            .order_by(ContentItem.published_at.desc(), ContentItem.id.desc())
+            .all()
+        )
+        rows = published or db.session.query(*columns).order_by(ContentItem.id).limit(UNPUBLISHED_POOL_SIZE).all()
+
+        by_category = {}
+        for category_id, title, body in rows:
+            pool = by_category.setdefault(category_id, [])
+            if len(pool) < CATEGORY_POOL_SIZE:
+                pool.append(render_tip(title, body))
+
+        categories = (
+            db.session.query(ContentCategory.id, ContentCategory.name)
+            .order_by(ContentCategory.id)
+            .all()
+        )
+        logger.info(f"USSD tip cache rebuilt: {len(rows)} tips in {len(by_category)} categories")
+        return {
+            'random': [render_tip(title, body) for _, title, body in rows[:RANDOM_POOL_SIZE]],
+            'categories': [((name or '').lower(), by_category.get(category_id, [])) for category_id, name in categories],
+        }
+
+
+tip_cache = TipCache()
+
+
+@event.listens_for(ContentItem, 'after_insert')
+@event.listens_for(ContentItem, 'after_update')
+@event.listens_for(ContentItem, 'after_delete')
+@event.listens_for(ContentCategory, 'after_insert')
+@event.listens_for(ContentCategory, 'after_update')
+@event.listens_for(ContentCategory, 'after_delete')
+def _mark_content_changed(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info['ussd_content_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_content_version(session):
+    # Bump only once the change is visible to the rebuild query
+    if session.info.pop('ussd_content_changed', False):
+        tip_cache.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_content_change(session):
+    session.info.pop('ussd_content_changed', None)
@@ -4,6 +4,14 @@ from statistics import mean
 from app.models import CycleLog
 from app.routes.cycle_logs import CyclePredictionEngine
 
+PREDICTION_CHARS = 160
+
+NO_CYCLE_DATA = "END No cycle data yet. Log a period first."
+NEED_TWO_PERIODS = (
+    "END Need at least 2 logged periods\n"
+    "to generate predictions."
+)
+
 
 def _format_iso_date(value, fmt='%d %b %Y'):
     try:
@@ -15,21 +23,25 @@ def _format_iso_date(value, fmt='%d %b %Y'):
 
 
 def get_ussd_cycle_predictions(user):
-    """Get cycle predictions using the ML engine (same as REST API)."""
+    """Predictions screen from the per-user cache (see prediction_cache)."""
+    from app.ussd.prediction_cache import cached_prediction
+
+    return cached_prediction(user.id)
+
+
+def render_cycle_predictions(user_id):
+    """Predictions screen using the ML engine (same as REST API)."""
     cycle_logs = CycleLog.query.filter_by(
-        user_id=user.id
+        user_id=user_id
     ).order_by(CycleLog.start_date.asc()).all()
 
     if not cycle_logs:
-        return "END No cycle data yet. Log a period first."
+        return NO_CYCLE_DATA
 
     cycle_data = CyclePredictionEngine.extract_cycle_lengths_robust(cycle_logs)
 
     if not cycle_data.get('lengths'):
-        return (
-            "END Need at least 2 logged periods\n"
-            "to generate predictions."
-        )
+        return NEED_TWO_PERIODS
 
     predictions = CyclePredictionEngine.predict_next_cycles(
         cycle_logs, num_predictions=2
@@ -39,19 +51,22 @@ def get_ussd_cycle_predictions(user):
         return "END Could not generate predictions. Log more periods."
 
     pred1 = predictions['predictions'][0]
-    confidence = pred1.get('confidence', 'low')
-    next_start = pred1.get('predicted_start', 'Unknown')
-    fertile_start = pred1.get('fertile_window_start', '')
-    fertile_end = pred1.get('fertile_window_end', '')
-
-    next_start_fmt = _format_iso_date(next_start)
-
     period_lengths = CyclePredictionEngine.compute_period_lengths(cycle_logs)
     anomalies = CyclePredictionEngine.detect_health_anomalies(cycle_data, period_lengths)
 
-    response = (
-        f"CON 🔮 Your Predictions:\n"
-        f"Next period: {next_start_fmt}\n"
+    return prediction_screen(
+        pred1.get('predicted_start', 'Unknown'),
+        pred1.get('confidence', 'low'),
+        pred1.get('fertile_window_start', ''),
+        pred1.get('fertile_window_end', ''),
+        alert=anomalies.get('risk_level') in ('medium', 'high'),
+    )
+
+
+def prediction_screen(next_start, confidence, fertile_start=None, fertile_end=None, alert=False):
+    """Predictions menu; the prediction itself is kept within one SMS-sized frame."""
+    summary = (
+        f"Next period: {_format_iso_date(next_start)}\n"
         f"Confidence: {confidence.upper()}\n"
     )
 
@@ -59,15 +74,14 @@ def get_ussd_cycle_predictions(user):
         try:
             fs = _format_iso_date(fertile_start, '%d %b')
             fe = _format_iso_date(fertile_end, '%d %b')
-            response += f"Fertile window: {fs}-{fe}\n"
+            summary += f"Fertile window: {fs}-{fe}\n"
         except Exception:
             pass
 
-    if anomalies.get('risk_level') in ('medium', 'high'):
-        response += "⚠ Health pattern alert detected\n"
+    if alert:
+        summary += "⚠ Health pattern alert detected\n"
 
-    response += "\n1. More details\n0. Back"
-    return response
+    return f"CON 🔮 Your Predictions:\n{summary[:PREDICTION_CHARS]}\n1. More details\n0. Back"
 
 
 def get_ussd_cycle_stats(user):
@@ -2,6 +2,8 @@ import logging
 
 from flask import Blueprint, request
 
+from app import db
+from app.models import User
 from app.ussd.auth import (
     check_role_allowed,
     handle_registration_flow,
@@ -15,6 +17,8 @@ from app.ussd.session import (
     to_stored_phone,
     user_first_name,
 )
+from app.ussd.state import SessionState, discard_state, finish_hop, load_state, resume, track_hop
+from app.ussd.timing import PLEASE_WAIT, HopTimer, collect_pending, run_within_budget
 
 logger = logging.getLogger(__name__)
 
@@ -37,23 +41,104 @@ def handle_authenticated_flow(user, input_list, session_id):
     return route_authenticated_user(user, input_list[1:])
 
 
+def _authenticated_hop(user, input_list, session_id, state):
+    with track_hop(state):
+        return handle_authenticated_flow(user, input_list, session_id)
+
+
+def _resume_hop(user, state, segment):
+    return resume(state, user, segment)
+
+
+def _registration_hop(user, stored_phone, input_list):
+    return handle_registration_flow(stored_phone, input_list)
+
+
+def _resumable_user(state, stored_phone, text):
+    """User and new segment when the hop can be served from the saved node, else None."""
+    segment = state.resumable_segment(text, stored_phone)
+    if segment is None:
+        return None
+    user = db.session.get(User, state.user_id)
+    if not user or check_role_allowed(user):
+        return None
+    return user, segment
+
+
 def _process_ussd_request(session_id, phone_number, text):
     """Core USSD logic shared by POST and GET handlers."""
     menu_state = 'entry'
     user_id = None
     stored_phone = to_stored_phone(phone_number) if phone_number else ''
+    timer = HopTimer()
+    state = None
+
+    def reply(response, success=True, error=None):
+        duration_ms = timer.elapsed_ms()
+        with timer.phase('log'):
+            log_ussd_transaction(
+                session_id, stored_phone, user_id, text, response, menu_state,
+                success=success, error=error, duration_ms=duration_ms,
+            )
+        timer.finish(menu_state)
+        return response
+
+    def settle(response):
+        if response is None:
+            # The handler is still running; the next hop collects its result
+            timer.timed_out = True
+            state.pending = True
+            finish_hop(state, text, PLEASE_WAIT)
+            return reply(PLEASE_WAIT, success=False, error='hop budget exceeded')
+        finish_hop(state, text, response)
+        return reply(response)
 
     try:
         if not phone_number:
-            response = "END Invalid request."
-            log_ussd_transaction(session_id, '', None, text, response, menu_state, success=False)
-            return response
+            return reply("END Invalid request.", success=False)
 
         input_list = text.split('*') if text else []
         current_step = len(input_list)
 
-        user = find_user_by_phone(phone_number)
-        user_id = user.id if user else None
+        with timer.phase('lookup'):
+            state = load_state(session_id) if current_step else None
+            resumable = None
+            if state is not None and not state.pending:
+                resumable = _resumable_user(state, stored_phone, text)
+
+        if state is not None and state.pending:
+            user_id = state.user_id
+            menu_state = state.node or 'pending'
+            # Whatever was typed on the please-wait screen is not menu input
+            state.ignore_last_segment(text)
+            state.pending = False
+            with timer.phase('handler'):
+                found, response = collect_pending(session_id, timer.handler_budget_ms())
+            if found:
+                return settle(response)
+            # The handler ran on another worker; run the step again here
+            logger.info("USSD session %s resumed on another worker, rerunning its step", session_id)
+
+        if resumable:
+            user, segment = resumable
+            user_id = user.id
+            with timer.phase('handler'):
+                response = run_within_budget(
+                    session_id, timer.handler_budget_ms(), _resume_hop, user, state, segment,
+                )
+            menu_state = state.node or 'authenticated'
+            return settle(response)
+
+        if state is None or state.phone != stored_phone:
+            state = SessionState(session_id=session_id, phone=stored_phone)
+        input_list = state.menu_inputs(text)
+        current_step = len(input_list)
+
+        with timer.phase('lookup'):
+            user = state.user_id and db.session.get(User, state.user_id)
+            if not user:
+                user = find_user_by_phone(phone_number)
+        user_id = state.user_id = user.id if user else None
 
         logger.info(
             "USSD Request: phone=%s step=%s user=%s",
@@ -61,15 +146,12 @@ def _process_ussd_request(session_id, phone_number, text):
         )
 
         if user and user.user_type not in ('parent', 'adolescent'):
-            response = (
+            menu_state = 'role_blocked'
+            return reply(
                 "END This service is for parents and adolescents only.\n"
-                "Health providers and admins please use the Lady's Essence app."
-            )
-            log_ussd_transaction(
-                session_id, stored_phone, user_id, text, response,
-                'role_blocked', success=False,
+                "Health providers and admins please use the Lady's Essence app.",
+                success=False,
             )
-            return response
 
         if current_step == 0:
             menu_state = 'smart_entry'
@@ -82,31 +164,30 @@ def _process_ussd_request(session_id, phone_number, text):
                     "No account found for this number.\n"
                     "Let's create one!\n\nEnter your full name:"
                 )
-            log_ussd_transaction(
-                session_id, stored_phone, user_id, text, response, menu_state,
-            )
-            return response
+            finish_hop(state, text, response)
+            return reply(response)
 
         if user:
-            menu_state = 'authenticated'
-            response = handle_authenticated_flow(user, input_list, session_id)
+            is_pin_step = current_step == 1
+            with timer.phase('pin' if is_pin_step else 'handler'):
+                response = run_within_budget(
+                    session_id, timer.handler_budget_ms(), _authenticated_hop,
+                    user, input_list, session_id, state,
+                )
+            menu_state = 'pin' if is_pin_step else (state.node or 'authenticated')
         else:
             menu_state = 'registration'
-            response = handle_registration_flow(stored_phone, input_list)
-
-        log_ussd_transaction(
-            session_id, stored_phone, user_id, text, response, menu_state,
-        )
-        return response
+            with timer.phase('handler'):
+                response = run_within_budget(
+                    session_id, timer.handler_budget_ms(), _registration_hop,
+                    None, stored_phone, input_list,
+                )
+        return settle(response)
 
     except Exception as exc:
         logger.error(f"USSD error: {exc}", exc_info=True)
-        response = "END Service error. Please try again later."
-        log_ussd_transaction(
-            session_id, stored_phone, user_id, text, response,
-            menu_state, success=False, error=str(exc),
-        )
-        return response
+        discard_state(session_id)
+        return reply("END Service error. Please try again later.", success=False, error=str(exc))
 
 
 @ussd_bp.route('', methods=['POST', 'GET'])
@@ -1,15 +1,11 @@
 import logging
-import random
 from datetime import datetime, timedelta
 
-from app import bcrypt, db
+from app import db
 from app.models import (
     Appointment,
-    ContentCategory,
-    ContentItem,
     CycleLog,
     MealLog,
-    Notification,
     Parent,
     ParentChild,
     Adolescent,
@@ -17,7 +13,10 @@ from app.models import (
 )
 from app.routes.cycle_logs import CyclePredictionEngine
 from app.services.notification_manager import notification_manager
+from app.services.pin_auth import hash_pin
 from app.ussd.auth import build_main_menu
+from app.ussd.content_cache import tip_cache
+from app.ussd.notification_cache import unread_inbox
 from app.ussd.cycle import (
     get_prediction_details,
     get_ussd_anomaly_report,
@@ -26,6 +25,7 @@ from app.ussd.cycle import (
 )
 from app.ussd.services import ussd_book_appointment, ussd_save_cycle_log, ussd_save_meal_log
 from app.ussd.session import user_first_name
+from app.ussd.state import mark_backtracked, ussd_node
 
 logger = logging.getLogger(__name__)
 
@@ -35,15 +35,15 @@ def _back_or_main(user, input_list, handler):
     if not input_list:
         return build_main_menu(user)
     last = input_list[-1]
-    if last == '00':
+    if last not in ('0', '00'):
+        return None
+    mark_backtracked()
+    if last == '00' or len(input_list) == 1:
         return build_main_menu(user)
-    if last == '0' and len(input_list) == 1:
-        return build_main_menu(user)
-    if last == '0':
-        return handler(user, input_list[:-1])
-    return None
+    return handler(user, input_list[:-1])
 
 
+@ussd_node('main')
 def route_authenticated_user(user, input_list):
     """Route authenticated user after PIN entry."""
     if not input_list:
@@ -80,6 +80,7 @@ def route_authenticated_user(user, input_list):
     return handler(user, input_list[1:])
 
 
+@ussd_node('cycle')
 def handle_cycle_menu(user, input_list):
     back = _back_or_main(user, input_list, handle_cycle_menu)
     if back:
@@ -114,6 +115,7 @@ def handle_cycle_menu(user, input_list):
     return "CON Invalid selection.\n0. Back"
 
 
+@ussd_node('cycle_log')
 def _handle_cycle_log_flow(user, input_list):
     step = len(input_list)
 
@@ -227,6 +229,7 @@ def _handle_last_period(user):
     return "END " + "\n".join(lines)
 
 
+@ussd_node('meal')
 def handle_meal_menu(user, input_list):
     back = _back_or_main(user, input_list, handle_meal_menu)
     if back:
@@ -250,6 +253,7 @@ def handle_meal_menu(user, input_list):
     return "CON Invalid selection.\n0. Back"
 
 
+@ussd_node('meal_log')
 def _handle_meal_log_flow(user, input_list):
     back = _back_or_main(user, input_list, lambda u, il: handle_meal_menu(u, ['1'] + il))
     if back:
@@ -290,6 +294,7 @@ def _handle_weekly_meals(user):
     return "".join(lines)
 
 
+@ussd_node('appointments')
 def handle_appointment_menu(user, input_list):
     back = _back_or_main(user, input_list, handle_appointment_menu)
     if back:
@@ -330,6 +335,7 @@ def handle_appointment_menu(user, input_list):
     return "CON Invalid selection.\n0. Back"
 
 
+@ussd_node('book_appointment')
 def _handle_book_appointment_flow(user, input_list):
     back = _back_or_main(user, input_list, lambda u, il: handle_appointment_menu(u, ['1'] + il))
     if back:
@@ -340,6 +346,7 @@ def _handle_book_appointment_flow(user, input_list):
     return ussd_book_appointment(user, input_list[0])
 
 
+@ussd_node('book_for_child')
 def _handle_book_for_child_flow(user, input_list):
     parent = Parent.query.filter_by(user_id=user.id).first()
     if not parent:
@@ -401,6 +408,7 @@ def _handle_my_appointments(user):
     return "".join(lines)
 
 
+@ussd_node('health_tips')
 def handle_health_tips(user, input_list):
     back = _back_or_main(user, input_list, handle_health_tips)
     if back:
@@ -427,30 +435,14 @@ def handle_health_tips(user, input_list):
 
 
 def _get_random_tip(user):
-    items = ContentItem.query.filter_by(status='published').limit(20).all()
-    if not items:
-        items = ContentItem.query.limit(10).all()
-    if not items:
-        return "END No health tips available yet."
-
-    item = random.choice(items)
-    content = item.summary or item.content
-    text = content[:140] + '...' if len(content) > 140 else content
-    return f"END 💡 {item.title}\n\n{text}"
+    return tip_cache.random_tip()
 
 
 def _get_category_tip(keyword):
-    categories = ContentCategory.query.all()
-    for cat in categories:
-        if keyword.lower() in cat.name.lower():
-            items = ContentItem.query.filter_by(category_id=cat.id).limit(5).all()
-            if items:
-                item = random.choice(items)
-                text = (item.summary or item.content)[:140]
-                return f"END 💡 {item.title}\n\n{text}"
-    return _get_random_tip(None)
+    return tip_cache.category_tip(keyword)
 
 
+@ussd_node('notifications')
 def handle_ussd_notifications(user, input_list):
     back = _back_or_main(user, input_list, handle_ussd_notifications)
     if back:
@@ -459,14 +451,9 @@ def handle_ussd_notifications(user, input_list):
     step = len(input_list)
 
     if step == 0:
-        notifications = (
-            Notification.query.filter_by(user_id=user.id, is_read=False)
-            .order_by(Notification.created_at.desc())
-            .limit(5)
-            .all()
-        )
-        unread_count = notification_manager.get_unread_count(user.id)
-
+        # Cached per user; dropped whenever one of their notifications changes
+        inbox = unread_inbox(user.id)
+        notifications = inbox['items']
         if not notifications:
             return (
                 f"CON 🔔 Notifications:\n"
@@ -474,9 +461,9 @@ def handle_ussd_notifications(user, input_list):
                 f"1. View all\n0. Back"
             )
 
-        menu = f"CON 🔔 {unread_count} unread:\n"
-        for idx, n in enumerate(notifications[:4], 1):
-            title = n.title[:30] + '...' if len(n.title) > 30 else n.title
+        menu = f"CON 🔔 {inbox['count']} unread:\n"
+        for idx, (_, title, _) in enumerate(notifications[:4], 1):
+            title = title[:30] + '...' if len(title) > 30 else title
             menu += f"{idx}. {title}\n"
         menu += "5. Mark all read\n0. Back"
         return menu
@@ -488,21 +475,17 @@ def handle_ussd_notifications(user, input_list):
         return "END ✅ All notifications marked as read."
 
     if choice.isdigit() and 1 <= int(choice) <= 4:
-        notifications = (
-            Notification.query.filter_by(user_id=user.id, is_read=False)
-            .order_by(Notification.created_at.desc())
-            .limit(5)
-            .all()
-        )
+        notifications = unread_inbox(user.id)['items']
         idx = int(choice) - 1
         if idx < len(notifications):
-            n = notifications[idx]
-            notification_manager.mark_read(n.id, user.id)
-            return f"END 📬 {n.title}\n\n{n.message[:200]}"
+            notification_id, title, message = notifications[idx]
+            notification_manager.mark_read(notification_id, user.id)
+            return f"END 📬 {title}\n\n{message}"
 
     return "CON 0. Back"
 
 
+@ussd_node('family')
 def handle_parent_dashboard(user, input_list):
     from datetime import date
 
@@ -633,6 +616,7 @@ def handle_parent_dashboard(user, input_list):
     return "CON 0. Back"
 
 
+@ussd_node('settings')
 def handle_settings(user, input_list):
     back = _back_or_main(user, input_list, handle_settings)
     if back:
@@ -656,6 +640,7 @@ def handle_settings(user, input_list):
     return "CON Invalid selection.\n0. Back"
 
 
+@ussd_node('change_pin')
 def _handle_change_pin(user, input_list):
     back = _back_or_main(user, input_list, lambda u, il: handle_settings(u, ['1'] + il))
     if back:
@@ -672,7 +657,7 @@ def _handle_change_pin(user, input_list):
         if input_list[0] != input_list[1]:
             return "CON PINs don't match.\nEnter new PIN:"
         try:
-            user.pin_hash = bcrypt.generate_password_hash(input_list[0]).decode('utf-8')
+            user.pin_hash = hash_pin(input_list[0])
             user.enable_pin_auth = True
             db.session.commit()
             return "END ✅ PIN updated successfully."
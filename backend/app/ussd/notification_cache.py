@@ -0,0 +1,69 @@
+"""
+Unread notifications for the USSD notifications menu.
+
+The menu used to run the unread-list query and an unread count on every
+render, and the list query again for the detail view. The few rows the menu
+shows and the count are kept per user in a shared store instead; a commit
+that inserts, updates or deletes one of the user's Notification rows (and
+``notification_manager.mark_all_read``, which updates in bulk) drops the
+entry, so the next render reads fresh rows.
+"""
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.models.notification import Notification
+from app.services.notification_manager import notification_manager
+from app.utils.kv_store import SharedKVStore
+
+# Backstop for notifications that expire without any write
+INBOX_TTL_SECONDS = 300
+# Rows the menu lists (it shows 4; a fifth tells it there are more)
+INBOX_SIZE = 5
+MESSAGE_CHARS = 200
+
+_inboxes = SharedKVStore('ussd_notification_inbox', default_ttl=INBOX_TTL_SECONDS, max_entries=100000)
+
+
+def unread_inbox(user_id):
+    """``{'count': unread, 'items': [[id, title, message], ...]}``, newest first."""
+    inbox = _inboxes.get(user_id)
+    if inbox is not None:
+        return inbox
+
+    rows = (
+        Notification.query.filter_by(user_id=user_id, is_read=False)
+        .order_by(Notification.created_at.desc())
+        .limit(INBOX_SIZE)
+        .all()
+    )
+    inbox = {
+        'count': notification_manager.get_unread_count(user_id),
+        'items': [[n.id, n.title, (n.message or '')[:MESSAGE_CHARS]] for n in rows],
+    }
+    _inboxes.set(user_id, inbox)
+    return inbox
+
+
+def invalidate_inbox(user_id):
+    _inboxes.delete(user_id)
+
+
+@event.listens_for(Notification, 'after_insert')
+@event.listens_for(Notification, 'after_update')
+@event.listens_for(Notification, 'after_delete')
+def _mark_inbox_changed(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None and target.user_id is not None:
+        session.info.setdefault('ussd_inbox_users', set()).add(target.user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _drop_changed_inboxes(session):
+    for user_id in session.info.pop('ussd_inbox_users', ()):
+        invalidate_inbox(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_inbox_changes(session):
+    session.info.pop('ussd_inbox_users', None)
@@ -0,0 +1,336 @@
+"""
+SMS digests of notifications for feature-phone users.
+
+USSD-registered users only saw notifications when they dialled in and opened
+the notifications menu. When ``SMS_OUTBOUND_ENABLED`` is on, every in-app
+Notification for such a user is mirrored into ``ussd_notifications`` inside
+the same transaction (one INSERT ... SELECT, no extra lookup), and a
+background dispatcher periodically:
+
+1. claims a batch of due rows with a single UPDATE (a claim token plus a
+   lease, so several workers can run the dispatcher without double sends),
+2. packs each user's rows into SMS-sized digests and sends them through the
+   configured gateway, within a shared per-second rate limit,
+3. writes every outcome (sent, retry with backoff, failed, skipped because
+   already read in the app) back in one executemany UPDATE.
+"""
+
+import logging
+import os
+import threading
+import time
+import unicodedata
+import uuid
+from datetime import datetime, timedelta
+from itertools import groupby
+
+from flask import current_app, has_app_context
+from sqlalchemy import and_, bindparam, event, literal, or_, select, update
+
+from app import db
+from app.models import User
+from app.models.notification import Notification
+from app.services.sms_gateway import SMSGatewayError, gateway_kind, get_sms_gateway
+from app.utils.kv_store import SharedKVStore, SlidingWindowCounter
+from app.ussd.ussd_models import USSDNotification
+
+logger = logging.getLogger(__name__)
+
+FEATURE_PHONE_ACCOUNT_TYPES = ('ussd_registered',)
+
+DIGEST_PREFIX = "Lady's Essence"
+ITEM_CHARS = 120
+# Two concatenated GSM-7 segments
+DEFAULT_MAX_CHARS = 306
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_RATE_PER_SECOND = 5
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_BASE_SECONDS = 60
+MAX_RETRY_DELAY_SECONDS = 3600
+CLAIM_LEASE_SECONDS = 300
+
+PRIORITY_BY_SEVERITY = {'error': 'urgent', 'warning': 'high'}
+PRIORITY_RANK = {'urgent': 0, 'high': 1, 'normal': 2, 'low': 3}
+
+# GSM 03.38 basic character set: anything else forces UCS-2 and 70-char segments
+GSM_CHARS = set(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+ASCII_REPLACEMENTS = {'‘': "'", '’': "'", '“': '"', '”': '"', '–': '-', '—': '-', '…': '...'}
+
+_send_rate = SlidingWindowCounter(SharedKVStore('sms_send_rate', default_ttl=10, max_entries=100), 1)
+
+
+# ── Mirroring notifications ───────────────────────────────────────────────
+
+@event.listens_for(Notification, 'after_insert')
+def _mirror_for_feature_phones(mapper, connection, target):
+    if not has_app_context() or not current_app.config.get('SMS_OUTBOUND_ENABLED'):
+        return
+
+    table = USSDNotification.__table__
+    users = User.__table__
+    values = {
+        'user_id': users.c.id,
+        'notification_id': literal(target.id, table.c.notification_id.type),
+        'notification_type': literal(target.notification_type or 'system', table.c.notification_type.type),
+        'message': literal(f"{target.title}: {target.message}", table.c.message.type),
+        'priority': literal(PRIORITY_BY_SEVERITY.get(target.severity, 'normal'), table.c.priority.type),
+        'scheduled_for': literal(target.scheduled_for, table.c.scheduled_for.type),
+        'sent': literal(False, table.c.sent.type),
+        'read': literal(False, table.c.read.type),
+        'delivery_status': literal('pending', table.c.delivery_status.type),
+        'attempts': literal(0, table.c.attempts.type),
+        'created_at': literal(datetime.utcnow(), table.c.created_at.type),
+    }
+    source = select(*values.values()).where(
+        users.c.id == target.user_id,
+        users.c.account_type.in_(FEATURE_PHONE_ACCOUNT_TYPES),
+    )
+    connection.execute(table.insert().from_select(list(values), source))
+
+
+# ── Digests ───────────────────────────────────────────────────────────────
+
+def sms_text(text):
+    """``text`` reduced to the GSM-7 alphabet (emoji dropped, accents folded)."""
+    out = []
+    for char in text or '':
+        char = ASCII_REPLACEMENTS.get(char, char)
+        if all(c in GSM_CHARS for c in char):
+            out.append(char)
+            continue
+        folded = unicodedata.normalize('NFKD', char).encode('ascii', 'ignore').decode('ascii')
+        out.append(folded if folded.isprintable() else '')
+    return ' '.join(''.join(out).split())
+
+
+def _clip(text, limit):
+    return text if len(text) <= limit else text[:limit - 3].rstrip() + '...'
+
+
+def build_digests(messages, max_chars=DEFAULT_MAX_CHARS):
+    """Pack messages into as few SMS bodies of at most ``max_chars`` as possible.
+
+    Returns ``[(indexes, body)]`` where ``indexes`` are the positions in
+    ``messages`` that each body carries.
+    """
+    items = [_clip(sms_text(message), ITEM_CHARS) for message in messages]
+    digests = []
+    start = 0
+    while start < len(items):
+        end = start + 1
+        while end < len(items) and len(_digest_body(items[start:end + 1])) <= max_chars:
+            end += 1
+        body = _digest_body(items[start:end])
+        digests.append((list(range(start, end)), _clip(body, max_chars)))
+        start = end
+    return digests
+
+
+def _digest_body(items):
+    if len(items) == 1:
+        return f"{DIGEST_PREFIX}: {items[0]}"
+    lines = [f"{DIGEST_PREFIX} ({len(items)} new):"]
+    lines.extend(f"{idx}. {item}" for idx, item in enumerate(items, 1))
+    return '\n'.join(lines)
+
+
+# ── Dispatch ──────────────────────────────────────────────────────────────
+
+def _due(now):
+    return and_(
+        USSDNotification.delivery_status.in_(('pending', 'sending')),
+        or_(USSDNotification.next_attempt_at.is_(None), USSDNotification.next_attempt_at <= now),
+        or_(USSDNotification.scheduled_for.is_(None), USSDNotification.scheduled_for <= now),
+    )
+
+
+def _claim(limit, now):
+    """Claim up to ``limit`` due rows for this run; expired claims are taken over."""
+    ids = [row_id for (row_id,) in (
+        db.session.query(USSDNotification.id)
+        .filter(_due(now))
+        .order_by(USSDNotification.user_id, USSDNotification.id)
+        .limit(limit)
+        .all()
+    )]
+    if not ids:
+        return []
+
+    token = uuid.uuid4().hex
+    db.session.execute(
+        update(USSDNotification)
+        .where(USSDNotification.id.in_(ids), _due(now))
+        .values(delivery_status='sending', claim_token=token,
+                next_attempt_at=now + timedelta(seconds=CLAIM_LEASE_SECONDS))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+    return (
+        db.session.query(
+            USSDNotification.id, USSDNotification.user_id, USSDNotification.message,
+            USSDNotification.priority, USSDNotification.attempts,
+            User.phone_e164, User.is_active, Notification.is_read,
+        )
+        .join(User, User.id == USSDNotification.user_id)
+        .outerjoin(Notification, Notification.id == USSDNotification.notification_id)
+        .filter(USSDNotification.claim_token == token)
+        .order_by(USSDNotification.user_id, USSDNotification.id)
+        .all()
+    )
+
+
+def _acquire_send_slot(rate_per_second, wait_seconds=2.0):
+    """Wait for a slot in the shared per-second send limit; False if none came up."""
+    if not rate_per_second:
+        return True
+    deadline = time.monotonic() + wait_seconds
+    while not _send_rate.hit('send', rate_per_second):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def _outcome(row, status, now, error=None, next_attempt_at=None, attempted=True):
+    return {
+        'b_id': row.id,
+        'b_status': status,
+        'b_attempts': row.attempts + (1 if attempted else 0),
+        'b_next_attempt_at': next_attempt_at,
+        'b_last_error': error,
+        'b_sent': status == 'sent',
+        'b_sent_at': now if status == 'sent' else None,
+    }
+
+
+def _apply(outcomes):
+    """Write every outcome back in one executemany UPDATE."""
+    if not outcomes:
+        return
+    stmt = (
+        update(USSDNotification.__table__)
+        .where(USSDNotification.__table__.c.id == bindparam('b_id'))
+        .values(
+            delivery_status=bindparam('b_status'),
+            attempts=bindparam('b_attempts'),
+            next_attempt_at=bindparam('b_next_attempt_at'),
+            last_error=bindparam('b_last_error'),
+            sent=bindparam('b_sent'),
+            sent_at=bindparam('b_sent_at'),
+            claim_token=None,
+        )
+    )
+    db.session.execute(stmt, outcomes)
+    db.session.commit()
+
+
+def dispatch_pending(gateway=None, batch_size=None):
+    """Claim, send and record one batch of due notifications; returns counters."""
+    config = current_app.config
+    gateway = gateway or get_sms_gateway()
+    batch_size = batch_size or config.get('SMS_DIGEST_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    max_chars = config.get('SMS_DIGEST_MAX_CHARS', DEFAULT_MAX_CHARS)
+    rate = config.get('SMS_RATE_PER_SECOND', DEFAULT_RATE_PER_SECOND)
+    max_attempts = config.get('SMS_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+    retry_base = config.get('SMS_RETRY_BASE_SECONDS', DEFAULT_RETRY_BASE_SECONDS)
+
+    now = datetime.utcnow()
+    rows = _claim(batch_size, now)
+    stats = {'claimed': len(rows), 'digests': 0, 'sent': 0, 'retrying': 0, 'failed': 0, 'skipped': 0, 'deferred': 0}
+    outcomes = []
+
+    for _, group in groupby(rows, key=lambda row: row.user_id):
+        group = list(group)
+        phone = group[0].phone_e164
+        if not phone or not group[0].is_active:
+            outcomes.extend(_outcome(row, 'skipped', now, 'No active phone number', attempted=False) for row in group)
+            stats['skipped'] += len(group)
+            continue
+
+        unread = []
+        for row in group:
+            if row.is_read:
+                outcomes.append(_outcome(row, 'skipped', now, 'Read in the app', attempted=False))
+                stats['skipped'] += 1
+            else:
+                unread.append(row)
+        unread.sort(key=lambda row: (PRIORITY_RANK.get(row.priority, 2), row.id))
+
+        for indexes, body in build_digests([row.message for row in unread], max_chars):
+            digest_rows = [unread[i] for i in indexes]
+            if not _acquire_send_slot(rate):
+                # Out of send budget: hand the rows back without spending an attempt
+                outcomes.extend(_outcome(row, 'pending', now, attempted=False) for row in digest_rows)
+                stats['deferred'] += len(digest_rows)
+                continue
+
+            stats['digests'] += 1
+            try:
+                gateway.send(phone, body)
+            except SMSGatewayError as exc:
+                for row in digest_rows:
+                    if exc.retryable and row.attempts + 1 < max_attempts:
+                        delay = min(retry_base * 2 ** row.attempts, MAX_RETRY_DELAY_SECONDS)
+                        outcomes.append(_outcome(row, 'pending', now, str(exc), now + timedelta(seconds=delay)))
+                        stats['retrying'] += 1
+                    else:
+                        outcomes.append(_outcome(row, 'failed', now, str(exc)))
+                        stats['failed'] += 1
+                continue
+            outcomes.extend(_outcome(row, 'sent', now) for row in digest_rows)
+            stats['sent'] += len(digest_rows)
+
+    _apply(outcomes)
+    if rows:
+        logger.info(f"SMS digest run: {stats}")
+    return stats
+
+
+class DigestDispatcher:
+    """Runs ``dispatch_pending`` every ``SMS_DIGEST_INTERVAL`` seconds on a daemon thread."""
+
+    def __init__(self):
+        self._app = None
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self.interval = 60.0
+
+    def start(self, app):
+        self.interval = float(app.config.get('SMS_DIGEST_INTERVAL', 60))
+        self._app = app
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='sms-digest-dispatcher', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def run_once(self):
+        with self._app.app_context():
+            try:
+                return dispatch_pending()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"SMS digest dispatch failed: {e}")
+                return None
+            finally:
+                db.session.remove()
+
+
+digest_dispatcher = DigestDispatcher()
+
+
+def init_sms_outbound(app):
+    if app.config.get('SMS_OUTBOUND_ENABLED'):
+        # Refuse to start rather than mark digests sent through a gateway that drops them
+        gateway_kind(app)
+        digest_dispatcher.start(app)
@@ -0,0 +1,174 @@
+"""
+Pre-rendered cycle predictions for the USSD predictions menu.
+
+Running the prediction engine (all of a user's cycle logs, outlier detection,
+baseline, anomaly checks) inside a USSD hop is the slowest thing the menu
+does. Instead the rendered screen is kept per user in a shared store. A
+commit that touches a user's CycleLog rows drops their entry and queues a
+background refresh, so the next visit normally finds a fresh screen. On a
+miss the hop answers with a simple average-gap estimate and queues the
+refresh rather than waiting for the engine.
+
+Until ``init_prediction_refresh`` has started the refresher (tests, scripts,
+a bare Flask app) a miss renders the full prediction inline, as before.
+"""
+
+import logging
+import os
+import threading
+from datetime import timedelta
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import CycleLog
+from app.utils.kv_store import SharedKVStore
+from app.ussd.cycle import NEED_TWO_PERIODS, NO_CYCLE_DATA, prediction_screen, render_cycle_predictions
+
+logger = logging.getLogger(__name__)
+
+# Predictions are relative to today, so even an untouched entry is redone daily
+PREDICTION_TTL_SECONDS = 6 * 3600
+
+# Fallback estimate: recent gaps between period starts that look like real cycles
+FALLBACK_CYCLES = 6
+MIN_CYCLE_DAYS = 15
+MAX_CYCLE_DAYS = 60
+
+_predictions = SharedKVStore('ussd_cycle_prediction', default_ttl=PREDICTION_TTL_SECONDS, max_entries=100000)
+
+
+def cached_prediction(user_id):
+    """Predictions screen for ``user_id`` without running the engine on a warm cache."""
+    screen = _predictions.get(user_id)
+    if screen is not None:
+        return screen
+
+    if prediction_refresher.request(user_id):
+        return average_prediction(user_id)
+
+    screen = render_cycle_predictions(user_id)
+    _predictions.set(user_id, screen)
+    return screen
+
+
+def average_prediction(user_id):
+    """Next period from the mean gap between recent period starts (one small query)."""
+    starts = [start for (start,) in (
+        db.session.query(CycleLog.start_date)
+        .filter(CycleLog.user_id == user_id)
+        .order_by(CycleLog.start_date.desc())
+        .limit(FALLBACK_CYCLES + 1)
+        .all()
+    )]
+    if not starts:
+        return NO_CYCLE_DATA
+
+    gaps = [
+        (newer - older).days for newer, older in zip(starts, starts[1:])
+        if MIN_CYCLE_DAYS <= (newer - older).days <= MAX_CYCLE_DAYS
+    ]
+    if not gaps:
+        return NEED_TWO_PERIODS
+
+    next_start = starts[0] + timedelta(days=round(sum(gaps) / len(gaps)))
+    ovulation = next_start - timedelta(days=14)
+    return prediction_screen(next_start, 'estimate', ovulation - timedelta(days=5), ovulation + timedelta(days=1))
+
+
+def refresh_prediction(user_id):
+    _predictions.set(user_id, render_cycle_predictions(user_id))
+
+
+def invalidate_prediction(user_id):
+    _predictions.delete(user_id)
+
+
+class PredictionRefresher:
+    """Re-renders queued users' predictions on a daemon thread."""
+
+    def __init__(self):
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._app = None
+        self._thread = None
+        self._pid = None
+
+    @property
+    def started(self):
+        return self._app is not None
+
+    def start(self, app):
+        self._app = app
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='ussd-prediction-refresh', daemon=True)
+        self._thread.start()
+
+    def request(self, user_id):
+        """Queue a refresh; False when no refresher is running in this process."""
+        if self._app is None:
+            return False
+        with self._lock:
+            self._pending.add(user_id)
+        self._ensure_thread()
+        self._wakeup.set()
+        return True
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            self.drain()
+
+    def drain(self):
+        with self._lock:
+            user_ids, self._pending = self._pending, set()
+        if not user_ids:
+            return
+        with self._app.app_context():
+            try:
+                for user_id in user_ids:
+                    try:
+                        refresh_prediction(user_id)
+                    except Exception as e:
+                        db.session.rollback()
+                        logger.warning(f"USSD prediction refresh failed for user {user_id}: {e}")
+            finally:
+                db.session.remove()
+
+
+prediction_refresher = PredictionRefresher()
+
+
+def init_prediction_refresh(app):
+    if app.config.get('USSD_PREDICTION_REFRESH_ENABLED', True):
+        prediction_refresher.start(app)
+
+
+@event.listens_for(CycleLog, 'after_insert')
+@event.listens_for(CycleLog, 'after_update')
+@event.listens_for(CycleLog, 'after_delete')
+def _mark_cycle_changed(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None and target.user_id is not None:
+        session.info.setdefault('ussd_prediction_users', set()).add(target.user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _refresh_changed_predictions(session):
+    # Only once the new log is visible to the refresh query
+    for user_id in session.info.pop('ussd_prediction_users', ()):
+        invalidate_prediction(user_id)
+        prediction_refresher.request(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_cycle_changes(session):
+    session.info.pop('ussd_prediction_users', None)
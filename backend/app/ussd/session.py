@@ -1,112 +1,101 @@
 import logging
-import re
 import time
 from datetime import datetime, timedelta
 
+from sqlalchemy import case, event, or_
+from sqlalchemy.orm import defer
+from sqlalchemy.exc import SQLAlchemyError
+
 from app import db
 from app.models import User
-from app.ussd.constants import LOGIN_ATTEMPTS
+from app.services.pin_auth import credential_matches_pin, issue_session_credential, read_session_credential
+from app.utils.buffered_writer import BufferedWriter
+from app.utils.kv_store import MemoryKVStore, SharedKVStore, SlidingWindowCounter
+from app.utils.phone import canonical_phone, normalize_phone, phone_lookup_variants, to_stored_phone  # noqa: F401
+from app.ussd.state import note_authenticated
 from app.ussd.ussd_models import USSDSession, USSDTransaction
 
 logger = logging.getLogger(__name__)
 
-_rate_limit_store = {}
-_memory_sessions = {}
-
-
-def normalize_phone(phone_number):
-    """Normalize to E.164 Rwanda (+250…) from any common local/international input."""
-    cleaned = re.sub(r'[\s\-]', '', (phone_number or '').strip())
-    if not cleaned:
-        return cleaned
-
-    if cleaned.startswith('+250'):
-        return cleaned
-
-    if cleaned.startswith('250') and len(cleaned) >= 12:
-        return '+' + cleaned
-
-    # Local Rwanda mobile: 07XXXXXXXX
-    if cleaned.startswith('07') and len(cleaned) == 10:
-        return '+250' + cleaned[1:]
+SESSION_TTL_SECONDS = 900
 
-    # Without leading 0: 7XXXXXXXX (9 digits)
-    if cleaned.startswith('7') and len(cleaned) == 9 and cleaned.isdigit():
-        return '+250' + cleaned
+# Shared between workers once init_kv_store has run, so a PIN verified on one
+# worker is honoured by the others without a DB read
+_auth_sessions = SharedKVStore('ussd_auth_sessions', default_ttl=SESSION_TTL_SECONDS, max_entries=50000)
+_login_attempts = SharedKVStore('ussd_login_attempts', default_ttl=SESSION_TTL_SECONDS, max_entries=50000)
+_login_rate = SharedKVStore('ussd_login_rate', default_ttl=2 * SESSION_TTL_SECONDS, max_entries=100000)
 
-    if not cleaned.startswith('+'):
-        return '+' + cleaned
+# One row per hop, batched off the request path
+ussd_transaction_writer = BufferedWriter(
+    'ussd_transactions', USSDTransaction.__table__, config_prefix='USSD_TXN_LOG'
+)
 
-    return cleaned
 
+# Numbers recently looked up and not registered; saves a DB read on every
+# hop of an unregistered caller's registration flow
+_unknown_phones = MemoryKVStore('ussd_unknown_phone', default_ttl=30, max_entries=20000)
 
-def phone_lookup_variants(raw_phone):
-    """Generate all formats to match DB records stored with or without country code."""
-    cleaned = re.sub(r'[\s\-]', '', (raw_phone or '').strip())
-    if not cleaned:
-        return []
 
-    variants = set()
-    variants.add(cleaned)
+def find_user_by_phone(raw_phone, use_cache=True):
+    """Look up a user by phone in one read over the canonical and stored phone columns.
 
-    e164 = normalize_phone(cleaned)
-    if e164:
-        variants.add(e164)
+    Accounts the phone_e164 backfill left NULL (duplicates of an older
+    account's number) are still found by an exact ``phone_number`` match,
+    which wins over the canonical holder when the number was typed exactly
+    as that account stored it.
+    ``use_cache=False`` skips the negative cache; use it before creating an
+    account so a registration on another worker is never missed.
+    """
+    canonical = canonical_phone(raw_phone)
+    if not canonical:
+        return None
 
-    # National number digits after +250
-    national = None
-    if e164.startswith('+250'):
-        national = e164[4:]
-    elif cleaned.startswith('250') and len(cleaned) >= 12:
-        national = cleaned[3:]
-    elif cleaned.startswith('07') and len(cleaned) == 10:
-        national = cleaned[1:]
-    elif cleaned.startswith('7') and len(cleaned) == 9:
-        national = cleaned
-
-    if national:
-        variants.add(national)
-        variants.add('0' + national)
-        variants.add('250' + national)
-        variants.add('+250' + national)
-
-    return list(variants)
+    if use_cache and _unknown_phones.get(canonical):
+        return None
 
+    typed = (raw_phone or '').strip()
+    stored = to_stored_phone(typed)
+    try:
+        user = User.query.filter(or_(
+            User.phone_e164 == canonical, User.phone_number.in_({typed, stored})
+        )).order_by(
+            # Typed exactly as stored, then the canonical holder, then another stored format
+            case((User.phone_number == typed, 0), (User.phone_e164 == canonical, 1), else_=2),
+            User.id,
+        ).first()
+    except SQLAlchemyError as exc:
+        # Schema not migrated yet: the exact match never selects phone_e164
+        logger.warning(f"phone_e164 lookup failed, falling back to phone_number: {exc}")
+        db.session.rollback()
+        user = _find_by_phone_number(typed, stored)
 
-def to_stored_phone(raw_phone):
-    """Store phones in local Rwanda format (07XXXXXXXX) to match existing DB records."""
-    e164 = normalize_phone(raw_phone)
-    if e164.startswith('+250'):
-        return '0' + e164[4:]
-    return re.sub(r'[\s\-]', '', (raw_phone or '').strip()).lstrip('+')
+    if user is None:
+        _unknown_phones.set(canonical, True)
+    return user
 
 
-def find_user_by_phone(raw_phone):
-    """Look up user trying all common phone formats, including DB numbers without +250."""
-    for variant in phone_lookup_variants(raw_phone):
-        user = User.query.filter_by(phone_number=variant).first()
-        if user:
-            return user
+def _find_by_phone_number(typed, *formats):
+    """Exact ``phone_number`` match, preferring ``typed`` over the other ``formats``"""
+    return User.query.options(defer(User.phone_e164)).filter(
+        User.phone_number.in_({typed, *formats})
+    ).order_by(case((User.phone_number == typed, 0), else_=1), User.id).first()
 
-    # Fallback: match last 9 digits (handles inconsistent DB formatting)
-    cleaned = re.sub(r'\D', '', (raw_phone or ''))
-    if cleaned.startswith('250'):
-        cleaned = cleaned[3:]
-    if cleaned.startswith('0'):
-        cleaned = cleaned[1:]
-    if len(cleaned) >= 9:
-        suffix = cleaned[-9:]
-        user = User.query.filter(User.phone_number.like(f'%{suffix}')).first()
-        if user:
-            return user
 
-    return None
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+def _forget_unknown_phone(mapper, connection, target):
+    # Read without loading: a user found by the fallback has phone_e164 deferred
+    phone_e164 = target.__dict__.get('phone_e164')
+    if phone_e164:
+        _unknown_phones.delete(phone_e164)
 
 
-def mark_session_authenticated(session_id, user_id):
-    """Mark a USSD session as authenticated."""
-    expires = datetime.utcnow() + timedelta(minutes=15)
-    _memory_sessions[(session_id, user_id)] = expires
+def mark_session_authenticated(session_id, user_id, pin=None):
+    """Mark a USSD session as authenticated with a signed session credential."""
+    expires = datetime.utcnow() + timedelta(seconds=SESSION_TTL_SECONDS)
+    credential = issue_session_credential(session_id, user_id, time.time() + SESSION_TTL_SECONDS, pin)
+    _auth_sessions.set(f'{session_id}:{user_id}', credential)
+    note_authenticated(session_id, user_id, expires)
 
     try:
         session = USSDSession.query.filter_by(session_id=session_id).first()
@@ -133,11 +122,11 @@ def mark_session_authenticated(session_id, user_id):
 
 def is_session_authenticated(session_id, user_id):
     """Check if session is authenticated and not expired."""
-    mem_key = (session_id, user_id)
-    if mem_key in _memory_sessions:
-        if _memory_sessions[mem_key] >= datetime.utcnow():
-            return True
-        _memory_sessions.pop(mem_key, None)
+    credential = read_session_credential(_auth_sessions.get(f'{session_id}:{user_id}'), session_id, user_id)
+    if credential:
+        expires = datetime.utcnow() + timedelta(seconds=credential['exp'] - time.time())
+        note_authenticated(session_id, user_id, expires)
+        return True
 
     try:
         session = USSDSession.query.filter_by(
@@ -149,58 +138,54 @@ def is_session_authenticated(session_id, user_id):
             return False
         if session.expires_at and session.expires_at < datetime.utcnow():
             return False
+        if session.expires_at:
+            note_authenticated(session_id, user_id, session.expires_at)
         return True
     except Exception as exc:
         logger.warning(f"USSD session DB read failed: {exc}")
         db.session.rollback()
-        return mem_key in _memory_sessions
+        return False
+
+
+def pin_verified_in_session(session_id, user_id, pin):
+    """True if this PIN already unlocked this session; checked by HMAC, not bcrypt."""
+    credential = read_session_credential(_auth_sessions.get(f'{session_id}:{user_id}'), session_id, user_id)
+    return credential_matches_pin(credential, session_id, user_id, pin)
 
 
 def increment_login_attempts(session_id):
-    LOGIN_ATTEMPTS[session_id] = LOGIN_ATTEMPTS.get(session_id, 0) + 1
-    return LOGIN_ATTEMPTS[session_id]
+    return _login_attempts.incr(session_id)
 
 
 def clear_login_attempts(session_id):
-    LOGIN_ATTEMPTS.pop(session_id, None)
+    _login_attempts.delete(session_id)
 
 
 def rate_limit_ussd_login(phone_number, max_attempts=5, window_seconds=900):
     """Limit login attempts per phone number (5 per 15 minutes)."""
-    now = time.time()
-    window_start = now - window_seconds
+    return SlidingWindowCounter(_login_rate, window_seconds).hit(phone_number, max_attempts)
 
-    attempts = _rate_limit_store.get(phone_number, [])
-    attempts = [t for t in attempts if t > window_start]
 
-    if len(attempts) >= max_attempts:
-        return False
-
-    attempts.append(now)
-    _rate_limit_store[phone_number] = attempts
-    return True
+def init_ussd_transaction_log(app):
+    """Start the background flusher for USSD transaction rows in this process."""
+    ussd_transaction_writer.start(app)
 
 
 def log_ussd_transaction(session_id, phone_number, user_id, request_text,
-                         response_text, menu_state, success=True, error=None):
-    """Log every USSD interaction to USSDTransaction."""
-    try:
-        txn = USSDTransaction(
-            session_id=session_id,
-            phone_number=phone_number,
-            user_id=user_id,
-            request_text=(request_text or '')[:500],
-            response_text=(response_text or '')[:500],
-            menu_state=menu_state,
-            transaction_type='menu_navigation' if '*' in (request_text or '') else 'data_entry',
-            success=success,
-            error_message=error,
-        )
-        db.session.add(txn)
-        db.session.commit()
-    except Exception as exc:
-        logger.debug(f"USSD transaction log skipped: {exc}")
-        db.session.rollback()
+                         response_text, menu_state, success=True, error=None, duration_ms=None):
+    """Queue a USSDTransaction row for every USSD interaction; never commits on the hop."""
+    ussd_transaction_writer.submit({
+        'session_id': session_id,
+        'phone_number': phone_number,
+        'user_id': user_id,
+        'request_text': (request_text or '')[:500],
+        'response_text': (response_text or '')[:500],
+        'menu_state': menu_state,
+        'transaction_type': 'menu_navigation' if '*' in (request_text or '') else 'data_entry',
+        'success': success,
+        'error_message': error,
+        'duration_ms': round(duration_ms) if duration_ms is not None else None,
+    })
 
 
 def user_first_name(user):
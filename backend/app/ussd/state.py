@@ -0,0 +1,228 @@
+"""
+Per-session USSD state so each hop only processes the newest input segment.
+
+Gateways resend the whole ``text`` (``1*2*3*...``) on every hop. Replaying it
+from the main menu repeats the phone lookup, the session check and the queries
+of every intermediate menu. Instead we remember, per ``sessionId``, the user,
+whether the PIN step succeeded, the text seen on the previous hop and the
+deepest menu node reached together with the segments it has collected (its
+form). When the new text is the previous text plus one segment, that node is
+called directly with ``form + [segment]`` — exactly what the full replay would
+have passed it. Anything else (no state, an unrelated text, a back key, a hop
+that navigated back) falls back to the full replay.
+
+A hop that overran its budget answers "Reply 1 to check again"; that reply
+stays in every later ``text`` the gateway sends, so its offset is kept in
+``ignored`` and dropped from the segments a replay hands to the menus.
+
+State lives in an in-process LRU and, once the session is authenticated, in
+``USSDSession.menu_data`` so a hop landing on another worker can resume too.
+"""
+
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import wraps
+
+from app import db
+from app.utils.kv_store import MemoryKVStore
+from app.ussd.ussd_models import USSDSession
+
+logger = logging.getLogger(__name__)
+
+STATE_TTL_SECONDS = 300
+
+# Back navigation is decided by the outermost menu whose last input is 0/00,
+# which a direct call to the current node cannot reproduce
+BACK_KEYS = ('0', '00')
+
+PERSISTED_FIELDS = ('phone', 'user_id', 'auth_expires', 'last_text', 'node', 'form', 'pending', 'ignored')
+
+# Menu handlers that can be resumed by name, filled in by @ussd_node
+NODES = {}
+
+_states = MemoryKVStore('ussd_session_state', default_ttl=STATE_TTL_SECONDS, max_entries=50000)
+_current = ContextVar('ussd_session_state', default=None)
+
+
+@dataclass
+class SessionState:
+    session_id: str
+    phone: str = ''
+    user_id: int = None
+    auth_expires: float = None  # epoch seconds
+    last_text: str = ''
+    node: str = None
+    form: list = field(default_factory=list)
+    pending: bool = False  # a handler overran the hop budget and is still running
+    ignored: list = field(default_factory=list)  # offsets of segments that answered "check again"
+    backtracked: bool = False  # set during a hop, never persisted
+
+    def is_authenticated(self):
+        return bool(self.auth_expires) and self.auth_expires >= time.time()
+
+    def ignore_last_segment(self, text):
+        """The newest segment of ``text`` answered the please-wait screen, not a menu."""
+        offset = text.count('*')
+        if offset not in self.ignored:
+            self.ignored.append(offset)
+
+    def menu_inputs(self, text):
+        """Segments of ``text`` as the menus expect them, without ignored replies."""
+        segments = text.split('*') if text else []
+        if not self.ignored:
+            return segments
+        return [segment for offset, segment in enumerate(segments) if offset not in self.ignored]
+
+    def next_segment(self, text):
+        """The single segment ``text`` adds to the previous hop's text, or None."""
+        if text == self.last_text:
+            return None
+        if self.last_text:
+            prefix = self.last_text + '*'
+            if not text.startswith(prefix):
+                return None
+            segment = text[len(prefix):]
+        else:
+            segment = text
+        return None if '*' in segment else segment
+
+    def resumable_segment(self, text, phone):
+        """Segment to feed straight into the saved node, or None if a replay is needed."""
+        if phone != self.phone or not self.user_id or self.node not in NODES:
+            return None
+        if not self.is_authenticated():
+            return None
+        segment = self.next_segment(text)
+        if segment is None or segment in BACK_KEYS:
+            return None
+        return segment
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in PERSISTED_FIELDS}
+
+
+def load_state(session_id):
+    """Saved state for a session: in-process LRU first, then the session row."""
+    if not session_id:
+        return None
+
+    state = _states.get(session_id)
+    if state is not None:
+        return state
+
+    try:
+        row = USSDSession.query.filter_by(session_id=session_id).first()
+    except Exception as exc:
+        logger.warning(f"USSD state read failed: {exc}")
+        db.session.rollback()
+        return None
+
+    if not row or not row.menu_data:
+        return None
+    try:
+        data = json.loads(row.menu_data)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or 'last_text' not in data:
+        return None
+
+    state = SessionState(session_id=session_id, **{name: data.get(name) for name in PERSISTED_FIELDS})
+    state.form = list(state.form or [])
+    state.ignored = list(state.ignored or [])
+    _states.set(session_id, state)
+    return state
+
+
+def save_state(state):
+    """Keep state for the next hop; authenticated sessions are also written to their row."""
+    if not state.session_id:
+        return
+    _states.set(state.session_id, state)
+
+    # Sessions only get a row once the PIN is verified
+    if not state.is_authenticated():
+        return
+    try:
+        USSDSession.query.filter_by(session_id=state.session_id).update(
+            {'menu_data': json.dumps(state.to_dict()), 'updated_at': datetime.utcnow()},
+            synchronize_session=False,
+        )
+        db.session.commit()
+    except Exception as exc:
+        logger.warning(f"USSD state write failed, keeping memory copy only: {exc}")
+        db.session.rollback()
+
+
+def discard_state(session_id):
+    if session_id:
+        _states.delete(session_id)
+
+
+def finish_hop(state, text, response):
+    """Record the outcome of a hop; END responses close the session."""
+    if (response or '').startswith('END'):
+        discard_state(state.session_id)
+        return
+    state.last_text = text
+    if state.backtracked:
+        state.node, state.form = None, []
+    save_state(state)
+
+
+@contextmanager
+def track_hop(state):
+    """Make ``state`` the target of @ussd_node tracing for the duration of a hop."""
+    state.backtracked = False
+    state.node, state.form = None, []
+    token = _current.set(state)
+    try:
+        yield state
+    finally:
+        _current.reset(token)
+
+
+def resume(state, user, segment):
+    """Run the saved node with the newest segment appended to its form."""
+    handler = NODES[state.node]
+    form = state.form + [segment]
+    with track_hop(state):
+        return handler(user, form)
+
+
+def ussd_node(name):
+    """Register a menu handler as a resumable node and trace when it is entered."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(user, input_list):
+            state = _current.get()
+            if state is not None and not state.backtracked:
+                state.node, state.form = name, list(input_list)
+            return func(user, input_list)
+
+        NODES[name] = wrapper
+        return wrapper
+    return decorator
+
+
+def mark_backtracked():
+    """Called on 0/00 navigation: the node reached no longer follows from the text prefix."""
+    state = _current.get()
+    if state is not None:
+        state.backtracked = True
+
+
+def note_authenticated(session_id, user_id, expires_at):
+    """Record a verified session on the current hop's state."""
+    state = _current.get()
+    if state is None or state.session_id != session_id:
+        return
+    state.user_id = user_id
+    state.auth_expires = time.time() + (expires_at - datetime.utcnow()).total_seconds()
+    if state.node is None:
+        # PIN step: the next segment is a main menu choice
+        state.node, state.form = 'main', []
@@ -0,0 +1,151 @@
+"""
+Per-hop timing and a hard latency budget for the USSD endpoint.
+
+Gateways drop the session when a hop is not answered within a few seconds.
+``HopTimer`` splits each hop into phases (lookup, pin, handler, log) and
+records it under its menu state in the performance collector, so /metrics and
+the admin reports show where the time goes.
+
+``run_within_budget`` runs the menu handler on a small thread pool and gives up
+waiting once the hop budget (``USSD_HOP_BUDGET_MS``) is spent. The handler keeps
+running; the caller gets a "please wait" screen and their next hop on this
+worker collects the finished result instead of running the step again. A
+next hop that lands on another worker, which cannot see the handler, runs
+the step again there.
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from contextlib import contextmanager
+
+from flask import current_app, g
+
+from app import db
+from app.utils.kv_store import MemoryKVStore
+from app.utils.performance import performance_stats
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOP_BUDGET_MS = 4000
+DEFAULT_HANDLER_THREADS = 8
+
+# Kept back from the handler for transaction logging and writing the response
+LOG_RESERVE_MS = 300
+
+PLEASE_WAIT = "CON ⏳ Still working on your request.\nReply 1 to check again."
+
+# Handler futures that overran the budget, by session id
+_pending = MemoryKVStore('ussd_pending_hop', default_ttl=300, max_entries=5000)
+
+
+class HopTimer:
+    """Wall-clock split of one USSD hop into named phases (milliseconds)."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.timed_out = False
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def handler_budget_ms(self):
+        """Time left for the menu handler, or None when no budget is configured."""
+        budget = hop_budget_ms()
+        if not budget:
+            return None
+        return max(budget - self.elapsed_ms() - LOG_RESERVE_MS, 0)
+
+    def finish(self, menu_state):
+        """Record the hop under ``menu_state``; returns its total duration."""
+        total = self.elapsed_ms()
+        performance_stats.record_ussd_hop(menu_state, total, self.phases, self.timed_out)
+        return total
+
+
+def hop_budget_ms():
+    return current_app.config.get('USSD_HOP_BUDGET_MS', DEFAULT_HOP_BUDGET_MS)
+
+
+class _HandlerPool:
+    """Process-local thread pool, recreated after a fork."""
+
+    def __init__(self):
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def executor(self):
+        pid = os.getpid()
+        if self._executor is None or self._pid != pid:
+            with self._lock:
+                if self._executor is None or self._pid != pid:
+                    threads = current_app.config.get('USSD_HANDLER_THREADS', DEFAULT_HANDLER_THREADS)
+                    self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='ussd-handler')
+                    self._pid = pid
+        return self._executor
+
+
+_pool = _HandlerPool()
+
+
+def run_within_budget(session_id, timeout_ms, func, user, *args):
+    """Run ``func(user, *args)`` on the handler pool; None if it misses ``timeout_ms``.
+
+    ``user`` is merged into the worker's own session without a query. With no
+    budget configured the handler simply runs inline. The worker's DB queries
+    are added to the counters of the request that collects its result.
+    """
+    if timeout_ms is None:
+        return func(user, *args)
+
+    app = current_app._get_current_object()
+
+    def call():
+        with app.app_context():
+            # A fresh context has its own g; count the handler's queries there
+            g.db_query_count = 0
+            g.db_query_time = 0
+            worker_user = db.session.merge(user, load=False) if user is not None else None
+            response = func(worker_user, *args)
+            return response, g.db_query_count, g.db_query_time
+
+    return _wait(session_id, _pool.executor().submit(call), timeout_ms)
+
+
+def collect_pending(session_id, timeout_ms):
+    """Result of an earlier over-budget hop: ``(found, response)``.
+
+    ``found`` is False when no handler for this session is running on this
+    worker; ``response`` is None while it is still running.
+    """
+    future = _pending.get(session_id)
+    if future is None:
+        return False, None
+    _pending.delete(session_id)
+    return True, _wait(session_id, future, timeout_ms or 0)
+
+
+def _wait(session_id, future, timeout_ms):
+    try:
+        response, query_count, query_time = future.result(timeout=timeout_ms / 1000)
+    except FutureTimeout:
+        logger.warning(f"USSD handler for session {session_id} exceeded its budget")
+        _pending.set(session_id, future)
+        return None
+    if hasattr(g, 'db_query_count'):
+        g.db_query_count += query_count
+        g.db_query_time += query_time
+    return response
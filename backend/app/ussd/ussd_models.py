@@ -59,7 +59,8 @@ class USSDTransaction(db.Model):
     transaction_type = db.Column(db.String(50), nullable=False)  # e.g., 'menu_navigation', 'data_entry', 'authentication'
     success = db.Column(db.Boolean, default=True)
     error_message = db.Column(db.Text, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    duration_ms = db.Column(db.Integer, nullable=True)  # Time to build the response, excluding this log write
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     def __repr__(self):
         return f'<USSDTransaction {self.id}>'
@@ -111,6 +112,7 @@ class USSDNotification(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    notification_id = db.Column(db.Integer, db.ForeignKey('notifications.id', ondelete='SET NULL'), nullable=True)  # In-app notification this mirrors
     notification_type = db.Column(db.String(50), nullable=False)  # e.g., 'period_reminder', 'appointment_reminder'
     message = db.Column(db.Text, nullable=False)
     priority = db.Column(db.String(20), default='normal')  # 'low', 'normal', 'high', 'urgent'
@@ -119,7 +121,17 @@ class USSDNotification(db.Model):
     sent_at = db.Column(db.DateTime, nullable=True)
     read = db.Column(db.Boolean, default=False)
     read_at = db.Column(db.DateTime, nullable=True)
+    # SMS delivery: 'pending' | 'sending' (claimed by a dispatcher) | 'sent' | 'failed' | 'skipped'
+    delivery_status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=True)  # Retry time, or claim expiry while 'sending'
+    claim_token = db.Column(db.String(32), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_ussd_notifications_dispatch', 'delivery_status', 'next_attempt_at'),
+    )
     
     def __repr__(self):
         return f'<USSDNotification {self.id}>'
@@ -0,0 +1,180 @@
+"""
+Background jobs for long-running admin operations.
+
+Jobs run on a daemon thread inside an application context and report progress
+through a ``BackgroundJob`` record. Each progress update is also written as a
+small JSON snapshot under the instance folder, so a status poll that lands on
+a different gunicorn worker than the one running the job still finds it.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+MAX_JOBS_IN_MEMORY = 200
+SNAPSHOT_MAX_AGE = 7 * 24 * 3600
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+class BackgroundJob:
+    """Status and progress of one background job"""
+
+    def __init__(self, kind, total=0, created_by=None, params=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = 'queued'
+        self.total = total
+        self.processed = 0
+        self.result = {}
+        self.error = None
+        self.params = params or {}
+        self.created_by = created_by
+        self.created_at = datetime.utcnow()
+        self.started_at = None
+        self.finished_at = None
+        self._snapshot_dir = None
+
+    def advance(self, count=1, **result_updates):
+        """Record ``count`` more items processed and merge counters into the result"""
+        self.processed += count
+        for key, value in result_updates.items():
+            if isinstance(value, (int, float)) and isinstance(self.result.get(key, 0), (int, float)):
+                self.result[key] = self.result.get(key, 0) + value
+            else:
+                self.result[key] = value
+        self._save_snapshot()
+
+    @property
+    def finished(self):
+        return self.status in ('succeeded', 'failed')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'total': self.total,
+            'processed': self.processed,
+            'progress': round(self.processed / self.total * 100, 1) if self.total else (100.0 if self.finished else 0.0),
+            'result': self.result,
+            'error': self.error,
+            'params': self.params,
+            'created_by': self.created_by,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def _save_snapshot(self):
+        if not self._snapshot_dir:
+            return
+        path = os.path.join(self._snapshot_dir, f'{self.id}.json')
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w') as fh:
+                json.dump(self.to_dict(), fh)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.debug(f"Could not write job snapshot {self.id}: {e}")
+
+
+def _snapshot_dir(app):
+    path = os.path.join(app.instance_path, 'jobs')
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError:
+        return None
+    return path
+
+
+def _prune(snapshot_dir):
+    with _jobs_lock:
+        finished = [job for job in _jobs.values() if job.finished]
+        overflow = len(_jobs) - MAX_JOBS_IN_MEMORY
+        for job in sorted(finished, key=lambda j: j.finished_at)[:max(overflow, 0)]:
+            _jobs.pop(job.id, None)
+
+    if not snapshot_dir:
+        return
+    cutoff = time.time() - SNAPSHOT_MAX_AGE
+    try:
+        for name in os.listdir(snapshot_dir):
+            path = os.path.join(snapshot_dir, name)
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+    except OSError:
+        pass
+
+
+def submit_job(app, kind, target, total=0, created_by=None, params=None):
+    """
+    Run ``target(job)`` on a background thread inside ``app``'s context
+
+    Args:
+        app: Flask application (use ``current_app._get_current_object()``)
+        kind: Short job type label, e.g. 'bulk_user_action'
+        target: Callable receiving the BackgroundJob; its return value is merged into job.result
+        total: Number of items the job will process, for progress reporting
+
+    Returns:
+        BackgroundJob
+    """
+    job = BackgroundJob(kind, total=total, created_by=created_by, params=params)
+    job._snapshot_dir = _snapshot_dir(app)
+
+    with _jobs_lock:
+        _jobs[job.id] = job
+    _prune(job._snapshot_dir)
+    job._save_snapshot()
+
+    def runner():
+        with app.app_context():
+            from app import db
+
+            job.status = 'running'
+            job.started_at = datetime.utcnow()
+            job._save_snapshot()
+            try:
+                result = target(job)
+                if isinstance(result, dict):
+                    job.result.update(result)
+                job.status = 'succeeded'
+            except Exception as e:
+                db.session.rollback()
+                job.status = 'failed'
+                job.error = str(e)
+                logger.error(f"Background job {job.kind} {job.id} failed: {e}")
+            finally:
+                job.finished_at = datetime.utcnow()
+                job._save_snapshot()
+                db.session.remove()
+
+    threading.Thread(target=runner, name=f'job-{kind}-{job.id[:8]}', daemon=True).start()
+    return job
+
+
+def get_job(job_id, app=None):
+    """Job status as a dict, from this process or another worker's snapshot"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is not None:
+        return job.to_dict()
+
+    if app is None or not all(c in '0123456789abcdef' for c in job_id):
+        return None
+    snapshot_dir = _snapshot_dir(app)
+    if not snapshot_dir:
+        return None
+    try:
+        with open(os.path.join(snapshot_dir, f'{job_id}.json')) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
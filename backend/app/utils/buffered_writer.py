@@ -0,0 +1,245 @@
+"""
+Write-behind buffering for append-only tables (audit logs, transaction logs).
+
+Rows are queued in a bounded in-memory queue and flushed by a background
+thread as multi-row INSERTs once a batch fills up or the flush interval
+elapses. When the queue is full new rows are dropped and counted rather than
+blocking the request thread.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+_writers = {}
+
+
+def registered_writers():
+    """All writers created in this process, keyed by name."""
+    return dict(_writers)
+
+
+class BufferedWriter:
+    """Batch rows for a single table and insert them off the request path.
+
+    Until ``start(app)`` has been called (tests, scripts, a bare Flask app)
+    ``submit`` writes the row through synchronously on the caller's session,
+    which keeps the old commit-per-row behaviour available as a fallback.
+    """
+
+    DEFAULT_QUEUE_SIZE = 10000
+    DEFAULT_BATCH_SIZE = 200
+    DEFAULT_FLUSH_INTERVAL = 2.0
+
+    def __init__(self, name, table, config_prefix=None, timestamp_column='created_at'):
+        self.name = name
+        self.table = table
+        self.config_prefix = config_prefix or name.upper()
+        self.timestamp_column = timestamp_column
+
+        self.batch_size = self.DEFAULT_BATCH_SIZE
+        self.flush_interval = self.DEFAULT_FLUSH_INTERVAL
+        self.max_queue = self.DEFAULT_QUEUE_SIZE
+
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._app = None
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._last_drop_warning = 0.0
+
+        self._stats = {
+            'enqueued': 0,
+            'written': 0,
+            'dropped': 0,
+            'failed': 0,
+            'flushes': 0,
+            'high_water_mark': 0,
+            'last_flush_at': None,
+            'last_flush_ms': None,
+            'last_error': None,
+        }
+        _writers[name] = self
+
+    # ── Lifecycle ─────────────────────────────────────────────────────────
+
+    def start(self, app):
+        """Read sizing from app config and start the flusher thread."""
+        prefix = self.config_prefix
+        self.batch_size = int(app.config.get(f'{prefix}_BATCH_SIZE', self.DEFAULT_BATCH_SIZE))
+        self.flush_interval = float(app.config.get(f'{prefix}_FLUSH_INTERVAL', self.DEFAULT_FLUSH_INTERVAL))
+        max_queue = int(app.config.get(f'{prefix}_QUEUE_SIZE', self.DEFAULT_QUEUE_SIZE))
+
+        if not app.config.get(f'{prefix}_ENABLED', True):
+            logger.info(f"Buffered writer '{self.name}' disabled; writing through")
+            return
+
+        with self._start_lock:
+            if max_queue != self.max_queue and self._queue.empty():
+                self.max_queue = max_queue
+                self._queue = queue.Queue(maxsize=max_queue)
+            self._app = app
+            self._ensure_thread()
+
+        atexit.register(self.stop)
+
+    @property
+    def started(self):
+        return self._app is not None
+
+    def _ensure_thread(self):
+        # gunicorn forks workers after import; a thread started in the parent
+        # does not exist in the child, so (re)start it per process.
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._stop.clear()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(
+            target=self._run, name=f'buffered-writer-{self.name}', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        """Stop the flusher and write out everything still queued."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout=timeout)
+        self._thread = None
+        # Anything submitted after the thread exited is still flushed here
+        self._drain()
+
+    # ── Producer side ─────────────────────────────────────────────────────
+
+    def submit(self, row):
+        """Queue one row (a dict of column values). Never raises."""
+        if self.timestamp_column and not row.get(self.timestamp_column):
+            row[self.timestamp_column] = datetime.utcnow()
+
+        if not self.started:
+            self._write_through(row)
+            return True
+
+        with self._start_lock:
+            self._ensure_thread()
+
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._bump('dropped')
+            now = time.time()
+            if now - self._last_drop_warning > 30:
+                self._last_drop_warning = now
+                logger.warning(
+                    f"Buffered writer '{self.name}' queue full ({self.max_queue}); dropping rows"
+                )
+            return False
+
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self._stats['enqueued'] += 1
+            if depth > self._stats['high_water_mark']:
+                self._stats['high_water_mark'] = depth
+
+        if depth >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def flush(self):
+        """Synchronously drain the queue (used by tests and shutdown)."""
+        self._drain()
+
+    # ── Consumer side ─────────────────────────────────────────────────────
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self._drain()
+        self._drain()
+
+    def _drain(self):
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._write_batch(batch)
+
+    def _write_batch(self, rows):
+        if self._app is None:
+            return
+        # A multi-row VALUES clause needs the same columns in every row
+        columns = set().union(*rows)
+        rows = [{col: row.get(col) for col in columns} for row in rows]
+
+        started = time.perf_counter()
+        try:
+            with self._app.app_context():
+                with db.engine.begin() as conn:
+                    conn.execute(insert(self.table).values(rows))
+        except Exception as exc:
+            with self._stats_lock:
+                self._stats['failed'] += len(rows)
+                self._stats['last_error'] = str(exc)[:300]
+            logger.error(f"Buffered writer '{self.name}' failed to flush {len(rows)} rows: {exc}")
+            return
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            self._stats['written'] += len(rows)
+            self._stats['flushes'] += 1
+            self._stats['last_flush_at'] = datetime.utcnow().isoformat()
+            self._stats['last_flush_ms'] = round(elapsed_ms, 2)
+
+    def _write_through(self, row):
+        try:
+            db.session.execute(insert(self.table).values([row]))
+            db.session.commit()
+            self._bump('written')
+        except Exception as exc:
+            db.session.rollback()
+            self._bump('failed')
+            logger.debug(f"Buffered writer '{self.name}' write-through skipped: {exc}")
+
+    def _bump(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    # ── Metrics ───────────────────────────────────────────────────────────
+
+    def metrics(self):
+        """Backpressure and throughput counters for this writer."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        depth = self._queue.qsize()
+        stats.update({
+            'name': self.name,
+            'table': self.table.name,
+            'mode': 'buffered' if self.started else 'write_through',
+            'queue_depth': depth,
+            'queue_capacity': self.max_queue,
+            'queue_utilization': round(depth / self.max_queue, 4) if self.max_queue else 0,
+            'batch_size': self.batch_size,
+            'flush_interval': self.flush_interval,
+        })
+        return stats
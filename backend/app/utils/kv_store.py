@@ -0,0 +1,339 @@
+"""
+Small key-value stores for hot-path caches, sessions and rate limits.
+
+``MemoryKVStore`` is a per-process dict with per-key TTL and an LRU size cap.
+``SqliteKVStore`` keeps the same interface in a local SQLite file so every
+gunicorn worker on the host sees the same keys. ``SharedKVStore`` is the
+pluggable front: per-process memory until ``init_kv_store(app)`` points it at
+the configured backend. Hits and misses are reported to the performance
+collector under the store's name, so hit rates show up in /metrics and the
+admin performance view.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from app.utils.performance import record_cache_access
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class MemoryKVStore:
+    """In-process TTL + LRU store. Safe to share between request threads."""
+
+    def __init__(self, name, default_ttl=60, max_entries=10000):
+        self.name = name
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires_at = entry
+                if expires_at is None or expires_at > now:
+                    self._data.move_to_end(key)
+                    hit = True
+                else:
+                    del self._data[key]
+                    hit = False
+            else:
+                hit = False
+        record_cache_access(self.name, hit)
+        return value if hit else default
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def incr(self, key, amount=1, ttl=None):
+        """Add to an integer value; a missing or expired key starts from zero with a fresh TTL."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > now):
+                value = entry[0] + amount
+                expires_at = entry[1]
+            else:
+                ttl = self.default_ttl if ttl is None else ttl
+                value = amount
+                expires_at = now + ttl if ttl else None
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SqliteKVStore:
+    """TTL store in a local SQLite file shared by every worker on the host.
+
+    Values are JSON encoded. Expired keys and keys beyond ``max_entries``
+    (soonest to expire first) are purged every few hundred writes. Storage
+    errors are logged and treated as misses so callers fail open.
+    """
+
+    PURGE_EVERY = 500
+
+    def __init__(self, name, path, default_ttl=60, max_entries=10000):
+        self.name = name
+        self.path = path
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+
+    def _conn(self):
+        # One connection per thread and per process; never reuse one across a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS kv ('
+                'store TEXT NOT NULL, key TEXT NOT NULL, value TEXT, expires_at REAL, '
+                'PRIMARY KEY (store, key))'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_kv_store_expires ON kv (store, expires_at)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _expiry(self, ttl):
+        ttl = self.default_ttl if ttl is None else ttl
+        return time.time() + ttl if ttl else None
+
+    def get(self, key, default=None):
+        try:
+            row = self._conn().execute(
+                'SELECT value, expires_at FROM kv WHERE store = ? AND key = ?', (self.name, str(key))
+            ).fetchone()
+        except sqlite3.Error as exc:
+            logger.warning(f"KV store '{self.name}' read failed: {exc}")
+            row = None
+        hit = row is not None and (row[1] is None or row[1] > time.time())
+        record_cache_access(self.name, hit)
+        return json.loads(row[0]) if hit else default
+
+    def set(self, key, value, ttl=None):
+        try:
+            self._conn().execute(
+                'INSERT OR REPLACE INTO kv (store, key, value, expires_at) VALUES (?, ?, ?, ?)',
+                (self.name, str(key), json.dumps(value), self._expiry(ttl)),
+            )
+        except sqlite3.Error as exc:
+            logger.warning(f"KV store '{self.name}' write failed: {exc}")
+            return
+        self._after_write()
+
+    def incr(self, key, amount=1, ttl=None):
+        """Atomically add to an integer value across processes."""
+        conn = self._conn()
+        now = time.time()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    'SELECT value, expires_at FROM kv WHERE store = ? AND key = ?', (self.name, str(key))
+                ).fetchone()
+                if row is not None and (row[1] is None or row[1] > now):
+                    value, expires_at = json.loads(row[0]) + amount, row[1]
+                else:
+                    value, expires_at = amount, self._expiry(ttl)
+                conn.execute(
+                    'INSERT OR REPLACE INTO kv (store, key, value, expires_at) VALUES (?, ?, ?, ?)',
+                    (self.name, str(key), json.dumps(value), expires_at),
+                )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as exc:
+            logger.warning(f"KV store '{self.name}' increment failed: {exc}")
+            return amount
+        self._after_write()
+        return value
+
+    def delete(self, key):
+        try:
+            self._conn().execute('DELETE FROM kv WHERE store = ? AND key = ?', (self.name, str(key)))
+        except sqlite3.Error as exc:
+            logger.warning(f"KV store '{self.name}' delete failed: {exc}")
+
+    def clear(self):
+        try:
+            self._conn().execute('DELETE FROM kv WHERE store = ?', (self.name,))
+        except sqlite3.Error as exc:
+            logger.warning(f"KV store '{self.name}' clear failed: {exc}")
+
+    def _after_write(self):
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self.purge()
+
+    def purge(self):
+        """Drop expired keys, then the soonest-expiring keys beyond the size cap."""
+        conn = self._conn()
+        try:
+            conn.execute('DELETE FROM kv WHERE store = ? AND expires_at <= ?', (self.name, time.time()))
+            (count,) = conn.execute('SELECT COUNT(*) FROM kv WHERE store = ?', (self.name,)).fetchone()
+            if count > self.max_entries:
+                conn.execute(
+                    'DELETE FROM kv WHERE store = ? AND key IN ('
+                    'SELECT key FROM kv WHERE store = ? ORDER BY expires_at LIMIT ?)',
+                    (self.name, self.name, count - self.max_entries),
+                )
+        except sqlite3.Error as exc:
+            logger.warning(f"KV store '{self.name}' purge failed: {exc}")
+
+    def __len__(self):
+        try:
+            (count,) = self._conn().execute(
+                'SELECT COUNT(*) FROM kv WHERE store = ? AND (expires_at IS NULL OR expires_at > ?)',
+                (self.name, time.time()),
+            ).fetchone()
+            return count
+        except sqlite3.Error:
+            return 0
+
+
+_shared_stores = {}
+
+
+class SharedKVStore:
+    """Named store that all workers share once ``init_kv_store`` has run.
+
+    Before that (tests, scripts, a bare Flask app) it is a per-process
+    MemoryKVStore with the same TTL and size cap.
+    """
+
+    def __init__(self, name, default_ttl=60, max_entries=10000):
+        self.name = name
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.backend = MemoryKVStore(name, default_ttl, max_entries)
+        _shared_stores[name] = self
+
+    def get(self, key, default=None):
+        return self.backend.get(key, default)
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(key, value, ttl)
+
+    def incr(self, key, amount=1, ttl=None):
+        return self.backend.incr(key, amount, ttl)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def clear(self):
+        self.backend.clear()
+
+    def __len__(self):
+        return len(self.backend)
+
+
+def init_kv_store(app):
+    """Point every SharedKVStore at the backend named by ``KV_STORE_BACKEND``."""
+    backend = app.config.get('KV_STORE_BACKEND', 'memory')
+    if backend != 'sqlite':
+        return
+
+    path = app.config.get('KV_STORE_PATH') or os.path.join(app.instance_path, 'kv_store.sqlite3')
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    except OSError as exc:
+        logger.warning(f"Shared KV store disabled, cannot create {path}: {exc}")
+        return
+
+    for store in _shared_stores.values():
+        store.backend = SqliteKVStore(store.name, path, store.default_ttl, store.max_entries)
+
+
+class SlidingWindowCounter:
+    """Sliding-window rate limit in O(1) per check.
+
+    Keeps one counter for the current fixed window and reads the previous
+    window's counter weighted by how much of it still overlaps the sliding
+    window, instead of storing and re-filtering a timestamp per event.
+    """
+
+    def __init__(self, store, window_seconds):
+        self.store = store
+        self.window = window_seconds
+
+    def count(self, key, now=None):
+        """Estimated events for ``key`` within the last window."""
+        now = time.time() if now is None else now
+        index, into = divmod(now, self.window)
+        previous = self.store.get(f'{key}:{int(index) - 1}', 0) or 0
+        current = self.store.get(f'{key}:{int(index)}', 0) or 0
+        return previous * (1 - into / self.window) + current
+
+    def hit(self, key, limit, now=None):
+        """Count one event unless ``limit`` has been reached; True when allowed."""
+        now = time.time() if now is None else now
+        if self.count(key, now) >= limit:
+            return False
+        self.store.incr(f'{key}:{int(now // self.window)}', ttl=self.window * 2)
+        return True
+
+
+class TokenBucket:
+    """Token bucket per key: up to ``capacity`` tokens, refilled at ``rate`` tokens per second.
+
+    Charges may take the level below zero (the cost of a call is only known
+    once it ends); the key is admitted again once the refill brings it back
+    above zero. State is read and written back rather than updated
+    atomically, so workers charging one key at the same instant can both get
+    through: limits built on it are approximate across processes.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+
+    def level(self, key, capacity, rate, now=None):
+        now = time.time() if now is None else now
+        state = self.store.get(key)
+        if not state:
+            return float(capacity)
+        level, at = state
+        return min(float(capacity), level + max(now - at, 0) * rate)
+
+    def charge(self, key, amount, capacity, rate, now=None):
+        """Take ``amount`` tokens (the level may go negative); returns the new level."""
+        now = time.time() if now is None else now
+        with self._lock:
+            level = self.level(key, capacity, rate, now) - amount
+            # Forget the key once it would have refilled completely anyway
+            ttl = int((capacity - level) / rate) + 60 if rate else None
+            self.store.set(key, [level, now], ttl=ttl)
+        return level
@@ -3,10 +3,17 @@ Performance Monitoring Middleware
 Tracks request timing, database queries, and identifies performance bottlenecks
 """
 
-from time import time
+from time import perf_counter, time
 from flask import g, request, current_app
 from functools import wraps
+from collections import deque
+from contextlib import contextmanager
+import json
 import logging
+import math
+import os
+import re
+import threading
 
 # Configure performance logger
 perf_logger = logging.getLogger('performance')
@@ -16,6 +23,8 @@ perf_logger.setLevel(logging.INFO)
 def init_performance_monitoring(app):
     """Initialize performance monitoring for Flask app"""
     
+    performance_stats.configure(app)
+    
     @app.before_request
     def start_timer():
         """Start request timer"""
@@ -48,6 +57,15 @@ def init_performance_monitoring(app):
             response.headers['X-Request-Time'] = f"{elapsed:.3f}s"
             if hasattr(g, 'db_query_count'):
                 response.headers['X-DB-Query-Count'] = str(g.db_query_count)
+            
+            # Route template (not the raw path) keeps the series bounded
+            route = request.url_rule.rule if request.url_rule else '<unmatched>'
+            performance_stats.record_request(
+                request.method, route, elapsed,
+                getattr(g, 'db_query_count', 0),
+                db_time=getattr(g, 'db_query_time', 0),
+                status_code=response.status_code
+            )
         
         return response
     
@@ -73,6 +91,9 @@ def init_performance_monitoring(app):
                 f"SLOW QUERY ({total:.2f}s): {statement[:200]}"
             )
         
+        if total >= performance_stats.slow_query_threshold:
+            performance_stats.record_query(statement, total)
+        
         # Update request-level stats
         if hasattr(g, 'db_query_count'):
             g.db_query_count += 1
@@ -103,46 +124,773 @@ def monitor_performance(threshold_seconds=1.0):
     return decorator
 
 
+class LogHistogram:
+    """
+    Latency histogram with logarithmic buckets and bounded memory
+
+    Bucket ``i`` covers (MIN_MS * GROWTH**i, MIN_MS * GROWTH**(i+1)] so every
+    quantile is within about 10% of the true value whatever the range, using
+    at most ~80 counters from 0.1ms to two minutes.
+    """
+    
+    MIN_MS = 0.1
+    GROWTH = 1.2
+    MAX_INDEX = 77
+    
+    def __init__(self, buckets=None):
+        self.buckets = {int(k): v for k, v in (buckets or {}).items()}
+    
+    @classmethod
+    def index_for(cls, value_ms):
+        if value_ms <= cls.MIN_MS:
+            return 0
+        return min(int(math.log(value_ms / cls.MIN_MS) / math.log(cls.GROWTH)), cls.MAX_INDEX)
+    
+    @classmethod
+    def upper_bound(cls, index):
+        return cls.MIN_MS * cls.GROWTH ** (index + 1)
+    
+    def record(self, value_ms):
+        index = self.index_for(value_ms)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+    
+    def merge(self, other):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+    
+    @property
+    def count(self):
+        return sum(self.buckets.values())
+    
+    def quantile(self, q):
+        total = self.count
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return self.upper_bound(index)
+        return self.upper_bound(max(self.buckets))
+    
+    def cumulative(self, bounds_ms):
+        """Counts at or below each bound; a bucket only counts once its upper edge fits"""
+        ordered = sorted(self.buckets.items())
+        result, seen, position = [], 0, 0
+        for bound in sorted(bounds_ms):
+            while position < len(ordered) and self.upper_bound(ordered[position][0]) <= bound:
+                seen += ordered[position][1]
+                position += 1
+            result.append(seen)
+        return result
+
+
+_LITERAL_PATTERNS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%\(\w+\)s|:\w+|\$\d+'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)'), '(?, ...)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def fingerprint_sql(statement):
+    """Normalize a SQL statement so queries differing only in literals group together"""
+    fingerprint = statement.strip()
+    for pattern, replacement in _LITERAL_PATTERNS:
+        fingerprint = pattern.sub(replacement, fingerprint)
+    return fingerprint[:500]
+
+
 class PerformanceStats:
-    """Track and report performance statistics"""
+    """
+    Track and report performance statistics
+    
+    Per-route latency histograms, per-route DB query count/time, slow query
+    fingerprints, cache hit rates, USSD hop timings by menu state, LLM calls
+    by endpoint and per-stage timings of named pipelines. Each worker keeps its own counters and
+    periodically writes them to ``<metrics dir>/perf-<pid>.json``; readers
+    merge every fresh snapshot so the numbers cover all gunicorn workers.
+    """
+    
+    SLOW_REQUEST_SECONDS = 2.0
+    MAX_ROUTES = 500
+    MAX_QUERY_FINGERPRINTS = 200
+    MAX_USSD_STATES = 100
+    MAX_LLM_ENDPOINTS = 50
+    MAX_PIPELINES = 50
+    MAX_CONTEXTS = 50
     
     def __init__(self):
-        self.request_times = []
-        self.slow_requests = []
-        self.db_query_counts = []
+        self._lock = threading.Lock()
+        self.slow_query_threshold = 0.05
+        self.snapshot_interval = 15.0
+        self.snapshot_ttl = 600.0
+        self.snapshot_dir = None
+        self._last_snapshot = 0.0
+        self._reset()
     
-    def record_request(self, method, path, duration, query_count):
+    def _reset(self):
+        self.started_at = time()
+        self.routes = {}
+        self.queries = {}
+        self.caches = {}
+        self.ussd = {}
+        self.llm = {}
+        self.pipelines = {}
+        self.contexts = {}
+        self.slow_requests = deque(maxlen=20)
+    
+    def configure(self, app):
+        """Read thresholds and the shared snapshot directory from app config"""
+        self.slow_query_threshold = app.config.get('PERF_SLOW_QUERY_MS', 50) / 1000.0
+        self.snapshot_interval = float(app.config.get('PERF_SNAPSHOT_INTERVAL', 15))
+        self.snapshot_dir = app.config.get('PERF_METRICS_DIR') or os.path.join(app.instance_path, 'metrics')
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+        except OSError as e:
+            perf_logger.warning(f"Metrics snapshots disabled, cannot create {self.snapshot_dir}: {e}")
+            self.snapshot_dir = None
+    
+    # ── Recording ─────────────────────────────────────────────────────────
+    
+    def record_request(self, method, path, duration, query_count, db_time=0.0, status_code=200):
         """Record request performance data"""
-        self.request_times.append(duration)
-        self.db_query_counts.append(query_count)
+        key = f"{method} {path}"
+        duration_ms = duration * 1000
+        with self._lock:
+            route = self.routes.get(key)
+            if route is None:
+                if len(self.routes) >= self.MAX_ROUTES:
+                    key = f"{method} <other>"
+                    route = self.routes.get(key)
+                if route is None:
+                    route = self.routes[key] = {
+                        'count': 0, 'errors': 0, 'sum_ms': 0.0, 'max_ms': 0.0,
+                        'db_queries': 0, 'db_time_ms': 0.0, 'db_max_queries': 0,
+                        'histogram': LogHistogram(),
+                    }
+            route['count'] += 1
+            if status_code >= 500:
+                route['errors'] += 1
+            route['sum_ms'] += duration_ms
+            route['max_ms'] = max(route['max_ms'], duration_ms)
+            route['db_queries'] += query_count
+            route['db_time_ms'] += db_time * 1000
+            route['db_max_queries'] = max(route['db_max_queries'], query_count)
+            route['histogram'].record(duration_ms)
+            
+            if duration > self.SLOW_REQUEST_SECONDS:
+                self.slow_requests.append({
+                    'method': method,
+                    'path': path,
+                    'duration': duration,
+                    'query_count': query_count,
+                    'at': time()
+                })
         
-        if duration > 2.0:
-            self.slow_requests.append({
-                'method': method,
-                'path': path,
-                'duration': duration,
-                'query_count': query_count
-            })
+        self.maybe_write_snapshot()
+    
+    def record_query(self, statement, duration):
+        """Record a slow query under its literal-free fingerprint"""
+        fingerprint = fingerprint_sql(statement)
+        duration_ms = duration * 1000
+        with self._lock:
+            entry = self.queries.get(fingerprint)
+            if entry is None:
+                if len(self.queries) >= self.MAX_QUERY_FINGERPRINTS:
+                    # Evict the fingerprint costing the least in total
+                    cheapest = min(self.queries, key=lambda fp: self.queries[fp]['total_ms'])
+                    del self.queries[cheapest]
+                entry = self.queries[fingerprint] = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+            entry['count'] += 1
+            entry['total_ms'] += duration_ms
+            entry['max_ms'] = max(entry['max_ms'], duration_ms)
+    
+    def record_cache_access(self, name, hit):
+        """Count a hit or miss for the named cache"""
+        with self._lock:
+            entry = self.caches.setdefault(name, {'hits': 0, 'misses': 0})
+            entry['hits' if hit else 'misses'] += 1
+    
+    def record_ussd_hop(self, menu_state, total_ms, phases, timed_out=False):
+        """Record one USSD hop and its per-phase breakdown under its menu state"""
+        with self._lock:
+            entry = self.ussd.get(menu_state)
+            if entry is None:
+                if len(self.ussd) >= self.MAX_USSD_STATES:
+                    menu_state = '<other>'
+                    entry = self.ussd.get(menu_state)
+                if entry is None:
+                    entry = self.ussd[menu_state] = _new_ussd_entry()
+            entry['count'] += 1
+            if timed_out:
+                entry['timeouts'] += 1
+            entry['sum_ms'] += total_ms
+            entry['max_ms'] = max(entry['max_ms'], total_ms)
+            entry['histogram'].record(total_ms)
+            for phase, phase_ms in phases.items():
+                timing = entry['phases'].setdefault(phase, {'sum_ms': 0.0, 'histogram': LogHistogram()})
+                timing['sum_ms'] += phase_ms
+                timing['histogram'].record(phase_ms)
+        
+        self.maybe_write_snapshot()
+    
+    def record_llm_call(self, endpoint, duration_ms, outcome, prompt_tokens=0, output_tokens=0, retries=0,
+                        cached_tokens=0):
+        """Record one upstream LLM call: latency, outcome ('ok', 'error', 'short_circuit', ...) and tokens
+
+        ``cached_tokens`` is the part of ``prompt_tokens`` served from Gemini's context cache.
+        """
+        with self._lock:
+            entry = self.llm.get(endpoint)
+            if entry is None:
+                if len(self.llm) >= self.MAX_LLM_ENDPOINTS:
+                    endpoint = '<other>'
+                    entry = self.llm.get(endpoint)
+                if entry is None:
+                    entry = self.llm[endpoint] = _new_llm_entry()
+            entry['count'] += 1
+            entry['outcomes'][outcome] = entry['outcomes'].get(outcome, 0) + 1
+            entry['retries'] += retries
+            entry['prompt_tokens'] += prompt_tokens or 0
+            entry['output_tokens'] += output_tokens or 0
+            entry['cached_tokens'] += cached_tokens or 0
+            entry['sum_ms'] += duration_ms
+            entry['max_ms'] = max(entry['max_ms'], duration_ms)
+            entry['histogram'].record(duration_ms)
+        
+        self.maybe_write_snapshot()
+    
+    def record_pipeline(self, pipeline, total_ms, stages):
+        """Record one run of a multi-stage pipeline (e.g. insight prompt assembly) and its stage split"""
+        with self._lock:
+            entry = self.pipelines.get(pipeline)
+            if entry is None:
+                if len(self.pipelines) >= self.MAX_PIPELINES:
+                    pipeline = '<other>'
+                    entry = self.pipelines.get(pipeline)
+                if entry is None:
+                    entry = self.pipelines[pipeline] = _new_pipeline_entry()
+            entry['count'] += 1
+            entry['sum_ms'] += total_ms
+            entry['max_ms'] = max(entry['max_ms'], total_ms)
+            entry['histogram'].record(total_ms)
+            for stage, stage_ms in stages.items():
+                timing = entry['stages'].setdefault(stage, {'sum_ms': 0.0, 'histogram': LogHistogram()})
+                timing['sum_ms'] += stage_ms
+                timing['histogram'].record(stage_ms)
+        
+        self.maybe_write_snapshot()
+    
+    def record_prompt_context(self, context, full_tokens, sent_tokens):
+        """Record one prompt built from stored history: tokens of the whole history vs. tokens actually sent"""
+        with self._lock:
+            entry = self.contexts.get(context)
+            if entry is None:
+                if len(self.contexts) >= self.MAX_CONTEXTS:
+                    context = '<other>'
+                    entry = self.contexts.get(context)
+                if entry is None:
+                    entry = self.contexts[context] = _new_context_entry()
+            entry['requests'] += 1
+            entry['full_tokens'] += full_tokens
+            entry['sent_tokens'] += sent_tokens
+        
+        self.maybe_write_snapshot()
+    
+    # ── Snapshots ─────────────────────────────────────────────────────────
+    
+    def snapshot(self):
+        """This worker's counters in a JSON-serialisable form"""
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'started_at': self.started_at,
+                'written_at': time(),
+                'routes': {
+                    key: {**{k: v for k, v in route.items() if k != 'histogram'},
+                          'buckets': dict(route['histogram'].buckets)}
+                    for key, route in self.routes.items()
+                },
+                'queries': {fp: dict(entry) for fp, entry in self.queries.items()},
+                'caches': {name: dict(entry) for name, entry in self.caches.items()},
+                'ussd': {
+                    menu_state: {
+                        'count': entry['count'],
+                        'timeouts': entry['timeouts'],
+                        'sum_ms': entry['sum_ms'],
+                        'max_ms': entry['max_ms'],
+                        'buckets': dict(entry['histogram'].buckets),
+                        'phases': {
+                            phase: {'sum_ms': timing['sum_ms'], 'buckets': dict(timing['histogram'].buckets)}
+                            for phase, timing in entry['phases'].items()
+                        },
+                    } for menu_state, entry in self.ussd.items()
+                },
+                'llm': {
+                    endpoint: {**{k: v for k, v in entry.items() if k not in ('histogram', 'outcomes')},
+                               'outcomes': dict(entry['outcomes']),
+                               'buckets': dict(entry['histogram'].buckets)}
+                    for endpoint, entry in self.llm.items()
+                },
+                'pipelines': {
+                    pipeline: {
+                        'count': entry['count'],
+                        'sum_ms': entry['sum_ms'],
+                        'max_ms': entry['max_ms'],
+                        'buckets': dict(entry['histogram'].buckets),
+                        'stages': {
+                            stage: {'sum_ms': timing['sum_ms'], 'buckets': dict(timing['histogram'].buckets)}
+                            for stage, timing in entry['stages'].items()
+                        },
+                    } for pipeline, entry in self.pipelines.items()
+                },
+                'contexts': {context: dict(entry) for context, entry in self.contexts.items()},
+                'slow_requests': list(self.slow_requests),
+            }
+    
+    def maybe_write_snapshot(self, force=False):
+        if not self.snapshot_dir:
+            return
+        now = time()
+        # Claim the interval under the lock so only one thread writes per interval
+        with self._lock:
+            if not force and now - self._last_snapshot < self.snapshot_interval:
+                return
+            self._last_snapshot = now
+        path = os.path.join(self.snapshot_dir, f'perf-{os.getpid()}.json')
+        # Forced writes can still overlap a scheduled one; never share a temp file
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'w') as fh:
+                json.dump(self.snapshot(), fh)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            perf_logger.debug(f"Could not write performance snapshot: {e}")
+    
+    def collect(self):
+        """Live counters for this worker merged with every other worker's fresh snapshot"""
+        snapshots = [self.snapshot()]
+        if self.snapshot_dir:
+            own = f'perf-{os.getpid()}.json'
+            cutoff = time() - self.snapshot_ttl
+            try:
+                names = os.listdir(self.snapshot_dir)
+            except OSError:
+                names = []
+            for name in names:
+                if not name.startswith('perf-') or not name.endswith('.json') or name == own:
+                    continue
+                path = os.path.join(self.snapshot_dir, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        continue
+                    with open(path) as fh:
+                        snapshots.append(json.load(fh))
+                except (OSError, ValueError):
+                    continue
+        return merge_snapshots(snapshots)
+    
+    # ── Reporting ─────────────────────────────────────────────────────────
     
     def get_summary(self):
-        """Get performance summary statistics"""
-        if not self.request_times:
+        """Get performance summary statistics across all workers"""
+        merged = self.collect()
+        routes = merged['routes']
+        total_requests = sum(r['count'] for r in routes.values())
+        overall = LogHistogram()
+        for route in routes.values():
+            overall.merge(route['histogram'])
+        
+        if not total_requests:
             return {
                 'total_requests': 0,
                 'avg_time': 0,
                 'max_time': 0,
                 'avg_queries': 0,
-                'slow_requests': 0
+                'slow_requests': 0,
+                'workers': merged['workers'],
+                'routes': [],
+                'slow_queries': [],
+                'caches': []
             }
         
         return {
-            'total_requests': len(self.request_times),
-            'avg_time': sum(self.request_times) / len(self.request_times),
-            'max_time': max(self.request_times),
-            'avg_queries': sum(self.db_query_counts) / len(self.db_query_counts),
-            'slow_requests': len(self.slow_requests),
-            'slow_request_details': self.slow_requests[-10:]  # Last 10 slow requests
+            'total_requests': total_requests,
+            'avg_time': sum(r['sum_ms'] for r in routes.values()) / total_requests / 1000,
+            'max_time': max(r['max_ms'] for r in routes.values()) / 1000,
+            'p50_ms': round(overall.quantile(0.5), 2),
+            'p95_ms': round(overall.quantile(0.95), 2),
+            'p99_ms': round(overall.quantile(0.99), 2),
+            'avg_queries': sum(r['db_queries'] for r in routes.values()) / total_requests,
+            'slow_requests': len(merged['slow_requests']),
+            'slow_request_details': merged['slow_requests'][-10:],  # Last 10 slow requests
+            'workers': merged['workers'],
+            'routes': sorted((
+                {
+                    'route': key,
+                    'count': r['count'],
+                    'errors': r['errors'],
+                    'avg_ms': round(r['sum_ms'] / r['count'], 2),
+                    'p50_ms': round(r['histogram'].quantile(0.5), 2),
+                    'p95_ms': round(r['histogram'].quantile(0.95), 2),
+                    'p99_ms': round(r['histogram'].quantile(0.99), 2),
+                    'max_ms': round(r['max_ms'], 2),
+                    'avg_db_queries': round(r['db_queries'] / r['count'], 2),
+                    'max_db_queries': r['db_max_queries'],
+                    'avg_db_time_ms': round(r['db_time_ms'] / r['count'], 2),
+                } for key, r in routes.items()
+            ), key=lambda r: r['p95_ms'] * r['count'], reverse=True),
+            'slow_queries': sorted((
+                {
+                    'fingerprint': fp,
+                    'count': q['count'],
+                    'total_ms': round(q['total_ms'], 2),
+                    'avg_ms': round(q['total_ms'] / q['count'], 2),
+                    'max_ms': round(q['max_ms'], 2),
+                } for fp, q in merged['queries'].items()
+            ), key=lambda q: q['total_ms'], reverse=True)[:25],
+            'caches': [
+                {
+                    'name': name,
+                    'hits': c['hits'],
+                    'misses': c['misses'],
+                    'hit_rate': round(c['hits'] / (c['hits'] + c['misses']) * 100, 2) if c['hits'] + c['misses'] else 0.0,
+                } for name, c in sorted(merged['caches'].items())
+            ]
         }
+    
+    def get_ussd_summary(self):
+        """USSD hop latency by menu state with the per-phase split, across all workers"""
+        states = []
+        for menu_state, entry in self.collect()['ussd'].items():
+            count = entry['count']
+            states.append({
+                'menu_state': menu_state,
+                'count': count,
+                'timeouts': entry['timeouts'],
+                'avg_ms': round(entry['sum_ms'] / count, 2) if count else 0.0,
+                'p50_ms': round(entry['histogram'].quantile(0.5), 2),
+                'p95_ms': round(entry['histogram'].quantile(0.95), 2),
+                'p99_ms': round(entry['histogram'].quantile(0.99), 2),
+                'max_ms': round(entry['max_ms'], 2),
+                'phases': {
+                    phase: {
+                        'avg_ms': round(timing['sum_ms'] / count, 2) if count else 0.0,
+                        'p95_ms': round(timing['histogram'].quantile(0.95), 2),
+                    } for phase, timing in sorted(entry['phases'].items())
+                },
+            })
+        return sorted(states, key=lambda s: s['p95_ms'], reverse=True)
+    
+    def get_llm_summary(self):
+        """LLM call latency, outcomes and token counts by endpoint, across all workers"""
+        endpoints = []
+        for endpoint, entry in sorted(self.collect()['llm'].items()):
+            count = entry['count']
+            endpoints.append({
+                'endpoint': endpoint,
+                'count': count,
+                'outcomes': entry['outcomes'],
+                'retries': entry['retries'],
+                'prompt_tokens': entry['prompt_tokens'],
+                'output_tokens': entry['output_tokens'],
+                'cached_tokens': entry['cached_tokens'],
+                'avg_ms': round(entry['sum_ms'] / count, 2) if count else 0.0,
+                'p50_ms': round(entry['histogram'].quantile(0.5), 2),
+                'p95_ms': round(entry['histogram'].quantile(0.95), 2),
+                'max_ms': round(entry['max_ms'], 2),
+            })
+        return endpoints
+    
+    def get_pipeline_summary(self):
+        """Pipeline latency with the per-stage split, across all workers"""
+        pipelines = []
+        for pipeline, entry in sorted(self.collect()['pipelines'].items()):
+            count = entry['count']
+            pipelines.append({
+                'pipeline': pipeline,
+                'count': count,
+                'avg_ms': round(entry['sum_ms'] / count, 2) if count else 0.0,
+                'p50_ms': round(entry['histogram'].quantile(0.5), 2),
+                'p95_ms': round(entry['histogram'].quantile(0.95), 2),
+                'max_ms': round(entry['max_ms'], 2),
+                'stages': {
+                    stage: {
+                        'avg_ms': round(timing['sum_ms'] / count, 2) if count else 0.0,
+                        'p95_ms': round(timing['histogram'].quantile(0.95), 2),
+                    } for stage, timing in sorted(entry['stages'].items())
+                },
+            })
+        return pipelines
+    
+    def get_context_summary(self):
+        """Prompt tokens saved by history compaction, by context, across all workers"""
+        contexts = []
+        for context, entry in sorted(self.collect()['contexts'].items()):
+            saved = entry['full_tokens'] - entry['sent_tokens']
+            contexts.append({
+                'context': context,
+                'requests': entry['requests'],
+                'full_tokens': entry['full_tokens'],
+                'sent_tokens': entry['sent_tokens'],
+                'saved_tokens': saved,
+                'saved_ratio': round(saved / entry['full_tokens'], 4) if entry['full_tokens'] else 0.0,
+            })
+        return contexts
+
+
+def _new_context_entry():
+    return {'requests': 0, 'full_tokens': 0, 'sent_tokens': 0}
+
+
+def _new_pipeline_entry():
+    return {'count': 0, 'sum_ms': 0.0, 'max_ms': 0.0, 'histogram': LogHistogram(), 'stages': {}}
+
+
+def _new_llm_entry():
+    return {
+        'count': 0, 'retries': 0, 'prompt_tokens': 0, 'output_tokens': 0, 'cached_tokens': 0,
+        'sum_ms': 0.0, 'max_ms': 0.0, 'outcomes': {}, 'histogram': LogHistogram(),
+    }
+
+
+def _new_ussd_entry():
+    return {'count': 0, 'timeouts': 0, 'sum_ms': 0.0, 'max_ms': 0.0, 'histogram': LogHistogram(), 'phases': {}}
+
+
+def merge_snapshots(snapshots):
+    """Combine per-worker snapshots into one set of counters"""
+    routes, queries, caches, ussd, llm, pipelines, contexts, slow_requests = {}, {}, {}, {}, {}, {}, {}, []
+    for snap in snapshots:
+        for key, route in snap.get('routes', {}).items():
+            merged = routes.setdefault(key, {
+                'count': 0, 'errors': 0, 'sum_ms': 0.0, 'max_ms': 0.0,
+                'db_queries': 0, 'db_time_ms': 0.0, 'db_max_queries': 0,
+                'histogram': LogHistogram(),
+            })
+            for field in ('count', 'errors', 'sum_ms', 'db_queries', 'db_time_ms'):
+                merged[field] += route.get(field, 0)
+            merged['max_ms'] = max(merged['max_ms'], route.get('max_ms', 0))
+            merged['db_max_queries'] = max(merged['db_max_queries'], route.get('db_max_queries', 0))
+            merged['histogram'].merge(LogHistogram(route.get('buckets')))
+        for fp, query in snap.get('queries', {}).items():
+            merged = queries.setdefault(fp, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            merged['count'] += query['count']
+            merged['total_ms'] += query['total_ms']
+            merged['max_ms'] = max(merged['max_ms'], query['max_ms'])
+        for name, cache in snap.get('caches', {}).items():
+            merged = caches.setdefault(name, {'hits': 0, 'misses': 0})
+            merged['hits'] += cache['hits']
+            merged['misses'] += cache['misses']
+        for menu_state, entry in snap.get('ussd', {}).items():
+            merged = ussd.setdefault(menu_state, _new_ussd_entry())
+            for field in ('count', 'timeouts', 'sum_ms'):
+                merged[field] += entry.get(field, 0)
+            merged['max_ms'] = max(merged['max_ms'], entry.get('max_ms', 0))
+            merged['histogram'].merge(LogHistogram(entry.get('buckets')))
+            for phase, timing in entry.get('phases', {}).items():
+                merged_phase = merged['phases'].setdefault(phase, {'sum_ms': 0.0, 'histogram': LogHistogram()})
+                merged_phase['sum_ms'] += timing.get('sum_ms', 0)
+                merged_phase['histogram'].merge(LogHistogram(timing.get('buckets')))
+        for endpoint, entry in snap.get('llm', {}).items():
+            merged = llm.setdefault(endpoint, _new_llm_entry())
+            for field in ('count', 'retries', 'prompt_tokens', 'output_tokens', 'cached_tokens', 'sum_ms'):
+                merged[field] += entry.get(field, 0)
+            merged['max_ms'] = max(merged['max_ms'], entry.get('max_ms', 0))
+            for outcome, count in entry.get('outcomes', {}).items():
+                merged['outcomes'][outcome] = merged['outcomes'].get(outcome, 0) + count
+            merged['histogram'].merge(LogHistogram(entry.get('buckets')))
+        for pipeline, entry in snap.get('pipelines', {}).items():
+            merged = pipelines.setdefault(pipeline, _new_pipeline_entry())
+            merged['count'] += entry.get('count', 0)
+            merged['sum_ms'] += entry.get('sum_ms', 0)
+            merged['max_ms'] = max(merged['max_ms'], entry.get('max_ms', 0))
+            merged['histogram'].merge(LogHistogram(entry.get('buckets')))
+            for stage, timing in entry.get('stages', {}).items():
+                merged_stage = merged['stages'].setdefault(stage, {'sum_ms': 0.0, 'histogram': LogHistogram()})
+                merged_stage['sum_ms'] += timing.get('sum_ms', 0)
+                merged_stage['histogram'].merge(LogHistogram(timing.get('buckets')))
+        for context, entry in snap.get('contexts', {}).items():
+            merged = contexts.setdefault(context, _new_context_entry())
+            for field in ('requests', 'full_tokens', 'sent_tokens'):
+                merged[field] += entry.get(field, 0)
+        slow_requests.extend(snap.get('slow_requests', []))
+    
+    slow_requests.sort(key=lambda r: r.get('at', 0))
+    return {
+        'workers': len(snapshots),
+        'routes': routes,
+        'queries': queries,
+        'caches': caches,
+        'ussd': ussd,
+        'llm': llm,
+        'pipelines': pipelines,
+        'contexts': contexts,
+        'slow_requests': slow_requests[-20:],
+    }
+
+
+PROMETHEUS_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+def render_prometheus(merged, extra_gauges=None):
+    """Prometheus text exposition of merged performance counters"""
+    lines = [
+        '# HELP http_request_duration_seconds Request latency by route',
+        '# TYPE http_request_duration_seconds histogram',
+    ]
+    for key, route in sorted(merged['routes'].items()):
+        method, _, path = key.partition(' ')
+        labels = f'method="{_label(method)}",route="{_label(path)}"'
+        for bound, count in zip(PROMETHEUS_BUCKETS_MS, route['histogram'].cumulative(PROMETHEUS_BUCKETS_MS)):
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound / 1000:g}"}} {count}')
+        lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {route["count"]}')
+        lines.append(f'http_request_duration_seconds_sum{{{labels}}} {route["sum_ms"] / 1000:.6f}')
+        lines.append(f'http_request_duration_seconds_count{{{labels}}} {route["count"]}')
+    
+    for name, help_text, field, scale in (
+        ('http_request_errors_total', 'Requests that returned 5xx', 'errors', 1),
+        ('http_request_db_queries_total', 'Database queries issued by route', 'db_queries', 1),
+        ('http_request_db_seconds_total', 'Database time spent by route', 'db_time_ms', 1000),
+    ):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for key, route in sorted(merged['routes'].items()):
+            method, _, path = key.partition(' ')
+            value = route[field] / scale
+            lines.append(f'{name}{{method="{_label(method)}",route="{_label(path)}"}} {value:g}')
+    
+    lines.append('# HELP db_slow_query_seconds_total Time spent in slow queries by fingerprint')
+    lines.append('# TYPE db_slow_query_seconds_total counter')
+    top_queries = sorted(merged['queries'].items(), key=lambda item: item[1]['total_ms'], reverse=True)[:25]
+    for fp, query in top_queries:
+        lines.append(f'db_slow_query_seconds_total{{query="{_label(fp[:200])}"}} {query["total_ms"] / 1000:.6f}')
+    
+    lines.append('# HELP cache_requests_total Cache lookups by result')
+    lines.append('# TYPE cache_requests_total counter')
+    for name, cache in sorted(merged['caches'].items()):
+        lines.append(f'cache_requests_total{{cache="{_label(name)}",result="hit"}} {cache["hits"]}')
+        lines.append(f'cache_requests_total{{cache="{_label(name)}",result="miss"}} {cache["misses"]}')
+    
+    lines.append('# HELP ussd_hop_duration_seconds USSD hop latency by menu state')
+    lines.append('# TYPE ussd_hop_duration_seconds histogram')
+    for menu_state, entry in sorted(merged['ussd'].items()):
+        labels = f'menu_state="{_label(menu_state)}"'
+        for bound, count in zip(PROMETHEUS_BUCKETS_MS, entry['histogram'].cumulative(PROMETHEUS_BUCKETS_MS)):
+            lines.append(f'ussd_hop_duration_seconds_bucket{{{labels},le="{bound / 1000:g}"}} {count}')
+        lines.append(f'ussd_hop_duration_seconds_bucket{{{labels},le="+Inf"}} {entry["count"]}')
+        lines.append(f'ussd_hop_duration_seconds_sum{{{labels}}} {entry["sum_ms"] / 1000:.6f}')
+        lines.append(f'ussd_hop_duration_seconds_count{{{labels}}} {entry["count"]}')
+    
+    lines.append('# HELP ussd_phase_seconds_total Time spent in each phase of USSD hops')
+    lines.append('# TYPE ussd_phase_seconds_total counter')
+    for menu_state, entry in sorted(merged['ussd'].items()):
+        for phase, timing in sorted(entry['phases'].items()):
+            lines.append(
+                f'ussd_phase_seconds_total{{menu_state="{_label(menu_state)}",phase="{_label(phase)}"}} '
+                f'{timing["sum_ms"] / 1000:.6f}'
+            )
+    
+    lines.append('# HELP ussd_hop_timeouts_total USSD hops answered with the over-budget fallback')
+    lines.append('# TYPE ussd_hop_timeouts_total counter')
+    for menu_state, entry in sorted(merged['ussd'].items()):
+        lines.append(f'ussd_hop_timeouts_total{{menu_state="{_label(menu_state)}"}} {entry["timeouts"]}')
+    
+    lines.append('# HELP llm_request_duration_seconds Upstream LLM call latency by endpoint')
+    lines.append('# TYPE llm_request_duration_seconds histogram')
+    for endpoint, entry in sorted(merged['llm'].items()):
+        labels = f'endpoint="{_label(endpoint)}"'
+        for bound, count in zip(PROMETHEUS_BUCKETS_MS, entry['histogram'].cumulative(PROMETHEUS_BUCKETS_MS)):
+            lines.append(f'llm_request_duration_seconds_bucket{{{labels},le="{bound / 1000:g}"}} {count}')
+        lines.append(f'llm_request_duration_seconds_bucket{{{labels},le="+Inf"}} {entry["count"]}')
+        lines.append(f'llm_request_duration_seconds_sum{{{labels}}} {entry["sum_ms"] / 1000:.6f}')
+        lines.append(f'llm_request_duration_seconds_count{{{labels}}} {entry["count"]}')
+    
+    lines.append('# HELP llm_requests_total LLM calls by endpoint and outcome')
+    lines.append('# TYPE llm_requests_total counter')
+    for endpoint, entry in sorted(merged['llm'].items()):
+        for outcome, count in sorted(entry['outcomes'].items()):
+            lines.append(f'llm_requests_total{{endpoint="{_label(endpoint)}",outcome="{_label(outcome)}"}} {count}')
+    
+    lines.append('# HELP llm_tokens_total LLM tokens by endpoint and direction')
+    lines.append('# TYPE llm_tokens_total counter')
+    for endpoint, entry in sorted(merged['llm'].items()):
+        lines.append(f'llm_tokens_total{{endpoint="{_label(endpoint)}",kind="prompt"}} {entry["prompt_tokens"]}')
+        lines.append(f'llm_tokens_total{{endpoint="{_label(endpoint)}",kind="output"}} {entry["output_tokens"]}')
+        lines.append(f'llm_tokens_total{{endpoint="{_label(endpoint)}",kind="cached"}} {entry["cached_tokens"]}')
+    
+    lines.append('# HELP llm_context_tokens_total Prompt history tokens: whole stored history vs. sent after compaction')
+    lines.append('# TYPE llm_context_tokens_total counter')
+    for context, entry in sorted(merged['contexts'].items()):
+        lines.append(f'llm_context_tokens_total{{context="{_label(context)}",kind="full"}} {entry["full_tokens"]}')
+        lines.append(f'llm_context_tokens_total{{context="{_label(context)}",kind="sent"}} {entry["sent_tokens"]}')
+    
+    lines.append('# HELP pipeline_duration_seconds Latency of multi-stage pipelines')
+    lines.append('# TYPE pipeline_duration_seconds histogram')
+    for pipeline, entry in sorted(merged['pipelines'].items()):
+        labels = f'pipeline="{_label(pipeline)}"'
+        for bound, count in zip(PROMETHEUS_BUCKETS_MS, entry['histogram'].cumulative(PROMETHEUS_BUCKETS_MS)):
+            lines.append(f'pipeline_duration_seconds_bucket{{{labels},le="{bound / 1000:g}"}} {count}')
+        lines.append(f'pipeline_duration_seconds_bucket{{{labels},le="+Inf"}} {entry["count"]}')
+        lines.append(f'pipeline_duration_seconds_sum{{{labels}}} {entry["sum_ms"] / 1000:.6f}')
+        lines.append(f'pipeline_duration_seconds_count{{{labels}}} {entry["count"]}')
+    
+    lines.append('# HELP pipeline_stage_seconds_total Time spent in each stage of a pipeline')
+    lines.append('# TYPE pipeline_stage_seconds_total counter')
+    for pipeline, entry in sorted(merged['pipelines'].items()):
+        for stage, timing in sorted(entry['stages'].items()):
+            lines.append(
+                f'pipeline_stage_seconds_total{{pipeline="{_label(pipeline)}",stage="{_label(stage)}"}} '
+                f'{timing["sum_ms"] / 1000:.6f}'
+            )
+    
+    lines.append('# HELP app_workers_reporting Worker processes included in these metrics')
+    lines.append('# TYPE app_workers_reporting gauge')
+    lines.append(f'app_workers_reporting {merged["workers"]}')
+    
+    for name, help_text, samples in (extra_gauges or []):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        for labels, value in samples:
+            label_text = ','.join(f'{k}="{_label(v)}"' for k, v in labels.items())
+            lines.append(f'{name}{{{label_text}}} {value:g}')
+    
+    return '\n'.join(lines) + '\n'
+
+
+class StageTimer:
+    """Wall-clock split of one pipeline run into named stages, recorded under the pipeline name"""
+    
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.started = perf_counter()
+        self.stages = {}
+    
+    @contextmanager
+    def stage(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (perf_counter() - start) * 1000
+    
+    def finish(self):
+        """Record the run; returns its total duration in milliseconds"""
+        total = (perf_counter() - self.started) * 1000
+        performance_stats.record_pipeline(self.pipeline, total, self.stages)
+        return total
+
+
+def record_cache_access(name, hit):
+    """Count a cache hit or miss (shown in /metrics and the admin performance view)"""
+    performance_stats.record_cache_access(name, hit)
 
 
 # Global performance stats instance
@@ -0,0 +1,86 @@
+"""
+Phone number normalization shared by USSD, login and account management.
+
+Numbers are stored in ``User.phone_number`` in whatever format they were
+registered with (mostly local 07XXXXXXXX); ``User.phone_e164`` holds the
+canonical +250… form and is what lookups should filter on.
+"""
+
+import re
+
+_E164_RE = re.compile(r'^\+\d{8,15}$')
+
+
+def normalize_phone(phone_number):
+    """Normalize to E.164 Rwanda (+250…) from any common local/international input."""
+    cleaned = re.sub(r'[\s\-]', '', (phone_number or '').strip())
+    if not cleaned:
+        return cleaned
+
+    if cleaned.startswith('+250'):
+        return cleaned
+
+    if cleaned.startswith('250') and len(cleaned) >= 12:
+        return '+' + cleaned
+
+    # Local Rwanda mobile: 07XXXXXXXX
+    if cleaned.startswith('07') and len(cleaned) == 10:
+        return '+250' + cleaned[1:]
+
+    # Without leading 0: 7XXXXXXXX (9 digits)
+    if cleaned.startswith('7') and len(cleaned) == 9 and cleaned.isdigit():
+        return '+250' + cleaned
+
+    if not cleaned.startswith('+'):
+        return '+' + cleaned
+
+    return cleaned
+
+
+def canonical_phone(phone_number):
+    """E.164 form used for the unique phone index, or None if it is not a usable number."""
+    if not phone_number:
+        return None
+    e164 = normalize_phone(re.sub(r'[().]', '', phone_number))
+    return e164 if _E164_RE.match(e164 or '') else None
+
+
+def phone_lookup_variants(raw_phone):
+    """Generate all formats to match DB records stored with or without country code."""
+    cleaned = re.sub(r'[\s\-]', '', (raw_phone or '').strip())
+    if not cleaned:
+        return []
+
+    variants = set()
+    variants.add(cleaned)
+
+    e164 = normalize_phone(cleaned)
+    if e164:
+        variants.add(e164)
+
+    # National number digits after +250
+    national = None
+    if e164.startswith('+250'):
+        national = e164[4:]
+    elif cleaned.startswith('250') and len(cleaned) >= 12:
+        national = cleaned[3:]
+    elif cleaned.startswith('07') and len(cleaned) == 10:
+        national = cleaned[1:]
+    elif cleaned.startswith('7') and len(cleaned) == 9:
+        national = cleaned
+
+    if national:
+        variants.add(national)
+        variants.add('0' + national)
+        variants.add('250' + national)
+        variants.add('+250' + national)
+
+    return list(variants)
+
+
+def to_stored_phone(raw_phone):
+    """Store phones in local Rwanda format (07XXXXXXXX) to match existing DB records."""
+    e164 = normalize_phone(raw_phone)
+    if e164.startswith('+250'):
+        return '0' + e164[4:]
+    return re.sub(r'[\s\-]', '', (raw_phone or '').strip()).lstrip('+')
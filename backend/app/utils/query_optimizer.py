@@ -6,8 +6,11 @@ Provides helper functions for optimizing database queries and preventing N+1 pro
 from functools import wraps
 from time import time
 from flask import current_app
+from sqlalchemy import func, select
 from sqlalchemy.orm import joinedload, subqueryload, selectinload
 
+from app import db
+
 def log_query_time(func):
     """Decorator to log query execution time for performance monitoring"""
     @wraps(func)
@@ -135,6 +138,132 @@ def batch_fetch_related(model, primary_key_values, related_field):
     ).all()
 
 
+def batch_count(key_column, ids, *criteria):
+    """
+    Count rows per key for a whole page of entities in one grouped query
+
+    Example:
+        provider_ids = [p.id for p in page.items]
+        totals = batch_count(Appointment.provider_id, provider_ids)
+
+    Args:
+        key_column: Foreign key column to group on (e.g. Appointment.provider_id)
+        ids: Entity ids to count for
+        *criteria: Extra filter expressions applied before grouping
+
+    Returns:
+        dict: id -> count (ids with no rows map to 0)
+    """
+    ids = list(ids)
+    if not ids:
+        return {}
+
+    rows = db.session.query(key_column, func.count()).filter(
+        key_column.in_(ids), *criteria
+    ).group_by(key_column).all()
+
+    counts = dict.fromkeys(ids, 0)
+    counts.update(rows)
+    return counts
+
+
+def batch_count_by(key_column, group_column, ids, *criteria):
+    """
+    Count rows per (key, value) in one grouped query, e.g. appointments per
+    provider broken down by status
+
+    Returns:
+        dict: id -> {value: count}
+    """
+    ids = list(ids)
+    if not ids:
+        return {}
+
+    rows = db.session.query(key_column, group_column, func.count()).filter(
+        key_column.in_(ids), *criteria
+    ).group_by(key_column, group_column).all()
+
+    counts = {entity_id: {} for entity_id in ids}
+    for entity_id, value, count in rows:
+        counts[entity_id][value] = count
+    return counts
+
+
+def scalar_counts(**counts):
+    """
+    Run several independent COUNTs for a single entity in one round trip
+
+    Example:
+        scalar_counts(
+            cycle_logs=CycleLog.user_id == user.id,
+            meal_logs=MealLog.user_id == user.id,
+        )
+
+    Args:
+        **counts: name -> filter expression; the table is taken from the expression
+
+    Returns:
+        dict: name -> count
+    """
+    if not counts:
+        return {}
+
+    subqueries = [
+        select(func.count()).where(criterion).scalar_subquery().label(name)
+        for name, criterion in counts.items()
+    ]
+
+    row = db.session.execute(select(*subqueries)).one()
+    return dict(row._mapping)
+
+
+class BatchStatsLoader:
+    """
+    Collects per-entity counts for a page of ids with one grouped query per
+    related table, so listing endpoints issue a constant number of queries
+    regardless of page size
+
+    Example:
+        stats = (BatchStatsLoader(provider_ids)
+                 .count_by('appointments', Appointment.provider_id, Appointment.status)
+                 .load())
+        stats[provider_id]['appointments']  # {'pending': 2, 'completed': 5}
+    """
+
+    def __init__(self, ids):
+        self.ids = list(dict.fromkeys(ids))
+        self._counts = []
+
+    def count(self, name, key_column, *criteria):
+        """Add a plain count of related rows under ``name``"""
+        self._counts.append((name, key_column, None, criteria))
+        return self
+
+    def count_by(self, name, key_column, group_column, *criteria):
+        """Add a count of related rows broken down by ``group_column`` under ``name``"""
+        self._counts.append((name, key_column, group_column, criteria))
+        return self
+
+    def load(self):
+        """
+        Returns:
+            dict: id -> {name: count or {value: count}}
+        """
+        stats = {entity_id: {} for entity_id in self.ids}
+        if not self.ids:
+            return stats
+
+        for name, key_column, group_column, criteria in self._counts:
+            if group_column is None:
+                result = batch_count(key_column, self.ids, *criteria)
+            else:
+                result = batch_count_by(key_column, group_column, self.ids, *criteria)
+            for entity_id, value in result.items():
+                stats[entity_id][name] = value
+
+        return stats
+
+
 # Query result caching decorator
 def cache_query_result(timeout=300):
     """
@@ -195,44 +324,10 @@ class QueryOptimizer:
         Returns:
             dict: User ID -> stats dictionary
         """
-        from app.models import CycleLog, MealLog, Appointment, Notification
-        from sqlalchemy import func
-        
-        # Fetch all stats in parallel queries
-        cycle_counts = dict(
-            db.session.query(
-                CycleLog.user_id, 
-                func.count(CycleLog.id)
-            ).filter(
-                CycleLog.user_id.in_(user_ids)
-            ).group_by(CycleLog.user_id).all()
-        )
-        
-        meal_counts = dict(
-            db.session.query(
-                MealLog.user_id,
-                func.count(MealLog.id)
-            ).filter(
-                MealLog.user_id.in_(user_ids)
-            ).group_by(MealLog.user_id).all()
-        )
+        from app.models import CycleLog, MealLog, Appointment
         
-        appointment_counts = dict(
-            db.session.query(
-                Appointment.user_id,
-                func.count(Appointment.id)
-            ).filter(
-                Appointment.user_id.in_(user_ids)
-            ).group_by(Appointment.user_id).all()
-        )
-        
-        # Combine results
-        stats = {}
-        for user_id in user_ids:
-            stats[user_id] = {
-                'cycle_logs': cycle_counts.get(user_id, 0),
-                'meal_logs': meal_counts.get(user_id, 0),
-                'appointments': appointment_counts.get(user_id, 0)
-            }
-        
-        return stats
+        return (BatchStatsLoader(user_ids)
+                .count('cycle_logs', CycleLog.user_id)
+                .count('meal_logs', MealLog.user_id)
+                .count('appointments', Appointment.user_id)
+                .load())
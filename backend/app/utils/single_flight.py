@@ -0,0 +1,98 @@
+"""
+Request coalescing for slow, idempotent work.
+
+``SingleFlight.do(key, fn)`` runs ``fn`` once per key at a time within the
+process: the first caller (the leader) runs it and every caller that arrives
+with the same key while it is in flight waits and receives the leader's
+result, or its exception. Nothing is remembered once the call finishes;
+callers cache results themselves. Coordination between gunicorn workers is
+left to the caller (see ``InsightGenerationLock``).
+
+Work that cannot be wrapped in a function (a generator streaming its result
+out as it goes) leads with ``with flight.lead(key) as call:`` instead and
+sets ``call.result`` for the callers waiting in ``do``.
+
+Leader/follower counts are reported to the performance collector under the
+flight's name, as hits (coalesced) and misses (led).
+"""
+
+import threading
+from contextlib import contextmanager
+
+from app.utils.performance import record_cache_access
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Per-key in-process call deduplication. Safe to share between threads."""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        record_cache_access(self.name, not leader)
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    @contextmanager
+    def lead(self, key):
+        """Lead ``key`` for the duration of the block.
+
+        Yields the call, whose ``result`` the block sets for followers, or
+        None when a call for ``key`` is already in flight (wait for it with
+        ``do``). Only an Exception is passed on to followers; a block left by
+        anything else (a closed generator) hands them ``result`` as it is.
+        """
+        with self._lock:
+            call = None if key in self._calls else _Call()
+            if call is not None:
+                self._calls[key] = call
+        record_cache_access(self.name, call is None)
+
+        if call is None:
+            yield None
+            return
+
+        try:
+            yield call
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
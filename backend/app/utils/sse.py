@@ -0,0 +1,10 @@
+"""Server-sent events framing for streamed JSON responses."""
+
+import json
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+def sse_event(event, data):
+    """One SSE frame with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
@@ -0,0 +1,24 @@
+"""Add insight_generation_locks, one row per insight being generated."""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'a6d1e9b3c7f2'
+down_revision = 'f3c7a2d8e4b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'insight_generation_locks',
+        sa.Column('fingerprint', sa.String(length=64), nullable=False),
+        sa.Column('owner', sa.String(length=32), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('fingerprint')
+    )
+
+
+def downgrade():
+    op.drop_table('insight_generation_locks')
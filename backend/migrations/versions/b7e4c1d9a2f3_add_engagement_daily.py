@@ -0,0 +1,32 @@
+"""Add engagement_daily aggregate table."""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'b7e4c1d9a2f3'
+down_revision = 'a1b2c3d4e5f8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'engagement_daily',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('metric', sa.String(length=50), nullable=False),
+        sa.Column('user_bitmap', sa.LargeBinary(), nullable=True),
+        sa.Column('distinct_users', sa.Integer(), nullable=True),
+        sa.Column('events', sa.Integer(), nullable=True),
+        sa.Column('is_final', sa.Boolean(), nullable=True),
+        sa.Column('computed_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('day', 'metric', name='uq_engagement_daily_day_metric'),
+    )
+    op.create_index('ix_engagement_daily_day', 'engagement_daily', ['day'])
+
+
+def downgrade():
+    op.drop_index('ix_engagement_daily_day', table_name='engagement_daily')
+    op.drop_table('engagement_daily')
@@ -0,0 +1,53 @@
+"""Add umwari_conversations and umwari_messages for server-side chat history."""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'b8c2f4e6a1d9'
+down_revision = 'a6d1e9b3c7f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'umwari_conversations',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('system_context', sa.Text(), nullable=True),
+        sa.Column('summary', sa.Text(), nullable=True),
+        sa.Column('summary_tokens', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('summarized_through_id', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('total_tokens', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('umwari_conversations', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_umwari_conversations_user_id'), ['user_id'], unique=False)
+
+    op.create_table(
+        'umwari_messages',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('conversation_id', sa.Integer(), nullable=False),
+        sa.Column('role', sa.String(length=10), nullable=False),
+        sa.Column('text', sa.Text(), nullable=False),
+        sa.Column('tokens', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['conversation_id'], ['umwari_conversations.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('umwari_messages', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_umwari_messages_conversation_id'), ['conversation_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('umwari_messages', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_umwari_messages_conversation_id'))
+    op.drop_table('umwari_messages')
+
+    with op.batch_alter_table('umwari_conversations', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_umwari_conversations_user_id'))
+    op.drop_table('umwari_conversations')
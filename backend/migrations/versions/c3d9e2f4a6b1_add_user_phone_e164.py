@@ -0,0 +1,76 @@
+"""Add canonical users.phone_e164 with a unique index.
+
+Backfills from phone_number. When several rows normalize to the same number
+only the oldest account gets the canonical value; the rest stay NULL so the
+unique index can be built and can be merged by hand later.
+"""
+
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'c3d9e2f4a6b1'
+down_revision = 'b7e4c1d9a2f3'
+branch_labels = None
+depends_on = None
+
+_E164_RE = re.compile(r'^\+\d{8,15}$')
+
+
+def _canonical(phone_number):
+    # Frozen copy of app.utils.phone.canonical_phone so the migration does not
+    # change meaning if the application helper evolves
+    cleaned = re.sub(r'[\s\-().]', '', (phone_number or '').strip())
+    if not cleaned:
+        return None
+    if cleaned.startswith('+250'):
+        e164 = cleaned
+    elif cleaned.startswith('250') and len(cleaned) >= 12:
+        e164 = '+' + cleaned
+    elif cleaned.startswith('07') and len(cleaned) == 10:
+        e164 = '+250' + cleaned[1:]
+    elif cleaned.startswith('7') and len(cleaned) == 9 and cleaned.isdigit():
+        e164 = '+250' + cleaned
+    elif not cleaned.startswith('+'):
+        e164 = '+' + cleaned
+    else:
+        e164 = cleaned
+    return e164 if _E164_RE.match(e164) else None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('phone_e164', sa.String(length=20), nullable=True))
+
+    conn = op.get_bind()
+    users = sa.table('users', sa.column('id', sa.Integer), sa.column('phone_number', sa.String),
+                     sa.column('phone_e164', sa.String))
+    rows = conn.execute(
+        sa.select(users.c.id, users.c.phone_number)
+        .where(users.c.phone_number.isnot(None))
+        .order_by(users.c.id)
+    ).fetchall()
+
+    seen = set()
+    updates = []
+    for user_id, phone_number in rows:
+        canonical = _canonical(phone_number)
+        if canonical and canonical not in seen:
+            seen.add(canonical)
+            updates.append({'uid': user_id, 'phone': canonical})
+
+    if updates:
+        conn.execute(
+            users.update().where(users.c.id == sa.bindparam('uid')).values(phone_e164=sa.bindparam('phone')),
+            updates
+        )
+
+    op.create_index('ix_users_phone_e164', 'users', ['phone_e164'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_users_phone_e164', table_name='users')
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('phone_e164')
@@ -0,0 +1,41 @@
+"""Add llm_usage, the per-call Gemini usage ledger."""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'c5d7e9f1a3b8'
+down_revision = 'b8c2f4e6a1d9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'llm_usage',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('role', sa.String(length=20), nullable=True),
+        sa.Column('endpoint', sa.String(length=50), nullable=False),
+        sa.Column('language', sa.String(length=20), nullable=True),
+        sa.Column('model', sa.String(length=50), nullable=True),
+        sa.Column('outcome', sa.String(length=20), nullable=False),
+        sa.Column('cache_hit', sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.Column('prompt_tokens', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('output_tokens', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('cached_tokens', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('duration_ms', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('llm_usage', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_llm_usage_created_at'), ['created_at'], unique=False)
+        batch_op.create_index('ix_llm_usage_user_created', ['user_id', 'created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('llm_usage', schema=None) as batch_op:
+        batch_op.drop_index('ix_llm_usage_user_created')
+        batch_op.drop_index(batch_op.f('ix_llm_usage_created_at'))
+    op.drop_table('llm_usage')
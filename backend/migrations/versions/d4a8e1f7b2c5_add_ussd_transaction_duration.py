@@ -0,0 +1,22 @@
+"""Add ussd_transactions.duration_ms and an index on created_at."""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'd4a8e1f7b2c5'
+down_revision = 'c3d9e2f4a6b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('ussd_transactions', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('duration_ms', sa.Integer(), nullable=True))
+        batch_op.create_index('ix_ussd_transactions_created_at', ['created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('ussd_transactions', schema=None) as batch_op:
+        batch_op.drop_index('ix_ussd_transactions_created_at')
+        batch_op.drop_column('duration_ms')
@@ -0,0 +1,27 @@
+"""Make insight_cache one row per (user, language) and index expires_at for the purge."""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'd9e1f3a5b7c2'
+down_revision = 'c5d7e9f1a3b8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Writes used to delete-then-insert, so concurrent workers could leave duplicates; keep the newest
+    op.execute(sa.text(
+        'DELETE FROM insight_cache WHERE id NOT IN '
+        '(SELECT keep_id FROM (SELECT MAX(id) AS keep_id FROM insight_cache GROUP BY user_id, language) AS newest)'
+    ))
+    with op.batch_alter_table('insight_cache', schema=None) as batch_op:
+        batch_op.create_index('ux_insight_cache_user_language', ['user_id', 'language'], unique=True)
+        batch_op.create_index(batch_op.f('ix_insight_cache_expires_at'), ['expires_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('insight_cache', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_insight_cache_expires_at'))
+        batch_op.drop_index('ux_insight_cache_user_language')
@@ -0,0 +1,22 @@
+"""Rename the SystemLog-backed engagement feature from 'dashboard' to 'staff_actions'."""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'e2f4a6b8c0d1'
+down_revision = 'd9e1f3a5b7c2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(sa.text(
+        "UPDATE engagement_daily SET metric = 'feature:staff_actions' WHERE metric = 'feature:dashboard'"
+    ))
+
+
+def downgrade():
+    op.execute(sa.text(
+        "UPDATE engagement_daily SET metric = 'feature:dashboard' WHERE metric = 'feature:staff_actions'"
+    ))
@@ -0,0 +1,74 @@
+"""Track SMS delivery of ussd_notifications.
+
+ussd_notifications was only ever created by db.create_all(), so it is created
+here when missing and otherwise gets the delivery columns added.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'e5b2c8f1a9d3'
+down_revision = 'd4a8e1f7b2c5'
+branch_labels = None
+depends_on = None
+
+
+DELIVERY_COLUMNS = (
+    ('notification_id', sa.Integer(), True, None),
+    ('delivery_status', sa.String(length=20), False, 'pending'),
+    ('attempts', sa.Integer(), False, '0'),
+    ('next_attempt_at', sa.DateTime(), True, None),
+    ('claim_token', sa.String(length=32), True, None),
+    ('last_error', sa.Text(), True, None),
+)
+
+
+def upgrade():
+    bind = op.get_bind()
+    if 'ussd_notifications' not in sa.inspect(bind).get_table_names():
+        op.create_table(
+            'ussd_notifications',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('notification_id', sa.Integer(), nullable=True),
+            sa.Column('notification_type', sa.String(length=50), nullable=False),
+            sa.Column('message', sa.Text(), nullable=False),
+            sa.Column('priority', sa.String(length=20), nullable=True),
+            sa.Column('scheduled_for', sa.DateTime(), nullable=True),
+            sa.Column('sent', sa.Boolean(), nullable=True),
+            sa.Column('sent_at', sa.DateTime(), nullable=True),
+            sa.Column('read', sa.Boolean(), nullable=True),
+            sa.Column('read_at', sa.DateTime(), nullable=True),
+            sa.Column('delivery_status', sa.String(length=20), nullable=False, server_default='pending'),
+            sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('next_attempt_at', sa.DateTime(), nullable=True),
+            sa.Column('claim_token', sa.String(length=32), nullable=True),
+            sa.Column('last_error', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+            sa.ForeignKeyConstraint(
+                ['notification_id'], ['notifications.id'],
+                name='fk_ussd_notifications_notification_id', ondelete='SET NULL',
+            ),
+            sa.PrimaryKeyConstraint('id'),
+        )
+    else:
+        with op.batch_alter_table('ussd_notifications', schema=None) as batch_op:
+            for name, type_, nullable, default in DELIVERY_COLUMNS:
+                batch_op.add_column(sa.Column(name, type_, nullable=nullable, server_default=default))
+            batch_op.create_foreign_key(
+                'fk_ussd_notifications_notification_id', 'notifications',
+                ['notification_id'], ['id'], ondelete='SET NULL',
+            )
+
+    with op.batch_alter_table('ussd_notifications', schema=None) as batch_op:
+        batch_op.create_index('ix_ussd_notifications_dispatch', ['delivery_status', 'next_attempt_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('ussd_notifications', schema=None) as batch_op:
+        batch_op.drop_index('ix_ussd_notifications_dispatch')
+        batch_op.drop_constraint('fk_ussd_notifications_notification_id', type_='foreignkey')
+        for name, _, _, _ in reversed(DELIVERY_COLUMNS):
+            batch_op.drop_column(name)
@@ -0,0 +1,40 @@
+"""Key insight_cache rows by a fingerprint of the prompt inputs.
+
+The original add_insight_cache migration predates the current model
+(insight_type/JSON instead of language/insight_data text), so the columns the
+model uses are added here when missing.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'f3c7a2d8e4b6'
+down_revision = 'e5b2c8f1a9d3'
+branch_labels = None
+depends_on = None
+
+
+MODEL_COLUMNS = (
+    ('language', sa.String(length=20), False, 'kinyarwanda'),
+    ('insight_data', sa.Text(), True, None),
+    ('is_valid', sa.Boolean(), True, sa.true()),
+)
+
+
+def upgrade():
+    bind = op.get_bind()
+    columns = {c['name'] for c in sa.inspect(bind).get_columns('insight_cache')}
+
+    with op.batch_alter_table('insight_cache', schema=None) as batch_op:
+        for name, type_, nullable, default in MODEL_COLUMNS:
+            if name not in columns:
+                batch_op.add_column(sa.Column(name, type_, nullable=nullable, server_default=default))
+        batch_op.add_column(sa.Column('fingerprint', sa.String(length=64), nullable=True))
+        batch_op.create_index('ix_insight_cache_fingerprint', ['fingerprint'])
+
+
+def downgrade():
+    with op.batch_alter_table('insight_cache', schema=None) as batch_op:
+        batch_op.drop_index('ix_insight_cache_fingerprint')
+        batch_op.drop_column('fingerprint')
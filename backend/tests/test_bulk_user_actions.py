@@ -0,0 +1,64 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import event
+
+from app import db
+from app.models import User, CycleLog, PeriodLog, UmwariConversation, UmwariMessage
+from app.services import bulk_user_actions
+
+
+@pytest.fixture
+def app(tmp_path):
+    from flask import Flask
+
+    application = Flask(__name__)
+    application.config.update({
+        'TESTING': True,
+        # A file, so the per-chunk connections see the same tables
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'bulk.db'}",
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+    })
+    db.init_app(application)
+
+    with application.app_context():
+        @event.listens_for(db.engine, 'connect')
+        def enforce_foreign_keys(connection, _):
+            connection.execute('PRAGMA foreign_keys=ON')
+
+        db.create_all()
+        yield application
+        db.session.remove()
+        db.drop_all()
+
+
+def _user_with_history(i):
+    user = User(name=f'User {i}', phone_number=f'07880002{i:02d}', password_hash='x', user_type='adolescent')
+    db.session.add(user)
+    db.session.commit()
+    cycle = CycleLog(user_id=user.id, start_date=date(2026, 1, 1))
+    conversation = UmwariConversation(user_id=user.id)
+    db.session.add_all([cycle, conversation])
+    db.session.commit()
+    db.session.add_all([
+        PeriodLog(user_id=user.id, cycle_log_id=cycle.id, start_date=date(2026, 1, 1)),
+        UmwariMessage(conversation_id=conversation.id, role='user', text='Muraho'),
+    ])
+    db.session.commit()
+    return user.id
+
+
+class TestBulkDelete:
+    def test_children_and_grandchildren_go_before_their_parents(self, app):
+        user_ids = [_user_with_history(i) for i in range(3)]
+
+        counts = bulk_user_actions.dry_run_counts('delete', user_ids)
+        assert counts['umwari_messages.conversation_id'] == 3
+        assert counts['period_logs.user_id'] == 3
+
+        successful, failed, details = bulk_user_actions.execute_bulk_action('delete', user_ids, chunk_size=2)
+
+        assert (successful, failed, details) == (3, 0, [])
+        assert User.query.count() == 0
+        assert PeriodLog.query.count() == 0
+        assert UmwariMessage.query.count() == 0
@@ -0,0 +1,150 @@
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytest
+
+from app import db
+from app.models import User, CycleLog, MealLog, EngagementDaily
+from app.services import engagement_analytics as ea
+
+
+@pytest.fixture
+def app(tmp_path):
+    from flask import Flask
+
+    application = Flask(__name__)
+    application.config.update({
+        'TESTING': True,
+        # A file, so the tracker's own app contexts see the same tables
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'engagement.db'}",
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+    })
+    db.init_app(application)
+
+    with application.app_context():
+        from app.ussd.ussd_models import USSDTransaction  # noqa: F401
+        db.create_all()
+        yield application
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def tracker(app):
+    """A tracker of our own, with no thread, standing in for the module's."""
+    tracker = ea.ActivityTracker()
+    tracker._app = app
+    with patch.object(ea, 'activity_tracker', tracker), patch.object(tracker, '_ensure_thread'):
+        yield tracker
+
+
+def _at(day, hour=10):
+    return datetime.combine(day, datetime.min.time()) + timedelta(hours=hour)
+
+
+def _user(i, created_at):
+    user = User(name=f'User {i}', phone_number=f'07880003{i:02d}', password_hash='x',
+                user_type='adolescent', created_at=created_at)
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+
+def _seed_activity(today):
+    """Three users over three past days; returns their ids and the days."""
+    d1, d2, d3 = (today - timedelta(days=n) for n in (3, 2, 1))
+    a = _user(1, _at(today - timedelta(days=30)))
+    b = _user(2, _at(today - timedelta(days=30)))
+    c = _user(3, _at(d2, hour=8))
+
+    from app.ussd.ussd_models import USSDTransaction
+    db.session.add_all([
+        CycleLog(user_id=a, start_date=_at(d1), created_at=_at(d1)),
+        CycleLog(user_id=a, start_date=_at(d1), created_at=_at(d1, hour=20)),
+        CycleLog(user_id=b, start_date=_at(d1), created_at=_at(d1)),
+        MealLog(user_id=c, meal_type='lunch', meal_time=_at(d2), description='Ibishyimbo', created_at=_at(d2)),
+        USSDTransaction(session_id='s', phone_number='0788000302', user_id=b, response_text='CON',
+                        menu_state='main', transaction_type='menu_navigation', created_at=_at(d3)),
+    ])
+    db.session.commit()
+    return (a, b, c), (d1, d2, d3)
+
+
+def _stored(day, metric):
+    row = EngagementDaily.query.filter_by(day=day, metric=metric).first()
+    return row and (ea.bitmap_to_ids(ea.bytes_to_bitmap(row.user_bitmap)), row.distinct_users, row.events)
+
+
+class TestBitmaps:
+    def test_ids_round_trip_through_bytes(self):
+        bitmap = ea.ids_to_bitmap([3, 0, 64, 3, None, -1])
+        assert ea.bitmap_to_ids(bitmap) == [0, 3, 64]
+        assert ea.popcount(bitmap) == 3
+        assert ea.bytes_to_bitmap(ea.bitmap_to_bytes(bitmap)) == bitmap
+        assert ea.bitmap_to_bytes(0) == b'' and ea.bytes_to_bitmap(b'') == 0
+        assert ea.bytes_to_bitmap(None) == 0
+
+    def test_union_is_the_distinct_ids(self):
+        bitmaps = [ea.ids_to_bitmap(ids) for ids in ([1, 2], [2, 9], [])]
+        assert ea.bitmap_to_ids(ea.union(bitmaps)) == [1, 2, 9]
+        assert ea.union([]) == 0
+
+
+class TestRollups:
+    def test_rollups_match_the_raw_activity(self, app, tracker):
+        today = datetime.utcnow().date()
+        (a, b, c), (d1, d2, d3) = _seed_activity(today)
+
+        ea.ensure_rollups(d1, d3)
+
+        assert _stored(d1, 'feature:cycle_tracking') == ([a, b], 2, 3)
+        assert _stored(d1, ea.ACTIVE) == ([a, b], 2, 3)
+        assert _stored(d2, 'feature:meal_tracking') == ([c], 1, 1)
+        assert _stored(d2, ea.SIGNUPS) == ([c], 1, 1)
+        assert _stored(d2, ea.ACTIVE) == ([c], 1, 1)
+        assert _stored(d3, 'feature:ussd') == ([b], 1, 1)
+        assert _stored(d3, ea.ACTIVE) == ([b], 1, 1)
+        assert all(row.is_final for row in EngagementDaily.query.all())
+
+        summary = ea.range_summary(d1, d3)
+        assert summary['active_users'] == 3
+        assert summary['new_users'] == 1
+        assert summary['returning_users'] == 2
+        assert summary['features']['cycle_tracking'] == {'users': 2, 'events': 3}
+
+        from app.services.insight_pregeneration import active_user_ids
+        assert active_user_ids(7) == [a, b, c]
+
+    def test_only_recent_days_are_rolled_up_inline(self, app, tracker):
+        app.config['ENGAGEMENT_SYNC_BACKFILL_DAYS'] = 3
+        today = datetime.utcnow().date()
+        start = today - timedelta(days=9)
+
+        ea.ensure_rollups(start, today)
+
+        inline = {day for (day,) in db.session.query(EngagementDaily.day).distinct()}
+        assert inline == {today - timedelta(days=n) for n in range(3)}
+        assert tracker._backfill == (start, today - timedelta(days=3))
+
+        tracker.run_backfill()
+        with app.app_context():
+            filled = {day for (day,) in db.session.query(EngagementDaily.day).distinct()}
+        assert filled == {start + timedelta(days=n) for n in range(10)}
+        assert tracker._backfill is None
+
+
+class TestActivityTracker:
+    def test_flush_stamps_last_activity_and_todays_bitmap(self, app, tracker):
+        today = datetime.utcnow().date()
+        a = _user(1, _at(today - timedelta(days=30)))
+        b = _user(2, _at(today - timedelta(days=30)))
+
+        tracker.touch(a)
+        tracker.flush()
+        tracker.touch(b)
+        tracker.flush()
+
+        with app.app_context():
+            stamped = dict(db.session.query(User.id, User.last_activity))
+            assert stamped[a].date() == today and stamped[b].date() == today
+            assert _stored(today, ea.ACTIVE)[:2] == ([a, b], 2)
@@ -0,0 +1,325 @@
+import time
+
+import pytest
+from datetime import date, timedelta
+from unittest.mock import patch
+
+from app import db
+from app.models import User, CycleLog
+from app.models.insight_cache import InsightCache
+from app.services.kinyarwanda_insight_service import (
+    KinyarwandaInsightService, _cycle_analyses, _recent_insights, _user_fingerprints, _verified_providers,
+)
+
+
+AI_TEXT = (
+    "1. Health Insight\nYour cycles look regular.\n"
+    "2. What to do next\n- Drink water\n- Eat beans\n- Sleep well\n"
+    "3. Words of encouragement\nKeep going!"
+)
+
+
+@pytest.fixture
+def app():
+    from flask import Flask
+
+    application = Flask(__name__)
+    application.config.update({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SECRET_KEY': 'test-secret',
+    })
+    db.init_app(application)
+    for cache in (_recent_insights, _cycle_analyses, _verified_providers, _user_fingerprints):
+        cache.clear()
+
+    with application.app_context():
+        from app.models import (  # noqa: F401
+            User, Parent, Adolescent, ParentChild, CycleLog, MealLog,
+            Appointment, HealthProvider,
+        )
+        db.create_all()
+        yield application
+        db.session.remove()
+        db.drop_all()
+
+
+def _create_user(phone, name):
+    user = User(name=name, phone_number=phone, password_hash='x', user_type='parent')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+class TestInsightFingerprintCache:
+    def test_identical_inputs_share_one_generation(self, app):
+        first = _create_user('0788000001', 'Uwase')
+        second = _create_user('0788000002', 'Mukamana')
+        service = KinyarwandaInsightService()
+        service.google_api_key = 'test-key'
+
+        with patch('app.services.kinyarwanda_insight_service.gemini_client.generate',
+                   return_value={'text': AI_TEXT, 'prompt_tokens': 1, 'output_tokens': 1}) as generate:
+            assert service.generate_insight(first.id, 'english')['cached'] is False
+            assert service.generate_insight(first.id, 'english')['cached'] is True
+            # Same anonymized prompt for another user: no second Gemini call
+            assert service.generate_insight(second.id, 'english')['cached'] is True
+            assert generate.call_count == 1
+
+            db.session.add(CycleLog(
+                user_id=first.id,
+                start_date=date.today() - timedelta(days=3),
+                end_date=date.today(),
+                mood='low',
+            ))
+            db.session.commit()
+
+            # New data changes the fingerprint, so the insight is regenerated at once
+            assert service.generate_insight(first.id, 'english')['cached'] is False
+            assert generate.call_count == 2
+
+            # The shared insight was copied into the second user's own row, so
+            # replacing the first user's row doesn't lose it
+            _recent_insights.clear()
+            assert service.generate_insight(second.id, 'english')['cached'] is True
+            assert generate.call_count == 2
+
+        assert InsightCache.query.filter_by(user_id=first.id).count() == 1
+        assert InsightCache.query.filter_by(user_id=second.id).count() == 1
+
+
+class TestInsightCacheMaintenance:
+    def test_upsert_replaces_and_cleanup_purges_in_chunks(self, app):
+        from datetime import datetime
+
+        users = [_create_user(f'07880001{i:02d}', f'User {i}') for i in range(5)]
+        for user in users:
+            InsightCache.upsert(user.id, 'english', '{"v": 1}', cache_hours=1)
+        InsightCache.upsert(users[0].id, 'english', '{"v": 2}', cache_hours=1, fingerprint='f' * 64)
+
+        assert InsightCache.query.count() == 5
+        assert InsightCache.get_valid_cache(users[0].id, 'english').insight_data == '{"v": 2}'
+
+        # Entries live for an hour: none is gone 59 minutes out, all are two hours out
+        assert InsightCache.cleanup_expired(datetime.utcnow() + timedelta(minutes=59), chunk_size=2) == 0
+        assert InsightCache.cleanup_expired(datetime.utcnow() + timedelta(hours=2), chunk_size=2) == 5
+        assert InsightCache.query.count() == 0
+
+
+class TestInsightCoalescing:
+    def test_concurrent_callers_share_one_call(self):
+        import threading
+        import time
+        from app.utils.single_flight import SingleFlight
+
+        flight = SingleFlight('test_flight')
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow_generation():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {'success': True}
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do('fp', slow_generation)))
+        leader.start()
+        started.wait(5)
+        followers = [
+            threading.Thread(target=lambda: results.append(flight.do('fp', slow_generation)))
+            for _ in range(3)
+        ]
+        for thread in followers:
+            thread.start()
+        time.sleep(0.2)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+
+        assert len(calls) == 1
+        assert len(results) == 4
+        assert all(result is results[0] for result in results)
+
+    def test_lock_row_excludes_other_workers_until_released_or_expired(self, app):
+        from app.models import InsightGenerationLock
+
+        assert InsightGenerationLock.acquire('fp', 'worker-a', 60) is True
+        assert InsightGenerationLock.acquire('fp', 'worker-b', 60) is False
+        assert InsightGenerationLock.is_held('fp')
+
+        InsightGenerationLock.release('fp', 'worker-b')
+        assert InsightGenerationLock.is_held('fp')
+        InsightGenerationLock.release('fp', 'worker-a')
+        assert InsightGenerationLock.acquire('fp', 'worker-b', 0) is True
+
+        # worker-b died holding an already expired lock
+        assert InsightGenerationLock.acquire('fp', 'worker-c', 60) is True
+
+
+class TestInsightPregeneration:
+    def test_off_peak_window_wraps_midnight(self):
+        from datetime import datetime
+        from app.services.insight_pregeneration import in_window
+
+        assert in_window(datetime(2026, 1, 1, 23), 22, 4)
+        assert in_window(datetime(2026, 1, 1, 3), 22, 4)
+        assert not in_window(datetime(2026, 1, 1, 12), 22, 4)
+        assert in_window(datetime(2026, 1, 1, 1), 0, 4)
+
+    def test_batch_fills_cache_for_users_with_changed_data(self, app):
+        from app.services.insight_pregeneration import users_needing_insight
+
+        first = _create_user('0788000011', 'Uwase')
+        second = _create_user('0788000012', 'Mukamana')
+        third = _create_user('0788000013', 'Ingabire')
+        db.session.add(CycleLog(user_id=third.id, start_date=date.today() - timedelta(days=2), mood='good'))
+        db.session.commit()
+        user_ids = [first.id, second.id, third.id]
+        service = KinyarwandaInsightService()
+        service.google_api_key = 'test-key'
+
+        assert users_needing_insight(user_ids, 'english') == user_ids
+
+        with patch('app.services.kinyarwanda_insight_service.gemini_client.generate',
+                   return_value={'text': AI_TEXT, 'prompt_tokens': 1, 'output_tokens': 1}) as generate:
+            stats = service.pregenerate_insights(user_ids, 'english', acquire_budget=lambda: True)
+            # The two users without data build the same prompt and share one call
+            assert stats == {'generated': 2, 'shared': 1, 'failed': 0, 'deferred': 0}
+            assert users_needing_insight(user_ids, 'english') == []
+
+            db.session.add(CycleLog(user_id=first.id, start_date=date.today() - timedelta(days=1), mood='low'))
+            db.session.commit()
+            assert users_needing_insight(user_ids, 'english') == [first.id]
+
+            assert service.generate_insight(second.id, 'english')['cached'] is True
+            assert generate.call_count == 2
+
+
+class TestPromptContextAssembly:
+    def test_stages_are_timed_and_cycle_analysis_is_reused(self, app):
+        from app.utils.performance import merge_snapshots, performance_stats
+
+        user = _create_user('0788000021', 'Uwase')
+        service = KinyarwandaInsightService()
+        service.google_api_key = 'test-key'
+
+        with patch.object(service, '_get_advanced_cycle_analysis', return_value={'has_data': False}) as analysis, \
+                patch('app.services.kinyarwanda_insight_service.gemini_client.generate',
+                      return_value={'text': AI_TEXT, 'prompt_tokens': 1, 'output_tokens': 1}):
+            service.generate_insight(user.id, 'english')
+            service.generate_insight(user.id, 'english')
+            assert analysis.call_count == 1
+
+        pipelines = merge_snapshots([performance_stats.snapshot()])['pipelines']
+        stages = pipelines['insight_context']['stages']
+        assert {'load', 'cycle_analysis', 'assemble', 'prompt', 'cache_lookup'} <= set(stages)
+
+
+class TestInsightStreaming:
+    def test_sections_are_emitted_before_the_stream_ends(self, app):
+        user = _create_user('0788000031', 'Uwase')
+        service = KinyarwandaInsightService()
+        service.google_api_key = 'test-key'
+        progress = {'finished': False}
+
+        def fake_stream(*args, **kwargs):
+            for chunk in ("1. Health Insight\nYour cycles ", "look regular.\n2. What to",
+                          " do next\n- Drink water\n- Eat beans\n", "3. Words of encouragement\nKeep going!"):
+                yield chunk
+            progress['finished'] = True
+
+        events = []
+        with patch('app.services.kinyarwanda_insight_service.gemini_client.stream', side_effect=fake_stream):
+            for event, payload in service.stream_insight(user.id, 'english'):
+                events.append((event, payload, progress['finished']))
+
+        # Rule-based first paint, then Gemini's sections as they complete
+        assert events[0][0] == 'preview' and events[0][1]['insights']['source'] == 'rules'
+        assert events[1][:2] == ('section', {'section': 'inyunganizi', 'content': 'Your cycles look regular.'})
+        assert events[1][2] is False
+        assert [payload['section'] for event, payload, _ in events if event == 'section'] == [
+            'inyunganizi', 'icyo_wakora', 'ihumure'
+        ]
+        done = events[-1][1]
+        assert events[-1][0] == 'done' and done['cached'] is False
+        assert done['insights']['icyo_wakora'] == ['Drink water', 'Eat beans']
+
+        cached = list(service.stream_insight(user.id, 'english'))
+        assert cached[-1][0] == 'done' and cached[-1][1]['cached'] is True
+
+    def test_waits_for_a_generation_held_by_another_worker(self, app):
+        user = _create_user('0788000032', 'Uwase')
+        service = KinyarwandaInsightService()
+        service.google_api_key = 'test-key'
+        theirs = {'inyunganizi': 'From the other worker', 'icyo_wakora': [], 'ihumure': ''}
+
+        with patch('app.services.kinyarwanda_insight_service.InsightGenerationLock.acquire', return_value=False), \
+                patch.object(service, '_wait_for_insight', return_value=theirs), \
+                patch('app.services.kinyarwanda_insight_service.gemini_client.stream') as stream:
+            events = list(service.stream_insight(user.id, 'english'))
+
+        stream.assert_not_called()
+        assert events[0][0] == 'preview'
+        assert events[-1] == ('done', {'insights': theirs, 'cached': True, 'stale': False, 'fallback': False})
+
+
+class TestRuleBasedInsights:
+    def test_engine_findings_become_kinyarwanda_sections(self, app):
+        from app.services.rule_based_insights import build_rule_based_insight
+
+        user_data = {
+            'cycle_analysis': {
+                'has_data': True,
+                'average_cycle_length': 27.6,
+                'predictions': [{'predicted_start': '2026-03-05T00:00:00', 'confidence': 'high'}],
+                'health_insights': [
+                    {'type': 'positive', 'category': 'mental_wellness'},
+                    {'type': 'warning', 'category': 'menorrhagia_risk', 'priority': 'medium'},
+                ],
+                'anomaly_analysis': {'anomalies_detected': False},
+            },
+            'meal_logs': [],
+            'appointments': [],
+            'available_providers': [],
+        }
+
+        insight = build_rule_based_insight(user_data, 'kinyarwanda')
+
+        assert insight['inyunganizi'].startswith("Ukwezi kwawe k'imihango kumara iminsi 28 ugereranyije.")
+        assert '05/03/2026' in insight['inyunganizi']
+        # The warning outranks the positive finding
+        assert insight['inyunganizi'].index('iminsi irenze 7') < insight['inyunganizi'].index('mu mutima')
+        assert len(insight['icyo_wakora']) == 3
+        assert insight['icyo_wakora'][0].startswith("Vugana n'umuganga")
+        assert insight['ihumure'].startswith('Kubona ibi bimenyetso')
+        assert insight['source'] == 'rules'
+
+    def test_slow_gemini_falls_back_then_caches(self, app):
+        import threading
+
+        app.config['INSIGHT_LLM_BUDGET_SECONDS'] = 0.05
+        user = _create_user('0788000041', 'Uwase')
+        service = KinyarwandaInsightService()
+        service.google_api_key = 'test-key'
+        release = threading.Event()
+
+        def slow_generate(*args, **kwargs):
+            release.wait(5)
+            return {'text': AI_TEXT, 'prompt_tokens': 1, 'output_tokens': 1}
+
+        with patch('app.services.kinyarwanda_insight_service.gemini_client.generate', side_effect=slow_generate):
+            result = service.generate_insight(user.id, 'english')
+            assert result['fallback'] is True and result['data']['source'] == 'rules'
+
+            release.set()
+            deadline = time.monotonic() + 5
+            while InsightCache.query.filter_by(user_id=user.id).count() == 0 and time.monotonic() < deadline:
+                time.sleep(0.05)
+                db.session.expire_all()
+
+        # The generation that missed the budget still lands in the cache
+        result = service.generate_insight(user.id, 'english')
+        assert result['cached'] is True and 'fallback' not in result
@@ -0,0 +1,157 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from flask import Flask
+
+from app.services import llm_usage
+from app.services.llm_client import CircuitOpenError, GeminiClient, LLMError
+
+
+class FakeGemini:
+    """Local stand-in for the Gemini REST API; ``statuses`` are served before a 200."""
+
+    def __init__(self):
+        self.statuses = []
+        self.calls = 0
+        self.lock = threading.Lock()
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with fake.lock:
+                    fake.calls += 1
+                    status = fake.statuses.pop(0) if fake.statuses else 200
+
+                if status != 200:
+                    body = json.dumps({'error': {'message': 'overloaded'}}).encode()
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                elif 'streamGenerateContent' in self.path:
+                    chunks = [
+                        {'candidates': [{'content': {'parts': [{'text': 'Mwaramutse'}]}}]},
+                        {'candidates': [{'content': {'parts': [{'text': ' neza'}]}}],
+                         'usageMetadata': {'promptTokenCount': 7, 'candidatesTokenCount': 3}},
+                    ]
+                    body = ''.join(f'data: {json.dumps(c)}\r\n\r\n' for c in chunks).encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/event-stream')
+                else:
+                    body = json.dumps({
+                        'candidates': [{'content': {'parts': [{'text': 'Stay hydrated.'}]}}],
+                        'usageMetadata': {'promptTokenCount': 12, 'candidatesTokenCount': 4},
+                    }).encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server.server_port}/v1beta'
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def fake_gemini():
+    fake = FakeGemini()
+    yield fake
+    fake.close()
+
+
+@pytest.fixture
+def app(fake_gemini):
+    application = Flask(__name__)
+    application.config.update({
+        'TESTING': True,
+        'GEMINI_API_BASE': fake_gemini.base_url,
+        'LLM_RETRY_BASE_SECONDS': 0.01,
+        'LLM_MAX_RETRIES': 2,
+        'LLM_BREAKER_FAILURES': 2,
+        'LLM_BREAKER_COOLDOWN': 60,
+    })
+    with application.app_context():
+        yield application
+
+
+class TestGeminiClient:
+    def test_retries_transient_errors_then_succeeds(self, app, fake_gemini):
+        fake_gemini.statuses = [503, 429]
+        result = GeminiClient().generate('How do I stay healthy?', 'test-key', endpoint='test')
+
+        assert result == {'text': 'Stay hydrated.', 'prompt_tokens': 12, 'output_tokens': 4}
+        assert fake_gemini.calls == 3
+
+    def test_client_errors_are_not_retried(self, app, fake_gemini):
+        fake_gemini.statuses = [400]
+        with pytest.raises(LLMError) as excinfo:
+            GeminiClient().generate('hi', 'test-key', endpoint='test')
+
+        assert excinfo.value.status == 400
+        assert fake_gemini.calls == 1
+
+    def test_circuit_opens_and_short_circuits(self, app, fake_gemini):
+        client = GeminiClient()
+        fake_gemini.statuses = [500] * 6
+        for _ in range(2):
+            with pytest.raises(LLMError):
+                client.generate('hi', 'test-key', endpoint='test')
+        calls = fake_gemini.calls
+
+        with pytest.raises(CircuitOpenError):
+            client.generate('hi', 'test-key', endpoint='test')
+        assert fake_gemini.calls == calls
+        assert not client.is_available('test')
+
+    def test_stream_yields_text_chunks(self, app, fake_gemini):
+        contents = [{'role': 'user', 'parts': [{'text': 'Muraho'}]}]
+        chunks = list(GeminiClient().stream(contents, 'test-key', endpoint='test_stream'))
+
+        assert ''.join(chunks) == 'Mwaramutse neza'
+
+    def test_cancelled_half_open_stream_frees_the_trial(self, app, fake_gemini):
+        client = GeminiClient()
+        breaker = client.breaker('test_stream')
+        # Opened long enough ago that the cooldown has passed: half-open
+        breaker.opened_at = 0.0
+        assert breaker.state == 'half_open'
+
+        stream = client.stream('Muraho', 'test-key', endpoint='test_stream')
+        assert next(stream) == 'Mwaramutse'
+        stream.close()
+
+        # The cancelled trial gave no verdict; the next call is the new trial
+        assert ''.join(client.stream('Muraho', 'test-key', endpoint='test_stream')) == 'Mwaramutse neza'
+        assert breaker.state == 'closed'
+
+    def test_tokens_are_charged_to_the_attributed_user(self, app, fake_gemini):
+        app.config['LLM_QUOTAS'] = '{"adolescent": [20, 3600]}'
+        who = {'user_id': 9001, 'role': 'adolescent', 'language': 'english'}
+        client = GeminiClient()
+
+        with llm_usage.attribute(who):
+            client.generate('hi', 'test-key', endpoint='test')
+            # 16 of 20 tokens used: still allowed
+            assert llm_usage.check_quota() is None
+            client.generate('hi', 'test-key', endpoint='test')
+            retry_after = llm_usage.check_quota()
+
+        assert retry_after is not None and 0 < retry_after <= 13
+        assert llm_usage.check_quota({**who, 'role': 'admin'}) is None
+        assert llm_usage.check_quota() is None
@@ -0,0 +1,83 @@
+import pytest
+from unittest.mock import patch
+
+from app import db
+from app.models import User
+from app.services import umwari_conversations as conversations
+
+
+@pytest.fixture
+def app():
+    from flask import Flask
+
+    application = Flask(__name__)
+    application.config.update({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'UMWARI_HISTORY_TOKEN_BUDGET': 100,
+        'UMWARI_KEEP_RECENT_MESSAGES': 2,
+        'UMWARI_MAX_PROMPT_TOKENS': 120,
+    })
+    db.init_app(application)
+
+    with application.app_context():
+        from app.models import UmwariConversation, UmwariMessage  # noqa: F401
+        db.create_all()
+        yield application
+        db.session.remove()
+        db.drop_all()
+
+
+def _conversation_with_history(turns):
+    user = User(name='Uwase', phone_number='0788000009', password_hash='x', user_type='adolescent')
+    db.session.add(user)
+    db.session.commit()
+    conversation = conversations.create_conversation(user.id, 'You are Umwari.')
+    for i in range(turns):
+        conversations.add_message(conversation, 'user', f'Question {i} ' + 'a' * 60)
+        conversations.add_message(conversation, 'model', f'Answer {i} ' + 'b' * 60)
+    return conversation
+
+
+class TestUmwariConversations:
+    def test_prompt_is_bounded_before_compaction(self, app):
+        conversation = _conversation_with_history(6)
+
+        contents, pending_tokens = conversations.build_prompt(conversation)
+
+        assert conversations.needs_compaction(pending_tokens)
+        assert contents[0]['role'] == 'user'
+        assert sum(conversations.estimate_tokens(p['text']) for c in contents for p in c['parts']) <= 120
+        assert contents[-1]['parts'][0]['text'].startswith('Answer 5')
+
+    def test_compaction_folds_older_turns_into_summary(self, app):
+        conversation = _conversation_with_history(4)
+
+        with patch('app.services.umwari_conversations.gemini_client.generate',
+                   return_value={'text': 'She asked four questions.', 'prompt_tokens': 1,
+                                 'output_tokens': 1}) as generate:
+            assert conversations.compact_conversation(conversation.id, 'test-key', 'gemini-2.5-flash')
+            # Already within budget: nothing left to fold
+            assert not conversations.compact_conversation(conversation.id, 'test-key', 'gemini-2.5-flash')
+        assert generate.call_count == 1
+        assert 'Question 0' in generate.call_args.args[0]
+
+        db.session.refresh(conversation)
+        contents, _ = conversations.build_prompt(conversation)
+        texts = [part['text'] for content in contents for part in content['parts']]
+        assert texts[0] == conversations.SUMMARY_PREAMBLE + 'She asked four questions.'
+        assert texts[2].startswith('Question 3') and texts[3].startswith('Answer 3')
+        assert len(texts) == 4
+
+    def test_stateless_history_keeps_first_and_newest_turns(self, app):
+        contents = [
+            {'role': 'user' if i % 2 == 0 else 'model', 'parts': [{'text': f'{i} ' + 'x' * 38}]}
+            for i in range(9)
+        ]
+
+        bounded, full_tokens, sent_tokens = conversations.bound_contents(contents, 40)
+
+        assert full_tokens == 90
+        assert [c['parts'][0]['text'].split()[0] for c in bounded] == ['0', '6', '7', '8']
+        assert sent_tokens == 40
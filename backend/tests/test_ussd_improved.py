@@ -1,3 +1,6 @@
+import os
+import time
+
 import pytest
 from datetime import datetime, timedelta
 from unittest.mock import patch
@@ -150,6 +153,225 @@ class TestUSSDAuthentication:
             assert Adolescent.query.filter_by(user_id=user.id).first() is not None
 
 
+
+class TestPinAuth:
+    def test_pin_hash_at_another_cost_is_upgraded(self, app):
+        import bcrypt as bcrypt_lib
+        from app.services.pin_auth import verify_user_pin
+
+        with app.app_context():
+            app.config['PIN_HASH_ROUNDS'] = 4
+            user = _create_user('+250788100001')
+            user.pin_hash = bcrypt_lib.hashpw(b'1234', bcrypt_lib.gensalt(5)).decode('utf-8')
+            db.session.commit()
+            old_hash = user.pin_hash
+
+            assert not verify_user_pin(user, '9999', allow_password=False)
+            assert db.session.get(User, user.id).pin_hash == old_hash
+
+            assert verify_user_pin(user, '1234', allow_password=False)
+            upgraded = db.session.get(User, user.id).pin_hash
+            assert upgraded != old_hash and upgraded.startswith('$2b$04$')
+            assert verify_user_pin(user, '1234', allow_password=False)
+            assert db.session.get(User, user.id).pin_hash == upgraded
+
+    def test_session_credential_is_bound_to_session_user_and_expiry(self, app):
+        from app.services.pin_auth import (
+            credential_matches_pin, issue_session_credential, read_session_credential,
+        )
+
+        with app.app_context():
+            now = time.time()
+            token = issue_session_credential('sess-a', 7, now + 60, pin='1234')
+            payload = read_session_credential(token, 'sess-a', 7)
+            assert payload['u'] == 7
+            assert credential_matches_pin(payload, 'sess-a', 7, '1234')
+            assert not credential_matches_pin(payload, 'sess-a', 7, '4321')
+            assert not credential_matches_pin(payload, 'sess-b', 7, '1234')
+
+            tampered = token[:-2] + ('AA' if token[-2:] != 'AA' else 'BB')
+            assert read_session_credential(tampered, 'sess-a', 7) is None
+            assert read_session_credential(token, 'sess-b', 7) is None
+            assert read_session_credential(token, 'sess-a', 8) is None
+            assert read_session_credential(issue_session_credential('sess-a', 7, now - 1), 'sess-a', 7) is None
+
+            # Issued without a PIN: nothing to match a repeated PIN hop against
+            bare = read_session_credential(issue_session_credential('sess-a', 7, now + 60), 'sess-a', 7)
+            assert not credential_matches_pin(bare, 'sess-a', 7, '1234')
+
+    def test_broken_hash_pool_falls_back_inline(self, app):
+        from concurrent.futures.process import BrokenProcessPool
+        from unittest.mock import MagicMock
+        from app.services import pin_auth
+
+        with app.app_context():
+            app.config['PIN_HASH_WORKERS'] = 1
+            broken = MagicMock()
+            broken.submit.side_effect = BrokenProcessPool('worker died')
+            pool = pin_auth._HashPool()
+            pool._executor, pool._pid = broken, os.getpid()
+
+            with patch.object(pin_auth, '_pool', pool):
+                assert pin_auth.check_pin('1234', pin_auth._hash('1234', 4))
+            assert broken.submit.called
+            assert pool._executor is None
+
+
+class TestUSSDSessionState:
+    def test_incremental_hops_match_full_replay(self, client, app):
+        with app.app_context():
+            _create_user('+250788444444', pin='5678')
+            hops = ['', '5678', '5678*1', '5678*1*1', '5678*1*1*01/03/2026']
+            with patch('app.ussd.handlers.find_user_by_phone', wraps=find_user_by_phone) as lookup:
+                for text in hops:
+                    resp = _ussd_post(client, '+250788444444', text, session_id='state-sess')
+                assert lookup.call_count == 1
+            assert 'end date' in resp.data.decode()
+
+            mark_session_authenticated('replay-sess', User.query.first().id)
+            replay = _ussd_post(client, '+250788444444', hops[-1], session_id='replay-sess')
+            assert replay.data.decode() == resp.data.decode()
+
+    def test_back_navigation_falls_back_to_replay(self, client, app):
+        with app.app_context():
+            _create_user('+250788444444', pin='5678')
+            for text in ['', '5678', '5678*1', '5678*1*1']:
+                _ussd_post(client, '+250788444444', text, session_id='back-sess')
+            resp = _ussd_post(client, '+250788444444', '5678*1*1*00', session_id='back-sess')
+            assert 'Hi Uwase' in resp.data.decode()
+
+    def test_over_budget_hop_answers_please_wait_then_collects(self, client, app):
+        import time as _time
+        from app.ussd import handlers
+
+        def slow_registration(phone, input_list):
+            _time.sleep(0.3)
+            return "CON Choose account type:"
+
+        app.config['USSD_HOP_BUDGET_MS'] = 350
+        with app.app_context(), patch.object(handlers, 'handle_registration_flow', slow_registration):
+            _ussd_post(client, '+250788666666', '', session_id='slow-sess')
+            resp = _ussd_post(client, '+250788666666', 'Jane', session_id='slow-sess')
+            assert 'Still working' in resp.data.decode()
+            app.config['USSD_HOP_BUDGET_MS'] = 4000
+            resp = _ussd_post(client, '+250788666666', 'Jane*1', session_id='slow-sess')
+            assert resp.data.decode() == "CON Choose account type:"
+
+    def test_query_count_header_includes_handler_queries(self, client, app):
+        from app.utils.performance import init_performance_monitoring
+
+        init_performance_monitoring(app)
+
+        def pin_hop_queries(session_id):
+            _ussd_post(client, '+250788444444', '', session_id=session_id)
+            resp = _ussd_post(client, '+250788444444', '5678', session_id=session_id)
+            assert 'Hi Uwase' in resp.data.decode()
+            return int(resp.headers['X-DB-Query-Count'])
+
+        with app.app_context():
+            _create_user('+250788444444', pin='5678')
+            pooled = pin_hop_queries('count-pooled')
+            # No budget: the handler runs inline on the request thread
+            app.config['USSD_HOP_BUDGET_MS'] = 0
+            inline = pin_hop_queries('count-inline')
+
+        assert pooled == inline > 0
+
+    def test_check_again_reply_is_not_replayed_as_input(self, client, app):
+        from app.ussd import handlers, timing
+
+        seen = []
+
+        def recording_registration(phone, input_list):
+            seen.append(list(input_list))
+            return "CON Next:"
+
+        with app.app_context(), patch.object(handlers, 'handle_registration_flow', recording_registration):
+            _ussd_post(client, '+250788666666', '', session_id='wait-sess')
+            with patch.object(handlers, 'run_within_budget', return_value=None):
+                resp = _ussd_post(client, '+250788666666', 'Jane', session_id='wait-sess')
+            assert 'Still working' in resp.data.decode()
+
+            # The check-again hop lands on a worker that never saw the handler
+            timing._pending.delete('wait-sess')
+            resp = _ussd_post(client, '+250788666666', 'Jane*1', session_id='wait-sess')
+            assert resp.data.decode() == "CON Next:"
+            _ussd_post(client, '+250788666666', 'Jane*1*2', session_id='wait-sess')
+            assert seen == [['Jane'], ['Jane', '2']]
+
+
+class TestUSSDLoadSimulator:
+    def test_every_scenario_completes_without_errors(self, app):
+        from tools.ussd_simulator import SCENARIOS, FlaskTransport, remove_fixture_users, run_load, seed_fixture_users
+
+        with app.app_context():
+            fixtures = seed_fixture_users(adolescents=2, parents=1)
+            assert seed_fixture_users(adolescents=2, parents=1) == fixtures
+            summary = run_load(FlaskTransport(app), fixtures, sessions=len(SCENARIOS), concurrency=1)
+
+        assert summary['overall']['errors'] == 0, summary['top_errors']
+        assert summary['overall']['hops'] == sum(len(steps) for _, steps in SCENARIOS.values())
+        assert CycleLog.query.count() == 1
+
+        with app.app_context():
+            # Two adolescents, a parent, their linked child and the registered account
+            assert remove_fixture_users() == 5
+            assert User.query.count() == 0
+
+
+class TestUSSDSMSDigests:
+    def test_pending_notifications_are_sent_as_one_digest_with_retry(self, app):
+        from app.services.notification_manager import notification_manager
+        from app.services.sms_gateway import FakeSMSGateway
+        from app.ussd.outbound import dispatch_pending
+        from app.ussd.ussd_models import USSDNotification
+
+        app.config.update({'SMS_OUTBOUND_ENABLED': True, 'SMS_RATE_PER_SECOND': 0, 'SMS_RETRY_BASE_SECONDS': 0})
+        with app.app_context():
+            feature_phone = _create_user('+250788777777')
+            feature_phone.account_type = 'ussd_registered'
+            smartphone = _create_user('+250788777778')
+            db.session.commit()
+
+            notification_manager.create(feature_phone.id, 'Period due 🌸', 'Your period may start in 2 days.')
+            notification_manager.create(feature_phone.id, 'Appointment', 'Your appointment is confirmed.')
+            already_read = notification_manager.create(feature_phone.id, 'Tip', 'Drink water.')
+            notification_manager.create(smartphone.id, 'Appointment', 'Your appointment is confirmed.')
+            already_read.mark_as_read()
+            assert USSDNotification.query.count() == 3
+
+            gateway = FakeSMSGateway()
+            gateway.fail_next = 1
+            first = dispatch_pending(gateway)
+            assert (first['retrying'], first['skipped'], gateway.outbox) == (2, 1, [])
+
+            second = dispatch_pending(gateway)
+            assert second['sent'] == 2 and second['digests'] == 1
+            assert len(gateway.outbox) == 1
+            body = gateway.outbox[0]['message']
+            assert '(2 new)' in body and 'Period due' in body and '🌸' not in body
+            assert dispatch_pending(gateway)['claimed'] == 0
+            assert USSDNotification.query.filter_by(delivery_status='sent', attempts=2).count() == 2
+
+    def test_outbound_needs_a_real_gateway_outside_tests(self, app):
+        from app.services.sms_gateway import gateway_kind
+
+        app.config.update({'SMS_OUTBOUND_ENABLED': True, 'SMS_GATEWAY': None})
+        with pytest.raises(ValueError):
+            gateway_kind(app)
+        app.config['SMS_GATEWAY'] = 'fake'
+        assert gateway_kind(app) == 'fake'
+        app.config['TESTING'] = False
+        with pytest.raises(ValueError):
+            gateway_kind(app)
+
+        app.config.update({'SMS_GATEWAY': 'africastalking', 'AFRICASTALKING_API_KEY': 'live-key'})
+        with pytest.raises(ValueError, match='AFRICASTALKING_USERNAME'):
+            gateway_kind(app)
+        app.config['AFRICASTALKING_USERNAME'] = 'ladys-essence'
+        assert gateway_kind(app) == 'africastalking'
+
+
 class TestUSSDMLEngine:
     def test_cycle_prediction_uses_ml_engine(self, app):
         with app.app_context():
@@ -180,6 +402,30 @@ class TestUSSDMLEngine:
                 mock_pred.assert_called()
                 assert 'Predictions' in result
 
+    def test_cycle_prediction_is_cached_until_a_cycle_log_changes(self, app):
+        from app.ussd.cycle import get_ussd_cycle_predictions, CyclePredictionEngine
+        from app.ussd.prediction_cache import average_prediction
+
+        with app.app_context():
+            user = _create_user('+250788555556')
+            for start in [datetime(2026, 1, 1), datetime(2026, 1, 29), datetime(2026, 2, 26)]:
+                db.session.add(CycleLog(user_id=user.id, start_date=start, end_date=start + timedelta(days=4)))
+            db.session.commit()
+
+            with patch.object(CyclePredictionEngine, 'predict_next_cycles',
+                              wraps=CyclePredictionEngine.predict_next_cycles) as engine:
+                first = get_ussd_cycle_predictions(user)
+                assert get_ussd_cycle_predictions(user) == first
+                assert engine.call_count == 1
+
+                db.session.add(CycleLog(user_id=user.id, start_date=datetime(2026, 3, 26)))
+                db.session.commit()
+                get_ussd_cycle_predictions(user)
+                assert engine.call_count == 2
+
+            estimate = average_prediction(user.id)
+            assert 'Next period: 23 Apr 2026' in estimate and 'ESTIMATE' in estimate
+
     def test_cycle_stats_uses_ml_engine(self, app):
         with app.app_context():
             user = _create_user('+250788666666')
@@ -263,6 +509,32 @@ class TestUSSDNotifications:
                 assert mock_create.called
 
 
+    def test_menu_is_served_from_the_inbox_cache_until_a_notification_changes(self, app):
+        from app.services.notification_manager import notification_manager
+        from app.ussd.menus import handle_ussd_notifications
+        from app.ussd.notification_cache import invalidate_inbox, unread_inbox
+
+        with app.app_context():
+            user = _create_user('+250788888889')
+            invalidate_inbox(user.id)
+            notification_manager.create(user.id, 'Appointment', 'Your appointment is confirmed.')
+            assert unread_inbox(user.id)['count'] == 1
+
+            with patch('app.ussd.notification_cache.notification_manager.get_unread_count') as count:
+                assert unread_inbox(user.id)['count'] == 1
+                assert not count.called
+
+            notification_manager.create(user.id, 'Period due', 'Your period may start in 2 days.')
+            inbox = unread_inbox(user.id)
+            assert inbox['count'] == 2
+            assert [title for _, title, _ in inbox['items']] == ['Period due', 'Appointment']
+
+            assert 'Period due' in handle_ussd_notifications(user, ['1'])
+            assert unread_inbox(user.id)['count'] == 1
+            notification_manager.mark_all_read(user.id)
+            assert unread_inbox(user.id) == {'count': 0, 'items': []}
+
+
 class TestUSSDSession:
     def test_normalize_rwanda_local_format(self):
         assert normalize_phone('0788123456') == '+250788123456'
@@ -287,6 +559,36 @@ class TestUSSDSession:
             assert find_user_by_phone('788111222') is not None
             assert to_stored_phone('+250788111222') == '0788111222'
 
+    def test_find_user_left_without_canonical_phone(self, app):
+        with app.app_context():
+            older = _create_user('0788111333', name='Older Account')
+            # A duplicate the phone_e164 backfill left NULL, stored in another format
+            duplicate_id = db.session.execute(User.__table__.insert().values(
+                name='Duplicate', phone_number='+250788111333', password_hash='x', user_type='adolescent'
+            )).inserted_primary_key[0]
+            db.session.commit()
+
+            # The number exactly as stored picks the account; other formats get the canonical holder
+            assert find_user_by_phone('+250788111333', use_cache=False).id == duplicate_id
+            assert find_user_by_phone('0788111333', use_cache=False).id == older.id
+            assert find_user_by_phone('788111333', use_cache=False).id == older.id
+
+    def test_find_user_is_one_query(self, app):
+        from sqlalchemy import event
+
+        with app.app_context():
+            _create_user('0788111444')
+            statements = []
+            record = lambda *args: statements.append(args[2])
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                # Gateway format against a locally stored number, then an unregistered caller
+                assert find_user_by_phone('+250788111444', use_cache=False).phone_number == '0788111444'
+                assert find_user_by_phone('+250788111555', use_cache=False) is None
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+            assert len(statements) == 2
+
     def test_session_authentication(self, app):
         with app.app_context():
             user = _create_user('+250788123457')
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+USSD load test
+
+Replays multi-hop USSD sessions against /api/ussd and prints per-hop
+p50/p95/p99 latency, DB query counts and error rates.
+
+    # in-process, against a throwaway database seeded with fixture users
+    python tools/ussd_load_test.py --database-url sqlite:////tmp/ussd_load.db --seed \\
+        --sessions 200 --concurrency 20
+
+    # against a running server whose (test) database was seeded beforehand
+    python tools/ussd_load_test.py --database-url postgresql://.../staging --seed-only
+    python tools/ussd_load_test.py --base-url http://localhost:5001 --sessions 2000 --concurrency 100
+
+Nothing is written to a database unless --database-url names it: the CLI
+never falls back to the app's configured DATABASE_URL. The registration
+scenario creates accounts (07992xxxxx), so it only runs when listed in
+--scenarios. In-process runs remove those accounts afterwards, and --cleanup
+removes every fixture user from --database-url.
+
+Exits with status 1 when the overall p99 exceeds --budget-ms or any hop errors
+beyond --max-error-rate, so it can gate a release.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.ussd_simulator import (
+    REGISTRATION_PREFIX, SCENARIOS, FlaskTransport, HttpTransport, fixture_phones, format_report,
+    remove_fixture_users, run_load, seed_fixture_users,
+)
+
+DEFAULT_SCENARIOS = [name for name in SCENARIOS if name != 'registration']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Replay USSD sessions and report hop latency.')
+    parser.add_argument('--base-url', help='Server to hit over HTTP; default runs in-process')
+    parser.add_argument('--database-url',
+                        help='Test database to seed, clean up or run in-process against (required for all three)')
+    parser.add_argument('--sessions', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--scenarios', default=','.join(DEFAULT_SCENARIOS),
+                        help=f"Comma-separated subset of: {', '.join(SCENARIOS)} (registration creates accounts)")
+    parser.add_argument('--adolescents', type=int, default=20, help='Fixture adolescents to use (and seed)')
+    parser.add_argument('--parents', type=int, default=10, help='Fixture parents to use (and seed)')
+    parser.add_argument('--seed', action='store_true', help='Create the fixture users in --database-url first')
+    parser.add_argument('--seed-only', action='store_true', help='Create fixture users and exit (implies --seed)')
+    parser.add_argument('--cleanup', action='store_true', help='Remove all fixture users from --database-url and exit')
+    parser.add_argument('--budget-ms', type=float, default=None,
+                        help='Fail when p99 exceeds this (default: USSD_HOP_BUDGET_MS)')
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--json', action='store_true', help='Print the summary as JSON')
+    return parser.parse_args()
+
+
+def _test_app(database_url):
+    # create_app reads DATABASE_URL; set it so nothing falls back to the configured database
+    os.environ['DATABASE_URL'] = database_url
+    from app import create_app
+    return create_app()
+
+
+def main():
+    args = parse_args()
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        print(f"Unknown scenarios: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    seed = args.seed or args.seed_only
+    needs_database = seed or args.cleanup or not args.base_url
+    if needs_database and not args.database_url:
+        print("--database-url is required to seed, clean up or run in-process; "
+              "point it at a test database", file=sys.stderr)
+        return 2
+
+    app = _test_app(args.database_url) if needs_database else None
+    if args.cleanup:
+        with app.app_context():
+            print(f"Removed {remove_fixture_users()} fixture users")
+        return 0
+
+    fixtures = fixture_phones(args.adolescents, args.parents)
+    if seed:
+        from app import db
+        with app.app_context():
+            # A fresh test database has no schema yet
+            db.create_all()
+            seed_fixture_users(args.adolescents, args.parents)
+        print(f"Seeded {len(fixtures['adolescent'])} adolescents and {len(fixtures['parent'])} parents")
+    if args.seed_only:
+        return 0
+
+    if args.base_url:
+        transport = HttpTransport(args.base_url.rstrip('/') + '/api/ussd')
+        budget_ms = args.budget_ms
+    else:
+        transport = FlaskTransport(app)
+        budget_ms = args.budget_ms or app.config.get('USSD_HOP_BUDGET_MS')
+
+    summary = run_load(transport, fixtures, scenarios, args.sessions, args.concurrency)
+    print(json.dumps(summary, indent=2) if args.json else format_report(summary))
+
+    if app is not None and 'registration' in scenarios and not args.base_url:
+        with app.app_context():
+            removed = remove_fixture_users(prefixes=(REGISTRATION_PREFIX,))
+        print(f"Removed {removed} accounts created by the registration scenario")
+
+    overall = summary['overall']
+    if budget_ms and overall['p99_ms'] > budget_ms:
+        print(f"FAIL: p99 {overall['p99_ms']}ms is over the {budget_ms}ms hop budget", file=sys.stderr)
+        return 1
+    if overall['error_rate'] > args.max_error_rate:
+        print(f"FAIL: error rate {overall['error_rate']:.2%} is over {args.max_error_rate:.2%}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
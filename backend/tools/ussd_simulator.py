@@ -0,0 +1,337 @@
+"""
+USSD load simulator.
+
+Replays realistic multi-hop sessions (registration, PIN login, cycle and meal
+logging, booking for a child, tips, notifications) against ``/api/ussd`` in the
+Africa's Talking request format, either in-process through a Flask test client
+or over HTTP, and summarises per-hop latency percentiles, DB query counts
+(from the ``X-DB-Query-Count`` header) and error rates.
+
+Fixture users live in reserved number ranges (07990xxxxx adolescents,
+07991xxxxx parents, 07992xxxxx registrations) so they are easy to spot;
+``remove_fixture_users`` deletes everything in them. Seeding writes to the
+database of the current app context, so only ever run it against a test
+database. ``tools/ussd_load_test.py`` is the CLI.
+"""
+
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from app import db
+from app.models import Adolescent, Parent, ParentChild, User
+from app.services.pin_auth import hash_pin
+from app.utils.phone import canonical_phone, to_stored_phone
+
+logger = logging.getLogger(__name__)
+
+SERVICE_CODE = '*384*1234#'
+NETWORK_CODE = '63510'
+FIXTURE_PIN = '4826'
+
+ADOLESCENT_PREFIX = '7990'
+PARENT_PREFIX = '7991'
+REGISTRATION_PREFIX = '7992'
+
+PLEASE_WAIT_MARKER = 'Still working'
+
+
+def _start_date():
+    return (date.today() - timedelta(days=random.randint(0, 20))).strftime('%d/%m/%Y')
+
+
+# scenario -> (caller role, [(step label, input segment)]); the first hop dials with empty text
+SCENARIOS = {
+    'registration': ('new', [
+        ('dial', None), ('name', 'Load Tester'), ('account_type', '2'),
+        ('create_pin', FIXTURE_PIN), ('confirm_pin', FIXTURE_PIN),
+    ]),
+    'pin_login': ('adolescent', [
+        ('dial', None), ('pin', FIXTURE_PIN),
+    ]),
+    'cycle_log': ('adolescent', [
+        ('dial', None), ('pin', FIXTURE_PIN), ('cycle_menu', '1'), ('log_period', '1'),
+        ('start_date', _start_date), ('end_date', 'ongoing'), ('mood', '4'),
+        ('sleep', '3'), ('stress', '1'), ('exercise', 'walking'),
+    ]),
+    'meal_log': ('adolescent', [
+        ('dial', None), ('pin', FIXTURE_PIN), ('meal_menu', '2'), ('log_meal', '1'),
+        ('meal_type', '2'), ('description', 'beans and rice'), ('calories', '450'),
+    ]),
+    'book_for_child': ('parent', [
+        ('dial', None), ('pin', FIXTURE_PIN), ('appointments', '3'),
+        ('book_for_child', '2'), ('child', '1'), ('concern', 'Stomach pain'),
+    ]),
+    'tips': ('adolescent', [
+        ('dial', None), ('pin', FIXTURE_PIN), ('tips_menu', '4'), ('category_tip', '2'),
+    ]),
+    'notifications': ('adolescent', [
+        ('dial', None), ('pin', FIXTURE_PIN), ('notifications', '6'),
+    ]),
+}
+
+
+# ── Fixtures ──────────────────────────────────────────────────────────────
+
+def _fixture_phone(prefix, index):
+    return f"0{prefix}{index:05d}"
+
+
+def fixture_phones(adolescents=20, parents=10):
+    """``{'adolescent': [phones], 'parent': [phones]}`` that ``seed_fixture_users`` creates."""
+    return {
+        'adolescent': [_fixture_phone(ADOLESCENT_PREFIX, i) for i in range(adolescents)],
+        'parent': [_fixture_phone(PARENT_PREFIX, i) for i in range(parents)],
+    }
+
+
+def seed_fixture_users(adolescents=20, parents=10, pin=FIXTURE_PIN):
+    """Create (or reuse) load-test users; each parent gets one linked adolescent.
+
+    Returns ``fixture_phones(adolescents, parents)``.
+    """
+    pin_hash = hash_pin(pin)
+    wanted = fixture_phones(adolescents, parents)
+    all_phones = wanted['adolescent'] + wanted['parent'] + [
+        _fixture_phone(ADOLESCENT_PREFIX, 50000 + i) for i in range(parents)
+    ]
+    existing = {
+        u.phone_e164: u for u in
+        User.query.filter(User.phone_e164.in_([canonical_phone(p) for p in all_phones])).all()
+    }
+
+    def ensure(phone, user_type, name):
+        user = existing.get(canonical_phone(phone))
+        if user is None:
+            user = User(
+                name=name, phone_number=to_stored_phone(phone), password_hash=pin_hash, pin_hash=pin_hash,
+                enable_pin_auth=True, user_type=user_type, account_type='load_test', is_active=True,
+            )
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(Adolescent(user_id=user.id) if user_type == 'adolescent' else Parent(user_id=user.id))
+            db.session.flush()
+        return user
+
+    for i, phone in enumerate(wanted['adolescent']):
+        ensure(phone, 'adolescent', f'Load Teen {i}')
+    for i, phone in enumerate(wanted['parent']):
+        parent_user = ensure(phone, 'parent', f'Load Parent {i}')
+        parent = Parent.query.filter_by(user_id=parent_user.id).first()
+        if not ParentChild.query.filter_by(parent_id=parent.id).first():
+            child_user = ensure(_fixture_phone(ADOLESCENT_PREFIX, 50000 + i), 'adolescent', f'Load Child {i}')
+            child = Adolescent.query.filter_by(user_id=child_user.id).first()
+            db.session.add(ParentChild(parent_id=parent.id, adolescent_id=child.id, relationship_type='guardian'))
+
+    db.session.commit()
+    return wanted
+
+
+def remove_fixture_users(prefixes=(ADOLESCENT_PREFIX, PARENT_PREFIX, REGISTRATION_PREFIX)):
+    """Delete every user in the reserved ranges, with their rows; returns how many."""
+    from app.services.bulk_user_actions import execute_bulk_action
+
+    user_ids = [user_id for (user_id,) in db.session.query(User.id).filter(
+        db.or_(*[User.phone_e164.like(f'+250{prefix}%') for prefix in prefixes])
+    )]
+    if not user_ids:
+        return 0
+    successful, _, details = execute_bulk_action('delete', user_ids)
+    for detail in details:
+        logger.error(f"Could not remove fixture users {detail['user_ids']}: {detail['error']}")
+    return successful
+
+
+# ── Transports ────────────────────────────────────────────────────────────
+
+class FlaskTransport:
+    """Posts through the app's test client (one client per thread)."""
+
+    def __init__(self, app, path='/api/ussd'):
+        self.app = app
+        self.path = path
+        self._local = threading.local()
+
+    def post(self, form):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        resp = client.post(self.path, data=form)
+        return resp.status_code, resp.get_data(as_text=True), resp.headers
+
+
+class HttpTransport:
+    """Posts to a running server, one keep-alive session per thread."""
+
+    def __init__(self, url, timeout=15.0):
+        import requests
+
+        self._requests = requests
+        self.url = url
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def post(self, form):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        try:
+            resp = session.post(self.url, data=form, timeout=self.timeout)
+        except self._requests.RequestException as exc:
+            return 0, f'transport error: {exc}', {}
+        return resp.status_code, resp.text, resp.headers
+
+
+# ── Running sessions ──────────────────────────────────────────────────────
+
+def run_session(transport, scenario, phone):
+    """Play one scenario hop by hop; returns a record per hop."""
+    role, steps = SCENARIOS[scenario]
+    session_id = f'ATUid_load_{uuid.uuid4().hex[:16]}'
+    segments, records = [], []
+
+    for index, (label, segment) in enumerate(steps):
+        if segment is not None:
+            segments.append(segment() if callable(segment) else segment)
+        form = {
+            'sessionId': session_id,
+            'serviceCode': SERVICE_CODE,
+            'phoneNumber': canonical_phone(phone) or phone,
+            'networkCode': NETWORK_CODE,
+            'text': '*'.join(segments),
+        }
+        started = time.perf_counter()
+        status, body, headers = transport.post(form)
+        latency_ms = (time.perf_counter() - started) * 1000
+
+        query_header = headers.get('X-DB-Query-Count') if headers else None
+        is_last = index == len(steps) - 1
+        ended = body.startswith('END')
+        error = None
+        if status != 200:
+            error = f'http {status}'
+        elif 'Service error' in body or 'Session expired' in body:
+            error = body[:60]
+        elif ended and not is_last:
+            error = f'session ended early: {body[:60]}'
+
+        records.append({
+            'scenario': scenario,
+            'step': label,
+            'latency_ms': latency_ms,
+            'db_queries': int(query_header) if query_header else None,
+            'timed_out': PLEASE_WAIT_MARKER in body,
+            'error': error,
+        })
+        if error or ended:
+            break
+    return records
+
+
+def run_load(transport, fixtures, scenarios=None, sessions=100, concurrency=10):
+    """Run ``sessions`` sessions spread round-robin over ``scenarios``."""
+    scenarios = list(scenarios or SCENARIOS)
+    plans = []
+    counters = defaultdict(int)
+    for i in range(sessions):
+        scenario = scenarios[i % len(scenarios)]
+        role = SCENARIOS[scenario][0]
+        if role == 'new':
+            phone = _fixture_phone(REGISTRATION_PREFIX, random.randint(0, 99999))
+        else:
+            pool = fixtures.get(role) or []
+            if not pool:
+                raise ValueError(f"No {role} fixture users for scenario '{scenario}'")
+            phone = pool[counters[role] % len(pool)]
+            counters[role] += 1
+        plans.append((scenario, phone))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as pool:
+        results = list(pool.map(lambda plan: run_session(transport, *plan), plans))
+    elapsed = time.perf_counter() - started
+
+    records = [record for session in results for record in session]
+    return summarize(records, elapsed)
+
+
+# ── Reporting ─────────────────────────────────────────────────────────────
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q * len(ordered)) - 1, 0)]
+
+
+def _stats(records):
+    latencies = [r['latency_ms'] for r in records]
+    queries = [r['db_queries'] for r in records if r['db_queries'] is not None]
+    errors = sum(1 for r in records if r['error'])
+    return {
+        'hops': len(records),
+        'p50_ms': round(percentile(latencies, 0.50), 1),
+        'p95_ms': round(percentile(latencies, 0.95), 1),
+        'p99_ms': round(percentile(latencies, 0.99), 1),
+        'max_ms': round(max(latencies), 1) if latencies else 0.0,
+        'avg_db_queries': round(sum(queries) / len(queries), 1) if queries else None,
+        'max_db_queries': max(queries) if queries else None,
+        'timeouts': sum(1 for r in records if r['timed_out']),
+        'errors': errors,
+        'error_rate': round(errors / len(records), 4) if records else 0.0,
+    }
+
+
+def summarize(records, elapsed_seconds=None):
+    by_step = defaultdict(list)
+    for record in records:
+        by_step[(record['scenario'], record['step'])].append(record)
+
+    errors = defaultdict(int)
+    for record in records:
+        if record['error']:
+            errors[record['error']] += 1
+
+    return {
+        'overall': {
+            **_stats(records),
+            'elapsed_s': round(elapsed_seconds, 2) if elapsed_seconds else None,
+            'hops_per_s': round(len(records) / elapsed_seconds, 1) if elapsed_seconds else None,
+        },
+        'steps': [
+            {'scenario': scenario, 'step': step, **_stats(rows)}
+            for (scenario, step), rows in by_step.items()
+        ],
+        'top_errors': sorted(errors.items(), key=lambda item: item[1], reverse=True)[:10],
+    }
+
+
+def format_report(summary):
+    """Plain-text table of a ``summarize`` result."""
+    header = f"{'scenario':<15} {'step':<15} {'hops':>5} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'queries':>8} {'errors':>6}"
+    lines = [header, '-' * len(header)]
+    for row in summary['steps']:
+        queries = '-' if row['avg_db_queries'] is None else f"{row['avg_db_queries']:.1f}"
+        lines.append(
+            f"{row['scenario']:<15} {row['step']:<15} {row['hops']:>5} {row['p50_ms']:>8.1f} "
+            f"{row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['max_ms']:>8.1f} {queries:>8} {row['errors']:>6}"
+        )
+    overall = summary['overall']
+    lines.append('-' * len(header))
+    lines.append(
+        f"overall: {overall['hops']} hops, p50 {overall['p50_ms']}ms, p95 {overall['p95_ms']}ms, "
+        f"p99 {overall['p99_ms']}ms, max {overall['max_ms']}ms, "
+        f"errors {overall['errors']} ({overall['error_rate'] * 100:.2f}%), timeouts {overall['timeouts']}"
+    )
+    if overall.get('hops_per_s'):
+        lines.append(f"throughput: {overall['hops_per_s']} hops/s over {overall['elapsed_s']}s")
+    for message, count in summary['top_errors']:
+        lines.append(f"  {count} x {message}")
+    return '\n'.join(lines)